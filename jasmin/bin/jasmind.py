@@ -137,9 +137,15 @@ class JasminDaemon(BaseDaemon):
         # AMQP Broker is used to listen to deliver_sm/dlr queues
         return self.components['router-pb-factory'].addAmqpBroker(self.components['amqp-broker-factory'])
 
+    @defer.inlineCallbacks
     def stopRouterPBService(self):
         """Stop Router PB server"""
-        return self.components['router-pb-server'].stopListening()
+        # Charge and settle queued bill requests
+        yield self.components['router-pb-factory'].billing_ledger.stop()
+        if self.components['router-pb-factory'].quotas_journal is not None:
+            yield self.components['router-pb-factory'].quotas_journal.stop()
+
+        yield self.components['router-pb-server'].stopListening()
 
     def startSMPPClientManagerPBService(self):
         """Start SMPP Client Manager PB server"""
@@ -165,7 +171,8 @@ class JasminDaemon(BaseDaemon):
 
         # AMQP Broker is used to listen to submit_sm queues and publish to deliver_sm/dlr queues
         self.components['smppcm-pb-factory'].addAmqpBroker(self.components['amqp-broker-factory'])
-        self.components['smppcm-pb-factory'].addRedisClient(self.components['rc'])
+        self.components['smppcm-pb-factory'].addRedisClient(self.components['rc'],
+                                                            RedisForJasminConfig(self.options['config']))
         self.components['smppcm-pb-factory'].addRouterPB(self.components['router-pb-factory'])
 
         # Add interceptor if enabled:
@@ -173,9 +180,14 @@ class JasminDaemon(BaseDaemon):
             self.components['smppcm-pb-factory'].addInterceptorPBClient(
                 self.components['interceptor-pb-client'])
 
+    @defer.inlineCallbacks
     def stopSMPPClientManagerPBService(self):
         """Stop SMPP Client Manager PB server"""
-        return self.components['smppcm-pb-server'].stopListening()
+        yield self.components['smppcm-pb-server'].stopListening()
+
+        # Wait for pending dlr maps to be written
+        if self.components['smppcm-pb-factory'].dlrMapWriter is not None:
+            yield self.components['smppcm-pb-factory'].dlrMapWriter.stop()
 
     @defer.inlineCallbacks
     def startDLRLookupService(self):
@@ -3,6 +3,8 @@ import datetime
 import sys
 import time
 import logging
+from copy import copy
+from functools import partial
 from logging.handlers import TimedRotatingFileHandler
 
 from twisted.internet import defer
@@ -11,11 +13,16 @@ from twisted.spread import pb
 import jasmin
 from jasmin.protocols.smpp.protocol import SMPPServerProtocol
 from jasmin.protocols.smpp.services import SMPPClientService
+from jasmin.queues import codec
 from jasmin.tools.migrations.configuration import ConfigurationMigrator
+from jasmin.tools.stats import ComponentsStatsCollector
+from jasmin.tools.store import StoreWriter, dumpSnapshot
 from smpp.pdu.pdu_types import RegisteredDeliveryReceipt
 from smpp.twisted.protocol import SMPPSessionStates
 from .configs import SMPPClientSMListenerConfig
 from .content import SubmitSmContent
+from .dlr import DLRMapWriter
+from .dlrmap import DLRMapDictionary
 from .listeners import SMPPClientSMListener
 
 LOG_CATEGORY = "jasmin-pb-client-mgmt"
@@ -33,11 +40,18 @@ class SMPPClientManagerPB(pb.Avatar):
         self.config = SMPPClientPBConfig
         self.avatar = None
         self.redisClient = None
+        self.dlrMapWriter = None
         self.amqpBroker = None
         self.interceptorpb_client = None
         self.RouterPB = None
         self.connectors = []
         self.declared_queues = []
+
+        # In-process connectors cache (cid -> connector), it's versioned and invalidated whenever
+        # connectors are added, removed, started, stopped or updated
+        self.connectors_version = 0
+        self._connectors_cache = {}
+        self._connectors_cache_version = 0
         self.pickleProtocol = pickle.HIGHEST_PROTOCOL
 
         # Persistence flag, accessed through perspective_is_persisted
@@ -61,6 +75,10 @@ class SMPPClientManagerPB(pb.Avatar):
         # Set pickleProtocol
         self.pickleProtocol = self.config.pickle_protocol
 
+        # Configuration snapshots are written to disk in a thread
+        self.store_writer = StoreWriter(self.log)
+        ComponentsStatsCollector().register('store', 'smppcm', self.store_writer.getStats)
+
         self.log.info('SMPP Client manager configured and ready.')
 
     def setAvatar(self, avatar):
@@ -76,9 +94,22 @@ class SMPPClientManagerPB(pb.Avatar):
 
         self.log.info('Added amqpBroker to SMPPClientManagerPB')
 
-    def addRedisClient(self, redisClient):
+    def addRedisClient(self, redisClient, redisConfig=None):
         self.redisClient = redisClient
 
+        dictionary = None
+        dlr_map_format = 'hash'
+        if redisConfig is not None and redisConfig.dlr_map_format == 'compact':
+            dlr_map_format = 'compact'
+            dictionary = DLRMapDictionary(redisClient, max_size=redisConfig.dlr_map_dictionary_size)
+        self.dlrMapWriter = DLRMapWriter(redisClient,
+                                         flush_interval=self.config.dlr_map_flush_interval,
+                                         batch_size=self.config.dlr_map_batch_size,
+                                         log=self.log,
+                                         dlr_map_format=dlr_map_format,
+                                         dictionary=dictionary)
+        ComponentsStatsCollector().register('dlr_map_writer', 'smppcm', self.dlrMapWriter.getStats)
+
         self.log.info('Added Redis Client to SMPPClientManagerPB')
 
     def addInterceptorPBClient(self, interceptorpb_client):
@@ -91,15 +122,51 @@ class SMPPClientManagerPB(pb.Avatar):
 
         self.log.info('Added RouterPB to SMPPClientManagerPB')
 
+    def invalidateConnectorsCache(self):
+        """Bump connectors version, the cache will be rebuilt on next lookup. Must be called
+        whenever self.connectors is updated"""
+        self.connectors_version += 1
+
+    def getConnectorsCache(self):
+        """Return the cid -> connector cache, rebuilt if its version is outdated"""
+        if self._connectors_cache_version != self.connectors_version:
+            self._connectors_cache = {str(c['id']): c for c in self.connectors}
+            self._connectors_cache_version = self.connectors_version
+
+        return self._connectors_cache
+
     def getConnector(self, cid):
-        for c in self.connectors:
-            if str(c['id']) == str(cid):
-                self.log.debug('getConnector [%s] returned a connector', cid)
-                return c
+        c = self.getConnectorsCache().get(str(cid))
+        if c is not None:
+            self.log.debug('getConnector [%s] returned a connector', cid)
+            return c
 
         self.log.debug('getConnector [%s] returned None', cid)
         return None
 
+    def getConnectorConfig(self, cid):
+        """Return the live SMPPClientConfig of a connector (or None), this is the in-process
+        alternative to perspective_connector_config: no pickling involved"""
+        c = self.getConnector(cid)
+        if c is None:
+            return None
+
+        return c['config']
+
+    def getConnectorSessionState(self, cid):
+        """Return the session state of a connector (or None if not found), a multi-bind connector
+        is in the state of its first bound session if any"""
+        c = self.getConnector(cid)
+        if c is None:
+            return None
+
+        for bind in c['binds']:
+            session_state = bind['service'].SMPPClientFactory.getSessionState()
+            if session_state.name[:6] == 'BOUND_':
+                return session_state
+
+        return c['service'].SMPPClientFactory.getSessionState()
+
     def getConnectorDetails(self, cid):
         c = self.getConnector(cid)
         if c is None:
@@ -112,14 +179,65 @@ class SMPPClientManagerPB(pb.Avatar):
         details['service_status'] = c['service'].running
         details['start_count'] = c['service'].startCounter
         details['stop_count'] = c['service'].stopCounter
+        details['binds'] = []
+        for bind in c['binds']:
+            details['binds'].append({
+                'session_state': bind['service'].SMPPClientFactory.getSessionState().name,
+                'service_status': bind['service'].running,
+                'start_count': bind['service'].startCounter,
+                'stop_count': bind['service'].stopCounter,
+                'outstanding_submits': bind['sm_listener'].getLoad()})
 
         self.log.debug('getConnectorDetails [%s] returned details', cid)
         return details
 
+    def newBind(self, c):
+        """Instanciate a connector's bind: a smpp client service and its SM listener"""
+        serviceManager = SMPPClientService(c, self.config)
+
+        smListener = SMPPClientSMListener(
+            config=SMPPClientSMListenerConfig(self.config.config_file),
+            SMPPClientFactory=serviceManager.SMPPClientFactory,
+            amqpBroker=self.amqpBroker,
+            redisClient=self.redisClient,
+            RouterPB=self.RouterPB,
+            interceptorpb_client=self.interceptorpb_client)
+
+        # Deliver_sm are sent to smListener's deliver_sm callback method
+        serviceManager.SMPPClientFactory.msgHandler = smListener.deliver_sm_event_interceptor
+
+        return {
+            'service': serviceManager,
+            'consumer_tag': None,
+            'submit_sm_q': None,
+            'sm_listener': smListener}
+
+    def setConnectorBinds(self, connector):
+        """Add or remove binds to get the connector's configured number of binds, the
+        first bind is the connector's 'service' and 'sm_listener'"""
+        # Connector configs from older releases have no binds
+        binds = getattr(connector['config'], 'binds', 1)
+
+        while len(connector['binds']) < binds:
+            connector['binds'].append(self.newBind(connector['config']))
+        del connector['binds'][binds:]
+
+        listeners = [bind['sm_listener'] for bind in connector['binds']]
+        for listener in listeners:
+            listener.siblings = listeners
+            listener.segments = listeners[0].segments
+        listeners[0].updateSubmitWindowStats()
+        ComponentsStatsCollector().register('segments', str(connector['id']), listeners[0].segments.getStats)
+
+        connector['service'] = connector['binds'][0]['service']
+        connector['sm_listener'] = connector['binds'][0]['sm_listener']
+
     def delConnector(self, cid):
+        ComponentsStatsCollector().unregister('segments', str(cid))
         for i in range(len(self.connectors)):
             if str(self.connectors[i]['id']) == str(cid):
                 del self.connectors[i]
+                self.invalidateConnectorsCache()
                 self.log.debug('Deleted connector [%s].', cid)
                 return True
 
@@ -133,35 +251,42 @@ class SMPPClientManagerPB(pb.Avatar):
         return jasmin.get_version()
 
     def perspective_persist(self, profile='jcli-prod'):
+        """Persist configuration to disk, returns a deferred fired with True once written
+
+        Configuration is copied right away (a consistent snapshot), it's then pickled and
+        written in a thread by self.store_writer"""
         path = '%s/%s.smppccs' % (self.config.store_path, profile)
         self.log.info('Persisting current configuration to [%s] profile in %s', profile, path)
 
         try:
             # Prepare connectors for persistence
             # Will persist config and service status only
+            # Configs are copied here and pickled in the writer thread
             connectors = []
             for c in self.connectors:
                 connectors.append({
                     'id': c['id'],
-                    'config': c['config'],
+                    'config': copy(c['config']),
                     'service_status': c['service'].running})
 
             # Write configuration with datetime stamp
-            fh = open(path, 'wb')
-            fh.write(('Persisted on %s [Jasmin %s]\n' % (time.strftime("%c"), jasmin.get_release())).encode('ascii'))
-            fh.write(pickle.dumps(connectors, self.pickleProtocol))
-            fh.close()
+            data = partial(dumpSnapshot, 'Persisted on %s [Jasmin %s]' % (time.strftime("%c"), jasmin.get_release()),
+                           connectors, self.pickleProtocol)
 
-            # Set persistance state to True
+            # Set persistance state to True, it's reverted if the snapshot cannot be written
             self.persisted = True
-        except IOError:
-            self.log.error('Cannot persist to %s', path)
-            return False
         except Exception as e:
             self.log.error('Unknown error occurred while persisting configuration: %s', e)
-            return False
+            return defer.succeed(False)
 
-        return True
+        d = self.store_writer.write([(path, data)])
+        d.addCallback(self.persistedCallback)
+        return d
+
+    def persistedCallback(self, written):
+        if not written:
+            self.persisted = False
+        return written
 
     @defer.inlineCallbacks
     def perspective_load(self, profile='jcli-prod'):
@@ -256,28 +381,11 @@ class SMPPClientManagerPB(pb.Avatar):
                                               exchange="messaging",
                                               routing_key=routing_key)
 
-        # Instanciate smpp client service manager
-        serviceManager = SMPPClientService(c, self.config)
-
-        # Instanciate a SM listener
-        smListener = SMPPClientSMListener(
-            config=SMPPClientSMListenerConfig(self.config.config_file),
-            SMPPClientFactory=serviceManager.SMPPClientFactory,
-            amqpBroker=self.amqpBroker,
-            redisClient=self.redisClient,
-            RouterPB=self.RouterPB,
-            interceptorpb_client=self.interceptorpb_client)
-
-        # Deliver_sm are sent to smListener's deliver_sm callback method
-        serviceManager.SMPPClientFactory.msgHandler = smListener.deliver_sm_event_interceptor
-
-        self.connectors.append({
-            'id': c.id,
-            'config': c,
-            'service': serviceManager,
-            'consumer_tag': None,
-            'submit_sm_q': None,
-            'sm_listener': smListener})
+        # Instanciate smpp client services and their SM listeners, one per bind
+        connector = {'id': c.id, 'config': c, 'binds': []}
+        self.setConnectorBinds(connector)
+        self.connectors.append(connector)
+        self.invalidateConnectorsCache()
 
         self.log.info('Added a new connector: %s', c.id)
 
@@ -296,9 +404,10 @@ class SMPPClientManagerPB(pb.Avatar):
         if connector is None:
             self.log.error('Trying to remove a connector with an unknown cid: %s', cid)
             defer.returnValue(False)
-        if connector['service'].running == 1:
-            self.log.debug('Stopping service for connector [%s] before removing it', cid)
-            connector['service'].stopService()
+        for bind in connector['binds']:
+            if bind['service'].running == 1:
+                self.log.debug('Stopping service for connector [%s] before removing it', cid)
+                bind['service'].stopService()
 
         # Stop the queue consumer
         self.log.debug('Stopping submit_sm_q consumer in connector [%s]', cid)
@@ -360,46 +469,60 @@ class SMPPClientManagerPB(pb.Avatar):
                 connector['service'].SMPPClientFactory.getSessionState())
             defer.returnValue(False)
 
-        connector['service'].startService()
-
-        # Start the queue consumer
-        self.log.debug('Starting submit_sm_q consumer in connector [%s]', cid)
+        # Binds number may have been updated while connector was stopped
+        self.setConnectorBinds(connector)
 
         # Subscribe to submit.sm.%cid queue
         # check jasmin.queues.test.test_amqp.PublishConsumeTestCase.test_simple_publish_consume_by_topic
         submit_sm_queue = 'submit.sm.%s' % connector['id']
-        consumerTag = 'SMPPClientFactory-%s' % (connector['id'])
 
-        try:
-            # Using the same consumerTag will prevent getting multiple consumers on the same queue
-            # This can resolve the dark hole issue #234
+        for bind_idx, bind in enumerate(connector['binds']):
+            bind['service'].startService()
 
-            # Stop the queue consumer if any
-            if connector['consumer_tag'] is not None:
-                self.log.debug('Stopping submit_sm_q consumer in connector [%s]', cid)
-                yield self.amqpBroker.chan.basic_cancel(consumer_tag=connector['consumer_tag'])
+            # Start the queue consumer
+            self.log.debug('Starting submit_sm_q consumer in connector [%s] bind #%s', cid, bind_idx)
 
-            # Start a new consumer
-            yield self.amqpBroker.chan.basic_consume(queue=submit_sm_queue,
-                                                     no_ack=False, consumer_tag=consumerTag)
-        except Exception as e:
-            self.log.error('Error consuming from queue %s: %s', submit_sm_queue, e)
-            defer.returnValue(False)
+            if bind_idx == 0:
+                consumerTag = 'SMPPClientFactory-%s' % (connector['id'])
+            else:
+                consumerTag = 'SMPPClientFactory-%s-%s' % (connector['id'], bind_idx)
+
+            try:
+                # Using the same consumerTag will prevent getting multiple consumers on the same queue
+                # This can resolve the dark hole issue #234
+
+                # Stop the queue consumer if any
+                if bind['consumer_tag'] is not None:
+                    self.log.debug('Stopping submit_sm_q consumer in connector [%s] bind #%s', cid, bind_idx)
+                    yield self.amqpBroker.chan.basic_cancel(consumer_tag=bind['consumer_tag'])
 
-        submit_sm_q = yield self.amqpBroker.client.queue(consumerTag)
-        self.log.info('%s is consuming from queue: %s', consumerTag, submit_sm_queue)
+                # Limit unacked messages to the connector's SMPP window, messages beyond it are
+                # kept in the queue (configs from older releases have no max_outstanding_submits)
+                yield self.amqpBroker.chan.basic_qos(
+                    prefetch_count=getattr(connector['config'], 'max_outstanding_submits', 1))
 
-        # Set callbacks for every consumed message from submit_sm_queue queue
-        d = submit_sm_q.get()
-        d.addCallback(connector['sm_listener'].submit_sm_callback).addErrback(
-            connector['sm_listener'].submit_sm_errback)
+                # Start a new consumer
+                yield self.amqpBroker.chan.basic_consume(queue=submit_sm_queue,
+                                                         no_ack=False, consumer_tag=consumerTag)
+            except Exception as e:
+                self.log.error('Error consuming from queue %s: %s', submit_sm_queue, e)
+                defer.returnValue(False)
 
-        self.log.info('Started connector [%s]', cid)
+            submit_sm_q = yield self.amqpBroker.client.queue(consumerTag)
+            self.log.info('%s is consuming from queue: %s', consumerTag, submit_sm_queue)
 
-        # Set connector data
-        connector['sm_listener'].setSubmitSmQ(submit_sm_q)
-        connector['consumer_tag'] = consumerTag
-        connector['submit_sm_q'] = submit_sm_q
+            # Set callbacks for every consumed message from submit_sm_queue queue
+            d = submit_sm_q.get()
+            d.addCallback(bind['sm_listener'].submit_sm_callback).addErrback(
+                bind['sm_listener'].submit_sm_errback)
+
+            # Set bind data
+            bind['sm_listener'].setSubmitSmQ(submit_sm_q)
+            bind['consumer_tag'] = consumerTag
+            bind['submit_sm_q'] = submit_sm_q
+
+        self.invalidateConnectorsCache()
+        self.log.info('Started connector [%s] with %s bind(s)', cid, len(connector['binds']))
 
         # Set persistance state to False (pending for persistance)
         self.persisted = False
@@ -418,15 +541,16 @@ class SMPPClientManagerPB(pb.Avatar):
             self.log.error('Trying to stop a connector with an unknown cid: %s', cid)
             defer.returnValue(False)
 
-        # Stop the queue consumer
-        if connector['consumer_tag'] is not None:
-            self.log.debug('Stopping submit_sm_q consumer in connector [%s]', cid)
-            yield self.amqpBroker.chan.basic_cancel(consumer_tag=connector['consumer_tag'])
+        # Stop the queue consumers
+        for bind in connector['binds']:
+            if bind['consumer_tag'] is not None:
+                self.log.debug('Stopping submit_sm_q consumer %s in connector [%s]', bind['consumer_tag'], cid)
+                yield self.amqpBroker.chan.basic_cancel(consumer_tag=bind['consumer_tag'])
 
-            # Cleaning
-            self.log.debug('Cleaning objects in connector [%s]', cid)
-            connector['submit_sm_q'] = None
-            connector['consumer_tag'] = None
+                # Cleaning
+                self.log.debug('Cleaning objects in connector [%s]', cid)
+                bind['submit_sm_q'] = None
+                bind['consumer_tag'] = None
 
         if connector['service'].running == 0:
             self.log.error('Connector [%s] is already stopped.', cid)
@@ -437,27 +561,30 @@ class SMPPClientManagerPB(pb.Avatar):
             self.log.debug('Deleting queue [%s]', submitSmQueueName)
             yield self.amqpBroker.chan.queue_delete(queue=submitSmQueueName)
 
-        # Reject & requeue any pending message to avoid loosing messages after
-        # clearing timers
-        if len(connector['sm_listener'].rejectTimers) > 0:
-            for msgid, timer in list(connector['sm_listener'].rejectTimers.items()):
-                if timer.active():
-                    func = timer.func
-                    kw = timer.kw
-                    timer.cancel()
-                    del connector['sm_listener'].rejectTimers[msgid]
-
-                    self.log.debug('Rejecting/requeuing msgid [%s] before stopping connector', msgid)
-                    yield func(**kw)
-
-        # Stop timers in message listeners
-        self.log.debug('Clearing sm_listener timers in connector [%s]', cid)
-        connector['sm_listener'].clearAllTimers()
-        connector['sm_listener'].submit_sm_q = None
-
-        # Stop SMPP connector
-        connector['service'].stopService()
-
+        for bind in connector['binds']:
+            # Reject & requeue any pending message to avoid loosing messages after
+            # clearing timers
+            if len(bind['sm_listener'].rejectTimers) > 0:
+                for msgid, timer in list(bind['sm_listener'].rejectTimers.items()):
+                    if timer.active():
+                        func = timer.func
+                        kw = timer.kw
+                        timer.cancel()
+                        del bind['sm_listener'].rejectTimers[msgid]
+
+                        self.log.debug('Rejecting/requeuing msgid [%s] before stopping connector', msgid)
+                        yield func(**kw)
+
+            # Stop timers in message listeners
+            self.log.debug('Clearing sm_listener timers in connector [%s]', cid)
+            bind['sm_listener'].clearAllTimers()
+            bind['sm_listener'].submit_sm_q = None
+
+            # Stop SMPP connector
+            if bind['service'].running == 1:
+                bind['service'].stopService()
+
+        self.invalidateConnectorsCache()
         self.log.info('Stopped connector [%s]', cid)
 
         # Set persistance state to False (pending for persistance)
@@ -544,6 +671,56 @@ class SMPPClientManagerPB(pb.Avatar):
 
         return pickle.dumps(connector['config'], self.pickleProtocol)
 
+    def setHttpApiDlrMap(self, connector, msgid, dlr_url, dlr_level, dlr_method, dlr_connector):
+        """Map msgid to the DLR url of a httpapi request, returns a deferred fired when the map is
+        written"""
+        if self.redisClient is None or str(self.redisClient) == '<Redis Connection: Not connected>':
+            self.log.warning("DLR is not enqueued for SubmitSmPDU [msgid:%s], RC is not connected.", msgid)
+            return defer.succeed(None)
+
+        self.log.debug('Setting DLR url (%s) and level (%s) for message id:%s, expiring in %s',
+                       dlr_url,
+                       dlr_level,
+                       msgid,
+                       connector['config'].dlr_expiry)
+        # Set values and callback expiration setting
+        hashKey = "dlr:%s" % msgid
+        hashValues = {'sc': 'httpapi',
+                      'url': dlr_url,
+                      'level': dlr_level,
+                      'method': dlr_method,
+                      'connector': dlr_connector,
+                      'expiry': connector['config'].dlr_expiry}
+        return self.dlrMapWriter.set(hashKey, hashValues, connector['config'].dlr_expiry)
+
+    def setSmppsDlrMap(self, source_connector, msgid, SubmitSmPDU):
+        """Map msgid to the SMPPServerProtocol source_connector, returns a deferred fired when the
+        map is written"""
+        if self.redisClient is None or str(self.redisClient) == '<Redis Connection: Not connected>':
+            self.log.warning("SMPPs mapping is not done for SubmitSmPDU [msgid:%s], RC is not connected.", msgid)
+            return defer.succeed(None)
+
+        self.log.debug(
+            'Setting SMPPs connector (%s) mapping for msgid:%s, registered_dlr: %s, expiring in %s',
+            source_connector.system_id,
+            msgid,
+            SubmitSmPDU.params['registered_delivery'],
+            source_connector.factory.config.dlr_expiry)
+        # Set values and callback expiration setting
+        hashKey = "dlr:%s" % msgid
+        hashValues = {'sc': 'smppsapi',
+                      'system_id': source_connector.system_id,
+                      'source_addr_ton': SubmitSmPDU.params['source_addr_ton'],
+                      'source_addr_npi': SubmitSmPDU.params['source_addr_npi'],
+                      'source_addr': SubmitSmPDU.params['source_addr'],
+                      'dest_addr_ton': SubmitSmPDU.params['dest_addr_ton'],
+                      'dest_addr_npi': SubmitSmPDU.params['dest_addr_npi'],
+                      'destination_addr': SubmitSmPDU.params['destination_addr'],
+                      'sub_date': datetime.datetime.now(),
+                      'rd_receipt': SubmitSmPDU.params['registered_delivery'].receipt,
+                      'expiry': source_connector.factory.config.dlr_expiry}
+        return self.dlrMapWriter.set(hashKey, hashValues, source_connector.factory.config.dlr_expiry)
+
     @defer.inlineCallbacks
     def perspective_submit_sm(self, uid, cid, SubmitSmPDU, submit_sm_bill, priority=1, validity_period=None,
                               pickled=True, dlr_url=None, dlr_level=1, dlr_method='POST', dlr_connector=None,
@@ -571,17 +748,23 @@ class SMPPClientManagerPB(pb.Avatar):
         pubQueueName = "submit.sm.%s" % cid
         responseQueueName = "submit.sm.resp.%s" % cid
 
-        # Pickle SubmitSmPDU if it's not pickled
-        if not pickled:
-            PickledSubmitSmPDU = pickle.dumps(SubmitSmPDU, self.pickleProtocol)
-            if submit_sm_bill is not None:
-                submit_sm_bill = pickle.dumps(submit_sm_bill, self.pickleProtocol)
+        # Unpickle SubmitSmPDU if it's pickled (PB transport) and encode it for publishing
+        messaging_codec = self.amqpBroker.config.getCodec('messaging')
+        if pickled:
+            if messaging_codec == 'pickle':
+                PickledSubmitSmPDU = SubmitSmPDU
+                SubmitSmPDU = pickle.loads(PickledSubmitSmPDU)
+            else:
+                SubmitSmPDU = pickle.loads(SubmitSmPDU)
+                PickledSubmitSmPDU = codec.dumps(SubmitSmPDU, messaging_codec, self.pickleProtocol)
+                if submit_sm_bill is not None:
+                    submit_sm_bill = codec.dumps(pickle.loads(submit_sm_bill), messaging_codec,
+                                                 self.pickleProtocol)
         else:
-            PickledSubmitSmPDU = SubmitSmPDU
-            SubmitSmPDU = pickle.loads(PickledSubmitSmPDU)
+            PickledSubmitSmPDU = codec.dumps(SubmitSmPDU, messaging_codec, self.pickleProtocol)
+            if submit_sm_bill is not None:
+                submit_sm_bill = codec.dumps(submit_sm_bill, messaging_codec, self.pickleProtocol)
 
-        # Publishing a pickled PDU
-        self.log.debug('Publishing SubmitSmPDU with routing_key=%s, priority=%s', pubQueueName, priority)
         c = SubmitSmContent(
             uid=uid,
             body=PickledSubmitSmPDU,
@@ -591,60 +774,74 @@ class SMPPClientManagerPB(pb.Avatar):
             expiration=validity_period,
             source_connector='httpapi' if source_connector == 'httpapi' else 'smppsapi',
             destination_cid=cid)
-        yield self.amqpBroker.publish(exchange='messaging', routing_key=pubQueueName, content=c)
 
+        # DLR maps are written before publishing, a fast submit_sm_resp or receipt would not
+        # find them otherwise
         if source_connector == 'httpapi' and dlr_url is not None:
             # Enqueue DLR request in redis 'dlr' key if it is a httpapi request
-            if self.redisClient is None or str(self.redisClient) == '<Redis Connection: Not connected>':
-                self.log.warning("DLR is not enqueued for SubmitSmPDU [msgid:%s], RC is not connected.",
-                              c.properties['message-id'])
-            else:
-                self.log.debug('Setting DLR url (%s) and level (%s) for message id:%s, expiring in %s',
-                               dlr_url,
-                               dlr_level,
-                               c.properties['message-id'],
-                               connector['config'].dlr_expiry)
-                # Set values and callback expiration setting
-                hashKey = "dlr:%s" % (c.properties['message-id'])
-                hashValues = {'sc': 'httpapi',
-                              'url': dlr_url,
-                              'level': dlr_level,
-                              'method': dlr_method,
-                              'connector': dlr_connector,
-                              'expiry': connector['config'].dlr_expiry}
-                self.redisClient.hmset(hashKey, hashValues).addCallback(
-                    lambda response: self.redisClient.expire(
-                        hashKey, connector['config'].dlr_expiry))
+            yield self.setHttpApiDlrMap(connector, c.properties['message-id'], dlr_url, dlr_level, dlr_method,
+                                        dlr_connector)
         elif (isinstance(source_connector, SMPPServerProtocol) and
               SubmitSmPDU.params['registered_delivery'].receipt != RegisteredDeliveryReceipt.NO_SMSC_DELIVERY_RECEIPT_REQUESTED):
-            # If submit_sm is successfully sent from a SMPPServerProtocol connector and DLR is
-            # requested, then map message-id to the source_connector to permit related deliver_sm
-            # messages holding further receipts to be sent back to the right connector
-            if self.redisClient is None or str(self.redisClient) == '<Redis Connection: Not connected>':
-                self.log.warning("SMPPs mapping is not done for SubmitSmPDU [msgid:%s], RC is not connected.",
-                              c.properties['message-id'])
-            else:
-                self.log.debug(
-                    'Setting SMPPs connector (%s) mapping for msgid:%s, registered_dlr: %s, expiring in %s',
-                    source_connector.system_id,
-                    c.properties['message-id'],
-                    SubmitSmPDU.params['registered_delivery'],
-                    source_connector.factory.config.dlr_expiry)
-                # Set values and callback expiration setting
-                hashKey = "dlr:%s" % (c.properties['message-id'])
-                hashValues = {'sc': 'smppsapi',
-                              'system_id': source_connector.system_id,
-                              'source_addr_ton': SubmitSmPDU.params['source_addr_ton'],
-                              'source_addr_npi': SubmitSmPDU.params['source_addr_npi'],
-                              'source_addr': SubmitSmPDU.params['source_addr'],
-                              'dest_addr_ton': SubmitSmPDU.params['dest_addr_ton'],
-                              'dest_addr_npi': SubmitSmPDU.params['dest_addr_npi'],
-                              'destination_addr': SubmitSmPDU.params['destination_addr'],
-                              'sub_date': datetime.datetime.now(),
-                              'rd_receipt': SubmitSmPDU.params['registered_delivery'].receipt,
-                              'expiry': source_connector.factory.config.dlr_expiry}
-                self.redisClient.hmset(hashKey, hashValues).addCallback(
-                    lambda response: self.redisClient.expire(
-                        hashKey, source_connector.factory.config.dlr_expiry))
+            # If DLR is requested from a SMPPServerProtocol connector, then map message-id to the
+            # source_connector to permit related deliver_sm messages holding further receipts to
+            # be sent back to the right connector
+            yield self.setSmppsDlrMap(source_connector, c.properties['message-id'], SubmitSmPDU)
+
+        # Publishing an encoded PDU
+        self.log.debug('Publishing SubmitSmPDU with routing_key=%s, priority=%s', pubQueueName, priority)
+        yield self.amqpBroker.publish(exchange='messaging', routing_key=pubQueueName, content=c)
 
         defer.returnValue(c.properties['message-id'])
+
+    @defer.inlineCallbacks
+    def submitSmBatch(self, uid, cid, submit_sms):
+        """Enqueue a batch of httpapi submit_sm to a connector with one batched publish
+
+        submit_sms is a list of dicts holding the perspective_submit_sm arguments (SubmitSmPDU
+        and submit_sm_bill are not pickled), returns the list of message ids in the same order
+        or False if the batch cannot be enqueued"""
+        connector = self.getConnector(cid)
+        if connector is None:
+            self.log.error('Trying to enqueue a SUBMIT_SM batch to a connector with an unknown cid: %s', cid)
+            defer.returnValue(False)
+        if self.amqpBroker is None:
+            self.log.error('AMQP Broker is not added')
+            defer.returnValue(False)
+        if self.amqpBroker.connected == False:
+            self.log.error('AMQP Broker is not connected')
+            defer.returnValue(False)
+
+        pubQueueName = "submit.sm.%s" % cid
+        responseQueueName = "submit.sm.resp.%s" % cid
+        messaging_codec = self.amqpBroker.config.getCodec('messaging')
+
+        messages = []
+        for submit_sm in submit_sms:
+            submit_sm_bill = submit_sm.get('submit_sm_bill')
+            if submit_sm_bill is not None:
+                submit_sm_bill = codec.dumps(submit_sm_bill, messaging_codec, self.pickleProtocol)
+
+            messages.append(SubmitSmContent(
+                uid=uid,
+                body=codec.dumps(submit_sm['SubmitSmPDU'], messaging_codec, self.pickleProtocol),
+                replyto=responseQueueName,
+                submit_sm_bill=submit_sm_bill,
+                priority=submit_sm.get('priority', 1),
+                expiration=submit_sm.get('validity_period'),
+                source_connector='httpapi',
+                destination_cid=cid))
+
+        # DLR maps are written before publishing
+        dlr_maps = []
+        for submit_sm, c in zip(submit_sms, messages):
+            if submit_sm.get('dlr_url') is not None:
+                dlr_maps.append(self.setHttpApiDlrMap(
+                    connector, c.properties['message-id'], submit_sm['dlr_url'], submit_sm.get('dlr_level', 1),
+                    submit_sm.get('dlr_method', 'POST'), submit_sm.get('dlr_connector')))
+        yield defer.gatherResults(dlr_maps)
+
+        self.log.debug('Publishing %s SubmitSmPDU with routing_key=%s', len(messages), pubQueueName)
+        yield self.amqpBroker.publishBatch('messaging', [(pubQueueName, c) for c in messages])
+
+        defer.returnValue([c.properties['message-id'] for c in messages])
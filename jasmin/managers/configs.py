@@ -8,6 +8,7 @@ import logging
 import os
 
 from jasmin.config import ConfigFile, ROOT_PATH, LOG_PATH
+from jasmin.protocols.smpp.configs import UnknownValue
 
 DEFAULT_LOGFORMAT = '%(asctime)s %(levelname)-8s %(process)d %(message)s'
 
@@ -39,6 +40,10 @@ class SMPPClientPBConfig(ConfigFile):
         self.log_date_format = self._get('client-management', 'log_date_format', '%Y-%m-%d %H:%M:%S')
         self.pickle_protocol = self._getint('client-management', 'pickle_protocol', 2)
 
+        # DLR maps batched writes: flush interval (in seconds) and size of written batches
+        self.dlr_map_flush_interval = self._getfloat('client-management', 'dlr_map_flush_interval', 0.005)
+        self.dlr_map_batch_size = self._getint('client-management', 'dlr_map_batch_size', 100)
+
 
 class SMPPClientSMListenerConfig(ConfigFile):
     """Config handler for 'sm-listener' section"""
@@ -70,6 +75,14 @@ class SMPPClientSMListenerConfig(ConfigFile):
         self.dlr_lookup_retry_delay = self._getint(
             'sm-listener', 'dlr_lookup_max_retries', 2)
 
+        # Long (concatenated) SMS-MO segments buffer: memory or redis (shared by jasmind instances)
+        self.long_content_buffer = self._get('sm-listener', 'long_content_buffer', 'redis')
+        if self.long_content_buffer not in ['memory', 'redis']:
+            raise UnknownValue('Invalid long_content_buffer: %s' % self.long_content_buffer)
+        self.long_content_ttl = self._getint('sm-listener', 'long_content_ttl', 300)
+        self.long_content_max_messages = self._getint('sm-listener', 'long_content_max_messages', 10000)
+        self.long_content_max_bytes = self._getint('sm-listener', 'long_content_max_bytes', 16777216)
+
         self.log_level = logging.getLevelName(self._get('sm-listener', 'log_level', 'INFO'))
         self.log_file = self._get('sm-listener', 'log_file', '%s/messages.log' % LOG_PATH)
         self.log_rotate = self._get('sm-listener', 'log_rotate', 'midnight')
@@ -92,6 +105,9 @@ class DLRLookupConfig(ConfigFile):
         self.smpp_receipt_on_success_submit_sm_resp = self._getbool('dlr', 'smpp_receipt_on_success_submit_sm_resp',
                                                                     False)
 
+        # Maximum number of smpp msgid mappings cached in memory, 0 to disable caching
+        self.smpp_msgid_cache_size = self._getint('dlr', 'smpp_msgid_cache_size', 100000)
+
         self.log_level = logging.getLevelName(self._get('dlr', 'log_level', 'INFO'))
         self.log_file = self._get('dlr', 'log_file', '%s/messages.log' % LOG_PATH)
         self.log_rotate = self._get('dlr', 'log_rotate', 'midnight')
@@ -12,6 +12,8 @@ from smpp.pdu.pdu_types import CommandId, CommandStatus
 
 from pkg_resources import iter_entry_points
 
+from jasmin.queues import codec as _codec
+
 
 class InvalidParameterError(Exception):
     """Raised when a parameter is invalid
@@ -34,11 +36,11 @@ class PDU(Content):
     pickleProtocol = pickle.HIGHEST_PROTOCOL
 
     def __init__(self, body="", children=None, properties=None, pickleProtocol=pickle.HIGHEST_PROTOCOL,
-                 prePickle=False):
+                 prePickle=False, codec='pickle'):
         self.pickleProtocol = pickleProtocol
 
         if prePickle is True:
-            body = pickle.dumps(body, self.pickleProtocol)
+            body = _codec.dumps(body, codec, self.pickleProtocol)
 
         # Add creation date in header
         if 'headers' not in properties:
@@ -174,10 +176,11 @@ class SubmitSmContent(PDU):
 class SubmitSmRespContent(PDU):
     """A SMPP SubmitSmResp Content"""
 
-    def __init__(self, body, msgid, pickleProtocol=pickle.HIGHEST_PROTOCOL, prePickle=True):
+    def __init__(self, body, msgid, pickleProtocol=pickle.HIGHEST_PROTOCOL, prePickle=True, codec='pickle'):
         props = {'message-id': msgid}
 
-        PDU.__init__(self, body, properties=props, pickleProtocol=pickleProtocol, prePickle=prePickle)
+        PDU.__init__(self, body, properties=props, pickleProtocol=pickleProtocol, prePickle=prePickle,
+                     codec=codec)
 
 
 class DeliverSmContent(PDU):
@@ -1,19 +1,152 @@
 import sys
+import time
+import hashlib
 import logging
 from logging.handlers import TimedRotatingFileHandler
 
 from twisted.internet import defer
 from twisted.internet import reactor
 from txamqp.queue import Closed
-from txredisapi import ConnectionError
+from txredisapi import ConnectionError, ScriptDoesNotExist
 from smpp.pdu.pdu_types import RegisteredDeliveryReceipt
 
+from jasmin.managers import dlrmap
 from jasmin.managers.content import DLRContentForHttpapi, DLRContentForSmpps
+from jasmin.tools.cache import LRUCache
 from jasmin.tools.singleton import Singleton
+from jasmin.tools.stats import ComponentsStatsCollector
 from jasmin.tools import to_enum
 
 LOG_CATEGORY = "dlr"
 
+# Server-side scripts making each dlr event a single Redis round-trip, they are returning the
+# fetched dlr map (as HGETALL does) after applying the dlr map updates the python side would do.
+# Receipt matching is left to the caller: it passes the registered delivery receipt values
+# (as stored in dlr maps) allowing smpps mapping/consumption.
+
+# Reads a hash or a compact (see jasmin.managers.dlrmap) dlr map, returns the values scripts are
+# deciding on and the reply to give back: HGETALL's one or {'__compact__', packed map}
+READ_DLR_MAP = """
+local function read_dlr_map(key)
+    local map = {}
+    local t = redis.call('TYPE', key)['ok']
+    if t == 'hash' then
+        local dlr = redis.call('HGETALL', key)
+        for i = 1, #dlr, 2 do
+            map[dlr[i]] = dlr[i + 1]
+        end
+        return map, dlr
+    elseif t == 'string' then
+        local v = redis.call('GET', key)
+        local sc = string.byte(v, 2)
+        if sc == 1 then
+            map['sc'] = 'httpapi'
+            map['level'] = tostring(string.byte(v, 3))
+        elseif sc == 2 then
+            map['sc'] = 'smppsapi'
+            map['rd_receipt'] = tostring(string.byte(v, 3))
+        end
+        local b5, b6, b7, b8 = string.byte(v, 5, 8)
+        map['expiry'] = tostring(((b5 * 256 + b6) * 256 + b7) * 256 + b8)
+        return map, {'__compact__', v}
+    end
+
+    return map, {}
+end
+"""
+
+# KEYS[1]: dlr:<msgid>, KEYS[2]: queue-msgid:<smpp msgid>
+# ARGV[1]: msgid, ARGV[2]: 1 if submit_sm_resp status is ESME_ROK, ARGV[3..]: smpps rd_receipt values
+SUBMIT_SM_RESP_DLR_SCRIPT = READ_DLR_MAP + """
+local map, dlr = read_dlr_map(KEYS[1])
+if #dlr == 0 then
+    return dlr
+end
+
+local ok = ARGV[2] == '1'
+local mapped_type = nil
+if map['sc'] == 'httpapi' then
+    if map['level'] == '1' or (map['level'] == '3' and not ok) then
+        redis.call('DEL', KEYS[1])
+    end
+    if ok and (map['level'] == '2' or map['level'] == '3') then
+        mapped_type = 'httpapi'
+    end
+elseif map['sc'] == 'smppsapi' and ok then
+    for i = 3, #ARGV do
+        if map['rd_receipt'] == ARGV[i] then
+            mapped_type = 'smppsapi'
+        end
+    end
+end
+
+if mapped_type then
+    redis.call('HMSET', KEYS[2], 'msgid', ARGV[1], 'connector_type', mapped_type)
+    redis.call('EXPIRE', KEYS[2], math.floor(tonumber(map['expiry'])))
+end
+
+return dlr
+"""
+
+# KEYS[1]: queue-msgid:<smpp msgid>
+# ARGV[1]: 1 if receipt status is final, ARGV[2..]: smpps rd_receipt values
+# Returns {msgid, connector_type, dlr map fields and values ...} or an empty list
+DELIVER_SM_DLR_SCRIPT = READ_DLR_MAP + """
+local q = redis.call('HGETALL', KEYS[1])
+if #q ~= 4 then
+    return {}
+end
+
+local qmap = {}
+for i = 1, #q, 2 do
+    qmap[q[i]] = q[i + 1]
+end
+if not qmap['msgid'] or not qmap['connector_type'] then
+    return {}
+end
+
+local dlr_key = 'dlr:' .. qmap['msgid']
+local map, dlr = read_dlr_map(dlr_key)
+
+if ARGV[1] == '1' and map['sc'] == qmap['connector_type'] then
+    local consume = false
+    if map['sc'] == 'httpapi' then
+        consume = map['level'] == '2' or map['level'] == '3'
+    elseif map['sc'] == 'smppsapi' then
+        for i = 2, #ARGV do
+            if map['rd_receipt'] == ARGV[i] then
+                consume = true
+            end
+        end
+    end
+
+    if consume then
+        redis.call('DEL', dlr_key)
+    end
+end
+
+local r = {qmap['msgid'], qmap['connector_type']}
+for i = 1, #dlr do
+    r[#r + 1] = dlr[i]
+end
+return r
+"""
+
+# KEYS[1]: dlr:<msgid>, ARGV[1]: expiry, ARGV[2..]: dlr map fields and values
+SET_DLR_MAP_SCRIPT = """
+redis.call('HMSET', KEYS[1], unpack(ARGV, 2))
+return redis.call('EXPIRE', KEYS[1], ARGV[1])
+"""
+
+
+def rd_receipt_values(receipts):
+    """Return the values registered delivery receipts may have in dlr maps (hash or compact)"""
+    values = []
+    for receipt in receipts:
+        values.extend([str(receipt), receipt.name, str(receipt.value)])
+
+    return values
+
 
 class RedisError(Exception):
     """Raised for any Redis connectivity problem"""
@@ -27,6 +160,139 @@ class DLRMapNotFound(Exception):
     """Raised if no dlr is found in Redis db"""
 
 
+class DLRMapWriter:
+    """
+    Batched dlr maps writer: maps are queued and written every flush_interval seconds (or as
+    soon as batch_size maps are queued) in one pipeline, each map is set with its expiry through
+    one single command: a script call for hash maps or a SET for compact ones
+
+    set() is returning a deferred fired when the map's batch is written, submit_sm are published
+    after their map is written: a fast submit_sm_resp or receipt would not find it otherwise.
+    """
+
+    def __init__(self, redisClient, flush_interval=0.005, batch_size=100, log=None, dlr_map_format='hash',
+                 dictionary=None):
+        self.redisClient = redisClient
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.dlr_map_format = dlr_map_format
+        if dictionary is None and dlr_map_format == 'compact':
+            dictionary = dlrmap.DLRMapDictionary(redisClient)
+        self.dictionary = dictionary
+        self.log = log if log is not None else logging.getLogger(LOG_CATEGORY)
+        self.script = {'source': SET_DLR_MAP_SCRIPT,
+                       'sha': hashlib.sha1(SET_DLR_MAP_SCRIPT.encode()).hexdigest()}
+        self.script_loaded = False
+
+        self.pending = []
+        # Deferreds returned by set() for pending maps
+        self.waiters = []
+        self.timer = None
+        # Batches being written (deferred -> number of maps)
+        self.flushing = {}
+        self.stats = {'written': 0, 'errors': 0, 'batches': 0,
+                      'last_flush_latency': 0.0, 'max_flush_latency': 0.0}
+
+    def set(self, hashKey, hashValues, expiry):
+        """Queue a dlr map for writing, returns a deferred fired when it's written (errors are
+        logged and counted in stats)"""
+        d = defer.Deferred()
+        self.pending.append((hashKey, hashValues, expiry))
+        self.waiters.append(d)
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.timer is None or not self.timer.active():
+            self.timer = reactor.callLater(self.flush_interval, self.flush)
+
+        return d
+
+    def getQueueDepth(self):
+        """Number of dlr maps waiting for the next flush"""
+        return len(self.pending)
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['queue_depth'] = self.getQueueDepth()
+        stats['in_flight'] = sum(self.flushing.values())
+        return stats
+
+    def flush(self):
+        """Write pending dlr maps, returns a deferred fired when they are written"""
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+        if len(self.pending) == 0:
+            return defer.succeed(None)
+
+        batch, self.pending = self.pending, []
+        waiters, self.waiters = self.waiters, []
+        d = self.writeBatch(batch)
+        self.flushing[d] = len(batch)
+        d.addBoth(self._flushed, d, waiters)
+        return d
+
+    def _flushed(self, result, d, waiters):
+        del self.flushing[d]
+        for waiter in waiters:
+            waiter.callback(None)
+        return result
+
+    @defer.inlineCallbacks
+    def writeBatch(self, batch, retry=True):
+        start = time.monotonic()
+        try:
+            if self.dlr_map_format == 'compact':
+                strings = []
+                for _, hashValues, _ in batch:
+                    if hashValues.get('sc') in ['httpapi', 'smppsapi']:
+                        strings.extend(dlrmap.internedStrings(hashValues))
+                yield self.dictionary.internAll(strings)
+
+            if not self.script_loaded:
+                yield self.redisClient.script_load(self.script['source'])
+                self.script_loaded = True
+
+            pipeline = yield self.redisClient.pipeline()
+            for hashKey, hashValues, expiry in batch:
+                if self.dlr_map_format == 'compact':
+                    try:
+                        pipeline.set(hashKey, dlrmap.dumps(hashValues, self.dictionary), expire=expiry)
+                        continue
+                    except dlrmap.DLRMapFormatError as e:
+                        self.log.debug('Writing %s as a hash map: %s', hashKey, e)
+
+                args = [expiry]
+                for field, value in hashValues.items():
+                    args.extend([field, value])
+                pipeline.evalsha(self.script['sha'], [hashKey], args)
+            yield pipeline.execute_pipeline()
+        except Exception as e:
+            if isinstance(e, defer.FirstError):
+                e = e.subFailure.value
+
+            if isinstance(e, ScriptDoesNotExist) and retry:
+                # Redis script cache was flushed (restarted server ?), reload it
+                self.script_loaded = False
+                yield self.writeBatch(batch, retry=False)
+            else:
+                self.stats['errors'] += len(batch)
+                self.log.error('Error writing %s dlr maps: %s', len(batch), e)
+        else:
+            latency = time.monotonic() - start
+            self.stats['written'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['last_flush_latency'] = latency
+            self.stats['max_flush_latency'] = max(latency, self.stats['max_flush_latency'])
+
+    @defer.inlineCallbacks
+    def stop(self):
+        """Flush pending dlr maps and wait for all batches being written"""
+        self.flush()
+        yield defer.DeferredList(list(self.flushing.keys()))
+
+
 class DLRLookup:
     """
     Will consume dlr pdus (submit_sm, deliver_sm or data_sm), lookup for matching dlr maps in redis db
@@ -41,6 +307,16 @@ class DLRLookup:
         self.redisClient = redisClient
         self.requeue_timers = {}
         self.lookup_retrials = {}
+        self.scripts = {}
+        for name, script in [('submit_sm_resp', SUBMIT_SM_RESP_DLR_SCRIPT),
+                             ('deliver_sm', DELIVER_SM_DLR_SCRIPT)]:
+            self.scripts[name] = {'source': script, 'sha': hashlib.sha1(script.encode()).hexdigest()}
+        # Compact dlr maps' strings dictionary
+        self.dictionary = dlrmap.DLRMapDictionary(redisClient)
+        # In-process smpp msgid -> (msgid, connector_type, dlr map) mappings, they are written through
+        # to Redis and will serve receipts handled by this DLRLookup without fetching them back
+        self.msgid_cache = LRUCache(maxsize=config.smpp_msgid_cache_size)
+        ComponentsStatsCollector().register('dlr_lookup', str(self.pid), self.getStats)
 
         # Set up a dedicated logger
         self.log = logging.getLogger(LOG_CATEGORY)
@@ -71,6 +347,33 @@ class DLRLookup:
         yield self.amqpBroker.chan.basic_consume(queue=queueName, no_ack=False, consumer_tag=consumerTag)
         self.amqpBroker.client.queue(consumerTag).addCallback(self.setup_callbacks)
 
+    @defer.inlineCallbacks
+    def runScript(self, name, keys, args):
+        """Run a dlr script by its sha1, it's loaded into Redis (EVAL) only when the server
+        doesn't know it yet"""
+        script = self.scripts[name]
+        try:
+            r = yield self.redisClient.evalsha(script['sha'], keys, args)
+        except ScriptDoesNotExist:
+            self.log.debug('Loading %s dlr script into Redis', name)
+            r = yield self.redisClient.eval(script['source'], keys, args)
+
+        defer.returnValue(r)
+
+    def getStats(self):
+        """Return smpp msgid cache statistics (hits, misses and hit_ratio)"""
+        return self.msgid_cache.getStats()
+
+    @defer.inlineCallbacks
+    def getDLRMap(self, reply):
+        """Return dlr map values from a script reply, hash or compact (see READ_DLR_MAP)"""
+        if len(reply) == 2 and reply[0] == '__compact__':
+            dlr = yield dlrmap.loads(reply[1], self.dictionary)
+        else:
+            dlr = dict(zip(reply[::2], reply[1::2]))
+
+        defer.returnValue(dlr)
+
     @defer.inlineCallbacks
     def rejectAndRequeueMessage(self, message, delay=True):
         msgid = message.content.properties['message-id']
@@ -170,7 +473,17 @@ class DLRLookup:
             # Check for DLR request from redis 'dlr' key
             # If there's a pending delivery receipt request then serve it
             # back by publishing a DLRContentForHttpapi to the messaging exchange
-            dlr = yield self.redisClient.hgetall("dlr:%s" % msgid)
+            # The dlr map is consumed and smpp msgid is mapped to msgid by the same script call
+            smpp_msgid = None
+            if dlr_status == 'ESME_ROK':
+                smpp_msgid = message.content.properties['headers']['smpp_msgid']
+            r = yield self.runScript(
+                'submit_sm_resp',
+                keys=["dlr:%s" % msgid, "queue-msgid:%s" % smpp_msgid],
+                args=[msgid, 1 if dlr_status == 'ESME_ROK' else 0] + rd_receipt_values(
+                    [RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED_FOR_FAILURE,
+                     RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED]))
+            dlr = yield self.getDLRMap(r)
 
             if dlr is None or len(dlr) == 0:
                 raise DLRMapNotFound('No dlr map for msgid[%s]' % msgid)
@@ -209,21 +522,16 @@ class DLRLookup:
                     # When level 3 is requested, the DLR will be removed when
                     # receiving a deliver_sm (terminal receipt)
                     if dlr_level == 1 or dlr_status != 'ESME_ROK':
-                        self.log.debug('Removing DLR request for msgid[%s]', msgid)
-                        yield self.redisClient.delete("dlr:%s" % msgid)
+                        self.log.debug('Removed DLR request for msgid[%s]', msgid)
                 else:
                     self.log.debug(
                         'Terminal level receipt is requested, will not send any DLR receipt at this level.')
 
                 if dlr_level in [2, 3] and dlr_status == 'ESME_ROK':
-                    smpp_msgid = message.content.properties['headers']['smpp_msgid']
-                    # Map received submit_sm_resp's message_id to the msg for later receipt handling
-                    self.log.debug('Mapping smpp msgid: %s to queue msgid: %s, expiring in %s',
+                    # Received submit_sm_resp's message_id is mapped to the msg for later receipt handling
+                    self.log.debug('Mapped smpp msgid: %s to queue msgid: %s, expiring in %s',
                                    smpp_msgid, msgid, dlr_expiry)
-                    hashKey = "queue-msgid:%s" % smpp_msgid
-                    hashValues = {'msgid': msgid, 'connector_type': 'httpapi'}
-                    yield self.redisClient.hmset(hashKey, hashValues)
-                    yield self.redisClient.expire(hashKey, dlr_expiry)
+                    self.msgid_cache.set(smpp_msgid, (msgid, 'httpapi', dlr), ttl=int(dlr_expiry))
             elif dlr['sc'] == 'smppsapi':
                 self.log.debug('There is a SMPPs mapping for msgid[%s] ...', msgid)
                 system_id = dlr['system_id']
@@ -267,14 +575,10 @@ class DLRLookup:
                                                                                  dest_addr_npi))
 
                     if dlr_status == 'ESME_ROK':
-                        smpp_msgid = message.content.properties['headers']['smpp_msgid']
-                        # Map received submit_sm_resp's message_id to the msg for later rceipt handling
-                        self.log.debug('Mapping smpp msgid: %s to queue msgid: %s, expiring in %s',
+                        # Received submit_sm_resp's message_id is mapped to the msg for later receipt handling
+                        self.log.debug('Mapped smpp msgid: %s to queue msgid: %s, expiring in %s',
                                        smpp_msgid, msgid, smpps_map_expiry)
-                        hashKey = "queue-msgid:%s" % smpp_msgid
-                        hashValues = {'msgid': msgid, 'connector_type': 'smppsapi'}
-                        yield self.redisClient.hmset(hashKey, hashValues)
-                        yield self.redisClient.expire(hashKey, smpps_map_expiry)
+                        self.msgid_cache.set(smpp_msgid, (msgid, 'smppsapi', dlr), ttl=int(smpps_map_expiry))
         except DLRMapError as e:
             self.log.error('[msgid:%s] DLR Content: %s', msgid, e)
             yield self.rejectMessage(message)
@@ -315,23 +619,45 @@ class DLRLookup:
             if self.redisClient is None:
                 raise RedisError('RC undefined !')
 
-            q = yield self.redisClient.hgetall("queue-msgid:%s" % msgid)
-            if len(q) != 2 or 'msgid' not in q or 'connector_type' not in q:
-                raise DLRMapNotFound('Got a DLR for an unknown message id: %s (coded:%s)' % (pdu_dlr_id, msgid))
-
-            submit_sm_queue_id = q['msgid']
-            connector_type = q['connector_type']
+            success_states = ['ACCEPTD', 'DELIVRD']
+            final_states = ['DELIVRD', 'EXPIRED', 'DELETED', 'UNDELIV', 'REJECTD']
 
-            # Get dlr and ensure it's sc (source_connector) is same as q['connector_type']
-            dlr = yield self.redisClient.hgetall("dlr:%s" % submit_sm_queue_id)
-            if dlr is None or len(dlr) == 0:
+            # Resolve smpp msgid to its dlr map, the map is consumed by the same script call
+            # when the receipt is final and forwarded
+            if pdu_dlr_status in success_states:
+                consuming_receipts = [RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED]
+            else:
+                consuming_receipts = [RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED,
+                                      RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED_FOR_FAILURE]
+            cached = self.msgid_cache.get(msgid)
+            if cached is not None:
+                # Mapped by this DLRLookup, only consuming the dlr map is left to Redis
+                submit_sm_queue_id, connector_type, dlr = cached
+                if pdu_dlr_status in final_states and (
+                        (connector_type == 'httpapi' and dlr['level'] in [2, 3]) or
+                        (connector_type == 'smppsapi' and to_enum(dlr['rd_receipt']) in consuming_receipts)):
+                    self.msgid_cache.pop(msgid)
+                    self.redisClient.delete('dlr:%s' % submit_sm_queue_id).addErrback(
+                        lambda f: self.log.error('Error removing dlr map for msgid[%s]: %s',
+                                                 submit_sm_queue_id, f.value))
+            else:
+                r = yield self.runScript(
+                    'deliver_sm',
+                    keys=["queue-msgid:%s" % msgid],
+                    args=[1 if pdu_dlr_status in final_states else 0] + rd_receipt_values(consuming_receipts))
+                if r is None or len(r) < 2:
+                    raise DLRMapNotFound('Got a DLR for an unknown message id: %s (coded:%s)' % (pdu_dlr_id, msgid))
+
+                submit_sm_queue_id = r[0]
+                connector_type = r[1]
+                dlr = yield self.getDLRMap(r[2:])
+
+            # Ensure dlr's sc (source_connector) is same as queue-msgid's connector_type
+            if len(dlr) == 0:
                 raise DLRMapNotFound('Got a DLR for an unknown message id: %s (coded:%s)' % (pdu_dlr_id, msgid))
             if len(dlr) > 0 and dlr['sc'] != connector_type:
                 raise DLRMapError('Found a dlr for msgid:%s with diffrent sc: %s' % (submit_sm_queue_id, dlr['sc']))
-            
-            success_states = ['ACCEPTD', 'DELIVRD']
-            final_states = ['DELIVRD', 'EXPIRED', 'DELETED', 'UNDELIV', 'REJECTD']
-            
+
             if connector_type == 'httpapi':
                 self.log.debug('There is a HTTP DLR request for msgid[%s] ...', msgid)
                 dlr_url = dlr['url']
@@ -362,8 +688,7 @@ class DLRLookup:
                                                                                method=dlr_method))
 
                     if pdu_dlr_status in final_states:
-                        self.log.debug('Removing HTTP dlr map for msgid[%s]', submit_sm_queue_id)
-                        yield self.redisClient.delete('dlr:%s' % submit_sm_queue_id)
+                        self.log.debug('Removed HTTP dlr map for msgid[%s]', submit_sm_queue_id)
             elif connector_type == 'smppsapi':
                 self.log.debug('There is a SMPPs mapping for msgid[%s] ...', msgid)
                 system_id = dlr['system_id']
@@ -404,8 +729,7 @@ class DLRLookup:
                                                                              err=pdu_dlr_err))
 
                     if pdu_dlr_status in final_states:
-                        self.log.debug('Removing SMPPs dlr map for msgid[%s]', submit_sm_queue_id)
-                        yield self.redisClient.delete('dlr:%s' % submit_sm_queue_id)
+                        self.log.debug('Removed SMPPs dlr map for msgid[%s]', submit_sm_queue_id)
         except DLRMapError as e:
             self.log.error('[msgid:%s] DLRMapError: %s', msgid, e)
             yield self.rejectMessage(message)
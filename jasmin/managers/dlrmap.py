@@ -0,0 +1,296 @@
+"""
+Storage formats of DLR maps in Redis
+
+Two formats are available:
+- hash: the historical format, one Redis hash per map with a field per value
+- compact: one packed binary string per map, repeated strings (urls, methods, connectors and
+  system ids) are interned in a dictionary shared through Redis and replaced by their ids
+
+A compact map starts with a fixed prefix holding the values DLRLookup's Redis scripts are
+deciding on, this prefix must be kept in sync with read_dlr_map() in jasmin.managers.dlr scripts.
+Decoded maps are holding the same values as hash maps fetched with HGETALL.
+
+The dictionary is one Redis hash without expiry, it must not be evicted (maxmemory-policy must be
+noeviction or volatile-*). When it's lost anyway (flushed db, failover to a stale replica ...) a
+new dictionary is started with a new random epoch, maps are carrying the epoch of their interned
+strings: the ones referencing a lost dictionary cannot be decoded anymore instead of being decoded
+with strings interned since.
+"""
+
+import datetime
+import random
+import struct
+
+from twisted.internet import defer
+from smpp.pdu.pdu_types import AddrNpi, AddrTon, RegisteredDeliveryReceipt
+
+from jasmin.tools import to_enum
+from jasmin.tools.cache import LRUCache
+
+FORMATS = ['hash', 'compact']
+
+VERSION = 1
+# version, sc, level (httpapi) or rd_receipt (smppsapi), reserved, expiry, dictionary epoch (0 when
+# no string is interned)
+PREFIX = struct.Struct('!BBBBII')
+
+SC_HTTPAPI = 1
+SC_SMPPSAPI = 2
+
+# String encodings
+STR_INLINE = 0
+STR_INTERNED = 1
+
+EPOCH = datetime.datetime(1970, 1, 1)
+
+DICTIONARY_KEY = 'dlr-dict'
+
+# KEYS[1]: dictionary hash, ARGV[1]: string, ARGV[2]: max dictionary size, ARGV[3]: epoch of a new
+# dictionary
+# The hash holds the dictionary epoch, its size, string -> id (s:<string>) and id -> string
+# (i:<id>) fields, it's a single key: a partially lost dictionary would reassign ids
+# Returns {epoch, string id}, the id is 0 when the dictionary is full
+INTERN_SCRIPT = """
+local epoch = redis.call('HGET', KEYS[1], 'epoch')
+if not epoch then
+    epoch = ARGV[3]
+    redis.call('HSET', KEYS[1], 'epoch', epoch)
+end
+
+local id = redis.call('HGET', KEYS[1], 's:' .. ARGV[1])
+if id then
+    return {tonumber(epoch), tonumber(id)}
+end
+
+local size = tonumber(redis.call('HGET', KEYS[1], 'size') or '0')
+if size >= tonumber(ARGV[2]) then
+    return {tonumber(epoch), 0}
+end
+
+id = size + 1
+redis.call('HMSET', KEYS[1], 'size', id, 's:' .. ARGV[1], id, 'i:' .. id, ARGV[1])
+return {tonumber(epoch), id}
+"""
+
+
+class DLRMapFormatError(ValueError):
+    """Raised when a map cannot be encoded or decoded with the compact format
+    """
+
+
+def _to_bytes(value):
+    """Encode value the way txredisapi does when writing a hash field"""
+    if isinstance(value, bytes):
+        return value
+    elif isinstance(value, str):
+        return value.encode()
+    else:
+        return str(value).encode()
+
+
+def _from_bytes(value):
+    """Decode value the way txredisapi does when reading a hash field"""
+    try:
+        return value.decode()
+    except UnicodeDecodeError:
+        return value
+
+
+class DLRMapDictionary:
+    """Strings dictionary shared by compact DLR maps writers and readers
+
+    Strings are assigned ids once and are never removed nor reassigned within a dictionary epoch,
+    both sides are caching them: (epoch, id) -> string never changes while string -> id cache
+    entries are expiring after cache_ttl seconds, writers will then find out about a new epoch.
+    """
+
+    def __init__(self, redisClient, max_size=10000, cache_ttl=300):
+        self.redisClient = redisClient
+        self.max_size = max_size
+        # Epoch of cached ids
+        self.epoch = 0
+        self.ids = LRUCache(maxsize=max_size, ttl=cache_ttl)
+        self.strings = LRUCache(maxsize=max_size)
+
+    def getId(self, string):
+        """Return the cached id of string (in the current epoch), None if not interned or not cached"""
+        return self.ids.get(string)
+
+    @defer.inlineCallbacks
+    def intern(self, string):
+        """Return the id of string, 0 if it cannot be interned (full dictionary)"""
+        _id = self.ids.get(string)
+        if _id is None:
+            epoch, _id = yield self.redisClient.eval(INTERN_SCRIPT, [DICTIONARY_KEY],
+                                                     [string, self.max_size, random.randint(1, 0xffffffff)])
+            if epoch != self.epoch:
+                # New dictionary, ids cached so far are not valid anymore
+                self.ids.clear()
+                self.epoch = epoch
+            if _id != 0:
+                self.ids.set(string, _id)
+                self.strings.set((epoch, _id), string)
+
+        defer.returnValue(_id)
+
+    @defer.inlineCallbacks
+    def internAll(self, strings):
+        """Intern strings not cached yet"""
+        for string in set(strings):
+            if self.getId(string) is None:
+                yield self.intern(string)
+
+    @defer.inlineCallbacks
+    def lookup(self, epoch, _id):
+        string = self.strings.get((epoch, _id))
+        if string is None:
+            current_epoch, string = yield self.redisClient.hmget(DICTIONARY_KEY, ['epoch', 'i:%s' % _id])
+            if current_epoch is None or int(current_epoch) != epoch:
+                raise DLRMapFormatError('Unknown dictionary epoch: %s' % epoch)
+            if string is None:
+                raise DLRMapFormatError('Unknown dictionary id: %s' % _id)
+
+            string = _to_bytes(string)
+            self.strings.set((epoch, _id), string)
+
+        defer.returnValue(string)
+
+
+def internedStrings(values):
+    """Return the strings of map values to intern before encoding them"""
+    if values['sc'] == 'httpapi':
+        fields = ['url', 'method', 'connector']
+    else:
+        fields = ['system_id']
+
+    return [_to_bytes(values[field]) for field in fields]
+
+
+def _enum_value(enum, value):
+    """Return the value of an enum member given as is or as read from a hash map"""
+    if isinstance(value, str):
+        value = to_enum(value)
+    return enum(value).value
+
+
+def _datetime(value):
+    if isinstance(value, str):
+        value = datetime.datetime.fromisoformat(value)
+    return value
+
+
+def _encode_str(value, dictionary=None):
+    value = _to_bytes(value)
+    _id = dictionary.getId(value) if dictionary is not None else None
+    if _id:
+        return struct.pack('!BI', STR_INTERNED, _id)
+
+    if len(value) > 0xffff:
+        raise DLRMapFormatError('String too long: %s bytes' % len(value))
+    return struct.pack('!BH', STR_INLINE, len(value)) + value
+
+
+def _decode_str(data, offset, strings):
+    """Decode string at offset, interned ones are read from strings (id -> string) """
+    kind, = struct.unpack_from('!B', data, offset)
+    if kind == STR_INTERNED:
+        _id, = struct.unpack_from('!I', data, offset + 1)
+        return _from_bytes(strings[_id]), offset + 5
+
+    length, = struct.unpack_from('!H', data, offset + 1)
+    offset += 3
+    return _from_bytes(data[offset:offset + length]), offset + length
+
+
+def _interned_ids(data):
+    """Return the dictionary ids referenced by compact map data"""
+    ids = []
+    offset = PREFIX.size
+    count = 3 if data[1] == SC_HTTPAPI else 1
+    for _ in range(count):
+        kind, = struct.unpack_from('!B', data, offset)
+        if kind == STR_INTERNED:
+            ids.append(struct.unpack_from('!I', data, offset + 1)[0])
+            offset += 5
+        else:
+            offset += 3 + struct.unpack_from('!H', data, offset + 1)[0]
+
+    return ids
+
+
+def dumps(values, dictionary=None):
+    """Pack a dlr map, its strings are interned when a dictionary is given and they are
+    already known to it (see internedStrings())
+
+    values are either the ones written by SMPPClientManagerPB or the ones read from a hash map
+    """
+    epoch = dictionary.epoch if dictionary is not None else 0
+    if epoch == 0:
+        dictionary = None
+
+    try:
+        if values['sc'] == 'httpapi':
+            data = PREFIX.pack(VERSION, SC_HTTPAPI, int(values['level']), 0, int(values['expiry']), epoch)
+            for field in ['url', 'method', 'connector']:
+                data += _encode_str(values[field], dictionary)
+        elif values['sc'] == 'smppsapi':
+            data = PREFIX.pack(VERSION, SC_SMPPSAPI, _enum_value(RegisteredDeliveryReceipt, values['rd_receipt']), 0,
+                               int(values['expiry']), epoch)
+            data += _encode_str(values['system_id'], dictionary)
+            data += struct.pack('!BB', _enum_value(AddrTon, values['source_addr_ton']),
+                                _enum_value(AddrNpi, values['source_addr_npi']))
+            data += _encode_str(values['source_addr'])
+            data += struct.pack('!BB', _enum_value(AddrTon, values['dest_addr_ton']),
+                                _enum_value(AddrNpi, values['dest_addr_npi']))
+            data += _encode_str(values['destination_addr'])
+            data += struct.pack('!q', (_datetime(values['sub_date']) - EPOCH) // datetime.timedelta(microseconds=1))
+        else:
+            raise DLRMapFormatError('Unknown dlr map sc: %s' % values['sc'])
+    except (KeyError, TypeError, ValueError, struct.error) as e:
+        raise DLRMapFormatError('Cannot pack dlr map: %s' % e)
+
+    return data
+
+
+@defer.inlineCallbacks
+def loads(data, dictionary=None):
+    """Unpack a dlr map into the values HGETALL returns for a hash map"""
+    if isinstance(data, str):
+        # txredisapi is decoding any utf-8 valid reply
+        data = data.encode()
+
+    if len(data) < PREFIX.size:
+        raise DLRMapFormatError('Truncated dlr map')
+    version, sc, level_or_receipt, _, expiry, epoch = PREFIX.unpack_from(data)
+    if version != VERSION:
+        raise DLRMapFormatError('Unsupported dlr map version: %s' % version)
+
+    strings = {}
+    for _id in _interned_ids(data):
+        if dictionary is None or epoch == 0:
+            raise DLRMapFormatError('A dictionary is required to unpack dlr map')
+        strings[_id] = yield dictionary.lookup(epoch, _id)
+
+    values = {'expiry': expiry}
+    offset = PREFIX.size
+    if sc == SC_HTTPAPI:
+        values['sc'] = 'httpapi'
+        values['level'] = level_or_receipt
+        for field in ['url', 'method', 'connector']:
+            values[field], offset = _decode_str(data, offset, strings)
+    elif sc == SC_SMPPSAPI:
+        values['sc'] = 'smppsapi'
+        values['rd_receipt'] = str(RegisteredDeliveryReceipt(level_or_receipt))
+        values['system_id'], offset = _decode_str(data, offset, strings)
+        ton, npi = struct.unpack_from('!BB', data, offset)
+        values['source_addr_ton'], values['source_addr_npi'] = str(AddrTon(ton)), str(AddrNpi(npi))
+        values['source_addr'], offset = _decode_str(data, offset + 2, strings)
+        ton, npi = struct.unpack_from('!BB', data, offset)
+        values['dest_addr_ton'], values['dest_addr_npi'] = str(AddrTon(ton)), str(AddrNpi(npi))
+        values['destination_addr'], offset = _decode_str(data, offset + 2, strings)
+        sub_date, = struct.unpack_from('!q', data, offset)
+        values['sub_date'] = str(EPOCH + datetime.timedelta(microseconds=sub_date))
+    else:
+        raise DLRMapFormatError('Unknown dlr map sc: %s' % sc)
+
+    defer.returnValue(values)
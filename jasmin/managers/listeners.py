@@ -2,7 +2,7 @@
 import pickle
 import sys
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from logging.handlers import TimedRotatingFileHandler
 
 from dateutil import parser
@@ -16,8 +16,10 @@ from smpp.pdu.error import SMPPRequestTimoutError
 
 from jasmin.managers.configs import SMPPClientPBConfig
 from jasmin.managers.content import SubmitSmRespContent, DeliverSmContent, SubmitSmRespBillContent, DLR
+from jasmin.managers.segments import SegmentsBuffer, concatenate
 from jasmin.protocols.smpp.error import *
 from jasmin.protocols.smpp.operations import SMPPOperationFactory
+from jasmin.queues import codec
 from jasmin.routing.Routables import RoutableDeliverSm
 from jasmin.routing.jasminApi import Connector
 from jasmin.tools import qos
@@ -40,10 +42,19 @@ class SMPPClientSMListener:
         self.RouterPB = RouterPB
         self.interceptorpb_client = interceptorpb_client
         self.submit_sm_q = None
-        self.qos_last_submit_sm_at = None
         self.rejectTimers = {}
         self.submit_retrials = {}
-        self.qosTimer = None
+
+        # Throttles submit_sm to the connector's submit_sm_throughput
+        self.qos_scheduler = qos.TokenBucketScheduler(self.SMPPClientFactory.config.submit_sm_throughput)
+
+        # SMPP window: submit_sm sent on the bind and waiting for their submit_sm_resp
+        self.submit_window = defer.DeferredSemaphore(self.getMaxOutstandingSubmits())
+
+        # Listeners of all the binds of the same connector (including this one), they're set
+        # by SMPPClientManagerPB for multi-bind connectors
+        self.siblings = [self]
+        self.updateSubmitWindowStats()
 
         # Set pickleProtocol
         self.pickleProtocol = SMPPClientPBConfig(self.config.config_file).pickle_protocol
@@ -62,6 +73,13 @@ class SMPPClientSMListener:
             self.log.addHandler(handler)
             self.log.propagate = False
 
+        # Segments of long SMS-MO, the buffer is shared with siblings since segments of the same
+        # message may be received through different binds
+        self.segments = SegmentsBuffer(ttl=self.config.long_content_ttl,
+                                       max_messages=self.config.long_content_max_messages,
+                                       max_bytes=self.config.long_content_max_bytes,
+                                       log=self.log)
+
     def setSubmitSmQ(self, queue):
         self.log.debug('Setting a new submit_sm_q: %s', queue)
         self.submit_sm_q = queue
@@ -80,14 +98,72 @@ class SMPPClientSMListener:
             del self.rejectTimers[msgid]
 
     def clearQosTimer(self):
-        if self.qosTimer is not None and self.qosTimer.called is False:
-            self.qosTimer.cancel()
-            self.qosTimer = None
+        self.qos_scheduler.cancel()
+
+    def clearSubmitWindow(self):
+        """Cancel submit_sm waiting for a free slot in the SMPP window"""
+        for d in list(self.submit_window.waiting):
+            d.cancel()
 
     def clearAllTimers(self):
         self.clearQosTimer()
+        self.clearSubmitWindow()
         self.clearRejectTimers()
 
+    def getMaxOutstandingSubmits(self):
+        # Connector configs from older releases have no max_outstanding_submits
+        return getattr(self.SMPPClientFactory.config, 'max_outstanding_submits', 1)
+
+    def updateSubmitWindowStats(self):
+        # Stats are per cid, sum up the windows of all binds
+        self.SMPPClientFactory.stats.set(
+            'submit_sm_window', sum(l.submit_window.limit for l in self.siblings))
+        self.SMPPClientFactory.stats.set(
+            'submit_sm_outstanding', sum(l.submit_window.limit - l.submit_window.tokens for l in self.siblings))
+
+    def getLoad(self):
+        """Return the number of submit_sm sent or waiting to be sent through this bind"""
+        return self.submit_window.limit - self.submit_window.tokens + len(self.submit_window.waiting)
+
+    def pickBind(self):
+        """Return the listener of the least loaded bound session among the connector's binds,
+        this listener is preferred on equal loads and returned if no session is bound"""
+        picked = None
+        for listener in self.siblings:
+            smpp = listener.SMPPClientFactory.smpp
+            if smpp is None or not smpp.isBound():
+                continue
+
+            if (picked is None or listener.getLoad() < picked.getLoad()
+                    or (listener is self and listener.getLoad() == picked.getLoad())):
+                picked = listener
+
+        return self if picked is None else picked
+
+    def resizeSubmitWindow(self):
+        """Apply an updated max_outstanding_submits to the SMPP window"""
+        window = self.getMaxOutstandingSubmits()
+        delta = window - self.submit_window.limit
+        if delta == 0:
+            return
+
+        self.log.info('Resizing SMPP window of [cid:%s] from %s to %s',
+                      self.SMPPClientFactory.config.id, self.submit_window.limit, window)
+        self.submit_window.limit = window
+        self.submit_window.tokens += delta
+        while self.submit_window.tokens > 0 and self.submit_window.waiting:
+            self.submit_window.tokens -= 1
+            self.submit_window.waiting.pop(0).callback(self.submit_window)
+        self.updateSubmitWindowStats()
+
+    def releaseSubmitWindow(self):
+        if self.submit_window.tokens < 0:
+            # The window was shrunk while this slot was in use, drop it
+            self.submit_window.tokens += 1
+        else:
+            self.submit_window.release()
+        self.updateSubmitWindowStats()
+
     @defer.inlineCallbacks
     def rejectAndRequeueMessage(self, message, delay=True):
         msgid = message.content.properties['message-id']
@@ -132,9 +208,11 @@ class SMPPClientSMListener:
         c.f. test_amqp.ConsumeTestCase for use cases
         """
         msgid = None
+        window_acquired = False
+        bind = self
         try:
             msgid = message.content.properties['message-id']
-            SubmitSmPDU = pickle.loads(message.content.body)
+            SubmitSmPDU = codec.loads(message.content.body)
 
             self.submit_sm_q.get().addCallback(self.submit_sm_callback).addErrback(self.submit_sm_errback)
 
@@ -146,28 +224,25 @@ class SMPPClientSMListener:
             else:
                 self.submit_retrials[msgid] = 1
 
-            if self.qos_last_submit_sm_at is None:
-                self.qos_last_submit_sm_at = datetime(1970, 1, 1)
-
-            if self.SMPPClientFactory.config.submit_sm_throughput > 0:
-                # QoS throttling
-                qos_throughput_second = 1 / float(self.SMPPClientFactory.config.submit_sm_throughput)
-                qos_throughput_ysecond_td = timedelta(microseconds=qos_throughput_second * 1000000)
-                qos_delay = datetime.now() - self.qos_last_submit_sm_at
-                if qos_delay < qos_throughput_ysecond_td:
-                    qos_slow_down = float((qos_throughput_ysecond_td - qos_delay).microseconds) / 1000000
-                    # We're faster than submit_sm_throughput,
-                    # slow down before taking a new message from the queue
-                    self.log.debug(
-                        "QoS: submit_sm_callback faster (%s) than throughput (%s), slowing down %ss (requeuing).",
-                        qos_delay, qos_throughput_ysecond_td, qos_slow_down)
-
-                    # New QoS controller (>=0.10.13):
-                    # Will pause for a delay then allow handling the message normally
-                    # This will avoid impacting resources by requeuing on rabbitmq
-                    yield qos.slow_down(qos_slow_down)
+            # Multi-bind connectors: send through the least loaded bound session
+            bind = self.pickBind()
+
+            # QoS throttling: wait for a token from the bind's scheduler, submit_sm_throughput may
+            # have been updated since the last submit_sm
+            bind.qos_scheduler.setRate(self.SMPPClientFactory.config.submit_sm_throughput)
+            d = bind.qos_scheduler.acquire()
+            if not d.called:
+                # We're faster than submit_sm_throughput, wait for our turn
+                self.log.debug("QoS: submit_sm_callback faster than throughput (%s/s), slowing down.",
+                               self.SMPPClientFactory.config.submit_sm_throughput)
+            yield d
 
-                self.qos_last_submit_sm_at = datetime.now()
+            # SMPP window: wait for a free slot on the bind, the message is kept unacked meanwhile
+            # so AMQP delivery stops once the consumer's prefetch_count is reached
+            bind.resizeSubmitWindow()
+            yield bind.submit_window.acquire()
+            window_acquired = True
+            bind.updateSubmitWindowStats()
 
             # Verify if message is a SubmitSm PDU
             if isinstance(SubmitSmPDU, SubmitSM) is False:
@@ -187,7 +262,7 @@ class SMPPClientSMListener:
                     defer.returnValue(False)
 
             # SMPP Client should be already connected
-            if self.SMPPClientFactory.smpp is None:
+            if bind.SMPPClientFactory.smpp is None:
                 created_at = parser.parse(message.content.properties['headers']['created_at'])
                 msgAge = datetime.now() - created_at
                 if msgAge.seconds > self.config.submit_max_age_smppc_not_ready:
@@ -211,7 +286,7 @@ class SMPPClientSMListener:
                     defer.returnValue(False)
 
             # SMPP Client should be already bound as transceiver or transmitter
-            if self.SMPPClientFactory.smpp.isBound() is False:
+            if bind.SMPPClientFactory.smpp.isBound() is False:
                 created_at = parser.parse(message.content.properties['headers']['created_at'])
                 msgAge = datetime.now() - created_at
                 if msgAge.seconds > self.config.submit_max_age_smppc_not_ready:
@@ -236,9 +311,14 @@ class SMPPClientSMListener:
             # Finally: send the sms !
             self.log.debug("Sending SubmitSmPDU[%s] through SMPPClientFactory [cid:%s] after %s requeues.",
                            msgid, self.SMPPClientFactory.config.id, self.submit_retrials[msgid])
-            d = self.SMPPClientFactory.smpp.sendDataRequest(SubmitSmPDU)
+            d = bind.SMPPClientFactory.smpp.sendDataRequest(SubmitSmPDU)
             d.addCallback(self.submit_sm_resp_event, message)
             yield d
+        except defer.CancelledError:
+            self.log.info("SubmitSmPDU[%s] throttling or windowing was cancelled through [cid:%s], message requeued.",
+                          msgid, self.SMPPClientFactory.config.id)
+            self.rejectAndRequeueMessage(message, delay=False)
+            defer.returnValue(False)
         except SMPPRequestTimoutError:
             self.log.error("SubmitSmPDU[%s] request timed out through [cid:%s], message requeued.",
                            msgid, self.SMPPClientFactory.config.id)
@@ -254,6 +334,9 @@ class SMPPClientSMListener:
                               msgid, self.SMPPClientFactory.config.id, type(e), e)
             self.rejectMessage(message)
             defer.returnValue(False)
+        finally:
+            if window_acquired:
+                bind.releaseSubmitWindow()
 
     @defer.inlineCallbacks
     def submit_sm_resp_event(self, r, amqpMessage):
@@ -263,7 +346,7 @@ class SMPPClientSMListener:
 
         try:
             if 'submit_sm_bill' in amqpMessage.content.properties['headers']:
-                submit_sm_resp_bill = pickle.loads(
+                submit_sm_resp_bill = codec.loads(
                     amqpMessage.content.properties['headers']['submit_sm_bill']).getSubmitSmRespBill()
             else:
                 submit_sm_resp_bill = None
@@ -409,7 +492,8 @@ class SMPPClientSMListener:
                 # Send back submit_sm_resp to submit.sm.resp.CID queue
                 # There's no actual listeners on this queue, it can be used to
                 # track submit_sm_resp messages from a 3rd party app
-                content = SubmitSmRespContent(r.response, msgid, pickleProtocol=self.pickleProtocol)
+                content = SubmitSmRespContent(r.response, msgid, pickleProtocol=self.pickleProtocol,
+                                              codec=self.amqpBroker.config.getCodec('messaging'))
                 self.log.debug("Sending back SubmitSmRespContent[%s] with routing_key[%s]",
                                msgid, amqpMessage.content.properties['reply-to'])
                 yield self.amqpBroker.publish(exchange='messaging',
@@ -431,7 +515,7 @@ class SMPPClientSMListener:
             # @todo: implement this errback
             # For info, this errback is called whenever:
             # - an error has occurred inside submit_sm_callback
-            # - the qosTimer has been cancelled (self.clearQosTimer())
+            # - the qos scheduler has been cancelled (self.clearQosTimer())
             try:
                 error.raiseException()
             except Exception as e:
@@ -443,56 +527,36 @@ class SMPPClientSMListener:
             self.log.warning('This hashKey %s already exists, will not reset it !', hashKey)
             return
 
-        # @TODO: longDeliverSm part expiry must be configurable
-        yield self.redisClient.expire(hashKey, 300)
-
-        # This is the last part
-        if segment_seqnum == total_segments:
-            hvals = yield self.redisClient.hvals(hashKey)
-            if len(hvals) != total_segments:
-                self.log.warning(
-                    'Received the last part (msg_ref_num:%s) and did not find all parts in redis, data lost !',
-                    msg_ref_num)
-                return
-
-            # Get PDUs
-            pdus = {}
-            for pickledValue in hvals:
-                value = pickle.loads(pickledValue)
-
-                pdus[value['segment_seqnum']] = value['pdu']
-
-            # Where is the message content to be found ?
-            if 'short_message' in pdus[1].params:
-                msg_content_key = 'short_message'
-            elif 'message_payload' in pdus[1].params:
-                msg_content_key = 'message_payload'
-            else:
-                self.log.warning('Cannot find message content in first pdu params: %s', pdus[1].params)
-                return
-
-            # Build concat_message_content
-            concat_message_content = b''
-            for i in range(total_segments):
-                if splitMethod == 'sar':
-                    concat_message_content += pdus[i + 1].params[msg_content_key]
-                else:
-                    concat_message_content += pdus[i + 1].params[msg_content_key][6:]
-
-            # Build the final pdu and return it back to deliver_sm_event
-            pdu = pdus[1]  # Take the first part as a base of work
-            # 1. Remove message splitting information from pdu
-            if splitMethod == 'sar':
-                del pdu.params['sar_segment_seqnum']
-                del pdu.params['sar_total_segments']
-                del pdu.params['sar_msg_ref_num']
-            else:
-                pdu.params['esm_class'] = None
-            # 2. Set the new concat_message_content
-            pdu.params[msg_content_key] = concat_message_content
+        yield self.redisClient.expire(hashKey, self.config.long_content_ttl)
+
+        # Parts may be received in any order, the message is complete once all of them are found
+        if (yield self.redisClient.hlen(hashKey)) < total_segments:
+            return
+
+        hvals = yield self.redisClient.hvals(hashKey)
+        # Parts of the same message may be received by other jasmind instances: the one deleting
+        # the hash is delivering the message
+        if (yield self.redisClient.delete(hashKey)) == 0:
+            return
+
+        # Get PDUs
+        pdus = {}
+        for pickledValue in hvals:
+            value = pickle.loads(pickledValue)
+
+            pdus[value['segment_seqnum']] = value['pdu']
 
-            routable = RoutableDeliverSm(pdu, Connector(self.SMPPClientFactory.config.id))
-            yield self.deliver_sm_event_post_interception(routable=routable, smpp=None, concatenated=True)
+        yield self.deliverConcatenatedSm(pdus, total_segments, splitMethod)
+
+    def deliverConcatenatedSm(self, pdus, total_segments, splitMethod):
+        """Build the long message from its segments and return it back to deliver_sm_event"""
+        pdu = concatenate(pdus, total_segments, splitMethod)
+        if pdu is None:
+            self.log.warning('Cannot find message content in first pdu params: %s', pdus[1].params)
+            return defer.succeed(None)
+
+        routable = RoutableDeliverSm(pdu, Connector(self.SMPPClientFactory.config.id))
+        return self.deliver_sm_event_post_interception(routable=routable, smpp=None, concatenated=True)
 
     def code_dlr_msgid(self, pdu):
         """Code the dlr msg id accordingly to SMPPc's dlr_msg_id_bases value"""
@@ -701,7 +765,16 @@ class SMPPClientSMListener:
                         logged_content)
                 else:
                     # Long message part received
-                    if self.redisClient is None:
+                    if self.config.long_content_buffer != 'redis':
+                        # Buffer it in memory
+                        key = (self.SMPPClientFactory.config.id,
+                               routable.pdu.params['source_addr'],
+                               routable.pdu.params['destination_addr'],
+                               msg_ref_num)
+                        pdus = self.segments.add(key, total_segments, segment_seqnum, routable.pdu)
+                        if pdus is not None:
+                            yield self.deliverConcatenatedSm(pdus, len(pdus), splitMethod)
+                    elif self.redisClient is None:
                         self.log.critical(
                             'Invalid RC found while receiving part of long DeliverSm [queue-msgid:%s], MSG IS LOST !',
                             msgid)
@@ -724,6 +797,7 @@ class SMPPClientSMListener:
                             msg_ref_num,
                             segment_seqnum)
 
+                    if self.config.long_content_buffer != 'redis' or self.redisClient is not None:
                         self.log.info(
                             "DeliverSmContent[%s] is part of long msg of (%s), will be enqueued after concatenation.",
                             msgid, total_segments)
@@ -0,0 +1,152 @@
+"""
+Reassembly of long (concatenated) SMS-MO
+
+Segments of a long message are buffered in memory until all of them are received, they are
+then concatenated into one single DeliverSm pdu; both SAR (sar_* optional parameters) and UDH
+(IEI 0x00 header) split methods are supported.
+"""
+
+import copy
+import logging
+import time
+from collections import OrderedDict
+
+# Length of UDH for concatenated messages with 8 bit reference: UDHL, IEI, IEDL, ref, total, seqnum
+UDH_LENGTH = 6
+
+LOG_CATEGORY = "jasmin-sm-listener"
+
+
+def getContentKey(pdu):
+    """Return the param holding pdu's message content, None if not found"""
+    if 'short_message' in pdu.params:
+        return 'short_message'
+    elif 'message_payload' in pdu.params:
+        return 'message_payload'
+    return None
+
+
+def concatenate(pdus, total_segments, splitMethod):
+    """Build the long message pdu from its segments (seqnum -> pdu), the first segment is taken as
+    a base for the returned pdu, None is returned if message content is not found in it
+    """
+    msg_content_key = getContentKey(pdus[1])
+    if msg_content_key is None:
+        return None
+
+    concat_message_content = b''
+    for i in range(total_segments):
+        if splitMethod == 'sar':
+            concat_message_content += pdus[i + 1].params[msg_content_key]
+        else:
+            concat_message_content += pdus[i + 1].params[msg_content_key][UDH_LENGTH:]
+
+    pdu = copy.copy(pdus[1])
+    pdu.params = dict(pdu.params)
+    # 1. Remove message splitting information from pdu
+    if splitMethod == 'sar':
+        del pdu.params['sar_segment_seqnum']
+        del pdu.params['sar_total_segments']
+        del pdu.params['sar_msg_ref_num']
+    else:
+        pdu.params['esm_class'] = None
+    # 2. Set the new concat_message_content
+    pdu.params[msg_content_key] = concat_message_content
+
+    return pdu
+
+
+class SegmentsBuffer:
+    """
+    In-memory buffer of long messages segments
+
+    Messages are kept until all their segments are received (in any order), a message is dropped
+    when no new segment is received within ttl seconds or when it's the oldest one and the buffer
+    is holding more than max_messages messages or max_bytes bytes of content.
+    """
+
+    def __init__(self, ttl=300, max_messages=10000, max_bytes=16777216, log=None):
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.log = log if log is not None else logging.getLogger(LOG_CATEGORY)
+
+        # key -> {'total_segments', 'pdus', 'size', 'expires_at'}, oldest first
+        self.messages = OrderedDict()
+        self.size = 0
+        self.stats = {'assembled': 0, 'expired': 0, 'evicted': 0, 'duplicates': 0}
+
+    def add(self, key, total_segments, segment_seqnum, pdu):
+        """Buffer a segment, returns the message segments (seqnum -> pdu) when it's the last missing
+        one and None otherwise
+
+        The returned segments are removed from the buffer, a segment already received for the same
+        message is ignored.
+        """
+        now = time.monotonic()
+        self.expire(now)
+
+        message = self.messages.get(key)
+        if message is None:
+            message = {'total_segments': total_segments, 'pdus': {}, 'size': 0}
+            self.messages[key] = message
+        elif segment_seqnum in message['pdus']:
+            self.stats['duplicates'] += 1
+            self.log.warning('Segment %s of long message %s already received, will not reset it !',
+                             segment_seqnum, key)
+            return None
+        else:
+            self.messages.move_to_end(key)
+
+        msg_content_key = getContentKey(pdu)
+        size = len(pdu.params[msg_content_key] or b'') if msg_content_key is not None else 0
+        message['pdus'][segment_seqnum] = pdu
+        message['size'] += size
+        message['expires_at'] = now + self.ttl
+        self.size += size
+
+        segments = range(1, message['total_segments'] + 1)
+        if all(i in message['pdus'] for i in segments):
+            self.pop(key)
+            self.stats['assembled'] += 1
+            return {i: message['pdus'][i] for i in segments}
+
+        self.evict()
+        return None
+
+    def pop(self, key):
+        message = self.messages.pop(key, None)
+        if message is not None:
+            self.size -= message['size']
+        return message
+
+    def expire(self, now=None):
+        """Drop messages with no new segment received within ttl seconds"""
+        if now is None:
+            now = time.monotonic()
+
+        # Messages are ordered by their last received segment, hence by expiry time
+        while len(self.messages) > 0:
+            key, message = next(iter(self.messages.items()))
+            if message['expires_at'] > now:
+                break
+
+            self.pop(key)
+            self.stats['expired'] += 1
+            self.log.warning('Long message %s expired with %s/%s segments received, data lost !',
+                             key, len(message['pdus']), message['total_segments'])
+
+    def evict(self):
+        """Drop the oldest messages until the buffer is within its bounds"""
+        while len(self.messages) > 0 and (len(self.messages) > self.max_messages or self.size > self.max_bytes):
+            key, message = self.messages.popitem(last=False)
+            self.size -= message['size']
+            self.stats['evicted'] += 1
+            self.log.warning('Long message %s evicted (buffer full) with %s/%s segments received, data lost !',
+                             key, len(message['pdus']), message['total_segments'])
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['pending_messages'] = len(self.messages)
+        stats['pending_bytes'] = self.size
+        return stats
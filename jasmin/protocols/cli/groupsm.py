@@ -1,4 +1,7 @@
 import pickle
+
+from twisted.internet import defer
+
 from jasmin.protocols.cli.managers import PersistableManager, Session
 from jasmin.routing.jasminApi import Group
 
@@ -69,8 +72,11 @@ class GroupsManager(PersistableManager):
     """Groups manager logics"""
     managerName = 'group'
 
+    @defer.inlineCallbacks
     def persist(self, arg, opts):
-        if self.pb['router'].perspective_persist(opts.profile, 'groups'):
+        r = yield self.pb['router'].perspective_persist(opts.profile, 'groups')
+
+        if r:
             self.protocol.sendData(
                 '%s configuration persisted (profile:%s)' % (self.managerName, opts.profile), prompt=False)
         else:
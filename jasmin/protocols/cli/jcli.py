@@ -1,6 +1,7 @@
 import jasmin
 from hashlib import md5
 from optparse import make_option
+from twisted.internet import defer
 from jasmin.protocols.cli.managers import PersistableManager
 from jasmin.protocols.cli.options import options
 from jasmin.protocols.cli.protocol import CmdProtocol
@@ -402,12 +403,13 @@ class JCliProtocol(CmdProtocol):
 
     @options([make_option('-p', '--profile', type="string", default="jcli-prod",
                           help="Configuration profile, default: jcli-prod")], '')
+    @defer.inlineCallbacks
     def do_persist(self, arg, opts):
         """Persist current configuration profile to disk in PROFILE"""
 
         for _, manager in self.managers.items():
             if manager is not None and isinstance(manager, PersistableManager):
-                manager.persist(arg, opts)
+                yield manager.persist(arg, opts)
         self.sendData()
 
     @options([make_option('-p', '--profile', type="string", default="jcli-prod",
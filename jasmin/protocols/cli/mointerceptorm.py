@@ -3,6 +3,9 @@ import re
 import inspect
 import pickle
 import urllib.parse, urllib.request, urllib.error
+
+from twisted.internet import defer
+
 from jasmin.protocols.cli.managers import PersistableManager, Session
 from jasmin.protocols.cli.filtersm import MOFILTERS
 from jasmin.routing.jasminApi import MOInterceptorScript
@@ -222,8 +225,11 @@ class MoInterceptorManager(PersistableManager):
     """MO Interceptor manager logics"""
     managerName = 'mointerceptor'
 
+    @defer.inlineCallbacks
     def persist(self, arg, opts):
-        if self.pb['router'].perspective_persist(opts.profile, 'mointerceptors'):
+        r = yield self.pb['router'].perspective_persist(opts.profile, 'mointerceptors')
+
+        if r:
             self.protocol.sendData(
                 '%s configuration persisted (profile:%s)' % (self.managerName, opts.profile), prompt=False)
         else:
@@ -3,6 +3,8 @@ import pickle
 import inspect
 import re
 
+from twisted.internet import defer
+
 from jasmin.protocols.cli.filtersm import MOFILTERS
 from jasmin.protocols.cli.managers import PersistableManager, Session
 from jasmin.routing.Routes import (DefaultRoute, StaticMORoute, RandomRoundrobinMORoute, FailoverMORoute)
@@ -233,8 +235,11 @@ class MoRouterManager(PersistableManager):
     """MO Router manager logics"""
     managerName = 'morouter'
 
+    @defer.inlineCallbacks
     def persist(self, arg, opts):
-        if self.pb['router'].perspective_persist(opts.profile, 'moroutes'):
+        r = yield self.pb['router'].perspective_persist(opts.profile, 'moroutes')
+
+        if r:
             self.protocol.sendData(
                 '%s configuration persisted (profile:%s)' % (self.managerName, opts.profile), prompt=False)
         else:
@@ -3,6 +3,8 @@ import pickle
 import inspect
 import re
 
+from twisted.internet import defer
+
 from jasmin.protocols.cli.filtersm import MTFILTERS
 from jasmin.protocols.cli.managers import PersistableManager, Session
 from jasmin.routing.Routes import (DefaultRoute, StaticMTRoute, RandomRoundrobinMTRoute, FailoverMTRoute)
@@ -230,8 +232,11 @@ class MtRouterManager(PersistableManager):
     """MT Router manager logics"""
     managerName = 'mtrouter'
 
+    @defer.inlineCallbacks
     def persist(self, arg, opts):
-        if self.pb['router'].perspective_persist(opts.profile, 'mtroutes'):
+        r = yield self.pb['router'].perspective_persist(opts.profile, 'mtroutes')
+
+        if r:
             self.protocol.sendData(
                 '%s configuration persisted (profile:%s)' % (self.managerName, opts.profile), prompt=False)
         else:
@@ -26,14 +26,16 @@ SMPPClientConfigKeyMap = {
     'def_msg_id': 'sm_default_msg_id', 'coding': 'data_coding', 'requeue_delay': 'requeue_delay',
     'submit_throughput': 'submit_sm_throughput', 'dlr_expiry': 'dlr_expiry', 'dlr_msgid': 'dlr_msg_id_bases',
     'con_fail_retry': 'reconnectOnConnectionFailure', 'dst_npi': 'dest_addr_npi',
-    'trx_to': 'inactivityTimerSecs', 'ssl': 'useSSL'}
+    'trx_to': 'inactivityTimerSecs', 'ssl': 'useSSL', 'submit_window': 'max_outstanding_submits',
+    'binds': 'binds', 'dlr_format': 'dlr_receipt_format'}
 
 # Keys to be kept in string type, as requested in #64 and #105
 SMPPClientConfigStringKeys = [
-    'host', 'systemType', 'username', 'password', 'addressRange', 'useSSL', 'source_addr']
+    'host', 'systemType', 'username', 'password', 'addressRange', 'useSSL', 'source_addr',
+    'dlr_receipt_format']
 
 # When updating a key from RequireRestartKeys, the connector need restart for update to take effect
-RequireRestartKeys = ['host', 'port', 'username', 'password', 'systemType']
+RequireRestartKeys = ['host', 'port', 'username', 'password', 'systemType', 'binds']
 
 
 def castOutputToBuiltInType(key, value):
@@ -227,8 +229,11 @@ class SmppCCManager(PersistableManager):
     """SMPP Client Connector manager logics"""
     managerName = 'smppcc'
 
+    @defer.inlineCallbacks
     def persist(self, arg, opts):
-        if self.pb['smppcm'].perspective_persist(opts.profile):
+        r = yield self.pb['smppcm'].perspective_persist(opts.profile)
+
+        if r:
             self.protocol.sendData(
                 '%s configuration persisted (profile:%s)' % (self.managerName, opts.profile), prompt=False)
         else:
@@ -269,6 +274,18 @@ class SmppCCManager(PersistableManager):
                     str(connector['start_count']).ljust(6),
                     str(connector['stop_count']).ljust(5),
                 ), prompt=False)
+
+                # Show every bind state when connector has many of them
+                binds = connector.get('binds', [])
+                if len(binds) > 1:
+                    for bind_idx, bind in enumerate(binds):
+                        self.protocol.sendData("#%s %s %s %s %s" % (
+                            str('  bind #%s' % bind_idx).ljust(35),
+                            str('started' if bind['service_status'] == 1 else 'stopped').ljust(7),
+                            str(bind['session_state']).ljust(16),
+                            str(bind['start_count']).ljust(6),
+                            str(bind['stop_count']).ljust(5),
+                        ), prompt=False)
                 self.protocol.sendData(prompt=False)
 
         self.protocol.sendData('Total connectors: %s' % counter)
@@ -300,6 +317,7 @@ class SmppCCManager(PersistableManager):
         connectorDetails = self.pb['smppcm'].getConnectorDetails(self.sessionContext['cid'])
         for key, value in updateLog.items():
             connector['config'].set(key, value)
+        self.pb['smppcm'].invalidateConnectorsCache()
 
         if connector['config'].PendingRestart and connectorDetails['service_status'] == 1:
             self.protocol.sendData(
@@ -1,6 +1,9 @@
 import pickle
 import re
 from hashlib import md5
+
+from twisted.internet import defer
+
 from jasmin.protocols.cli.managers import PersistableManager, Session
 from jasmin.protocols.cli.protocol import str2num
 from jasmin.routing.jasminApi import User, MtMessagingCredential, SmppsCredential, jasminApiCredentialError
@@ -355,8 +358,11 @@ class UsersManager(PersistableManager):
     """Users manager logics"""
     managerName = 'user'
 
+    @defer.inlineCallbacks
     def persist(self, arg, opts):
-        if self.pb['router'].perspective_persist(opts.profile, 'users'):
+        r = yield self.pb['router'].perspective_persist(opts.profile, 'users')
+
+        if r:
             self.protocol.sendData(
                 '%s configuration persisted (profile:%s)' % (self.managerName, opts.profile),
                 prompt=False)
@@ -32,3 +32,10 @@ class HTTPApiConfig(ConfigFile):
         # Long message splitting
         self.long_content_max_parts = self._get('http-api', 'long_content_max_parts', 5)
         self.long_content_split = self._get('http-api', 'long_content_split', 'udh')  # sar or udh
+
+        # Batches (/sendbatch): messages are routed and published by chunks of batch_chunk_size,
+        # batch status is kept for batch_status_ttl seconds (up to batch_status_max batches)
+        self.batch_chunk_size = self._getint('http-api', 'batch_chunk_size', 500)
+        self.batch_max_messages = self._getint('http-api', 'batch_max_messages', 100000)
+        self.batch_status_ttl = self._getint('http-api', 'batch_status_ttl', 86400)
+        self.batch_status_max = self._getint('http-api', 'batch_status_max', 10000)
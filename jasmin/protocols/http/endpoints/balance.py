@@ -4,10 +4,14 @@ import json
 
 from twisted.web.resource import Resource
 
-from jasmin.protocols.http.validation import UrlArgsValidator, HttpAPICredentialValidator
+from jasmin.protocols.http.validation import HttpRequestParser, HttpAPICredentialValidator
 from jasmin.protocols.http.errors import HttpApiError
 from jasmin.protocols.http.endpoints import authenticate_user
 
+# Validation
+BALANCE_FIELDS = {b'username': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
+                  b'password': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')}}
+BALANCE_PARSER = HttpRequestParser(BALANCE_FIELDS)
 
 class Balance(Resource):
     isleaf = True
@@ -35,13 +39,8 @@ class Balance(Resource):
         self.stats.set('last_request_at', datetime.now())
 
         try:
-            # Validation
-            fields = {b'username': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
-                      b'password': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')}}
-
             # Make validation
-            v = UrlArgsValidator(request, fields)
-            v.validate()
+            BALANCE_PARSER.parse(request)
 
             # Authentication
             user = authenticate_user(
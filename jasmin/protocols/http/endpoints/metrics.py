@@ -2,6 +2,8 @@ from twisted.web.resource import Resource
 
 from jasmin.protocols.http.stats import HttpAPIStatsCollector
 from jasmin.protocols.smpp.stats import SMPPClientStatsCollector, SMPPServerStatsCollector
+from jasmin.routing.stats import ThrowerStatsCollector
+from jasmin.tools.stats import ComponentsStatsCollector
 
 PROM_METRICS_HTTPAPI = {
     'request_count':            {'type': b'counter', 'help': b'Http request count.'},
@@ -27,6 +29,8 @@ PROM_METRICS_SMPPC = {
     'throttling_error_count':   {'type': b'counter', 'help': b'Throttling errors count.'},
     'interceptor_error_count':  {'type': b'counter', 'help': b'Interception errors count.'},
     'other_submit_error_count': {'type': b'counter', 'help': b'Other errors count.'},
+    'submit_sm_window':         {'type': b'gauge', 'help': b'Maximum number of outstanding SubmitSm.'},
+    'submit_sm_outstanding':    {'type': b'gauge', 'help': b'SubmitSm pdus waiting for their SubmitSmResp.'},
 }
 PROM_METRICS_SMPPS_API = {
     'connected_count':          {'type': b'counter', 'help': b'Number of connected sessions.'},
@@ -49,6 +53,50 @@ PROM_METRICS_SMPPS_API = {
     'interceptor_error_count':  {'type': b'counter', 'help': b'Interception errors count.'},
     'other_submit_error_count': {'type': b'counter', 'help': b'Other errors count.'},
 }
+PROM_METRICS_THROWER = {
+    'http_connections_created': {'type': b'counter', 'help': b'Cumulated number of created http connections.'},
+    'http_connections_reused':  {'type': b'counter', 'help': b'Cumulated number of reused http connections.'},
+    'http_connections_idle':    {'type': b'gauge', 'help': b'Number of idle pooled http connections.'},
+    'http_requests_inflight':   {'type': b'gauge', 'help': b'Number of in-flight http requests.'},
+}
+
+PROM_METRICS_STORE = {
+    'persisted':                {'type': b'counter', 'help': b'Persisted configuration snapshots count.'},
+    'failed':                   {'type': b'counter', 'help': b'Failed configuration snapshots count.'},
+    'last_duration':            {'type': b'gauge', 'help': b'Last snapshot serialization and write duration in seconds.'},
+    'max_duration':             {'type': b'gauge', 'help': b'Maximum snapshot serialization and write duration in seconds.'},
+}
+PROM_METRICS_DLR_MAP_WRITER = {
+    'written':                  {'type': b'counter', 'help': b'Written dlr maps count.'},
+    'errors':                   {'type': b'counter', 'help': b'Dlr maps write errors count.'},
+    'batches':                  {'type': b'counter', 'help': b'Written dlr maps batches count.'},
+    'queue_depth':              {'type': b'gauge', 'help': b'Dlr maps waiting for the next flush.'},
+    'in_flight':                {'type': b'gauge', 'help': b'Dlr maps being written.'},
+    'last_flush_latency':       {'type': b'gauge', 'help': b'Last dlr maps batch write latency in seconds.'},
+    'max_flush_latency':        {'type': b'gauge', 'help': b'Maximum dlr maps batch write latency in seconds.'},
+}
+PROM_METRICS_SEGMENTS = {
+    'assembled':                {'type': b'counter', 'help': b'Long SMS-MO assembled in memory count.'},
+    'expired':                  {'type': b'counter', 'help': b'Long SMS-MO dropped after long_content_ttl count.'},
+    'evicted':                  {'type': b'counter', 'help': b'Long SMS-MO dropped when the buffer is full count.'},
+    'duplicates':               {'type': b'counter', 'help': b'Duplicate long SMS-MO segments count.'},
+    'pending_messages':         {'type': b'gauge', 'help': b'Long SMS-MO waiting for their segments.'},
+    'pending_bytes':            {'type': b'gauge', 'help': b'Bytes of buffered long SMS-MO segments.'},
+}
+PROM_METRICS_DLR_LOOKUP = {
+    'size':                     {'type': b'gauge', 'help': b'Smpp msgids in the dlr lookup cache.'},
+    'maxsize':                  {'type': b'gauge', 'help': b'Maximum smpp msgids in the dlr lookup cache.'},
+    'hits':                     {'type': b'counter', 'help': b'Receipts matched from the dlr lookup cache count.'},
+    'misses':                   {'type': b'counter', 'help': b'Receipts looked up in redis count.'},
+    'hit_ratio':                {'type': b'gauge', 'help': b'Dlr lookup cache hit ratio.'},
+}
+# Internal components metrics, by component kind
+PROM_METRICS_COMPONENTS = {
+    'store': PROM_METRICS_STORE,
+    'dlr_map_writer': PROM_METRICS_DLR_MAP_WRITER,
+    'segments': PROM_METRICS_SEGMENTS,
+    'dlr_lookup': PROM_METRICS_DLR_LOOKUP,
+}
 
 
 class Metrics(Resource):
@@ -110,6 +158,38 @@ class Metrics(Resource):
                 ('smppsapi_%s %s' % (metric, _s.get(metric))).encode(),
             ])
 
+        # Fill throwers stats
+        _throwers = ThrowerStatsCollector().throwers
+        for metric, descriptor in PROM_METRICS_THROWER.items():
+            if len(_throwers) > 0:
+                response.extend([
+                    b'# TYPE thrower_%s %s' % (metric.encode(), descriptor['type']),
+                    b'# HELP thrower_%s %s' % (metric.encode(), descriptor['help']),
+                ])
+
+            for _thrower_id, _s in _throwers.items():
+                response.extend([
+                    ('thrower_%s{thrower="%s"} %s' % (metric, _thrower_id, _s.get(metric))).encode(),
+                ])
+
+        # Fill internal components stats
+        for kind, descriptors in PROM_METRICS_COMPONENTS.items():
+            _components = ComponentsStatsCollector().get(kind)
+            for metric, descriptor in descriptors.items():
+                if len(_components) > 0:
+                    response.extend([
+                        b'# TYPE %s_%s %s' % (kind.encode(), metric.encode(), descriptor['type']),
+                        b'# HELP %s_%s %s' % (kind.encode(), metric.encode(), descriptor['help']),
+                    ])
+
+                for _component_id, _s in _components.items():
+                    if _s.get(metric) is None:
+                        continue
+
+                    response.extend([
+                        ('%s_%s{id="%s"} %s' % (kind, metric, _component_id, _s.get(metric))).encode(),
+                    ])
+
         # Add padding
         response.extend([b'', b''])
 
@@ -11,10 +11,49 @@ import messaging.sms.gsm0338
 from jasmin.routing.Routables import RoutableSubmitSm
 from jasmin.protocols.smpp.operations import SMPPOperationFactory
 from jasmin.protocols.http.errors import UrlArgsValidationError
-from jasmin.protocols.http.validation import UrlArgsValidator, HttpAPICredentialValidator
+from jasmin.protocols.http.validation import HttpRequestParser, HttpAPICredentialValidator
 from jasmin.protocols.http.errors import HttpApiError, AuthenticationError, InterceptorNotSetError, InterceptorNotConnectedError, InterceptorRunError, RouteNotFoundError
 from jasmin.protocols.http.endpoints import hex2bin, authenticate_user
 
+# Validation (must be almost the same params as /send service)
+RATE_FIELDS = {b'to': {'optional': False, 'pattern': re.compile(rb'^\+{0,1}\d+$')},
+               b'from': {'optional': True},
+               b'coding': {'optional': True, 'pattern': re.compile(rb'^(0|1|2|3|4|5|6|7|8|9|10|13|14){1}$')},
+               b'username': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
+               b'password': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
+               # Priority validation pattern can be validated/filtered further more
+               # through HttpAPICredentialValidator
+               b'priority': {'optional': True, 'pattern': re.compile(rb'^[0-3]$')},
+               # Validity period validation pattern can be validated/filtered further more
+               # through HttpAPICredentialValidator
+               b'validity-period': {'optional': True, 'pattern': re.compile(rb'^\d+$')},
+               b'tags': {'optional': True, 'pattern': re.compile(rb'^([-a-zA-Z0-9,])*$')},
+               b'content': {'optional': True},
+               b'hex-content': {'optional': True},
+               }
+
+
+def set_rate_defaults(args):
+    """Set default values of undefined /rate arguments"""
+
+    # Default coding is 0 when not provided
+    if b'coding' not in args:
+        args[b'coding'] = [b'0']
+
+    # Content is optional, defaults to empty content string
+    if b'hex-content' not in args and b'content' not in args:
+        args[b'content'] = [b'']
+
+
+def check_rate_content(args):
+    """Check if have content --OR-- hex-content"""
+
+    if b'content' in args and b'hex-content' in args:
+        raise UrlArgsValidationError("content and hex-content cannot be used both in same request.")
+
+
+RATE_PARSER = HttpRequestParser(RATE_FIELDS, set_defaults=set_rate_defaults, check=check_rate_content)
+
 
 class Rate(Resource):
     isleaf = True
@@ -190,39 +229,8 @@ class Rate(Resource):
         self.stats.set('last_request_at', datetime.now())
 
         try:
-            # Validation (must be almost the same params as /send service)
-            fields = {b'to': {'optional': False, 'pattern': re.compile(rb'^\+{0,1}\d+$')},
-                      b'from': {'optional': True},
-                      b'coding': {'optional': True, 'pattern': re.compile(rb'^(0|1|2|3|4|5|6|7|8|9|10|13|14){1}$')},
-                      b'username': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
-                      b'password': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
-                      # Priority validation pattern can be validated/filtered further more
-                      # through HttpAPICredentialValidator
-                      b'priority': {'optional': True, 'pattern': re.compile(rb'^[0-3]$')},
-                      # Validity period validation pattern can be validated/filtered further more
-                      # through HttpAPICredentialValidator
-                      b'validity-period': {'optional': True, 'pattern': re.compile(rb'^\d+$')},
-                      b'tags': {'optional': True, 'pattern': re.compile(rb'^([-a-zA-Z0-9,])*$')},
-                      b'content': {'optional': True},
-                      b'hex-content': {'optional': True},
-                      }
-
-            # Default coding is 0 when not provided
-            if b'coding' not in request.args:
-                request.args[b'coding'] = [b'0']
-
-            # Content is optional, defaults to empty content string
-            if b'hex-content' not in request.args and b'content' not in request.args:
-                request.args[b'content'] = [b'']
-
-            # Make validation
-            v = UrlArgsValidator(request, fields)
-            v.validate()
-
-            # Check if have content --OR-- hex-content
-            # @TODO: make this inside UrlArgsValidator !
-            if b'content' in request.args and b'hex-content' in request.args:
-                raise UrlArgsValidationError("content and hex-content cannot be used both in same request.")
+            # Set default values and make validation
+            RATE_PARSER.parse(request)
 
             # Continue routing in a separate thread
             reactor.callFromThread(self.route_routable, request=request)
@@ -1,6 +1,5 @@
 from datetime import datetime, timedelta
 import re
-import json
 import pickle
 
 from twisted.internet import reactor, defer
@@ -14,11 +13,12 @@ from jasmin.routing.Routables import RoutableSubmitSm
 from jasmin.protocols.smpp.configs import SMPPClientConfig
 from jasmin.protocols.smpp.operations import SMPPOperationFactory
 from jasmin.protocols.http.errors import UrlArgsValidationError
-from jasmin.protocols.http.validation import UrlArgsValidator, HttpAPICredentialValidator
+from jasmin.protocols.http.validation import HttpRequestParser, HttpAPICredentialValidator
 from jasmin.protocols.http.errors import (HttpApiError, AuthenticationError, ServerError, RouteNotFoundError, ConnectorNotFoundError,
                      ChargingError, ThroughputExceededError, InterceptorNotSetError,
                      InterceptorNotConnectedError, InterceptorRunError)
 from jasmin.protocols.http.endpoints import hex2bin, authenticate_user
+from jasmin.tools.qos import TokenBucket
 
 
 def update_submit_sm_pdu(routable, config, config_update_params=None):
@@ -61,6 +61,281 @@ def update_submit_sm_pdu(routable, config, config_update_params=None):
     return routable
 
 
+@defer.inlineCallbacks
+def intercept_routable(routable, RouterPB, interceptorpb_client, stats, log):
+    """Run the MT interceptor matching routable (if any) and return the intercepted routable"""
+
+    interceptor = RouterPB.getMTInterceptionTable().getInterceptorFor(routable)
+    if interceptor is None:
+        defer.returnValue(routable)
+
+    log.debug("RouterPB selected %s interceptor for this SubmitSmPDU", interceptor)
+    if interceptorpb_client is None:
+        stats.inc('interceptor_error_count')
+        log.error("InterceptorPB not set !")
+        raise InterceptorNotSetError('InterceptorPB not set !')
+    if not interceptorpb_client.isConnected:
+        stats.inc('interceptor_error_count')
+        log.error("InterceptorPB not connected !")
+        raise InterceptorNotConnectedError('InterceptorPB not connected !')
+
+    script = interceptor.getScript()
+    log.debug("Interceptor script loaded: %s", script)
+
+    # Run !
+    r = yield interceptorpb_client.run_script(script, routable)
+    if isinstance(r, dict) and r['http_status'] != 200:
+        stats.inc('interceptor_error_count')
+        log.error('Interceptor script returned %s http_status error.', r['http_status'])
+        raise InterceptorRunError(
+            code=r['http_status'],
+            message='Interception specific error code %s' % r['http_status']
+        )
+    elif isinstance(r, (str, bytes)):
+        stats.inc('interceptor_count')
+        defer.returnValue(pickle.loads(r))
+    else:
+        stats.inc('interceptor_error_count')
+        log.error('Failed running interception script, got the following return: %s', r)
+        raise InterceptorRunError(message='Failed running interception script, check log for details')
+
+
+def get_routed_connector(route, SMPPClientManagerPB, log):
+    """Return the connector of route, a failover route will return its first bound connector or None
+    when none of them are bound"""
+
+    routedConnector = route.getConnector()
+    # Is it a failover route ? then check for a bound connector, otherwise don't route
+    # The failover route requires at least one connector to be up, no message enqueuing will
+    # occur otherwise.
+    if repr(route) == 'FailoverMTRoute':
+        log.debug('Selected route is a failover, will ensure connector is bound:')
+        while True:
+            session_state = SMPPClientManagerPB.getConnectorSessionState(routedConnector.cid)
+            if session_state is not None:
+                log.debug('Connector [%s] is: %s', routedConnector.cid, session_state.name)
+            else:
+                log.debug('Connector [%s] is not found', routedConnector.cid)
+
+            if session_state is not None and session_state.name[:6] == 'BOUND_':
+                # Choose this connector
+                break
+            else:
+                # Check next connector, None if no more connectors are available
+                routedConnector = route.getConnector()
+                if routedConnector is None:
+                    break
+
+    return routedConnector
+
+
+# Validation (must have almost the same params as /rate service)
+SEND_FIELDS = {b'to': {'optional': False, 'pattern': re.compile(rb'^\+{0,1}\d+$')},
+               b'from': {'optional': True},
+               b'coding': {'optional': True, 'pattern': re.compile(rb'^(0|1|2|3|4|5|6|7|8|9|10|13|14){1}$')},
+               b'username': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
+               b'password': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
+               # Priority validation pattern can be validated/filtered further more
+               # through HttpAPICredentialValidator
+               b'priority': {'optional': True, 'pattern': re.compile(rb'^[0-3]$')},
+               b'sdt': {'optional': True,
+                        'pattern': re.compile(rb'^\d{2}\d{2}\d{2}\d{2}\d{2}\d{2}\d{1}\d{2}(\+|-|R)$')},
+               # Validity period validation pattern can be validated/filtered further more
+               # through HttpAPICredentialValidator
+               b'validity-period': {'optional': True, 'pattern': re.compile(rb'^\d+$')},
+               b'dlr': {'optional': False, 'pattern': re.compile(rb'^(yes|no)$')},
+               b'dlr-url': {'optional': True, 'pattern': re.compile(rb'^(http|https)\://.*$')},
+               # DLR Level validation pattern can be validated/filtered further more
+               # through HttpAPICredentialValidator
+               b'dlr-level'   : {'optional': True, 'pattern': re.compile(rb'^[1-3]$')},
+               b'dlr-method'  : {'optional': True, 'pattern': re.compile(rb'^(get|post)$', re.IGNORECASE)},
+               b'tags'        : {'optional': True, 'pattern': re.compile(rb'^([-a-zA-Z0-9,])*$')},
+               b'content'     : {'optional': True},
+               b'hex-content' : {'optional': True},
+               b'custom_tlvs' : {'optional': True}}
+
+
+def set_send_defaults(args):
+    """Set default values of undefined /send arguments"""
+
+    # If no custom TLVs present, defaujlt to an [] which will be passed down to SubmitSM
+    if b'custom_tlvs' not in args:
+        args[b'custom_tlvs'] = [[]]
+
+    # Default coding is 0 when not provided
+    if b'coding' not in args:
+        args[b'coding'] = [b'0']
+
+    # Set default for undefined arguments
+    if b'dlr-url' in args or b'dlr-level' in args:
+        args[b'dlr'] = [b'yes']
+    if b'dlr' not in args:
+        # Setting DLR to 'no'
+        args[b'dlr'] = [b'no']
+
+    # Set default values
+    if args[b'dlr'][0] == b'yes':
+        if b'dlr-level' not in args:
+            # If DLR is requested and no dlr-level were provided, assume minimum level (1)
+            args[b'dlr-level'] = [1]
+        if b'dlr-method' not in args:
+            # If DLR is requested and no dlr-method were provided, assume default (POST)
+            args[b'dlr-method'] = [b'POST']
+
+    # DLR method must be uppercase
+    if b'dlr-method' in args:
+        args[b'dlr-method'][0] = args[b'dlr-method'][0].upper()
+
+
+def check_send_content(args):
+    """Check if have content --OR-- hex-content"""
+
+    if b'content' not in args and b'hex-content' not in args:
+        raise UrlArgsValidationError("content or hex-content not present.")
+    elif b'content' in args and b'hex-content' in args:
+        raise UrlArgsValidationError("content and hex-content cannot be used both in same request.")
+
+
+SEND_PARSER = HttpRequestParser(SEND_FIELDS, set_defaults=set_send_defaults, check=check_send_content)
+
+
+def get_short_message(args):
+    """Return the short message to send from content (converted to GSM 03.38 when coding is 0) or
+    from hex-content"""
+
+    # Do we have a hex-content ?
+    if b'hex-content' not in args:
+        # Convert utf8 to GSM 03.38
+        if args[b'coding'][0] == b'0':
+            if isinstance(args[b'content'][0], bytes):
+                short_message = args[b'content'][0].decode().encode('gsm0338', 'replace')
+            else:
+                short_message = args[b'content'][0].encode('gsm0338', 'replace')
+            args[b'content'][0] = short_message
+        else:
+            # Otherwise forward it as is
+            short_message = args[b'content'][0]
+    else:
+        # Otherwise convert hex to bin
+        short_message = hex2bin(args[b'hex-content'][0])
+
+    return short_message
+
+
+def set_routable_params(routable, args, log):
+    """Apply priority, schedule_delivery_time, validity_period and DLR arguments on the routable pdu(s),
+    returns (routable, priority, dlr_url, dlr_level, dlr_level_text, dlr_method)"""
+
+    # Set a placeholder for any parameter update to be applied on the pdu(s)
+    param_updates = {}
+
+    # Set priority
+    priority = 0
+    if b'priority' in args:
+        priority = int(args[b'priority'][0])
+        param_updates['priority_flag'] = priority_flag_value_map[priority]
+    log.debug("SubmitSmPDU priority is set to %s", priority)
+
+    # Set schedule_delivery_time
+    if b'sdt' in args:
+        param_updates['schedule_delivery_time'] = parse(args[b'sdt'][0])
+        log.debug(
+            "SubmitSmPDU schedule_delivery_time is set to %s (%s)",
+            routable.pdu.params['schedule_delivery_time'],
+            args[b'sdt'][0])
+
+    # Set validity_period
+    if b'validity-period' in args:
+        delta = timedelta(minutes=int(args[b'validity-period'][0]))
+        param_updates['validity_period'] = datetime.today() + delta
+        log.debug(
+            "SubmitSmPDU validity_period is set to %s (+%s minutes)",
+            routable.pdu.params['validity_period'],
+            args[b'validity-period'][0])
+
+    # Got any updates to apply on pdu(s) ?
+    if len(param_updates) > 0:
+        routable = update_submit_sm_pdu(routable=routable, config=param_updates,
+                                        config_update_params=list(param_updates))
+
+    # Set DLR bit mask on the last pdu
+    _last_pdu = routable.pdu
+    while True:
+        if hasattr(_last_pdu, 'nextPdu'):
+            _last_pdu = _last_pdu.nextPdu
+        else:
+            break
+    # DLR setting is clearly described in #107
+    _last_pdu.params['registered_delivery'] = RegisteredDelivery(
+        RegisteredDeliveryReceipt.NO_SMSC_DELIVERY_RECEIPT_REQUESTED)
+    if args[b'dlr'][0] == b'yes':
+        _last_pdu.params['registered_delivery'] = RegisteredDelivery(
+            RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED)
+        log.debug(
+            "SubmitSmPDU registered_delivery is set to %s",
+            str(_last_pdu.params['registered_delivery']))
+
+        dlr_level = int(args[b'dlr-level'][0])
+        if b'dlr-url' in args:
+            dlr_url = args[b'dlr-url'][0]
+        else:
+            dlr_url = None
+        if args[b'dlr-level'][0] == b'1':
+            dlr_level_text = 'SMS-C'
+        elif args[b'dlr-level'][0] == b'2':
+            dlr_level_text = 'Terminal'
+        else:
+            dlr_level_text = 'All'
+        dlr_method = args[b'dlr-method'][0]
+    else:
+        dlr_url = None
+        dlr_level = 0
+        dlr_level_text = 'No'
+        dlr_method = None
+
+    return routable, priority, dlr_url, dlr_level, dlr_level_text, dlr_method
+
+
+def charge_user(user, route, routable, RouterPB, stats, log):
+    """Bill user for the routable pdu(s) through the selected route, returns the bill or raises a
+    ChargingError"""
+
+    # Get number of PDUs to be sent (for billing purpose)
+    _pdu = routable.pdu
+    submit_sm_count = 1
+    while hasattr(_pdu, 'nextPdu'):
+        _pdu = _pdu.nextPdu
+        submit_sm_count += 1
+
+    bill = route.getBillFor(user)
+    log.debug("SubmitSmBill [bid:%s] [ttlamounts:%s] generated for this SubmitSmPDU (x%s)",
+              bill.bid, bill.getTotalAmounts(), submit_sm_count)
+    charging_requirements = []
+    u_balance = user.mt_credential.getQuota('balance')
+    u_subsm_count = user.mt_credential.getQuota('submit_sm_count')
+    if u_balance is not None and bill.getTotalAmounts() > 0:
+        # Ensure user have enough balance to pay submit_sm and submit_sm_resp
+        charging_requirements.append({
+            'condition': bill.getTotalAmounts() * submit_sm_count <= u_balance,
+            'error_message': 'Not enough balance (%s) for charging: %s' % (
+                u_balance, bill.getTotalAmounts())})
+    if u_subsm_count is not None:
+        # Ensure user have enough submit_sm_count to to cover
+        # the bill action (decrement_submit_sm_count)
+        charging_requirements.append({
+            'condition': bill.getAction('decrement_submit_sm_count') * submit_sm_count <= u_subsm_count,
+            'error_message': 'Not enough submit_sm_count (%s) for charging: %s' % (
+                u_subsm_count, bill.getAction('decrement_submit_sm_count'))})
+
+    if RouterPB.chargeUserForSubmitSms(user, bill, submit_sm_count, charging_requirements) is None:
+        stats.inc('charging_error_count')
+        log.error('Charging user %s failed, [bid:%s] [ttlamounts:%s] SubmitSmPDU (x%s)',
+                  user, bill.bid, bill.getTotalAmounts(), submit_sm_count)
+        raise ChargingError('Cannot charge submit_sm, check RouterPB log file for details')
+
+    return bill
+
+
 class Send(Resource):
     isleaf = True
 
@@ -74,6 +349,9 @@ class Send(Resource):
         self.interceptorpb_client = interceptorpb_client
         self.config = HTTPApiConfig
 
+        # Per user token buckets for http_throughput control
+        self.qos_buckets = {}
+
         # opFactory is initiated with a dummy SMPPClientConfig used for building SubmitSm only
         self.opFactory = SMPPOperationFactory(long_content_max_parts=HTTPApiConfig.long_content_max_parts,
                                               long_content_split=HTTPApiConfig.long_content_split)
@@ -81,21 +359,7 @@ class Send(Resource):
     @defer.inlineCallbacks
     def route_routable(self, updated_request):
         try:
-            # Do we have a hex-content ?
-            if b'hex-content' not in updated_request.args:
-                # Convert utf8 to GSM 03.38
-                if updated_request.args[b'coding'][0] == b'0':
-                    if isinstance(updated_request.args[b'content'][0], bytes):
-                        short_message = updated_request.args[b'content'][0].decode().encode('gsm0338', 'replace')
-                    else:
-                        short_message = updated_request.args[b'content'][0].encode('gsm0338', 'replace')
-                    updated_request.args[b'content'][0] = short_message
-                else:
-                    # Otherwise forward it as is
-                    short_message = updated_request.args[b'content'][0]
-            else:
-                # Otherwise convert hex to bin
-                short_message = hex2bin(updated_request.args[b'hex-content'][0])
+            short_message = get_short_message(updated_request.args)
 
             # Authentication
             user = authenticate_user(
@@ -151,37 +415,8 @@ class Send(Resource):
                     self.log.debug('Tagged routable %s: +%s', routable, tag)
 
             # Intercept
-            interceptor = self.RouterPB.getMTInterceptionTable().getInterceptorFor(routable)
-            if interceptor is not None:
-                self.log.debug("RouterPB selected %s interceptor for this SubmitSmPDU", interceptor)
-                if self.interceptorpb_client is None:
-                    self.stats.inc('interceptor_error_count')
-                    self.log.error("InterceptorPB not set !")
-                    raise InterceptorNotSetError('InterceptorPB not set !')
-                if not self.interceptorpb_client.isConnected:
-                    self.stats.inc('interceptor_error_count')
-                    self.log.error("InterceptorPB not connected !")
-                    raise InterceptorNotConnectedError('InterceptorPB not connected !')
-
-                script = interceptor.getScript()
-                self.log.debug("Interceptor script loaded: %s", script)
-
-                # Run !
-                r = yield self.interceptorpb_client.run_script(script, routable)
-                if isinstance(r, dict) and r['http_status'] != 200:
-                    self.stats.inc('interceptor_error_count')
-                    self.log.error('Interceptor script returned %s http_status error.', r['http_status'])
-                    raise InterceptorRunError(
-                        code=r['http_status'],
-                        message='Interception specific error code %s' % r['http_status']
-                    )
-                elif isinstance(r, (str, bytes)):
-                    self.stats.inc('interceptor_count')
-                    routable = pickle.loads(r)
-                else:
-                    self.stats.inc('interceptor_error_count')
-                    self.log.error('Failed running interception script, got the following return: %s', r)
-                    raise InterceptorRunError(message='Failed running interception script, check log for details')
+            routable = yield intercept_routable(routable, self.RouterPB, self.interceptorpb_client,
+                                                self.stats, self.log)
 
             # Get the route
             route = self.RouterPB.getMTRoutingTable().getRouteFor(routable)
@@ -192,27 +427,7 @@ class Send(Resource):
 
             # Get connector from selected route
             self.log.debug("RouterPB selected %s route for this SubmitSmPDU", route)
-            routedConnector = route.getConnector()
-            # Is it a failover route ? then check for a bound connector, otherwise don't route
-            # The failover route requires at least one connector to be up, no message enqueuing will
-            # occur otherwise.
-            if repr(route) == 'FailoverMTRoute':
-                self.log.debug('Selected route is a failover, will ensure connector is bound:')
-                while True:
-                    c = self.SMPPClientManagerPB.perspective_connector_details(routedConnector.cid)
-                    if c:
-                        self.log.debug('Connector [%s] is: %s', routedConnector.cid, c['session_state'])
-                    else:
-                        self.log.debug('Connector [%s] is not found', routedConnector.cid)
-
-                    if c and c['session_state'][:6] == 'BOUND_':
-                        # Choose this connector
-                        break
-                    else:
-                        # Check next connector, None if no more connectors are available
-                        routedConnector = route.getConnector()
-                        if routedConnector is None:
-                            break
+            routedConnector = get_routed_connector(route, self.SMPPClientManagerPB, self.log)
 
             if routedConnector is None:
                 self.stats.inc('route_error_count')
@@ -220,129 +435,35 @@ class Send(Resource):
                 raise ConnectorNotFoundError("Failover route has no bound connectors")
 
             # Re-update SubmitSmPDU with parameters from the route's connector
-            connector_config = self.SMPPClientManagerPB.perspective_connector_config(routedConnector.cid)
-            if connector_config:
-                connector_config = pickle.loads(connector_config)
+            connector_config = self.SMPPClientManagerPB.getConnectorConfig(routedConnector.cid)
+            if connector_config is not None:
                 routable = update_submit_sm_pdu(routable=routable, config=connector_config)
 
-            # Set a placeholder for any parameter update to be applied on the pdu(s)
-            param_updates = {}
-
-            # Set priority
-            priority = 0
-            if b'priority' in updated_request.args:
-                priority = int(updated_request.args[b'priority'][0])
-                param_updates['priority_flag'] = priority_flag_value_map[priority]
-            self.log.debug("SubmitSmPDU priority is set to %s", priority)
-
-            # Set schedule_delivery_time
-            if b'sdt' in updated_request.args:
-                param_updates['schedule_delivery_time'] = parse(updated_request.args[b'sdt'][0])
-                self.log.debug(
-                    "SubmitSmPDU schedule_delivery_time is set to %s (%s)",
-                    routable.pdu.params['schedule_delivery_time'],
-                    updated_request.args[b'sdt'][0])
-
-            # Set validity_period
-            if b'validity-period' in updated_request.args:
-                delta = timedelta(minutes=int(updated_request.args[b'validity-period'][0]))
-                param_updates['validity_period'] = datetime.today() + delta
-                self.log.debug(
-                    "SubmitSmPDU validity_period is set to %s (+%s minutes)",
-                    routable.pdu.params['validity_period'],
-                    updated_request.args[b'validity-period'][0])
-
-            # Got any updates to apply on pdu(s) ?
-            if len(param_updates) > 0:
-                routable = update_submit_sm_pdu(routable=routable, config=param_updates,
-                                                config_update_params=list(param_updates))
-
-            # Set DLR bit mask on the last pdu
-            _last_pdu = routable.pdu
-            while True:
-                if hasattr(_last_pdu, 'nextPdu'):
-                    _last_pdu = _last_pdu.nextPdu
-                else:
-                    break
-            # DLR setting is clearly described in #107
-            _last_pdu.params['registered_delivery'] = RegisteredDelivery(
-                RegisteredDeliveryReceipt.NO_SMSC_DELIVERY_RECEIPT_REQUESTED)
-            if updated_request.args[b'dlr'][0] == b'yes':
-                _last_pdu.params['registered_delivery'] = RegisteredDelivery(
-                    RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED)
-                self.log.debug(
-                    "SubmitSmPDU registered_delivery is set to %s",
-                    str(_last_pdu.params['registered_delivery']))
-
-                dlr_level = int(updated_request.args[b'dlr-level'][0])
-                if b'dlr-url' in updated_request.args:
-                    dlr_url = updated_request.args[b'dlr-url'][0]
-                else:
-                    dlr_url = None
-                if updated_request.args[b'dlr-level'][0] == b'1':
-                    dlr_level_text = 'SMS-C'
-                elif updated_request.args[b'dlr-level'][0] == b'2':
-                    dlr_level_text = 'Terminal'
-                else:
-                    dlr_level_text = 'All'
-                dlr_method = updated_request.args[b'dlr-method'][0]
-            else:
-                dlr_url = None
-                dlr_level = 0
-                dlr_level_text = 'No'
-                dlr_method = None
+            routable, priority, dlr_url, dlr_level, dlr_level_text, dlr_method = set_routable_params(
+                routable, updated_request.args, self.log)
 
             # QoS throttling
-            if (user.mt_credential.getQuota('http_throughput') and user.mt_credential.getQuota('http_throughput') >= 0) and user.getCnxStatus().httpapi[
-                'qos_last_submit_sm_at'] != 0:
-                qos_throughput_second = 1 / float(user.mt_credential.getQuota('http_throughput'))
-                qos_throughput_ysecond_td = timedelta(microseconds=qos_throughput_second * 1000000)
-                qos_delay = datetime.now() - user.getCnxStatus().httpapi['qos_last_submit_sm_at']
-                if qos_delay < qos_throughput_ysecond_td:
+            http_throughput = user.mt_credential.getQuota('http_throughput')
+            if http_throughput and http_throughput >= 0:
+                bucket = self.qos_buckets.get(user.uid)
+                if bucket is None:
+                    bucket = self.qos_buckets[user.uid] = TokenBucket(http_throughput)
+                else:
+                    bucket.setRate(http_throughput)
+
+                if not bucket.consume():
                     self.stats.inc('throughput_error_count')
                     self.log.error(
-                        "QoS: submit_sm_event is faster (%s) than fixed throughput (%s), user:%s, rejecting message.",
-                        qos_delay,
-                        qos_throughput_ysecond_td,
+                        "QoS: submit_sm_event is faster than fixed throughput (%s/s), user:%s, rejecting message.",
+                        http_throughput,
                         user)
 
                     raise ThroughputExceededError("User throughput exceeded")
             user.getCnxStatus().httpapi['qos_last_submit_sm_at'] = datetime.now()
 
-            # Get number of PDUs to be sent (for billing purpose)
-            _pdu = routable.pdu
-            submit_sm_count = 1
-            while hasattr(_pdu, 'nextPdu'):
-                _pdu = _pdu.nextPdu
-                submit_sm_count += 1
-
             # Pre-sending submit_sm: Billing processing
             if self.config.billing_feature:
-                bill = route.getBillFor(user)
-                self.log.debug("SubmitSmBill [bid:%s] [ttlamounts:%s] generated for this SubmitSmPDU (x%s)",
-                               bill.bid, bill.getTotalAmounts(), submit_sm_count)
-                charging_requirements = []
-                u_balance = user.mt_credential.getQuota('balance')
-                u_subsm_count = user.mt_credential.getQuota('submit_sm_count')
-                if u_balance is not None and bill.getTotalAmounts() > 0:
-                    # Ensure user have enough balance to pay submit_sm and submit_sm_resp
-                    charging_requirements.append({
-                        'condition': bill.getTotalAmounts() * submit_sm_count <= u_balance,
-                        'error_message': 'Not enough balance (%s) for charging: %s' % (
-                            u_balance, bill.getTotalAmounts())})
-                if u_subsm_count is not None:
-                    # Ensure user have enough submit_sm_count to to cover
-                    # the bill action (decrement_submit_sm_count)
-                    charging_requirements.append({
-                        'condition': bill.getAction('decrement_submit_sm_count') * submit_sm_count <= u_subsm_count,
-                        'error_message': 'Not enough submit_sm_count (%s) for charging: %s' % (
-                            u_subsm_count, bill.getAction('decrement_submit_sm_count'))})
-
-                if self.RouterPB.chargeUserForSubmitSms(user, bill, submit_sm_count, charging_requirements) is None:
-                    self.stats.inc('charging_error_count')
-                    self.log.error('Charging user %s failed, [bid:%s] [ttlamounts:%s] SubmitSmPDU (x%s)',
-                                   user, bill.bid, bill.getTotalAmounts(), submit_sm_count)
-                    raise ChargingError('Cannot charge submit_sm, check RouterPB log file for details')
+                bill = charge_user(user, route, routable, self.RouterPB, self.stats, self.log)
             else:
                 bill = None
 
@@ -431,82 +552,8 @@ class Send(Resource):
         updated_request = request
 
         try:
-            # Validation (must have almost the same params as /rate service)
-            fields = {b'to': {'optional': False, 'pattern': re.compile(rb'^\+{0,1}\d+$')},
-                      b'from': {'optional': True},
-                      b'coding': {'optional': True, 'pattern': re.compile(rb'^(0|1|2|3|4|5|6|7|8|9|10|13|14){1}$')},
-                      b'username': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
-                      b'password': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
-                      # Priority validation pattern can be validated/filtered further more
-                      # through HttpAPICredentialValidator
-                      b'priority': {'optional': True, 'pattern': re.compile(rb'^[0-3]$')},
-                      b'sdt': {'optional': True,
-                              'pattern': re.compile(rb'^\d{2}\d{2}\d{2}\d{2}\d{2}\d{2}\d{1}\d{2}(\+|-|R)$')},
-                      # Validity period validation pattern can be validated/filtered further more
-                      # through HttpAPICredentialValidator
-                      b'validity-period': {'optional': True, 'pattern': re.compile(rb'^\d+$')},
-                      b'dlr': {'optional': False, 'pattern': re.compile(rb'^(yes|no)$')},
-                      b'dlr-url': {'optional': True, 'pattern': re.compile(rb'^(http|https)\://.*$')},
-                      # DLR Level validation pattern can be validated/filtered further more
-                      # through HttpAPICredentialValidator
-                      b'dlr-level'   : {'optional': True, 'pattern': re.compile(rb'^[1-3]$')},
-                      b'dlr-method'  : {'optional': True, 'pattern': re.compile(rb'^(get|post)$', re.IGNORECASE)},
-                      b'tags'        : {'optional': True, 'pattern': re.compile(rb'^([-a-zA-Z0-9,])*$')},
-                      b'content'     : {'optional': True},
-                      b'hex-content' : {'optional': True},
-                      b'custom_tlvs' : {'optional': True}}
-
-            if updated_request.getHeader(b'content-type') == b'application/json':
-                json_body = updated_request.content.read()
-                json_data = json.loads(json_body)
-                for key, value in json_data.items():
-                    # Make the values look like they came from form encoding all surrounded by [ ]
-                    if isinstance(value, str):
-                        value = value.encode()
-
-                    if isinstance(key, str):
-                        key = key.encode()
-
-                    updated_request.args[key] = [value]
-
-            # If no custom TLVs present, defaujlt to an [] which will be passed down to SubmitSM
-            if b'custom_tlvs' not in updated_request.args:
-                updated_request.args[b'custom_tlvs'] = [[]]
-
-            # Default coding is 0 when not provided
-            if b'coding' not in updated_request.args:
-                updated_request.args[b'coding'] = [b'0']
-
-            # Set default for undefined updated_request.arguments
-            if b'dlr-url' in updated_request.args or b'dlr-level' in updated_request.args:
-                updated_request.args[b'dlr'] = [b'yes']
-            if b'dlr' not in updated_request.args:
-                # Setting DLR updated_request to 'no'
-                updated_request.args[b'dlr'] = [b'no']
-
-            # Set default values
-            if updated_request.args[b'dlr'][0] == b'yes':
-                if b'dlr-level' not in updated_request.args:
-                    # If DLR is requested and no dlr-level were provided, assume minimum level (1)
-                    updated_request.args[b'dlr-level'] = [1]
-                if b'dlr-method' not in updated_request.args:
-                    # If DLR is requested and no dlr-method were provided, assume default (POST)
-                    updated_request.args[b'dlr-method'] = [b'POST']
-
-            # DLR method must be uppercase
-            if b'dlr-method' in updated_request.args:
-                updated_request.args[b'dlr-method'][0] = updated_request.args[b'dlr-method'][0].upper()
-
-            # Make validation
-            v = UrlArgsValidator(updated_request, fields)
-            v.validate()
-
-            # Check if have content --OR-- hex-content
-            # @TODO: make this inside UrlArgsValidator !
-            if b'content' not in request.args and b'hex-content' not in request.args:
-                raise UrlArgsValidationError("content or hex-content not present.")
-            elif b'content' in request.args and b'hex-content' in request.args:
-                raise UrlArgsValidationError("content and hex-content cannot be used both in same request.")
+            # Load json body (if any), set default values and make validation
+            SEND_PARSER.parse(updated_request)
 
             # Continue routing in a separate thread
             reactor.callFromThread(self.route_routable, updated_request=updated_request)
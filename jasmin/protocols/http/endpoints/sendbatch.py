@@ -0,0 +1,450 @@
+from datetime import datetime
+import re
+import json
+import uuid
+
+from twisted.internet import reactor, defer, task
+from twisted.web.resource import Resource
+
+from jasmin.routing.Filters import (TransparentFilter, UserFilter, GroupFilter, SourceAddrFilter,
+                                    DestinationAddrFilter, ShortMessageFilter, TagFilter)
+from jasmin.routing.Routables import RoutableSubmitSm
+from jasmin.protocols.smpp.operations import SMPPOperationFactory
+from jasmin.protocols.http.validation import HttpRequestParser, HttpAPICredentialValidator
+from jasmin.protocols.http.errors import (HttpApiError, UrlArgsValidationError, RouteNotFoundError,
+                                          ConnectorNotFoundError)
+from jasmin.protocols.http.endpoints import authenticate_user
+from jasmin.protocols.http.endpoints.send import (SEND_PARSER, get_short_message,
+                                                  update_submit_sm_pdu, set_routable_params, charge_user,
+                                                  intercept_routable, get_routed_connector)
+from jasmin.tools.qos import TokenBucket, slow_down
+
+# Filters matching the same way for every message of a batch (they're on the batch user) or
+# depending on these pdu params / tags only, other filters (date, time and python scripts) are
+# disabling the routes cache
+ROUTE_KEY_FILTERS = {
+    TransparentFilter: None,
+    UserFilter: None,
+    GroupFilter: None,
+    SourceAddrFilter: 'source_addr',
+    DestinationAddrFilter: 'destination_addr',
+    ShortMessageFilter: 'short_message',
+    TagFilter: 'tags',
+}
+
+# Validation
+BATCH_FIELDS = {b'username': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')},
+                b'password': {'optional': False, 'pattern': re.compile(rb'^.{1,16}$')}}
+BATCH_PARSER = HttpRequestParser(BATCH_FIELDS)
+BATCH_STATUS_PARSER = HttpRequestParser(
+    {**BATCH_FIELDS, b'batch_id': {'optional': False, 'pattern': re.compile(rb'^[-a-f0-9]{36}$')}})
+
+
+def get_route_key_params(mt_routing_table):
+    """Return the sorted list of routable attributes MT routes are filtering on, None if routes
+    cannot be cached"""
+
+    params = set()
+    for route_entry in mt_routing_table.getAll():
+        route = list(route_entry.values())[0]
+        for _filter in getattr(route, 'filters', []):
+            if type(_filter) not in ROUTE_KEY_FILTERS:
+                return None
+            if ROUTE_KEY_FILTERS[type(_filter)] is not None:
+                params.add(ROUTE_KEY_FILTERS[type(_filter)])
+
+    return sorted(params)
+
+
+def get_route_key(routable, params):
+    """Build the routes cache key of routable"""
+
+    key = []
+    for param in params:
+        if param == 'tags':
+            key.append(tuple(sorted(routable.getTags())))
+        elif param == 'short_message' and 'short_message' not in routable.pdu.params:
+            key.append(routable.pdu.params.get('message_payload'))
+        else:
+            key.append(routable.pdu.params.get(param))
+
+    return tuple(key)
+
+
+class BatchMessage:
+    """A message of a batch, holding /send arguments in the same format as a request"""
+
+    def __init__(self, args):
+        self.args = args
+
+
+class SendBatch(Resource):
+    isleaf = True
+
+    def __init__(self, HTTPApiConfig, RouterPB, SMPPClientManagerPB, stats, log, interceptorpb_client,
+                 batches, qos_buckets=None):
+        Resource.__init__(self)
+
+        self.SMPPClientManagerPB = SMPPClientManagerPB
+        self.RouterPB = RouterPB
+        self.stats = stats
+        self.log = log
+        self.interceptorpb_client = interceptorpb_client
+        self.config = HTTPApiConfig
+        self.batches = batches
+
+        # Per user token buckets for http_throughput control (shared with /send)
+        self.qos_buckets = {} if qos_buckets is None else qos_buckets
+
+        # opFactory is initiated with a dummy SMPPClientConfig used for building SubmitSm only
+        self.opFactory = SMPPOperationFactory(long_content_max_parts=HTTPApiConfig.long_content_max_parts,
+                                              long_content_split=HTTPApiConfig.long_content_split)
+
+    def parse_messages(self, json_data):
+        """Return the list of BatchMessage from a batch, messages are built from batch globals updated
+        with message params, a message with a list of destinations is expanded to one message per
+        destination"""
+
+        if not isinstance(json_data.get('messages'), list) or len(json_data['messages']) == 0:
+            raise UrlArgsValidationError('Batch has no messages.')
+
+        _globals = json_data.get('globals', {})
+        if not isinstance(_globals, dict):
+            raise UrlArgsValidationError('Batch globals must be an object.')
+
+        messages = []
+        for _message in json_data['messages']:
+            if not isinstance(_message, dict):
+                raise UrlArgsValidationError('Batch messages must be objects.')
+
+            params = dict(_globals)
+            params.update(_message)
+            params['username'] = json_data['username']
+            params['password'] = json_data['password']
+
+            # Make the values look like they came from form encoding, _ are converted to -
+            # (like in the rest api) except for custom_tlvs
+            args = {}
+            for key, value in params.items():
+                if key != 'custom_tlvs':
+                    key = key.replace('_', '-')
+                if isinstance(value, str):
+                    value = value.encode()
+                args[key.encode()] = value
+
+            if isinstance(args.get(b'to'), list):
+                destinations = args[b'to']
+            else:
+                destinations = [args.get(b'to')]
+
+            for to in destinations:
+                message_args = {k: [v] for k, v in args.items() if k != b'to'}
+                if isinstance(to, str):
+                    message_args[b'to'] = [to.encode()]
+                elif isinstance(to, int):
+                    message_args[b'to'] = [str(to).encode()]
+                elif to is not None:
+                    message_args[b'to'] = [to]
+                messages.append(BatchMessage(message_args))
+
+            if len(messages) > self.config.batch_max_messages:
+                raise UrlArgsValidationError('Batch cannot hold more than %s messages.' %
+                                             self.config.batch_max_messages)
+
+        return messages
+
+    def throttle(self, user, count):
+        """Take count tokens from user's http_throughput bucket and return the number of seconds
+        to wait before sending, batches are paced instead of being rejected"""
+
+        http_throughput = user.mt_credential.getQuota('http_throughput')
+        if not http_throughput or http_throughput < 0:
+            return 0.0
+
+        bucket = self.qos_buckets.get(user.uid)
+        if bucket is None:
+            bucket = self.qos_buckets[user.uid] = TokenBucket(http_throughput)
+        else:
+            bucket.setRate(http_throughput)
+
+        return bucket.reserve(count)
+
+    @defer.inlineCallbacks
+    def prepare_message(self, user, message, route_key_params, routes_cache):
+        """Validate and route message, returns (cid, submit_sm) where submit_sm holds the
+        SMPPClientManagerPB.submitSmBatch() arguments"""
+
+        SEND_PARSER.validate(message)
+
+        short_message = get_short_message(message.args)
+
+        # Build SubmitSmPDU
+        SubmitSmPDU = self.opFactory.SubmitSM(
+            source_addr=None if b'from' not in message.args else message.args[b'from'][0],
+            destination_addr=message.args[b'to'][0],
+            short_message=short_message,
+            data_coding=int(message.args[b'coding'][0]),
+            custom_tlvs=message.args[b'custom_tlvs'][0])
+
+        # Make Credential validation
+        v = HttpAPICredentialValidator('Send', user, message, submit_sm=SubmitSmPDU)
+        v.validate()
+
+        # Update SubmitSmPDU by default values from user MtMessagingCredential
+        _pdu = v.updatePDUWithUserDefaults(SubmitSmPDU)
+        while hasattr(_pdu, 'nextPdu'):
+            _pdu = _pdu.nextPdu
+            _pdu = v.updatePDUWithUserDefaults(_pdu)
+
+        routable = RoutableSubmitSm(SubmitSmPDU, user)
+        if b'tags' in message.args:
+            for tag in message.args[b'tags'][0].split(b','):
+                routable.addTag(tag.decode())
+
+        # Intercept
+        routable = yield intercept_routable(routable, self.RouterPB, self.interceptorpb_client,
+                                            self.stats, self.log)
+
+        # Get the route, routes are resolved once per distinct key
+        route_key = None
+        if route_key_params is not None:
+            route_key = get_route_key(routable, route_key_params)
+
+        if route_key is not None and route_key in routes_cache:
+            route, routedConnector = routes_cache[route_key]
+            if repr(route) != 'FailoverMTRoute':
+                routedConnector = route.getConnector()
+        else:
+            route = self.RouterPB.getMTRoutingTable().getRouteFor(routable)
+            if route is None:
+                self.stats.inc('route_error_count')
+                self.log.error("No route matched from user %s for SubmitSmPDU: %s", user, routable.pdu)
+                raise RouteNotFoundError("No route found")
+
+            self.log.debug("RouterPB selected %s route for this SubmitSmPDU", route)
+            routedConnector = get_routed_connector(route, self.SMPPClientManagerPB, self.log)
+            if route_key is not None:
+                routes_cache[route_key] = (route, routedConnector)
+
+        if routedConnector is None:
+            self.stats.inc('route_error_count')
+            self.log.error("Failover route has no bound connector to handle SubmitSmPDU: %s", routable.pdu)
+            raise ConnectorNotFoundError("Failover route has no bound connectors")
+
+        # Re-update SubmitSmPDU with parameters from the route's connector
+        connector_config = self.SMPPClientManagerPB.getConnectorConfig(routedConnector.cid)
+        if connector_config is not None:
+            routable = update_submit_sm_pdu(routable=routable, config=connector_config)
+
+        routable, priority, dlr_url, dlr_level, _, dlr_method = set_routable_params(
+            routable, message.args, self.log)
+
+        # Pre-sending submit_sm: Billing processing
+        if self.config.billing_feature:
+            bill = charge_user(user, route, routable, self.RouterPB, self.stats, self.log)
+        else:
+            bill = None
+
+        defer.returnValue((routedConnector.cid, {
+            'SubmitSmPDU': routable.pdu,
+            'submit_sm_bill': bill,
+            'priority': priority,
+            'dlr_url': dlr_url,
+            'dlr_level': dlr_level,
+            'dlr_method': dlr_method,
+            'dlr_connector': routedConnector.cid}))
+
+    @defer.inlineCallbacks
+    def process_batch(self, batch_id, user, messages):
+        """Route and publish messages by chunks, batch status is updated after each chunk"""
+
+        status = self.batches.get(batch_id)
+        status['status'] = 'processing'
+        chunk_size = max(1, self.config.batch_chunk_size)
+
+        try:
+            for offset in range(0, len(messages), chunk_size):
+                chunk = messages[offset:offset + chunk_size]
+
+                # QoS throttling
+                delay = self.throttle(user, len(chunk))
+                if delay > 0:
+                    self.log.debug('QoS: pacing batch %s for %.3fs, user:%s', batch_id, delay, user)
+                    yield slow_down(delay)
+                user.getCnxStatus().httpapi['qos_last_submit_sm_at'] = datetime.now()
+
+                # Routes are cached for one chunk, following chunks will see routing table updates
+                route_key_params = get_route_key_params(self.RouterPB.getMTRoutingTable())
+                routes_cache = {}
+
+                submit_sms = {}
+                for message in chunk:
+                    try:
+                        cid, submit_sm = yield self.prepare_message(user, message, route_key_params,
+                                                                    routes_cache)
+                    except HttpApiError as e:
+                        self.log.error("Batch %s error: %s", batch_id, e)
+                        status['failed'] += 1
+                    except Exception as e:
+                        self.log.error("Batch %s unknown error: %s", batch_id, e)
+                        status['failed'] += 1
+                    else:
+                        submit_sms.setdefault(cid, []).append(submit_sm)
+
+                # Send SubmitSmPDUs through smpp client manager PB server, one publish per connector
+                for cid, _submit_sms in submit_sms.items():
+                    msgids = yield self.SMPPClientManagerPB.submitSmBatch(user.uid, cid, _submit_sms)
+                    if not msgids:
+                        self.stats.inc('server_error_count')
+                        self.log.error('Failed to send %s SubmitSmPDU of batch %s to [cid:%s]',
+                                       len(_submit_sms), batch_id, cid)
+                        status['failed'] += len(_submit_sms)
+                    else:
+                        self.stats.inc('success_count', len(msgids))
+                        self.stats.set('last_success_at', datetime.now())
+                        self.log.info('SMS-MT [uid:%s] [cid:%s] [batch:%s] [count:%s]',
+                                      user.uid, cid, batch_id, len(msgids))
+                        status['submitted'] += len(msgids)
+
+                status['updated_at'] = datetime.now()
+
+                # Let the reactor breathe between chunks
+                yield task.deferLater(reactor, 0, lambda: None)
+        finally:
+            status['status'] = 'done'
+            status['updated_at'] = datetime.now()
+            self.log.info('Batch %s done for user %s: %s submitted, %s failed out of %s', batch_id, user,
+                          status['submitted'], status['failed'], status['total'])
+
+    def render_POST(self, request):
+        """
+        /sendbatch request processing
+
+        Batch is given as json: {"username", "password", "globals": {..}, "messages": [{..}, ..]}
+        where messages and globals are holding /send arguments, it's authenticated and accepted at
+        once and processed in background, its progress is available through /batchstatus
+        """
+
+        self.log.debug("Rendering /sendbatch response from %s", request.getClientIP())
+        request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+        response = {'return': None, 'status': 200}
+
+        self.stats.inc('request_count')
+        self.stats.set('last_request_at', datetime.now())
+
+        try:
+            try:
+                json_data = json.loads(request.content.read())
+            except Exception:
+                raise UrlArgsValidationError('Cannot parse JSON data.')
+            if not isinstance(json_data, dict):
+                raise UrlArgsValidationError('Cannot parse JSON data.')
+
+            # Validation
+            BATCH_PARSER.validate(BatchMessage({
+                k.encode(): [json_data[k].encode() if isinstance(json_data[k], str) else json_data[k]]
+                for k in ['username', 'password'] if k in json_data}))
+
+            # Authentication
+            user = authenticate_user(json_data['username'], json_data['password'], self.RouterPB,
+                                     self.stats, self.log)
+
+            # Update CnxStatus
+            user.getCnxStatus().httpapi['connects_count'] += 1
+            user.getCnxStatus().httpapi['submit_sm_request_count'] += 1
+            user.getCnxStatus().httpapi['last_activity_at'] = datetime.now()
+
+            messages = self.parse_messages(json_data)
+
+            batch_id = str(uuid.uuid4())
+            self.batches.set(batch_id, {
+                'uid': user.uid,
+                'status': 'scheduled',
+                'total': len(messages),
+                'submitted': 0,
+                'failed': 0,
+                'created_at': datetime.now(),
+                'updated_at': datetime.now()})
+
+            # Continue processing in background
+            reactor.callLater(0, self.process_batch, batch_id, user, messages)
+
+            response = {'return': {'batchId': batch_id, 'messageCount': len(messages)}, 'status': 200}
+        except HttpApiError as e:
+            self.log.error("Error: %s", e)
+            response = {'return': e.message, 'status': e.code}
+        except Exception as e:
+            self.log.error("Error: %s", e)
+            response = {'return': "Unknown error: %s" % e, 'status': 500}
+
+        self.log.debug("Returning %s to %s.", response, request.getClientIP())
+        request.setResponseCode(response['status'])
+        if isinstance(response['return'], bytes):
+            return json.dumps(response['return'].decode()).encode()
+        return json.dumps(response['return']).encode()
+
+
+class BatchStatus(Resource):
+    isleaf = True
+
+    def __init__(self, RouterPB, stats, log, batches):
+        Resource.__init__(self)
+
+        self.RouterPB = RouterPB
+        self.stats = stats
+        self.log = log
+        self.batches = batches
+
+    def render_GET(self, request):
+        """
+        /batchstatus request processing
+
+        Note: Batch status is only returned to the user who posted the batch
+        """
+
+        self.log.debug("Rendering /batchstatus response with args: %s from %s",
+                       request.args, request.getClientIP())
+        request.responseHeaders.addRawHeader(b"content-type", b"application/json")
+        response = {'return': None, 'status': 200}
+
+        self.stats.inc('request_count')
+        self.stats.set('last_request_at', datetime.now())
+
+        try:
+            # Make validation
+            BATCH_STATUS_PARSER.parse(request)
+
+            # Authentication
+            user = authenticate_user(
+                request.args[b'username'][0],
+                request.args[b'password'][0],
+                self.RouterPB,
+                self.stats,
+                self.log
+            )
+
+            batch_id = request.args[b'batch_id'][0].decode()
+            status = self.batches.get(batch_id)
+            if status is None or status['uid'] != user.uid:
+                response = {'return': 'Unknown batch: %s' % batch_id, 'status': 404}
+            else:
+                response = {'return': {
+                    'batchId': batch_id,
+                    'status': status['status'],
+                    'total': status['total'],
+                    'submitted': status['submitted'],
+                    'failed': status['failed'],
+                    'created_at': status['created_at'].strftime('%Y-%m-%d %H:%M:%S'),
+                    'updated_at': status['updated_at'].strftime('%Y-%m-%d %H:%M:%S')}, 'status': 200}
+        except HttpApiError as e:
+            self.log.error("Error: %s", e)
+            response = {'return': e.message, 'status': e.code}
+        except Exception as e:
+            self.log.error("Error: %s", e)
+            response = {'return': "Unknown error: %s" % e, 'status': 500}
+
+        self.log.debug("Returning %s to %s.", response, request.getClientIP())
+        request.setResponseCode(response['status'])
+        if isinstance(response['return'], bytes):
+            return json.dumps(response['return'].decode()).encode()
+        return json.dumps(response['return']).encode()
@@ -7,11 +7,13 @@ from twisted.web.resource import Resource
 
 import jasmin
 from jasmin.protocols.http.endpoints.send import Send
+from jasmin.protocols.http.endpoints.sendbatch import SendBatch, BatchStatus
 from jasmin.protocols.http.endpoints.rate import Rate
 from jasmin.protocols.http.endpoints.ping import Ping
 from jasmin.protocols.http.endpoints.balance import Balance
 from jasmin.protocols.http.endpoints.metrics import Metrics
 from jasmin.protocols.http.stats import HttpAPIStatsCollector
+from jasmin.tools.cache import LRUCache
 
 LOG_CATEGORY = "jasmin-http-api"
 
@@ -41,7 +43,15 @@ class HTTPApi(Resource):
         self.log = log
         # Set http url routings
         log.debug("Setting http url routing for /send")
-        self.putChild(b'send', Send(config, RouterPB, SMPPClientManagerPB, stats, log, interceptor))
+        send = Send(config, RouterPB, SMPPClientManagerPB, stats, log, interceptor)
+        self.putChild(b'send', send)
+        # Status of batches posted to /sendbatch
+        batches = LRUCache(config.batch_status_max, config.batch_status_ttl)
+        log.debug("Setting http url routing for /sendbatch")
+        self.putChild(b'sendbatch', SendBatch(config, RouterPB, SMPPClientManagerPB, stats, log, interceptor,
+                                              batches, send.qos_buckets))
+        log.debug("Setting http url routing for /batchstatus")
+        self.putChild(b'batchstatus', BatchStatus(RouterPB, stats, log, batches))
         log.debug("Setting http url routing for /rate")
         self.putChild(b'rate', Rate(config, RouterPB, stats, log, interceptor))
         log.debug("Setting http url routing for /balance")
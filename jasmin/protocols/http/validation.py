@@ -2,6 +2,7 @@
 HTTP request validators
 """
 
+import json
 import re
 from jasmin.protocols.http.errors import UrlArgsValidationError, CredentialValidationError
 from jasmin.protocols.validation import AbstractCredentialValidator
@@ -23,38 +24,91 @@ class UrlArgsValidator:
             raise UrlArgsValidationError(
                 'Mandatory arguments not found, please refer to the HTTPAPI specifications.')
 
+        # Arguments and fields are checked in one pass, errors are raised in this order:
+        # first argument is unknown, then fields (invalid value or mandatory field not found),
+        # then any other unknown argument
         for arg in args:
-            # Check for unknown args
             if arg not in self.fields:
                 # we probably just should drop extraneous args rather than throwing an error...
                 raise UrlArgsValidationError(b"Argument [%s] is unknown." % arg)
+            break
+
+        for field, fieldData in self.fields.items():
+            if field in args:
+                if 'pattern' not in fieldData:
+                    continue
+
+                value = args[field][0]
+                if isinstance(value, (dict, list)):
+                    continue  # Todo check structure of dict/list
+                elif isinstance(value, (int, float)):
+                    value = str(value).encode()
+                elif isinstance(value, str):
+                    value = value.encode()
+
+                # Validate known args
+                if fieldData['pattern'].match(value) is None:
+                    raise UrlArgsValidationError(b"Argument [%s] has an invalid value: [%s]." % (
+                        field, value))
+            elif not fieldData['optional']:
+                raise UrlArgsValidationError(b"Mandatory argument [%s] is not found." % field)
 
-            # Validate known args and check for mandatory fields
-            for field in self.fields:
-                fieldData = self.fields[field]
-
-                if field in args:
-                    if isinstance(args[field][0], dict) or isinstance(args[field][0], list):
-                        continue  # Todo check structure of dict/list
-                    elif isinstance(args[field][0], int) or isinstance(args[field][0], float):
-                        value = str(args[field][0]).encode()
-                    elif isinstance(args[field][0], str):
-                        value = args[field][0].encode()
-                    else:
-                        value = args[field][0]
-
-                    # Validate known args
-                    # print(f'Validating field {field} of value {value}')
-                    if ('pattern' in self.fields[field]
-                        and self.fields[field]['pattern'].match(value) is None):
-                        raise UrlArgsValidationError(b"Argument [%s] has an invalid value: [%s]." % (
-                            field, value))
-                elif not fieldData['optional']:
-                    raise UrlArgsValidationError(b"Mandatory argument [%s] is not found." % field)
+        for arg in args:
+            if arg not in self.fields:
+                raise UrlArgsValidationError(b"Argument [%s] is unknown." % arg)
 
         return True
 
 
+class HttpRequestParser:
+    """Parse requests of a http api endpoint against its fields
+
+    A parser is built once per endpoint (with precompiled field patterns), parse() loads the json
+    body into request.args (values look like they came from form encoding), sets default values
+    through set_defaults(args), validates arguments then calls check(args) for extra checks.
+    """
+
+    def __init__(self, fields, set_defaults=None, check=None):
+        self.fields = fields
+        self.set_defaults = set_defaults
+        self.check = check
+
+    def load_json(self, request):
+        """Load json body into request.args"""
+
+        json_data = json.loads(request.content.read())
+        for key, value in json_data.items():
+            # Make the values look like they came from form encoding all surrounded by [ ]
+            if isinstance(value, str):
+                value = value.encode()
+
+            if isinstance(key, str):
+                key = key.encode()
+
+            request.args[key] = [value]
+
+    def validate(self, request):
+        """Set defaults and validate request.args, raises UrlArgsValidationError if something is wrong"""
+
+        if self.set_defaults is not None:
+            self.set_defaults(request.args)
+
+        UrlArgsValidator(request, self.fields).validate()
+
+        if self.check is not None:
+            self.check(request.args)
+
+        return request.args
+
+    def parse(self, request):
+        """Parse a http request and return its validated args"""
+
+        if request.getHeader(b'content-type') == b'application/json':
+            self.load_json(request)
+
+        return self.validate(request)
+
+
 class HttpAPICredentialValidator(AbstractCredentialValidator):
     """Will check for user MtMessagingCredential"""
 
@@ -4,7 +4,7 @@ import json
 import os
 import sys
 
-from .api import PingResource, BalanceResource, RateResource, SendResource, SendBatchResource
+from .api import PingResource, BalanceResource, RateResource, SendResource, SendBatchResource, BatchStatusResource
 from .config import *
 
 sys.path.append("%s/vendor" % os.path.dirname(os.path.abspath(jasmin.__file__)))
@@ -124,4 +124,6 @@ api.add_route('/secure/send', SendResource())
 logger.info('\t[OK] /secure/send')
 api.add_route('/secure/sendbatch', SendBatchResource())
 logger.info('\t[OK] /secure/sendbatch')
+api.add_route('/secure/batchstatus/{batch_id}', BatchStatusResource())
+logger.info('\t[OK] /secure/batchstatus')
 logger.info('API Started.')
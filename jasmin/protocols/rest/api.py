@@ -1,13 +1,16 @@
+import hashlib
 import json
 import os
 import sys
+import threading
 import uuid
 import re
 import requests
 
 import jasmin
+from jasmin.tools.cache import LRUCache
 from .config import *
-from .tasks import httpapi_send
+from .tasks import httpapi_send, httpapi_send_batch, get_http_session
 from datetime import datetime
 from falcon import HTTPInternalServerError, HTTPPreconditionFailed
 import falcon
@@ -15,12 +18,45 @@ import falcon
 sys.path.append("%s/vendor" % os.path.dirname(os.path.abspath(jasmin.__file__)))
 
 
+class AuthCache:
+    """Thread-safe cache of successful authentications, passwords are not kept in clear"""
+
+    def __init__(self, seconds, max_keys):
+        self.cache = LRUCache(max_keys if seconds > 0 else 0, seconds)
+        self.lock = threading.Lock()
+
+    def key(self, username, password):
+        return username, hashlib.sha256(('%s' % password).encode('utf-8')).hexdigest()
+
+    def get(self, username, password):
+        with self.lock:
+            return self.cache.get(self.key(username, password), False)
+
+    def set(self, username, password):
+        with self.lock:
+            self.cache.set(self.key(username, password), True)
+
+
+auth_cache = AuthCache(auth_cache_seconds, auth_cache_max_keys)
+
+
 class JasminHttpApiProxy:
     """Provides a WS caller for old Jasmin http api"""
 
     def call_jasmin(self, url, params=None):
         try:
-            r = requests.get('%s/%s' % (old_api_uri, url), params=params)
+            r = get_http_session().get('%s/%s' % (old_api_uri, url), params=params, timeout=old_api_timeout)
+        except requests.exceptions.ConnectionError as e:
+            raise HTTPInternalServerError('Jasmin httpapi connection error',
+                                          'Could not connect to Jasmin http api (%s): %s' % (old_api_uri, e))
+        except Exception as e:
+            raise HTTPInternalServerError('Jasmin httpapi unknown error', str(e))
+        else:
+            return r.status_code, r.content.decode('utf-8').strip('"')
+
+    def call_jasmin_post(self, url, json_data):
+        try:
+            r = get_http_session().post('%s/%s' % (old_api_uri, url), json=json_data, timeout=old_api_timeout)
         except requests.exceptions.ConnectionError as e:
             raise HTTPInternalServerError('Jasmin httpapi connection error',
                                           'Could not connect to Jasmin http api (%s): %s' % (old_api_uri, e))
@@ -29,6 +65,19 @@ class JasminHttpApiProxy:
         else:
             return r.status_code, r.content.decode('utf-8').strip('"')
 
+    def authenticate(self, username, password):
+        """Check credentials through old Jasmin http api /balance, successful authentications are
+        cached for auth_cache_seconds"""
+        if auth_cache.get(username, password):
+            return True
+
+        status, _ = self.call_jasmin('balance', params={'username': username, 'password': password})
+        if status != 200:
+            return False
+
+        auth_cache.set(username, password)
+        return True
+
 
 class JasminRestApi:
     """Parent class for all rest api resources"""
@@ -192,11 +241,7 @@ class SendBatchResource(JasminRestApi, JasminHttpApiProxy):
         """
 
         # Authentify user before proceeding
-        status, _ = self.call_jasmin('balance', params={
-            'username': request.context.get('username'),
-            'password': request.context.get('password')
-        })
-        if status != 200:
+        if not self.authenticate(request.context.get('username'), request.context.get('password')):
             raise HTTPPreconditionFailed('Authentication failed',
                                          "Authentication failed for user: %s" % request.context.get('username'))
 
@@ -207,7 +252,33 @@ class SendBatchResource(JasminRestApi, JasminHttpApiProxy):
         # Batch scheduling
         countdown = self.parse_schedule_at(params.get('batch_config', {}).get('schedule_at', None))
 
-        message_count = 0
+        # Batch throughput (shared by all workers)
+        try:
+            if float(params.get('batch_config', {}).get('throughput', 0) or 0) < 0:
+                raise ValueError('negative throughput')
+        except (TypeError, ValueError):
+            raise HTTPPreconditionFailed('Cannot parse throughput value',
+                                         "Got invalid throughput: %s, a positive number of messages per second "
+                                         "is expected" % params.get('batch_config', {}).get('throughput'))
+
+        # Post the batch at once to Jasmin's http api when it's not tracked through callbacks
+        if http_sendbatch and countdown == 0 and not set(params.get('batch_config', {})) & {
+                'callback_url', 'errback_url', 'throughput'}:
+            self.build_response_from_proxy_result(
+                response,
+                self.call_jasmin_post(
+                    'sendbatch',
+                    json_data={
+                        'username': request.context.get('username'),
+                        'password': request.context.get('password'),
+                        'globals': params.get('globals', {}),
+                        'messages': params.get('messages', [])
+                    }
+                )
+            )
+            return
+
+        messages_params = []
         for _message_params in params.get('messages', {}):
             # Construct message params
             message_params = {'username': request.context.get('username'),
@@ -232,21 +303,27 @@ class SendBatchResource(JasminRestApi, JasminHttpApiProxy):
             if isinstance(message_params.get('to', ''), list):
                 to_list = message_params.get('to')
                 for _to in to_list:
-                    message_params['to'] = _to
-                    if countdown == 0:
-                        httpapi_send.delay(batch_id, params.get('batch_config', {}), message_params, config)
-                    else:
-                        httpapi_send.apply_async(
-                            args=[batch_id, params.get('batch_config', {}), message_params, config],
-                            countdown=countdown)
-                    message_count += 1
+                    _message_params = message_params.copy()
+                    _message_params['to'] = _to
+                    messages_params.append(_message_params)
             else:
-                if countdown == 0:
-                    httpapi_send.delay(batch_id, params.get('batch_config', {}), message_params, config)
-                else:
-                    httpapi_send.apply_async(
-                        args=[batch_id, params.get('batch_config', {}), message_params, config], countdown=countdown)
-                message_count += 1
+                messages_params.append(message_params)
+
+        # Enqueue sendouts by tasks of batch_task_size messages
+        task_size = max(1, batch_task_size)
+        for i in range(0, len(messages_params), task_size):
+            if task_size == 1:
+                send_task = httpapi_send
+                args = [batch_id, params.get('batch_config', {}), messages_params[i], config]
+            else:
+                send_task = httpapi_send_batch
+                args = [batch_id, params.get('batch_config', {}), messages_params[i:i + task_size], config]
+
+            if countdown == 0:
+                send_task.delay(*args)
+            else:
+                send_task.apply_async(args=args, countdown=countdown)
+        message_count = len(messages_params)
 
         response.body = {
             'data': {
@@ -256,3 +333,23 @@ class SendBatchResource(JasminRestApi, JasminHttpApiProxy):
         }
         if countdown > 0:
             response.body['data']['scheduled'] = '%ss' % countdown
+
+
+class BatchStatusResource(JasminRestApi, JasminHttpApiProxy):
+    def on_get(self, request, response, batch_id):
+        """
+        GET /secure/batchstatus/{batch_id} request processing
+
+        Note: Only batches posted to Jasmin's http api /sendbatch (http_sendbatch = True) are tracked
+        """
+        self.build_response_from_proxy_result(
+            response,
+            self.call_jasmin(
+                'batchstatus',
+                params={
+                    'username': request.context.get('username'),
+                    'password': request.context.get('password'),
+                    'batch_id': batch_id
+                }
+            )
+        )
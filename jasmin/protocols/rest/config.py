@@ -5,9 +5,18 @@ from jasmin.config import LOG_PATH
 
 # RESTAPI
 old_api_uri = 'http://127.0.0.1:1401'
+# Calls to old_api_uri are sent through a pool of keep-alive connections (per process), requests
+# are timing out after old_api_timeout seconds
+old_api_pool_size = 10
+old_api_timeout = 30
 show_jasmin_version = True
+# Successful authentications are cached for auth_cache_seconds (0 disables caching)
 auth_cache_seconds = 10
 auth_cache_max_keys = 500
+# When set to True, batches without callbacks nor scheduling are posted at once to Jasmin's http api
+# /sendbatch (routed and published by chunks there) instead of enqueuing one Celery task per message,
+# their progress is available through /secure/batchstatus/{batch_id}
+http_sendbatch = False
 
 log_level = logging.getLevelName('INFO')
 log_file = '%s/restapi.log' % LOG_PATH
@@ -31,3 +40,28 @@ http_throughput_per_worker = 8
 # control the batch throughput, slower response time will slow down the throughput
 # and vice-versa
 smart_qos = True
+# Smart QoS is comparing the p95 latency of the last smart_qos_window requests of each worker
+smart_qos_window = 50
+# Throughputs shared by all workers through Redis (distributed token buckets), set to zero (0) to
+# disable them:
+# - http_throughput: messages per second sent to Jasmin's http api by the whole cluster
+# - http_throughput_per_user: messages per second sent for each user
+# - a batch throughput can be given in its batch_config (throughput)
+# Set rate_limiter_redis_url to None to disable the distributed throughput control
+rate_limiter_redis_url = 'redis://:@127.0.0.1:6379/1'
+rate_limiter_burst_seconds = 1.0
+http_throughput = 0
+http_throughput_per_user = 0
+# Each worker process sends requests to Jasmin's http api and to batch callback urls through one
+# session of keep-alive connections, keeping pools for up to http_pool_hosts different hosts
+http_pool_hosts = 10
+# Callback urls are timing out after callback_timeout seconds
+callback_timeout = 30
+# Batch messages are sent by Celery tasks of batch_task_size messages, callbacks are enqueued once
+# a task is done
+batch_task_size = 1
+# How callback_url and errback_url are called:
+# - message: one GET per message (batchId, to, status, statusText)
+# - batched: one json POST per task (batchId, status, messages: [{to, statusText}, ..])
+# - summary: one GET per task (batchId, status, count)
+batch_callback_mode = 'message'
@@ -1,9 +1,14 @@
+import os
+import threading
 import time
 
+import redis
 import requests
+from requests.adapters import HTTPAdapter
 from celery import Celery, Task
-from datetime import datetime, timedelta
+from datetime import datetime
 
+from jasmin.tools.qos import TokenBucket, DistributedTokenBucket, LatencyWindow
 from .config import *
 
 # @TODO: make configuration loadable from /etc/jasmin/restapi.conf
@@ -18,103 +23,229 @@ app = Celery(__name__)
 task = app.task
 app.config_from_object('jasmin.protocols.rest.config')
 
+_http_session = None
+_http_session_pid = None
+_http_session_lock = threading.Lock()
+
+
+def get_http_session():
+    """Return the keep-alive session of this process, used for calls to Jasmin's http api and to
+    batch callback urls; it's created once per process (after forking workers) and shared by all
+    threads"""
+    global _http_session, _http_session_pid
+
+    with _http_session_lock:
+        if _http_session is None or _http_session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=http_pool_hosts, pool_maxsize=old_api_pool_size)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            _http_session = session
+            _http_session_pid = os.getpid()
+
+    return _http_session
+
+
+_rate_limiter = None
+_rate_limiter_pid = None
+
+
+def get_rate_limiter():
+    """Return the distributed token buckets of this process, None if rate_limiter_redis_url is not set"""
+    global _rate_limiter, _rate_limiter_pid
+
+    if not rate_limiter_redis_url:
+        return None
+
+    with _http_session_lock:
+        if _rate_limiter is None or _rate_limiter_pid != os.getpid():
+            _rate_limiter = DistributedTokenBucket(redis.Redis.from_url(rate_limiter_redis_url),
+                                                   burst_seconds=rate_limiter_burst_seconds, log=logger)
+            _rate_limiter_pid = os.getpid()
+
+    return _rate_limiter
+
 
 class JasminTask(Task):
     def __init__(self):
         Task.__init__(self)
 
         # Shared namespace
-        self.worker_tracker = {'last_req_at': datetime.now(), 'last_req_time': 0, 'throughput': 0}
+        self.worker_tracker = {'last_req_at': datetime.now(), 'throughput': 0,
+                               'bucket': TokenBucket(0, burst=1),
+                               'latencies': LatencyWindow(smart_qos_window), 'last_p95': None,
+                               'since_adjustment': 0}
 
     def on_failure(self, exc, task_id, args, kwargs, einfo):
         logger.error('Task [%s] failed: %s', task_id, exc)
 
-
-@task(bind=True, base=JasminTask)
-def httpapi_send(self, batch_id, batch_config, message_params, config):
-    """Calls Jasmin's /send http api, if we have errback_url and callback_url in batch_config then
-    will callback those urls asynchronously to inform user of batch progression"""
-    try:
-        slow_down_seconds = 0
-        # Shall we do QoS control ?
-        if self.worker_tracker['throughput'] > 0:
-            qos_throughput_second = 1 / float(self.worker_tracker['throughput'])
-            qos_throughput_ysecond_td = timedelta(microseconds=qos_throughput_second * 1000000)
-            qos_delay = datetime.now() - self.worker_tracker['last_req_at']
-            if qos_delay < qos_throughput_ysecond_td:
-                slow_down_seconds = float((qos_throughput_ysecond_td - qos_delay).microseconds) / 1000000
-                logger.debug('QoS: slowing down request by %s/s to meet configured throughput per worker: %s/s',
+    def send(self, batch_id, batch_config, message_params, config):
+        """Calls Jasmin's /send http api, returns (status, status_text) where status is 1 if message
+        were sent, 0 otherwise"""
+        try:
+            # Shall we do QoS control ? (a zero throughput will disable the bucket)
+            bucket = self.worker_tracker['bucket']
+            bucket.setRate(self.worker_tracker['throughput'])
+            slow_down_seconds = bucket.reserve()
+
+            # Batch, user and cluster-wide throughputs are shared by all workers
+            rate_limiter = get_rate_limiter()
+            if rate_limiter is not None:
+                slow_down_seconds = max(slow_down_seconds, rate_limiter.reserve([
+                    ('batch:%s' % batch_id, float(batch_config.get('throughput', 0) or 0)),
+                    ('user:%s' % message_params.get('username'), http_throughput_per_user),
+                    ('httpapi', http_throughput)]))
+
+            if slow_down_seconds > 0:
+                logger.debug('QoS: slowing down request by %s/s to meet configured throughputs (worker: %s/s)',
                              slow_down_seconds, self.worker_tracker['throughput'])
+                time.sleep(slow_down_seconds)
 
-        # Shall we sleep ?
-        if slow_down_seconds > 0:
-            time.sleep(slow_down_seconds)
+            r = get_http_session().get('%s/send' % old_api_uri, params=message_params, timeout=old_api_timeout)
+        except requests.exceptions.ConnectionError as e:
+            logger.error('[%s] Jasmin httpapi connection error: %s' % (batch_id, e))
+            return 0, 'HTTPAPI Connection error: %s' % e
+        except Exception as e:
+            logger.error('[%s] Unknown error (%s): %s' % (batch_id, type(e), e))
+            return 0, 'Unknown error: %s' % e
 
-        r = requests.get('%s/send' % old_api_uri, params=message_params)
-    except requests.exceptions.ConnectionError as e:
-        logger.error('[%s] Jasmin httpapi connection error: %s' % (batch_id, e))
-        if batch_config.get('errback_url', None):
-            batch_callback.delay(batch_config.get('errback_url'), batch_id, message_params['to'], 0,
-                                 'HTTPAPI Connection error: %s' % e)
-    except Exception as e:
-        logger.error('[%s] Unknown error (%s): %s' % (batch_id, type(e), e))
-        if batch_config.get('errback_url', None):
-            batch_callback.delay(batch_config.get('errback_url'), batch_id, message_params['to'], 0,
-                                 'Unknown error: %s' % e)
-    else:
         # Useful for QoS control
         self.worker_tracker['last_req_at'] = datetime.now()
 
-        # Smart throughput calculation
+        # Smart throughput calculation, the worker throughput is adjusted by 10% when p95 latency
+        # (over the last smart_qos_window requests) is moving by more than 10%
         if self.worker_tracker['throughput'] == 0 and config['throughput'] > 0:
             current_throughput = config['throughput']
         else:
             current_throughput = self.worker_tracker['throughput']
-        if config['smart_qos'] and self.worker_tracker['last_req_time'] is not None:
-            if r.elapsed.total_seconds() > self.worker_tracker['last_req_time']:
-                # We have a slower request, we need to slow down the throughput
+
+        latencies = self.worker_tracker['latencies']
+        latencies.add(r.elapsed.total_seconds())
+        self.worker_tracker['since_adjustment'] += 1
+        adjustment_interval = max(1, smart_qos_window // 5)
+        if (config['smart_qos'] and self.worker_tracker['since_adjustment'] >= adjustment_interval
+                and len(latencies) >= adjustment_interval):
+            self.worker_tracker['since_adjustment'] = 0
+            p95 = latencies.percentile(95)
+            last_p95 = self.worker_tracker['last_p95']
+            self.worker_tracker['last_p95'] = p95
+
+            if last_p95 is not None and p95 > last_p95 * 1.1:
+                # Requests are slower, we need to slow down the throughput
                 if current_throughput > 0 and (current_throughput - (current_throughput * 10 / 100.0)) > 0:
-                    logger.debug('Smart QoS: Slowing down throughput %s/s to -10%%', current_throughput)
+                    logger.debug('Smart QoS: Slowing down throughput %s/s to -10%% (p95: %.3fs)',
+                                 current_throughput, p95)
                     current_throughput = current_throughput - (current_throughput * 10 / 100.0)
                 elif current_throughput == 0:
-                    logger.debug('Smart QoS: Slowing down throughput %s/s to fixed 0.5/s', current_throughput)
+                    logger.debug('Smart QoS: Slowing down throughput %s/s to fixed 0.5/s (p95: %.3fs)',
+                                 current_throughput, p95)
                     current_throughput = 0.5
                     # Else: keep current_throughput as is since it cannot go down to zero
-            elif r.elapsed.total_seconds() < self.worker_tracker['last_req_time']:
-                # We have a slower request, we need to boost the throughput
+            elif last_p95 is not None and p95 < last_p95 * 0.9:
+                # Requests are faster, we can boost the throughput
                 if (current_throughput > 0 and config['throughput'] > 0 and (
                             current_throughput + (current_throughput * 10 / 100.0)) <= config['throughput']):
-                    logger.debug('Smart QoS: Boosting throughput %s/s to +10%%', current_throughput)
+                    logger.debug('Smart QoS: Boosting throughput %s/s to +10%% (p95: %.3fs)',
+                                 current_throughput, p95)
                     current_throughput = current_throughput + (current_throughput * 10 / 100.0)
                 elif current_throughput > 0 and config['throughput'] == 0:
-                    logger.debug('Smart QoS: Restoring throughput %s/s to unlimited', current_throughput)
+                    logger.debug('Smart QoS: Restoring throughput %s/s to unlimited (p95: %.3fs)',
+                                 current_throughput, p95)
                     current_throughput = 0
 
         self.worker_tracker['throughput'] = current_throughput
-        self.worker_tracker['last_req_time'] = r.elapsed.total_seconds()
 
         # Return status back
         if r.status_code != 200:
             logger.error('[%s] %s' % (batch_id, r.text.strip('"')))
-            if batch_config.get('errback_url', None):
-                batch_callback.delay(
-                    batch_config.get('errback_url'), batch_id, message_params['to'], 0,
-                    'HTTPAPI error: %s' % r.text.strip('"'))
+            return 0, 'HTTPAPI error: %s' % r.text.strip('"')
+
+        return 1, r.text
+
+
+def enqueue_callbacks(batch_id, batch_config, results):
+    """Inform user of batch progression through callback_url (sent messages) and errback_url (failed
+    ones), results is a list of (to, status, status_text); depending on batch_callback_mode, urls
+    are called once per message, once with all the messages or once with their count"""
+    for status, url in [(1, batch_config.get('callback_url', None)), (0, batch_config.get('errback_url', None))]:
+        if not url:
+            continue
+
+        _results = [(to, status_text) for to, _status, status_text in results if _status == status]
+        if len(_results) == 0:
+            continue
+
+        if batch_callback_mode == 'batched':
+            batch_callbacks.delay(url, batch_id, status, _results)
+        elif batch_callback_mode == 'summary':
+            batch_summary_callback.delay(url, batch_id, status, len(_results))
         else:
-            if batch_config.get('callback_url', None):
-                batch_callback.delay(
-                    batch_config.get('callback_url'), batch_id, message_params['to'], 1, r.text)
+            for to, status_text in _results:
+                batch_callback.delay(url, batch_id, to, status, status_text)
+
+
+@task(bind=True, base=JasminTask)
+def httpapi_send(self, batch_id, batch_config, message_params, config):
+    """Calls Jasmin's /send http api, if we have errback_url and callback_url in batch_config then
+    will callback those urls asynchronously to inform user of batch progression"""
+    status, status_text = self.send(batch_id, batch_config, message_params, config)
+    enqueue_callbacks(batch_id, batch_config, [(message_params['to'], status, status_text)])
+
+
+@task(bind=True, base=JasminTask)
+def httpapi_send_batch(self, batch_id, batch_config, messages_params, config):
+    """Calls Jasmin's /send http api for a list of messages then callback errback_url and callback_url
+    (if any in batch_config) for all of them"""
+    results = []
+    for message_params in messages_params:
+        status, status_text = self.send(batch_id, batch_config, message_params, config)
+        results.append((message_params['to'], status, status_text))
+
+    enqueue_callbacks(batch_id, batch_config, results)
+
+
+def callback_operation_name(status):
+    if status == 0:
+        return 'Errback'
+    return 'Callback'
 
 
 @task(bind=True, base=JasminTask)
 def batch_callback(self, url, batch_id, to, status, status_text):
+    operation_name = callback_operation_name(status)
     try:
-        if status == 0:
-            operation_name = 'Errback'
-        else:
-            operation_name = 'Callback'
+        get_http_session().get(url, params={'batchId': batch_id, 'to': to, 'status': status,
+                                            'statusText': status_text}, timeout=callback_timeout)
+    except Exception as e:
+        logger.error('(%s) of batch %s to %s failed (%s): %s.' % (operation_name, batch_id, url, type(e), e))
+    else:
+        logger.info('(%s) of batch %s to %s succeeded.' % (operation_name, batch_id, url))
 
-        requests.get(url, params={'batchId': batch_id, 'to': to, 'status': status, 'statusText': status_text})
+
+@task(bind=True, base=JasminTask)
+def batch_callbacks(self, url, batch_id, status, results):
+    """Callback url once for many messages of a batch: results are POSTed as json"""
+    operation_name = callback_operation_name(status)
+    try:
+        payload = {'batchId': batch_id,
+                   'status': status,
+                   'messages': [{'to': to, 'statusText': status_text} for to, status_text in results]}
+        get_http_session().post(url, json=payload, timeout=callback_timeout)
+    except Exception as e:
+        logger.error('(%s) of batch %s to %s for %s messages failed (%s): %s.' % (
+            operation_name, batch_id, url, len(results), type(e), e))
+    else:
+        logger.info('(%s) of batch %s to %s for %s messages succeeded.' % (
+            operation_name, batch_id, url, len(results)))
+
+
+@task(bind=True, base=JasminTask)
+def batch_summary_callback(self, url, batch_id, status, count):
+    """Callback url with the number of messages of a batch having the same status"""
+    operation_name = callback_operation_name(status)
+    try:
+        get_http_session().get(url, params={'batchId': batch_id, 'status': status, 'count': count},
+                               timeout=callback_timeout)
     except Exception as e:
         logger.error('(%s) of batch %s to %s failed (%s): %s.' % (operation_name, batch_id, url, type(e), e))
     else:
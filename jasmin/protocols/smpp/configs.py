@@ -3,6 +3,7 @@ import re
 
 from jasmin.config import LOG_PATH
 from jasmin.config import ConfigFile
+from jasmin.protocols.smpp.receipts import RECEIPT_FORMATS
 from smpp.pdu.pdu_types import (EsmClass, EsmClassMode, EsmClassType,
                                               RegisteredDelivery, RegisteredDeliveryReceipt,
                                               AddrTon, AddrNpi,
@@ -184,6 +185,20 @@ class SMPPClientConfig:
         if (not isinstance(self.submit_sm_throughput, int)
             and not isinstance(self.submit_sm_throughput, float)):
             raise TypeMismatch('submit_sm_throughput must be an integer or float')
+        # SMPP window: maximum number of submit_sm waiting for their submit_sm_resp
+        self.max_outstanding_submits = kwargs.get('max_outstanding_submits', 1)
+        if not isinstance(self.max_outstanding_submits, int):
+            raise TypeMismatch('max_outstanding_submits must be an integer')
+        if self.max_outstanding_submits < 1:
+            raise UnknownValue('Invalid max_outstanding_submits: %s' % self.max_outstanding_submits)
+
+        # Number of parallel binds opened for this connector, all of them consuming from the
+        # connector's submit.sm queue
+        self.binds = kwargs.get('binds', 1)
+        if not isinstance(self.binds, int):
+            raise TypeMismatch('binds must be an integer')
+        if self.binds < 1:
+            raise UnknownValue('Invalid binds: %s' % self.binds)
 
         # DLR Message id bases from submit_sm_resp to deliver_sm, possible values:
         # [0] (default) : submit_sm_resp and deliver_sm messages IDs are on the same base.
@@ -195,6 +210,12 @@ class SMPPClientConfig:
         if self.dlr_msg_id_bases not in [0, 1, 2]:
             raise UnknownValue('Invalid dlr_msg_id_bases: %s' % self.dlr_msg_id_bases)
 
+        # Format of delivery receipts content received through this connector, one of
+        # jasmin.protocols.smpp.receipts.RECEIPT_FORMATS
+        self.dlr_receipt_format = kwargs.get('dlr_receipt_format', 'standard')
+        if self.dlr_receipt_format not in RECEIPT_FORMATS:
+            raise UnknownValue('Invalid dlr_receipt_format: %s' % self.dlr_receipt_format)
+
 
 class SMPPClientServiceConfig(ConfigFile):
     def __init__(self, config_file):
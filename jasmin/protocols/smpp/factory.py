@@ -402,13 +402,13 @@ class SMPPServerFactory(_SMPPServerFactory):
             if repr(route) == 'FailoverMTRoute':
                 self.log.debug('Selected route is a failover, will ensure connector is bound:')
                 while True:
-                    c = self.SMPPClientManagerPB.perspective_connector_details(routedConnector.cid)
-                    if c:
-                        self.log.debug('Connector [%s] is: %s', routedConnector.cid, c['session_state'])
+                    session_state = self.SMPPClientManagerPB.getConnectorSessionState(routedConnector.cid)
+                    if session_state is not None:
+                        self.log.debug('Connector [%s] is: %s', routedConnector.cid, session_state.name)
                     else:
                         self.log.debug('Connector [%s] is not found', routedConnector.cid)
 
-                    if c and c['session_state'][:6] == 'BOUND_':
+                    if session_state is not None and session_state.name[:6] == 'BOUND_':
                         # Choose this connector
                         break
                     else:
@@ -1,12 +1,12 @@
 import datetime
 import math
-import re
 import struct
 from enum import Enum
 
 import dateutil.parser as parser
 
 from jasmin.protocols.smpp.configs import SMPPClientConfig
+from jasmin.protocols.smpp.receipts import getReceiptParser
 from smpp.pdu.operations import SubmitSM, DataSM, DeliverSM
 from smpp.pdu.pdu_types import (EsmClass, EsmClassMode, EsmClassType, EsmClassGsmFeatures,
                                               MoreMessagesToSend, MessageState, AddrTon, AddrNpi)
@@ -85,33 +85,12 @@ class SMPPOperationFactory:
 
         # 2.Message content parsing if short_message exists:
         ####################################################
-        # Example of DLR content
-        # id:IIIIIIIIII sub:SSS dlvrd:DDD submit date:YYMMDDhhmm done
-        # date:YYMMDDhhmm stat:DDDDDDD err:E text: . . . . . . . . .
-        if 'short_message' in pdu.params:
-            patterns = [
-                r"id:(?P<id>[\dA-Za-z-_]+)",
-                r"sub:(?P<sub>\d{1,3})",
-                r"dlvrd:(?P<dlvrd>\d{1,3})",
-                r"submit date:(?P<sdate>\d+)",
-                r"done date:(?P<ddate>\d+)",
-                r"stat:(?P<stat>\w{7})",
-                r"err:(?P<err>\w{1,3})",
-                r"[tT]ext:(?P<text>.*)",
-            ]
-
-            # Look for patterns and compose return object
-            for pattern in patterns:
-                if isinstance(pdu.params['short_message'], bytes):
-                    m = re.search(pattern, pdu.params['short_message'].decode('utf-8', 'ignore'))
-                else:
-                    m = re.search(pattern, pdu.params['short_message'])
-                if m:
-                    key = list(m.groupdict())[0]
-                    if (key not in ['id', 'stat']
-                        or (key == 'id' and 'id' not in ret)
-                        or (key == 'stat' and 'stat' not in ret)):
-                        ret.update(m.groupdict())
+        # Fields are parsed with the connector's receipt format (see jasmin.protocols.smpp.receipts)
+        if 'short_message' in pdu.params and pdu.params['short_message'] is not None:
+            parser = getReceiptParser(getattr(self.config, 'dlr_receipt_format', 'standard'))
+            for key, value in parser.parse(pdu.params['short_message']).items():
+                if key not in ret or key not in ['id', 'stat']:
+                    ret[key] = value
 
         if ret['sub'] != 'ND' and len(ret['sub']) < 3:
             ret['sub'] = '{:0>3}'.format(ret['sub'])
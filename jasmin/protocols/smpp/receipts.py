@@ -0,0 +1,99 @@
+"""
+Delivery receipts content parsing
+
+Receipt fields are matched in one single pass over the content, each receipt format is
+compiled once into one alternation of its fields and SMPP client connectors select their
+format through the dlr_receipt_format setting.
+"""
+
+import re
+
+STAT_LENGTH = 7
+
+# Full length message states used by some vendors
+LONG_STATS = {
+    'DELIVERED': 'DELIVRD',
+    'ACCEPTED': 'ACCEPTD',
+    'UNDELIVERABLE': 'UNDELIV',
+    'UNDELIVERED': 'UNDELIV',
+    'REJECTED': 'REJECTD',
+}
+
+
+class DeliveryReceiptParser:
+    """Compiled delivery receipt format
+
+    fields is a list of (key, label pattern, value pattern), only the first match of each key
+    is kept, as if every field was searched separately in the content.
+    """
+
+    def __init__(self, fields, flags=0, long_stats=None):
+        alternatives = []
+        for key, label, value in fields:
+            if key == 'text':
+                # Text runs until the end of line and may contain other fields, it's captured
+                # without being consumed
+                alternatives.append('%s(?=(?P<%s>%s))' % (label, key, value))
+            else:
+                alternatives.append('%s(?P<%s>%s)' % (label, key, value))
+
+        self.regex = re.compile('|'.join(alternatives), flags)
+        self.fields_count = len(fields)
+        self.long_stats = long_stats
+
+    def parse(self, content):
+        """Return a dict of the fields found in content"""
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', 'ignore')
+
+        found = {}
+        for m in self.regex.finditer(content):
+            key = m.lastgroup
+            if key not in found:
+                found[key] = m.group(key)
+                if len(found) == self.fields_count:
+                    break
+
+        if self.long_stats is not None and 'stat' in found:
+            stat = found['stat'].upper()
+            found['stat'] = self.long_stats.get(stat, stat[:STAT_LENGTH])
+
+        return found
+
+
+# Example of standard receipt content
+# id:IIIIIIIIII sub:SSS dlvrd:DDD submit date:YYMMDDhhmm done
+# date:YYMMDDhhmm stat:DDDDDDD err:E text: . . . . . . . . .
+STANDARD_FIELDS = [
+    ('id', r'id:', r'[\dA-Za-z-_]+'),
+    ('sub', r'sub:', r'\d{1,3}'),
+    ('dlvrd', r'dlvrd:', r'\d{1,3}'),
+    ('sdate', r'submit date:', r'\d+'),
+    ('ddate', r'done date:', r'\d+'),
+    ('stat', r'stat:', r'\w{7}'),
+    ('err', r'err:', r'\w{1,3}'),
+    ('text', r'[tT]ext:', r'.*'),
+]
+
+# Variants seen from some vendors: upper case labels, blank after labels, submit_date/done_date
+# labels, dotted ids and full length states (DELIVERED, UNDELIVERABLE ...)
+LENIENT_FIELDS = [
+    ('id', r'id: ?', r'[\w.-]+'),
+    ('sub', r'sub: ?', r'\d{1,3}'),
+    ('dlvrd', r'dlvrd: ?', r'\d{1,3}'),
+    ('sdate', r'submit[ _]?date: ?', r'\d+'),
+    ('ddate', r'done[ _]?date: ?', r'\d+'),
+    ('stat', r'stat: ?', r'[A-Za-z]+'),
+    ('err', r'err: ?', r'\w{1,3}'),
+    ('text', r'text:', r'.*'),
+]
+
+RECEIPT_FORMATS = {
+    'standard': DeliveryReceiptParser(STANDARD_FIELDS),
+    'lenient': DeliveryReceiptParser(LENIENT_FIELDS, flags=re.IGNORECASE, long_stats=LONG_STATS),
+}
+
+
+def getReceiptParser(receipt_format):
+    """Return the parser of receipt_format, the standard one if unknown"""
+    return RECEIPT_FORMATS.get(receipt_format, RECEIPT_FORMATS['standard'])
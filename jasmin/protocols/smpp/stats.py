@@ -38,7 +38,9 @@ class ClientConnectorStatistics(ConnectorStatistics):
             "throttling_error_count": 0,
             "other_submit_error_count": 0,
             "interceptor_error_count": 0,
-            "interceptor_count": 0}
+            "interceptor_count": 0,
+            "submit_sm_window": 0,
+            "submit_sm_outstanding": 0}
 
     def getStats(self):
         return self._stats
@@ -0,0 +1,178 @@
+"""
+Wire format of AMQP message bodies and headers
+
+Two codecs are available:
+- pickle: the historical format, whole python objects are pickled
+- compact: SMPP PDUs are encoded with their SMPP binary encoding and bills with their billables
+  only, both prefixed by a small versioned header, PDUs carrying custom TLVs are still pickled
+
+loads() will read both formats, messages already sitting in the queues when switching the codec
+are still consumed.
+"""
+
+import json
+import pickle
+import struct
+from collections import namedtuple
+from io import BytesIO
+
+from smpp.pdu.pdu_encoding import PDUEncoder
+from smpp.pdu.pdu_types import PDU, DataCoding, DataCodingScheme
+
+from jasmin.routing.Bills import SubmitSmBill
+
+CODECS = ['pickle', 'compact']
+
+# Compact header: MAGIC, format version and kind of encoded object, MAGIC starts with a byte that
+# is not a pickle opcode, a compact message cannot be taken for a pickled one
+MAGIC = b'\x00J'
+VERSION = 1
+HEADER = struct.Struct('!2sBB')
+
+KIND_PDU = 1
+KIND_BILL = 2
+
+# PDU flags
+FLAG_NO_SEQNUM = 0x01
+FLAG_INT_DATA_CODING = 0x02
+
+_encoder = PDUEncoder()
+
+# Decoded bills are only carrying their user's uid
+BilledUser = namedtuple('BilledUser', ['uid'])
+
+
+class CodecError(ValueError):
+    """Raised when a message body cannot be decoded
+    """
+
+
+def _encode_pdu(pdu):
+    """Encode pdu and every PDU chained to it through nextPdu attribute
+
+    Each PDU is preceded by its flags and the list of its parameters set to None, these are
+    not kept by the SMPP encoding while Jasmin makes use of them (e.g.: source_addr is set to
+    the connector's default when None)
+    """
+    chunks = []
+    while pdu is not None:
+        if pdu.custom_tlvs:
+            # Custom TLVs are encoded but would be decoded as unknown optional parameters and
+            # dropped, the whole chain is pickled instead
+            raise ValueError('Cannot encode custom TLVs: %s' % pdu.custom_tlvs)
+
+        params = list(pdu.mandatoryParams) + list(pdu.optionalParams)
+        nones = bytes(i for i, name in enumerate(params) if name in pdu.params and pdu.params[name] is None)
+
+        flags = 0
+        extra = b''
+        seqNum = pdu.seqNum
+        data_coding = pdu.params.get('data_coding')
+        if seqNum is None:
+            flags |= FLAG_NO_SEQNUM
+        if isinstance(data_coding, int):
+            flags |= FLAG_INT_DATA_CODING
+            extra = struct.pack('!B', data_coding)
+
+        # The SMPP encoding requires a sequence number and a DataCoding instance, these are
+        # put back once pdu is encoded
+        try:
+            if flags & FLAG_NO_SEQNUM:
+                pdu.seqNum = 1
+            if flags & FLAG_INT_DATA_CODING:
+                pdu.params['data_coding'] = DataCoding(DataCodingScheme.RAW, data_coding)
+            encoded = _encoder.encode(pdu)
+        finally:
+            pdu.seqNum = seqNum
+            if flags & FLAG_INT_DATA_CODING:
+                pdu.params['data_coding'] = data_coding
+
+        chunks.append(struct.pack('!BB', flags, len(nones)) + nones + extra + encoded)
+        pdu = getattr(pdu, 'nextPdu', None)
+
+    return b''.join(chunks)
+
+
+def _decode_pdu(data):
+    stream = BytesIO(data)
+    first = previous = None
+    while stream.tell() < len(data):
+        flags, nones_count = struct.unpack('!BB', stream.read(2))
+        nones = stream.read(nones_count)
+        data_coding = None
+        if flags & FLAG_INT_DATA_CODING:
+            data_coding, = struct.unpack('!B', stream.read(1))
+
+        pdu = _encoder.decode(stream)
+        if flags & FLAG_NO_SEQNUM:
+            pdu.seqNum = None
+        if flags & FLAG_INT_DATA_CODING:
+            pdu.params['data_coding'] = data_coding
+        params = list(pdu.mandatoryParams) + list(pdu.optionalParams)
+        for i in nones:
+            pdu.params[params[i]] = None
+
+        if first is None:
+            first = pdu
+        else:
+            previous.nextPdu = pdu
+        previous = pdu
+
+    return first
+
+
+def _encode_bill(bill):
+    return json.dumps({
+        'type': bill.__class__.__name__,
+        'bid': bill.bid,
+        'uid': bill.user.uid,
+        'amounts': bill.amounts,
+        'actions': bill.actions}, separators=(',', ':')).encode()
+
+
+def _decode_bill(data):
+    values = json.loads(data.decode())
+    if values['type'] != SubmitSmBill.__name__:
+        raise CodecError('Unknown bill type: %s' % values['type'])
+
+    bill = SubmitSmBill(BilledUser(values['uid']))
+    bill.bid = values['bid']
+    bill.amounts = values['amounts']
+    bill.actions = values['actions']
+    return bill
+
+
+def dumps(obj, codec='pickle', pickleProtocol=pickle.HIGHEST_PROTOCOL):
+    """Serialize obj for publishing, PDUs and bills are encoded with the compact codec when
+    selected, any other object (or one the SMPP encoding rejects) is pickled"""
+    if codec == 'compact':
+        try:
+            if isinstance(obj, PDU):
+                return HEADER.pack(MAGIC, VERSION, KIND_PDU) + _encode_pdu(obj)
+            elif isinstance(obj, SubmitSmBill):
+                return HEADER.pack(MAGIC, VERSION, KIND_BILL) + _encode_bill(obj)
+        except Exception:
+            # e.g.: short_message longer than 254 bytes (concatenated deliver_sm) or custom TLVs
+            pass
+
+    return pickle.dumps(obj, pickleProtocol)
+
+
+def loads(data):
+    """Deserialize a message body or header, whatever the codec used to encode it"""
+    if data[:len(MAGIC)] != MAGIC:
+        return pickle.loads(data)
+
+    if len(data) < HEADER.size:
+        raise CodecError('Truncated compact message')
+    _, version, kind = HEADER.unpack_from(data)
+    if version != VERSION:
+        raise CodecError('Unsupported compact message version: %s' % version)
+
+    payload = data[HEADER.size:]
+    if kind == KIND_PDU:
+        return _decode_pdu(payload)
+    elif kind == KIND_BILL:
+        return _decode_bill(payload)
+    else:
+        raise CodecError('Unknown compact message kind: %s' % kind)
@@ -35,6 +35,10 @@ class AmqpConfig(ConfigFile):
         self.spec = self._get('amqp-broker', 'spec', '%s/amqp0-9-1.xml' % RESOURCE_PATH)
         self.heartbeat = self._getint('amqp-broker', 'heartbeat', 0)
 
+        # Wire format of published messages per exchange (pickle or compact), consumers
+        # are reading both formats
+        self.codecs = {'messaging': self._get('amqp-broker', 'messaging_codec', 'pickle')}
+
         # Logging
         self.log_level = logging.getLevelName(self._get('amqp-broker', 'log_level', 'INFO'))
         self.log_file = self._get('amqp-broker', 'log_file', '%s/amqp-client.log' % LOG_PATH)
@@ -50,6 +54,11 @@ class AmqpConfig(ConfigFile):
         self.reconnectOnConnectionFailureDelay = self._getint(
             'amqp-broker', 'connection_failure_retry_delay', 10)
 
+    def getCodec(self, exchange):
+        """Will return the codec to be used when publishing to exchange"""
+
+        return self.codecs.get(exchange, 'pickle')
+
     def getSpec(self):
         """Will return the specifications from self.spec file"""
 
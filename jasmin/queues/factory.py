@@ -167,6 +167,7 @@ class AmqpFactory(ClientFactory):
 
         self.chan = chan
         self.queues = []
+        self.last_channel_id = 1
 
         d = self.chan.channel_open()
         d.addCallback(self._channel_open)
@@ -180,6 +181,17 @@ class AmqpFactory(ClientFactory):
         self.connected = True
         self.channelReady.callback(self)
 
+    @defer.inlineCallbacks
+    def openChannel(self):
+        """Open and return a new channel, used by consumers acknowledging their messages in bulk
+        since delivery tags are scoped to the channel"""
+        self.last_channel_id += 1
+        chan = yield self.client.channel(self.last_channel_id)
+        yield chan.channel_open()
+        self.log.info("Opened channel %s", self.last_channel_id)
+
+        defer.returnValue(chan)
+
     def _channel_open_failed(self, error):
         self.log.error("Channel open failed: %s", error)
 
@@ -229,6 +241,20 @@ class AmqpFactory(ClientFactory):
 
         return self.chan.basic_publish(**args)
 
+    def publishBatch(self, exchange, messages):
+        """Publish a list of (routing_key, content) to exchange, messages are written at once
+        (without waiting for each publish) and in order, returns a deferred fired when all of
+        them are published"""
+
+        if not self.connected:
+            self.log.error("AMQP Client is not connected, cannot publish %s messages to %s",
+                           len(messages), exchange)
+            return None
+
+        return defer.gatherResults(
+            [self.chan.basic_publish(exchange=exchange, routing_key=routing_key, content=content)
+             for routing_key, content in messages], consumeErrors=True)
+
     def stopConnectionRetrying(self):
         """This will stop the factory from reconnecting
         It is used whenever a service stop has been requested, the connectionRetry flag
@@ -29,6 +29,10 @@ class RedisForJasminConfig(ConfigFile):
         self.dbid = self._getint('redis-client', 'dbid', '0')
         self.poolsize = self._getint('redis-client', 'poolsize', 10)
 
+        # DLR maps storage format: hash or compact (see jasmin.managers.dlrmap)
+        self.dlr_map_format = self._get('redis-client', 'dlr_map_format', 'hash')
+        self.dlr_map_dictionary_size = self._getint('redis-client', 'dlr_map_dictionary_size', 10000)
+
         self.log_level = logging.getLevelName(self._get('redis-client', 'log_level', 'INFO'))
         self.log_file = self._get('redis-client',
                                   'log_file', '%s/redis-client.log' % LOG_PATH)
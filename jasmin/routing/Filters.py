@@ -5,6 +5,7 @@ More info: http://docs.jasminsms.com/en/latest/routing/index.html
 
 import datetime
 
+from jasmin.routing.Indexes import compile_prefix_matcher
 from jasmin.routing.Routables import Routable
 from jasmin.routing.jasminApi import *
 from jasmin.tools.eval import CompiledNode
@@ -165,28 +166,58 @@ class SourceAddrFilter(Filter):
     def __init__(self, source_addr):
         Filter.__init__(self, source_addr=source_addr)
 
+        # Literal prefix patterns (like ^33\d+) are matched without the regex engine
+        self.prefix_matcher = compile_prefix_matcher(self.source_addr)
+
         self._repr = '<SA (src_addr=%s)>' % source_addr
         self._str = '%s:\nsource_addr = %s' % (self.__class__.__name__, source_addr)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['prefix_matcher']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.prefix_matcher = compile_prefix_matcher(self.source_addr)
+
     def match(self, routable):
         Filter.match(self, routable)
 
-        return False if self.source_addr.match(
-            routable.pdu.params['source_addr'].decode('utf-8', 'replace')) is None else True
+        source_addr = routable.pdu.params['source_addr'].decode('utf-8', 'replace')
+        if self.prefix_matcher is not None:
+            return self.prefix_matcher.match(source_addr)
+
+        return False if self.source_addr.match(source_addr) is None else True
 
 
 class DestinationAddrFilter(Filter):
     def __init__(self, destination_addr):
         Filter.__init__(self, destination_addr=destination_addr)
 
+        # Literal prefix patterns (like ^33\d+) are matched without the regex engine
+        self.prefix_matcher = compile_prefix_matcher(self.destination_addr)
+
         self._repr = '<DA (dst_addr=%s)>' % destination_addr
         self._str = '%s:\ndestination_addr = %s' % (self.__class__.__name__, destination_addr)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['prefix_matcher']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.prefix_matcher = compile_prefix_matcher(self.destination_addr)
+
     def match(self, routable):
         Filter.match(self, routable)
 
-        if self.destination_addr.match(
-                routable.pdu.params['destination_addr'].decode('utf-8', 'replace')) is None:
+        destination_addr = routable.pdu.params['destination_addr'].decode('utf-8', 'replace')
+        if self.prefix_matcher is not None:
+            return self.prefix_matcher.match(destination_addr)
+
+        if self.destination_addr.match(destination_addr) is None:
             return False
         else:
             return True
@@ -0,0 +1,239 @@
+"""
+Lookup indexes used by routing tables to avoid scanning every route for each routable.
+
+A RouteIndex is compiled from a routing table's ordered routes, every route is placed in exactly
+one bucket:
+
+  * a hash bucket when one of its filters is a UserFilter, GroupFilter, ConnectorFilter or TagFilter
+  * a prefix trie node when one of its filters is a DestinationAddrFilter or SourceAddrFilter with a
+    literal prefix, one trie is shared by all the routes for each address
+  * the unindexed bucket otherwise (TransparentFilter, EvalPyFilter, DefaultRoute ...)
+
+Looking up a routable will only collect the buckets it can possibly match, candidates are then
+verified with route.matchFilters() in table order, this will keep the first-match-by-order behaviour
+of the linear scan.
+"""
+
+import heapq
+import re
+
+
+class PrefixTrie:
+    """A character trie mapping literal prefixes to sorted lists of values"""
+
+    def __init__(self):
+        self.root = {}
+        self.size = 0
+
+    def add(self, prefix, value):
+        node = self.root
+        for c in prefix:
+            node = node.setdefault(c, {})
+        node.setdefault(None, []).append(value)
+        self.size += 1
+
+    def lookup(self, key):
+        """Return a list of value lists for every stored prefix of key"""
+        found = []
+        node = self.root
+        for c in key:
+            node = node.get(c)
+            if node is None:
+                break
+            if None in node:
+                found.append(node[None])
+
+        return found
+
+
+def _parse_literal_prefix(pattern):
+    """Parse the leading literal characters of a compiled pattern
+
+    Return a (prefix, rest) tuple where rest is the unparsed pattern source, None is returned when
+    the pattern cannot be safely parsed (alternations, case-insensitive or verbose patterns ...)
+    """
+    if not isinstance(pattern, re.Pattern) or not isinstance(pattern.pattern, str):
+        return None
+    if pattern.flags & re.IGNORECASE or pattern.flags & re.VERBOSE:
+        return None
+
+    source = pattern.pattern
+    if '|' in source:
+        return None
+
+    prefix = []
+    i = 1 if source.startswith('^') else 0
+    while i < len(source):
+        c = source[i]
+        if c.isascii() and c.isalnum():
+            prefix.append(c)
+            i += 1
+        elif c == '\\' and i + 1 < len(source) and source[i + 1].isascii() and not source[i + 1].isalnum():
+            prefix.append(source[i + 1])
+            i += 2
+        else:
+            break
+
+    return ''.join(prefix), source[i:]
+
+
+def literal_prefix(pattern):
+    """Return the literal prefix any string matching pattern (with re.match) must start with.
+
+    Return an empty string when no such prefix can be safely extracted from the pattern, parsing is
+    conservative: alternations and case-insensitive patterns are never considered.
+    """
+    parsed = _parse_literal_prefix(pattern)
+    if parsed is None:
+        return ''
+
+    prefix, rest = parsed
+    # Last literal is optional when followed by one of these quantifiers
+    if rest[:1] in ('?', '*', '{'):
+        return prefix[:-1]
+
+    return prefix
+
+
+class PrefixMatcher:
+    """Evaluate a literal prefix pattern (like ^99890\\d+) without running the regex engine"""
+
+    # Supported pattern tails following the literal prefix
+    TAILS = ('', r'.*', r'\d*', r'\d+', '$', r'\d*$', r'\d+$')
+
+    def __init__(self, prefix, tail):
+        self.prefix = prefix
+        self.tail = tail
+
+    def match(self, value):
+        """Return True if value is matched by the original pattern"""
+        if not value.startswith(self.prefix):
+            return False
+
+        tail = self.tail
+        if tail in ('', r'.*', r'\d*'):
+            return True
+
+        rest = value[len(self.prefix):]
+        if tail == r'\d+':
+            # \d is matching any unicode decimal character, like str.isdecimal()
+            return rest[:1].isdecimal()
+
+        # $ is matching at the end of the string or just before a trailing newline
+        if rest[-1:] == '\n':
+            rest = rest[:-1]
+        if tail == '$':
+            return rest == ''
+        if tail == r'\d*$':
+            return rest == '' or rest.isdecimal()
+        return rest.isdecimal()
+
+
+def compile_prefix_matcher(pattern):
+    """Return a PrefixMatcher equivalent to pattern.match or None if pattern is not a simple
+    literal prefix pattern"""
+    parsed = _parse_literal_prefix(pattern)
+    if parsed is None:
+        return None
+
+    prefix, rest = parsed
+    if rest not in PrefixMatcher.TAILS or prefix == '' and rest == '':
+        return None
+    if pattern.flags & re.MULTILINE:
+        return None
+
+    return PrefixMatcher(prefix, rest)
+
+
+class RouteIndex:
+    """Compiled index of an ordered routing table"""
+
+    def __init__(self, table):
+        self.routes = []
+        self.users = {}
+        self.groups = {}
+        self.connectors = {}
+        self.tags = {}
+        self.destination_addr = PrefixTrie()
+        self.source_addr = PrefixTrie()
+        self.unindexed = []
+
+        for position, r in enumerate(table):
+            route = list(r.values())[0]
+            self.routes.append(route)
+            self._index(route, position)
+
+    def _index(self, route, position):
+        """Put route position in its most selective bucket"""
+        # Avoid circular imports
+        from jasmin.routing.Filters import (UserFilter, GroupFilter, ConnectorFilter, TagFilter,
+                                            DestinationAddrFilter, SourceAddrFilter, EvalPyFilter)
+
+        # Filters are evaluated in order, filters following an EvalPyFilter are not considered
+        # since the latter may raise or have side effects
+        filters = []
+        for _filter in getattr(route, 'filters', []):
+            if isinstance(_filter, EvalPyFilter):
+                break
+            filters.append(_filter)
+
+        for _filter in filters:
+            if isinstance(_filter, UserFilter):
+                self.users.setdefault(_filter.user.uid, []).append(position)
+                return
+            elif isinstance(_filter, ConnectorFilter):
+                self.connectors.setdefault(_filter.connector.cid, []).append(position)
+                return
+            elif isinstance(_filter, GroupFilter):
+                self.groups.setdefault(_filter.group.gid, []).append(position)
+                return
+            elif isinstance(_filter, TagFilter):
+                self.tags.setdefault(_filter.tag, []).append(position)
+                return
+
+        for _filter in filters:
+            if isinstance(_filter, DestinationAddrFilter):
+                prefix = literal_prefix(_filter.destination_addr)
+                if prefix != '':
+                    self.destination_addr.add(prefix, position)
+                    return
+
+        for _filter in filters:
+            if isinstance(_filter, SourceAddrFilter):
+                prefix = literal_prefix(_filter.source_addr)
+                if prefix != '':
+                    self.source_addr.add(prefix, position)
+                    return
+
+        self.unindexed.append(position)
+
+    def candidates(self, routable):
+        """Return an iterator over the positions of routes that may match routable, in table order
+
+        Raise AttributeError, KeyError or TypeError when routable is missing some of the indexed
+        attributes (i.e. routed through a table of the wrong type)
+        """
+        buckets = [self.unindexed]
+
+        if self.users or self.groups:
+            user = routable.user
+            if user.uid in self.users:
+                buckets.append(self.users[user.uid])
+            if user.group.gid in self.groups:
+                buckets.append(self.groups[user.group.gid])
+        if self.connectors and routable.connector.cid in self.connectors:
+            buckets.append(self.connectors[routable.connector.cid])
+        if self.tags:
+            for tag in set(routable.getTags()):
+                if tag in self.tags:
+                    buckets.append(self.tags[tag])
+        if self.destination_addr.size > 0:
+            buckets.extend(self.destination_addr.lookup(
+                routable.pdu.params['destination_addr'].decode('utf-8', 'replace')))
+        if self.source_addr.size > 0:
+            buckets.extend(self.source_addr.lookup(
+                routable.pdu.params['source_addr'].decode('utf-8', 'replace')))
+
+        if len(buckets) == 1:
+            return iter(buckets[0])
+        return heapq.merge(*buckets)
@@ -2,6 +2,8 @@
 More info: http://docs.jasminsms.com/en/latest/interception/index.html
 """
 
+import copy
+
 from jasmin.routing.Interceptors import Interceptor
 from jasmin.routing.Routables import Routable
 
@@ -20,6 +22,13 @@ class InterceptionTable:
     def __init__(self):
         self.table = []
 
+    def snapshot(self):
+        """Return a copy to be serialized out of the reactor, the table is updated in place and
+        copied as well (interceptors are replaced, never updated)"""
+        _copy = copy.copy(self)
+        _copy.table = list(self.table)
+        return _copy
+
     def add(self, interceptor, order):
         if not isinstance(interceptor, Interceptor):
             raise InvalidInterceptionTableParameterError("interceptor is not an instance of Interceptor")
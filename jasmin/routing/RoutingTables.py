@@ -2,6 +2,9 @@
 More info: http://docs.jasminsms.com/en/latest/routing/index.html
 """
 
+import copy
+
+from jasmin.routing.Indexes import RouteIndex
 from jasmin.routing.Routables import Routable
 from jasmin.routing.Routes import Route
 
@@ -19,6 +22,24 @@ class RoutingTable:
 
     def __init__(self):
         self.table = []
+        self._index = None
+
+    def __getstate__(self):
+        """The compiled index is not persisted, it will be rebuilt on first lookup"""
+        state = self.__dict__.copy()
+        state['_index'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._index = None
+
+    def snapshot(self):
+        """Return a copy to be serialized out of the reactor, the table is updated in place and
+        copied as well (routes are replaced, never updated)"""
+        _copy = copy.copy(self)
+        _copy.table = list(self.table)
+        return _copy
 
     def add(self, route, order):
         if not isinstance(route, Route):
@@ -61,11 +82,13 @@ class RoutingTable:
 
         self.table.append({order: route})
         self.table = sorted(self.table, key=lambda x: sorted(x.keys()), reverse=True)
+        self._index = None
 
     def remove(self, order):
         for r in self.table:
             if list(r)[0] == order:
                 self.table.remove(r)
+                self._index = None
                 return True
 
         return False
@@ -75,6 +98,14 @@ class RoutingTable:
 
     def flush(self):
         self.table = []
+        self._index = None
+
+    def getIndex(self):
+        """Return the compiled RouteIndex, (re)building it if the table was updated"""
+        if self._index is None:
+            self._index = RouteIndex(self.table)
+
+        return self._index
 
     def getRouteFor(self, routable):
         """This will return the right route to send the routable to, None returned otherwise
@@ -83,8 +114,15 @@ class RoutingTable:
         if not isinstance(routable, Routable):
             raise InvalidRoutingTableParameterError("routable is not an instance of Routable")
 
-        for r in self.table:
-            route = list(r.values())[0]
+        index = self.getIndex()
+        try:
+            candidates = index.candidates(routable)
+        except (AttributeError, KeyError, TypeError):
+            # Routable cannot be looked up through the index, fallback to matching every route
+            candidates = range(len(index.routes))
+
+        for position in candidates:
+            route = index.routes[position]
             if route.matchFilters(routable):
                 return route
 
@@ -0,0 +1,147 @@
+"""
+Billing ledger of submit_sm_resp bill requests
+
+Bill requests are queued and applied in batches: charges of the same user are summed up and
+the user balance is updated once per batch, balance updates are journaled (see
+jasmin.routing.journal) and bill requests are settled once their journal entries are written.
+"""
+
+import logging
+from collections import OrderedDict
+
+from twisted.internet import defer, reactor
+
+from jasmin.tools.cache import LRUCache
+
+LOG_CATEGORY = "jasmin-router"
+
+
+class BillingLedger:
+    """
+    Bill requests are queued and applied every flush_interval seconds (or as soon as batch_size
+    requests are queued) through updateQuota(user, quota, difference, bids), settle(accepted,
+    rejected) is then called with the queued messages.
+
+    A bill request is rejected if its user is unknown or has not enough balance, a bill request
+    already charged (same bid) is accepted without charging it again.
+    """
+
+    def __init__(self, getUser, updateQuota, settle, journal=None, flush_interval=0.1, batch_size=1000,
+                 log=None):
+        self.getUser = getUser
+        self.updateQuota = updateQuota
+        self.settle = settle
+        self.journal = journal
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.log = log if log is not None else logging.getLogger(LOG_CATEGORY)
+
+        # Bids of the last charged bill requests, redelivered ones will not be charged twice
+        self.charged_bids = LRUCache(maxsize=max(batch_size * 10, 10000))
+
+        self.pending = []
+        self.timer = None
+        self.settling = defer.DeferredLock()
+        self.stats = {'charged': 0, 'rejected': 0, 'batches': 0}
+
+    def charge(self, uid, amount, bid, message=None):
+        """Queue a bill request"""
+        self.pending.append((str(uid), amount, bid, message))
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        elif self.timer is None or not self.timer.active():
+            self.timer = reactor.callLater(self.flush_interval, self.flush)
+
+    def getStats(self):
+        stats = dict(self.stats)
+        stats['queue_depth'] = len(self.pending)
+        return stats
+
+    def apply(self, charges):
+        """Apply charges, returns the messages of (accepted, rejected) ones"""
+        accepted, rejected = [], []
+
+        by_uid = OrderedDict()
+        for uid, amount, bid, message in charges:
+            by_uid.setdefault(uid, []).append((amount, bid, message))
+
+        for uid, user_charges in by_uid.items():
+            _user = self.getUser(uid)
+            if _user is None:
+                self.log.error("User [uid:%s] not found, billing requests %s rejected",
+                               uid, [bid for _, bid, _ in user_charges])
+                rejected.extend(message for _, _, message in user_charges)
+                continue
+
+            balance = _user.mt_credential.getQuota('balance')
+            total = 0
+            bids = []
+            user_accepted = []
+            for amount, bid, message in user_charges:
+                if bid in self.charged_bids:
+                    self.log.warning('Billing request [bid:%s] of user [uid:%s] already charged', bid, uid)
+                elif balance is not None and balance - total < amount:
+                    self.log.error(
+                        'User [uid:%s] have no sufficient balance (%s/%s) for this billing [bid:%s] request: '
+                        'rejected', uid, balance - total, amount, bid)
+                    rejected.append(message)
+                    continue
+                elif balance is not None:
+                    total += amount
+                    bids.append(bid)
+                user_accepted.append(message)
+
+            if total > 0:
+                try:
+                    self.updateQuota(_user, 'balance', -total, bids=bids)
+                except Exception as e:
+                    self.log.error('Cannot charge user [uid:%s] for billing requests %s, rejected: %s',
+                                   uid, bids, e)
+                    rejected.extend(user_accepted)
+                    continue
+
+                self.log.info('User [uid:%s] charged for amount: %s (bids:%s)', uid, total, bids)
+                for bid in bids:
+                    self.charged_bids.set(bid, True)
+
+            accepted.extend(user_accepted)
+
+        self.stats['charged'] += len(accepted)
+        self.stats['rejected'] += len(rejected)
+        self.stats['batches'] += 1
+        return accepted, rejected
+
+    def flush(self):
+        """Apply queued bill requests, returns a deferred fired when their messages are settled"""
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+        if len(self.pending) == 0:
+            return defer.succeed(None)
+
+        charges, self.pending = self.pending, []
+        accepted, rejected = self.apply(charges)
+
+        # Messages are settled in order (a batch may be acknowledged up to its last message) and
+        # once balance updates are journaled
+        d = self.journal.flush() if self.journal is not None else defer.succeed(True)
+        d.addCallback(lambda _: self.settling.run(self.settle, accepted, rejected))
+        d.addErrback(self.settleErrback)
+        return d
+
+    def settleErrback(self, error):
+        self.log.error('Error while settling billing requests: %s', error)
+
+    def addChargedBids(self, bids):
+        """Remember bids charged before a restart (see RouterPB's journal replay)"""
+        for bid in bids:
+            self.charged_bids.set(bid, True)
+
+    @defer.inlineCallbacks
+    def stop(self):
+        """Apply queued bill requests and wait for their settlement"""
+        yield self.flush()
+        yield self.settling.acquire()
+        self.settling.release()
@@ -31,6 +31,29 @@ class RouterPBConfig(ConfigFile):
 
         self.pickle_protocol = self._getint('router', 'pickle_protocol', 2)
 
+        # Successful user authentications are cached for auth_cache_seconds, the cache is
+        # bounded to auth_cache_max_keys entries (0 disables caching)
+        self.auth_cache_seconds = self._getint('router', 'auth_cache_seconds', 60)
+        self.auth_cache_max_keys = self._getint('router', 'auth_cache_max_keys', 50000)
+
+        # Bill requests are applied in batches every billing_flush_interval seconds (or as soon as
+        # billing_batch_size requests are queued)
+        self.billing_flush_interval = self._getfloat('router', 'billing_flush_interval', 0.1)
+        self.billing_batch_size = self._getint('router', 'billing_batch_size', 1000)
+
+        # Quota updates are journaled to store_path, users are persisted (and the journal
+        # compacted) when it's bigger than quotas_journal_max_size bytes or older than
+        # quotas_journal_compaction_secs
+        self.quotas_journal = self._getbool('router', 'quotas_journal', True)
+        self.quotas_journal_max_size = self._getint('router', 'quotas_journal_max_size', 1048576)
+        self.quotas_journal_compaction_secs = self._getint('router', 'quotas_journal_compaction_secs', 3600)
+
+        # Users are persisted as records (memory-mapped and decoded on access when loaded), the
+        # first users_load_batch_size users are loaded right away, the others in background; this
+        # is opt-in since previous releases cannot load users persisted as records
+        self.users_records_store = self._getbool('router', 'users_records_store', False)
+        self.users_load_batch_size = self._getint('router', 'users_load_batch_size', 1000)
+
         # Logging
         self.log_level = logging.getLevelName(self._get('router', 'log_level', 'INFO'))
         self.log_rotate = self._get('router', 'log_rotate', 'W6')
@@ -50,6 +73,19 @@ class deliverSmThrowerConfig(ConfigFile):
         self.retry_delay = self._getint('deliversm-thrower', 'retry_delay', 30)
         self.max_retries = self._getint('deliversm-thrower', 'max_retries', 3)
 
+        # Http connections pooling
+        self.http_persistent_connections = self._getbool('deliversm-thrower', 'http_persistent_connections', True)
+        self.http_max_persistent_per_host = self._getint('deliversm-thrower', 'http_max_persistent_per_host', 20)
+        self.http_idle_timeout = self._getint('deliversm-thrower', 'http_idle_timeout', 60)
+
+        # Concurrency
+        self.concurrency = self._getint('deliversm-thrower', 'concurrency', 10)
+        self.prefetch_count = self._getint('deliversm-thrower', 'prefetch_count', 10 * self.concurrency)
+        self.max_inflight_per_destination = self._getint(
+            'deliversm-thrower', 'max_inflight_per_destination', max(1, self.concurrency // 2))
+        self.max_waiting_per_destination = self._getint(
+            'deliversm-thrower', 'max_waiting_per_destination', 5 * self.concurrency)
+
         # Logging
         self.log_level = logging.getLevelName(self._get('deliversm-thrower', 'log_level', 'INFO'))
         self.log_file = self._get(
@@ -70,6 +106,19 @@ class DLRThrowerConfig(ConfigFile):
         self.retry_delay = self._getint('dlr-thrower', 'retry_delay', 30)
         self.max_retries = self._getint('dlr-thrower', 'max_retries', 3)
 
+        # Http connections pooling
+        self.http_persistent_connections = self._getbool('dlr-thrower', 'http_persistent_connections', True)
+        self.http_max_persistent_per_host = self._getint('dlr-thrower', 'http_max_persistent_per_host', 20)
+        self.http_idle_timeout = self._getint('dlr-thrower', 'http_idle_timeout', 60)
+
+        # Concurrency
+        self.concurrency = self._getint('dlr-thrower', 'concurrency', 10)
+        self.prefetch_count = self._getint('dlr-thrower', 'prefetch_count', 10 * self.concurrency)
+        self.max_inflight_per_destination = self._getint(
+            'dlr-thrower', 'max_inflight_per_destination', max(1, self.concurrency // 2))
+        self.max_waiting_per_destination = self._getint(
+            'dlr-thrower', 'max_waiting_per_destination', 5 * self.concurrency)
+
         # #139: need configuration to send deliver_sm instead of data_sm for SMPP delivery receipt
         # 20150521: it seems better to get deliver_sm the default pdu for receipts
         self.dlr_pdu = self._get('dlr-thrower', 'dlr_pdu', 'deliver_sm')
@@ -3,6 +3,7 @@ A set of objects used by Jasmin to manage users, groups and connectors in memory
 """
 
 import re
+import copy
 from hashlib import md5
 
 from jasmin.tools.singleton import Singleton
@@ -99,6 +100,14 @@ class CredentialGeneric(jasminApiGeneric):
 
         return self.quotas[key]
 
+    def snapshot(self):
+        """Return a copy to be serialized out of the reactor, dicts are updated in place and
+        copied as well"""
+        _copy = copy.copy(self)
+        for attr in ['authorizations', 'value_filters', 'defaults', 'quotas']:
+            setattr(_copy, attr, dict(getattr(self, attr)))
+        return _copy
+
 
 class MtMessagingCredential(CredentialGeneric):
     """Credential set for sending MT Messages through"""
@@ -290,6 +299,13 @@ class User(jasminApiGeneric):
         if self.smpps_credential is None:
             self.smpps_credential = SmppsCredential()
 
+    def snapshot(self):
+        """Return a copy to be serialized out of the reactor"""
+        _copy = copy.copy(self)
+        _copy.mt_credential = self.mt_credential.snapshot()
+        _copy.smpps_credential = self.smpps_credential.snapshot()
+        return _copy
+
     def getCnxStatus(self):
         """CnxStatus is a singleton which is not persisted to disk,
         this will resolve the reported issue #207."""
@@ -0,0 +1,140 @@
+"""
+Journal of users quota updates
+
+Quota updates (balance charges, submit_sm_count decrements ...) are appended to a journal as
+deltas instead of persisting all the users, the journal is written and synced to disk in a
+thread; it's compacted whenever the users are persisted (snapshot), each snapshot is holding the
+sequence number of the last journal entry it's including.
+"""
+
+import json
+import logging
+import os
+import time
+
+from twisted.internet import defer, threads
+
+LOG_CATEGORY = "jasmin-router"
+
+
+class QuotasJournal:
+    """
+    Append-only journal, one json line per quota update:
+    {"seq": ..., "uid": ..., "cred": ..., "quota": ..., "delta": ..., "at": ...}
+
+    Entries are buffered by append() and written by flush(), writes and compactions are run in
+    a thread one at a time and in order.
+    """
+
+    def __init__(self, path, max_size=1048576, compaction_secs=3600, log=None):
+        self.path = path
+        self.max_size = max_size
+        self.compaction_secs = compaction_secs
+        self.log = log if log is not None else logging.getLogger(LOG_CATEGORY)
+
+        self.pending = []
+        self.lock = defer.DeferredLock()
+        self.size = 0
+        self.compacted_at = time.monotonic()
+        # Set when a write failed, a snapshot is then required
+        self.failed = False
+
+        entries = self.read()
+        self.seq = entries[-1]['seq'] if len(entries) > 0 else 0
+        if len(entries) > 0:
+            self.size = os.path.getsize(self.path)
+
+    def resume(self, seq):
+        """Continue numbering after seq, the journal is empty after a compaction and entries
+        must still follow the sequence number of the snapshot holding them"""
+        self.seq = max(self.seq, seq)
+
+    def append(self, entry):
+        """Buffer an entry, returns its sequence number"""
+        self.seq += 1
+        entry['seq'] = self.seq
+        entry['at'] = time.time()
+        self.pending.append(entry)
+        return self.seq
+
+    def needsCompaction(self):
+        if self.failed or self.size > self.max_size:
+            return True
+        return self.size > 0 and time.monotonic() - self.compacted_at > self.compaction_secs
+
+    def _write(self, data):
+        with open(self.path, 'a') as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        return os.path.getsize(self.path)
+
+    @defer.inlineCallbacks
+    def _flush(self):
+        if len(self.pending) == 0:
+            defer.returnValue(True)
+
+        entries, self.pending = self.pending, []
+        data = ''.join('%s\n' % json.dumps(entry) for entry in entries)
+        try:
+            self.size = yield threads.deferToThread(self._write, data)
+        except Exception as e:
+            self.log.error('Cannot write quotas journal %s (%s), users will be persisted: %s',
+                           self.path, type(e), e)
+            self.failed = True
+            defer.returnValue(False)
+
+        defer.returnValue(True)
+
+    def flush(self):
+        """Write buffered entries, returns a deferred fired with False if they cannot be written"""
+        return self.lock.run(self._flush)
+
+    def _truncate(self, seq):
+        """Rewrite the journal without entries up to seq"""
+        kept = [entry for entry in self.read() if entry['seq'] > seq]
+        tmp_path = '%s.tmp' % self.path
+        with open(tmp_path, 'w') as fh:
+            fh.write(''.join('%s\n' % json.dumps(entry) for entry in kept))
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp_path, self.path)
+        return os.path.getsize(self.path)
+
+    @defer.inlineCallbacks
+    def _compact(self, seq):
+        self.pending = [entry for entry in self.pending if entry['seq'] > seq]
+        try:
+            self.size = yield threads.deferToThread(self._truncate, seq)
+        except Exception as e:
+            self.log.error('Cannot compact quotas journal %s (%s): %s', self.path, type(e), e)
+        else:
+            self.failed = False
+            self.compacted_at = time.monotonic()
+
+    def compact(self, seq):
+        """Drop entries up to seq, they're included in a snapshot"""
+        return self.lock.run(self._compact, seq)
+
+    def read(self, after_seq=0):
+        """Return written entries following after_seq, a partially written last line is ignored"""
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+
+        with open(self.path) as fh:
+            for line in fh:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    self.log.warning('Ignoring invalid quotas journal line in %s: %r', self.path, line)
+                    continue
+
+                if entry['seq'] > after_seq:
+                    entries.append(entry)
+
+        return entries
+
+    def stop(self):
+        """Write buffered entries and wait for pending writes"""
+        return self.flush()
@@ -1,25 +1,38 @@
 import pickle
+import re
 import sys
 import logging
 import time
 from copy import copy
+from functools import partial
 from hashlib import md5
 from logging.handlers import TimedRotatingFileHandler
 
-from twisted.internet import defer, reactor
+from twisted.internet import defer, reactor, task
 from twisted.spread import pb
 from txamqp.queue import Closed
 
 import jasmin
+from jasmin.routing.billing import BillingLedger
 from jasmin.routing.InterceptionTables import (MOInterceptionTable,
                                                MTInterceptionTable,
                                                InvalidInterceptionTableParameterError)
 from jasmin.routing.RoutingTables import MORoutingTable, MTRoutingTable, InvalidRoutingTableParameterError
+from jasmin.routing.journal import QuotasJournal
 from jasmin.routing.content import RoutedDeliverSmContent
+from jasmin.tools.cache import LRUCache
 from jasmin.tools.migrations.configuration import ConfigurationMigrator
+from jasmin.tools.stats import ComponentsStatsCollector
+from jasmin.tools.store import RecordsStore, StoreWriter, dumpRecordsSnapshot, dumpSnapshot
 
 LOG_CATEGORY = "jasmin-router"
 
+# Profile persisted by persistenceTimer, quota updates are journaled for this profile only
+JOURNAL_PROFILE = 'jcli-prod'
+
+# Users snapshots are holding the sequence number of the last journal entry they're including
+_REGEX_JOURNAL_SEQ = re.compile(r'journal:(?P<seq>\d+)')
+
 
 class RouterPB(pb.Avatar):
     def __init__(self, RouterPBConfig, persistenceTimer=True):
@@ -50,10 +63,44 @@ class RouterPB(pb.Avatar):
         self.users = []
         self.groups = []
 
+        # Lookup indexes of users and groups, they are updated in place by perspective_* calls and
+        # must be rebuilt by indexUsers() and indexGroups() when self.users or self.groups are
+        # replaced or updated elsewhere
+        self.users_by_uid = {}
+        self.users_by_username = {}
+        self.groups_by_gid = {}
+
+        # Users records store being loaded (see perspective_load), pending users are decoded on
+        # access or by the background users_loader
+        self.users_store = None
+        self.users_migrator = None
+        self.users_loader = None
+
+        # Cache of successful credential checks: username -> (hashed password, user), evicted
+        # whenever the user is replaced or removed
+        self.auth_cache = LRUCache(self.config.auth_cache_max_keys, self.config.auth_cache_seconds)
+
         # Init interception-related objects
         self.mo_interception_table = MOInterceptionTable()
         self.mt_interception_table = MTInterceptionTable()
 
+        # Quota updates are journaled instead of persisting all the users
+        self.quotas_journal = None
+        if self.config.quotas_journal:
+            self.quotas_journal = QuotasJournal(
+                '%s/%s.router-users-journal' % (self.config.store_path, JOURNAL_PROFILE),
+                max_size=self.config.quotas_journal_max_size,
+                compaction_secs=self.config.quotas_journal_compaction_secs,
+                log=self.log)
+
+        # Bill requests are applied in batches
+        self.billing_chan = None
+        self.billing_ledger = BillingLedger(self.getUser, self.updateUserQuota, self.settleBillRequests,
+                                            self.quotas_journal,
+                                            flush_interval=self.config.billing_flush_interval,
+                                            batch_size=self.config.billing_batch_size,
+                                            log=self.log)
+
         if persistenceTimer:
             # Activate persistenceTimer, used for persisting users and groups whenever critical updates
             # occured
@@ -62,6 +109,10 @@ class RouterPB(pb.Avatar):
         # Persistence flag, accessed through perspective_is_persisted
         self.persistenceState = {'users': True, 'groups': True, 'moroutes': True, 'mtroutes': True}
 
+        # Configuration snapshots are written to disk in a thread
+        self.store_writer = StoreWriter(self.log)
+        ComponentsStatsCollector().register('store', 'router', self.store_writer.getStats)
+
         self.log.info('Router configured and ready.')
 
     def setAvatar(self, avatar):
@@ -94,14 +145,16 @@ class RouterPB(pb.Avatar):
         self.deliver_sm_q.get().addCallback(self.deliver_sm_callback).addErrback(self.deliver_sm_errback)
         self.log.info('RouterPB is consuming from routing key: %s', routingKey)
 
-        # Subscribe to bill_request.submit_sm_resp.* queues
-        yield self.amqpBroker.chan.exchange_declare(exchange='billing', type='topic')
+        # Subscribe to bill_request.submit_sm_resp.* queues, through a dedicated channel since
+        # bill requests are acknowledged in bulk
+        self.billing_chan = yield self.amqpBroker.openChannel()
+        yield self.billing_chan.exchange_declare(exchange='billing', type='topic')
         consumerTag = 'RouterPB-billrequests'
         routingKey = 'bill_request.submit_sm_resp.*'
         queueName = 'RouterPB_bill_request_submit_sm_resp_all'  # A local queue to RouterPB
         yield self.amqpBroker.named_queue_declare(queue=queueName)
-        yield self.amqpBroker.chan.queue_bind(queue=queueName, exchange="billing", routing_key=routingKey)
-        yield self.amqpBroker.chan.basic_consume(queue=queueName, no_ack=False, consumer_tag=consumerTag)
+        yield self.billing_chan.queue_bind(queue=queueName, exchange="billing", routing_key=routingKey)
+        yield self.billing_chan.basic_consume(queue=queueName, no_ack=False, consumer_tag=consumerTag)
         self.bill_request_submit_sm_resp_q = yield self.amqpBroker.client.queue(consumerTag)
         self.bill_request_submit_sm_resp_q.get().addCallback(
             self.bill_request_submit_sm_resp_callback).addErrback(
@@ -137,19 +190,62 @@ class RouterPB(pb.Avatar):
         'This is run every self.config.persistence_timer_secs seconds'
         self.log.debug('persistenceTimerExpired called')
 
-        # If at least one user have its quotas updated, then persist
-        # groups and users to disk
-        for u in self.users:
-            if u.mt_credential.quotas_updated:
-                self.log.info('Detected a user quota update, users and groups will be persisted.')
-                self.perspective_persist(scope='groups')
-                self.perspective_persist(scope='users')
-                u.mt_credential.quotas_updated = False
-                self.log.debug('Persisted successfully')
-                break
+        if self.quotas_journal is not None:
+            self.quotas_journal.flush()
+
+        # If at least one user have its quotas updated (and not journaled) or if the journal
+        # must be compacted, then persist groups and users to disk
+        if self.quotas_journal is not None and self.quotas_journal.needsCompaction():
+            self.log.info('Quotas journal will be compacted, users and groups will be persisted.')
+            self.perspective_persist(scope='groups')
+            self.perspective_persist(scope='users')
+            self.log.debug('Persisted successfully')
+        else:
+            for u in self.users:
+                if u.mt_credential.quotas_updated:
+                    self.log.info('Detected a user quota update, users and groups will be persisted.')
+                    self.perspective_persist(scope='groups')
+                    self.perspective_persist(scope='users')
+                    u.mt_credential.quotas_updated = False
+                    self.log.debug('Persisted successfully')
+                    break
 
         self.activatePersistenceTimer()
 
+    def updateUserQuota(self, _user, quota, difference, cred='mt_credential', bids=None):
+        """Update a user quota, the update is journaled (if enabled) instead of flagging the user
+        for persistence"""
+        _cred = getattr(_user, cred)
+        quotas_updated = _cred.quotas_updated
+        _cred.updateQuota(quota, difference)
+
+        if self.quotas_journal is not None:
+            _cred.quotas_updated = quotas_updated
+            entry = {'uid': str(_user.uid), 'cred': cred, 'quota': quota, 'delta': difference}
+            if bids:
+                entry['bids'] = bids
+            self.quotas_journal.append(entry)
+
+    def replayQuotasJournal(self, seq):
+        """Apply quota updates journaled after users snapshot seq"""
+        self.quotas_journal.resume(seq)
+        entries = self.quotas_journal.read(after_seq=seq)
+        for entry in entries:
+            _user = self.getUser(entry['uid'])
+            if _user is None:
+                self.log.warning('Cannot replay journaled quota update of unknown user [uid:%s]', entry['uid'])
+                continue
+
+            getattr(_user, entry['cred']).updateQuota(entry['quota'], entry['delta'])
+            self.billing_ledger.addChargedBids(entry.get('bids', []))
+
+        # Restored updates are kept in journal until the next snapshot
+        for u in self.users:
+            u.mt_credential.quotas_updated = False
+
+        if len(entries) > 0:
+            self.log.info('Replayed %d quota updates from journal %s', len(entries), self.quotas_journal.path)
+
     @defer.inlineCallbacks
     def deliver_sm_callback(self, message):
         """This callback is a queue listener
@@ -213,7 +309,8 @@ class RouterPB(pb.Avatar):
                 yield self.ackMessage(message)
 
                 # Enqueue DeliverSm for delivery through publishing it to deliver_sm_thrower.(type)
-                content = RoutedDeliverSmContent(routable.pdu, msgid, scid, routedConnectors, route_type)
+                content = RoutedDeliverSmContent(routable.pdu, msgid, scid, routedConnectors, route_type,
+                                                 codec=self.amqpBroker.config.getCodec('messaging'))
                 self.log.debug("Publishing RoutedDeliverSmContent [msgid:%s] in deliver_sm_thrower.%s",
                                msgid, routedConnectors[0]._type)
                 yield self.amqpBroker.publish(exchange='messaging', routing_key='deliver_sm_thrower.%s' %
@@ -232,9 +329,9 @@ class RouterPB(pb.Avatar):
             # - an error has occured inside deliver_sm_callback
             self.log.error("Error in deliver_sm_errback: %s", error)
 
-    @defer.inlineCallbacks
     def bill_request_submit_sm_resp_callback(self, message):
-        """This callback is a queue listener
+        """This callback is a queue listener, bill requests are charged in batches by
+        billing_ledger then settled by settleBillRequests()
         """
         bid = message.content.properties['message-id']
         amount = float(message.content.properties['headers']['amount'])
@@ -246,20 +343,18 @@ class RouterPB(pb.Avatar):
             self.bill_request_submit_sm_resp_callback).addErrback(
             self.bill_request_submit_sm_resp_errback)
 
-        _user = self.getUser(uid)
-        if _user is None:
-            self.log.error("User [uid:%s] not found, billing request [bid:%s] rejected", uid, bid)
-            yield self.rejectMessage(message)
-        elif _user.mt_credential.getQuota('balance') is not None:
-            if _user.mt_credential.getQuota('balance') < amount:
-                self.log.error(
-                    'User [uid:%s] have no sufficient balance (%s/%s) for this billing [bid:%s] request: rejected',
-                    uid, _user.mt_credential.getQuota('balance'), amount, bid)
-                yield self.rejectMessage(message)
-            else:
-                _user.mt_credential.updateQuota('balance', -amount)
-                self.log.info('User [uid:%s] charged for amount: %s (bid:%s)', uid, amount, bid)
-                yield self.ackMessage(message)
+        self.billing_ledger.charge(uid, amount, bid, message)
+
+    @defer.inlineCallbacks
+    def settleBillRequests(self, accepted, rejected):
+        """Reject bill requests one by one and acknowledge accepted ones at once"""
+        for message in rejected:
+            yield self.billing_chan.basic_reject(delivery_tag=message.delivery_tag, requeue=0)
+
+        if len(accepted) > 0:
+            # Bill requests are consumed in order: all the ones preceding the last accepted are
+            # either accepted or already rejected
+            yield self.billing_chan.basic_ack(delivery_tag=max(m.delivery_tag for m in accepted), multiple=True)
 
     def bill_request_submit_sm_resp_errback(self, error):
         """It appears that when closing a queue with the close() method it errbacks with
@@ -286,32 +381,133 @@ class RouterPB(pb.Avatar):
     def getMTRoutingTable(self):
         return self.mt_routing_table
 
+    def indexUsers(self):
+        """(Re)build users lookup indexes, must be called whenever self.users is replaced"""
+        self.users_by_uid = {}
+        self.users_by_username = {}
+        for _user in self.users:
+            self.indexUser(_user)
+
+        self.auth_cache.clear()
+
+    def indexUser(self, _user):
+        """Add a user appended to self.users to lookup indexes"""
+        self.users_by_uid.setdefault(str(_user.uid), _user)
+        self.users_by_username.setdefault(_user.username, []).append(_user)
+
+    def unindexUser(self, _user):
+        """Remove a user removed from self.users from lookup indexes and authentications cache"""
+        if self.users_by_uid.get(str(_user.uid)) is _user:
+            del self.users_by_uid[str(_user.uid)]
+
+        _users = [u for u in self.users_by_username.get(_user.username, []) if u is not _user]
+        if len(_users) > 0:
+            self.users_by_username[_user.username] = _users
+        else:
+            self.users_by_username.pop(_user.username, None)
+
+        self.auth_cache.pop(_user.username)
+
+    def indexGroups(self):
+        """(Re)build groups lookup index, must be called whenever self.groups is replaced"""
+        self.groups_by_gid = {}
+        for _group in self.groups:
+            self.groups_by_gid.setdefault(str(_group.gid), _group)
+
+    def getUsersByUsername(self, username):
+        """Return the list of users having the given username"""
+        if self.users_store is not None:
+            for uid in self.users_store.keysByName(username):
+                self.loadUserRecord(uid)
+
+        return self.users_by_username.get(username, [])
+
+    def loadUserRecord(self, uid):
+        """Decode and migrate a pending user of the users records store, returns None if the user
+        is not pending"""
+        if self.users_store is None or uid not in self.users_store:
+            return None
+
+        _user = self.users_migrator.getMigratedRecord(self.users_store.pop(uid))
+        _user.mt_credential.quotas_updated = False
+
+        self.users.append(_user)
+        self.indexUser(_user)
+
+        return _user
+
+    def loadPendingUsers(self):
+        """Load pending users by batches, used with task.cooperate()"""
+        while self.users_store is not None and len(self.users_store) > 0:
+            for uid in self.users_store.keys(self.config.users_load_batch_size):
+                self.loadUserRecord(uid)
+            yield None
+
+    def pendingUsersLoaded(self, _):
+        self.users_loader = None
+        self.closeUsersStore()
+
+    def finishUsersLoading(self):
+        """Load all pending users, must be called before iterating over self.users (a single user
+        is loaded through getUser() or getUsersByUsername())"""
+        if self.users_store is None:
+            return
+
+        for uid in self.users_store.keys():
+            self.loadUserRecord(uid)
+        self.closeUsersStore()
+
+    def closeUsersStore(self):
+        """Stop loading users, pending ones are dropped"""
+        if self.users_loader is not None:
+            self.users_loader.stop()
+            self.users_loader = None
+
+        if self.users_store is not None:
+            self.log.info('Loaded Users (%d) from %s, %d dropped', len(self.users), self.users_store.path,
+                          len(self.users_store))
+            self.users_store.close()
+            self.users_store = None
+            self.users_migrator = None
+
     def authenticateUser(self, username, password, return_pickled=False):
         """Authenticate a user agains username and password and return user object or None
         """
-        # Find user having correct username/password
-        for _user in self.users:
-            if _user.username == username and _user.password == md5(password.encode('ascii')).digest():
-                self.log.debug('authenticateUser [username:%s] returned a User', username)
-
-                # Check if user's group is enabled
-                _group = self.getGroup(_user.group.gid)
-                if _group is not None and not _group.enabled:
-                    self.log.info('authenticateUser [username:%s] returned None (group %s is disabled)',
-                                  username, _user.group)
-                    return None
-
-                # Check if user is enabled
-                if not _user.enabled:
-                    self.log.info('authenticateUser [username:%s] returned None (user is disabled)',
-                                  username)
-                    return None
-
-                # If user/group are enabled:
-                if return_pickled:
-                    return pickle.dumps(_user, self.pickleProtocol)
-                else:
-                    return _user
+        # Find user having correct username/password, plaintext passwords are not kept in the cache
+        # and users are checked for being enabled (with their group) whether they are cached or not
+        password = md5(password.encode('ascii')).digest()
+        _user = None
+        cached = self.auth_cache.get(username)
+        if cached is not None and cached[0] == password:
+            _user = cached[1]
+        else:
+            for _candidate in self.getUsersByUsername(username):
+                if _candidate.password == password:
+                    _user = _candidate
+                    self.auth_cache.set(username, (password, _user))
+                    break
+
+        if _user is not None:
+            self.log.debug('authenticateUser [username:%s] returned a User', username)
+
+            # Check if user's group is enabled
+            _group = self.getGroup(_user.group.gid)
+            if _group is not None and not _group.enabled:
+                self.log.info('authenticateUser [username:%s] returned None (group %s is disabled)',
+                              username, _user.group)
+                return None
+
+            # Check if user is enabled
+            if not _user.enabled:
+                self.log.info('authenticateUser [username:%s] returned None (user is disabled)',
+                              username)
+                return None
+
+            # If user/group are enabled:
+            if return_pickled:
+                return pickle.dumps(_user, self.pickleProtocol)
+            else:
+                return _user
 
         self.log.info('authenticateUser [username:%s] returned None', username)
         return None
@@ -342,7 +538,7 @@ class RouterPB(pb.Avatar):
                               user.uid, _user.mt_credential.getQuota('balance'),
                               bill.getAmount('submit_sm') * submit_sm_count)
                 return None
-            _user.mt_credential.updateQuota('balance', -(bill.getAmount('submit_sm') * submit_sm_count))
+            self.updateUserQuota(_user, 'balance', -(bill.getAmount('submit_sm') * submit_sm_count))
             self.log.info('User [uid:%s] charged for submit_sm amount: %s',
                           user.uid, bill.getAmount('submit_sm') * submit_sm_count)
         # Decrement counts
@@ -354,7 +550,8 @@ class RouterPB(pb.Avatar):
                               user.uid, _user.mt_credential.getQuota('submit_sm_count'),
                               bill.getAction('decrement_submit_sm_count') * submit_sm_count)
                 return None
-            _user.mt_credential.updateQuota(
+            self.updateUserQuota(
+                _user,
                 'submit_sm_count',
                 -(bill.getAction('decrement_submit_sm_count') * submit_sm_count))
             self.log.info('User\'s [uid:%s] submit_sm_count decremented for submit_sm: %s',
@@ -363,22 +560,20 @@ class RouterPB(pb.Avatar):
         return True
 
     def getUser(self, uid):
-        for _user in self.users:
-            if str(_user.uid) == str(uid):
-                self.log.debug('getUser [uid:%s] returned a User', uid)
-                return _user
+        _user = self.users_by_uid.get(str(uid))
+        if _user is None and self.users_store is not None:
+            _user = self.loadUserRecord(str(uid))
+        if _user is None:
+            self.log.debug('getUser [uid:%s] returned None', uid)
 
-        self.log.debug('getUser [uid:%s] returned None', uid)
-        return None
+        return _user
 
     def getGroup(self, gid):
-        for _group in self.groups:
-            if str(_group.gid) == str(gid):
-                self.log.debug('getGroup [gid:%s] returned a Group', gid)
-                return _group
+        _group = self.groups_by_gid.get(str(gid))
+        if _group is None:
+            self.log.debug('getGroup [gid:%s] returned None', gid)
 
-        self.log.debug('getGroup [gid:%s] returned None', gid)
-        return None
+        return _group
 
     def getMOInterceptor(self, order):
         mointerceptors = self.mo_interception_table.getAll()
@@ -431,110 +626,85 @@ class RouterPB(pb.Avatar):
         return jasmin.get_version()
 
     def perspective_persist(self, profile='jcli-prod', scope='all'):
+        """Persist configuration to disk, returns a deferred fired with True once written
+
+        Configuration is copied right away (a consistent snapshot), it's then pickled and files
+        written in a thread by self.store_writer"""
+        files = []
+        scopes = []
+        updated_users = []
+        journal_seq = None
         try:
-            if scope in ['all', 'groups']:
-                # Persist groups configuration
-                path = '%s/%s.router-groups' % (self.config.store_path, profile)
-                self.log.info('Persisting current Groups configuration to [%s] profile in %s',
-                              profile, path)
-
-                fh = open(path, 'wb')
-                # Write configuration with datetime stamp
-                fh.write(
-                    ('Persisted on %s [Jasmin %s]\n' % (time.strftime("%c"), jasmin.get_release())).encode('ascii'))
-                fh.write(pickle.dumps(self.groups, self.pickleProtocol))
-                fh.close()
-
-                # Set persistance state to True
-                self.persistenceState['groups'] = True
-
             if scope in ['all', 'users']:
-                # Persist users configuration
-                path = '%s/%s.router-users' % (self.config.store_path, profile)
-                self.log.info('Persisting current Users configuration to [%s] profile in %s',
-                              profile, path)
-
-                fh = open(path, 'wb')
-                # Write configuration with datetime stamp
-                fh.write(
-                    ('Persisted on %s [Jasmin %s]\n' % (time.strftime("%c"), jasmin.get_release())).encode('ascii'))
-                fh.write(pickle.dumps(self.users, self.pickleProtocol))
-                fh.close()
-
-                # Set persistance state to True
-                self.persistenceState['users'] = True
+                self.finishUsersLoading()
+
+            header = 'Persisted on %s [Jasmin %s]' % (time.strftime("%c"), jasmin.get_release())
+            for _scope, title, data in [
+                    ('groups', 'Groups configuration', self.groups),
+                    ('users', 'Users configuration', self.users),
+                    ('moroutes', 'MORoutingTable', self.mo_routing_table),
+                    ('mtroutes', 'MTRoutingTable', self.mt_routing_table),
+                    ('mointerceptors', 'MOInterceptionTable', self.mo_interception_table),
+                    ('mtinterceptors', 'MTInterceptionTable', self.mt_interception_table)]:
+                if scope not in ['all', _scope]:
+                    continue
+
+                path = '%s/%s.router-%s' % (self.config.store_path, profile, _scope)
+                self.log.info('Persisting current %s to [%s] profile in %s', title, profile, path)
+
+                _header = header
+                if _scope == 'users' and profile == JOURNAL_PROFILE and self.quotas_journal is not None:
+                    # Snapshot is including all the journaled quota updates
+                    journal_seq = self.quotas_journal.seq
+                    _header += ' journal:%d' % journal_seq
+
+                # Write configuration with datetime stamp, configuration is copied here and
+                # pickled in the writer thread
+                if _scope == 'users' and self.config.users_records_store:
+                    data = partial(dumpRecordsSnapshot, _header,
+                                   [(str(u.uid), u.username, u.snapshot()) for u in self.users],
+                                   self.pickleProtocol)
+                elif _scope == 'users':
+                    data = partial(dumpSnapshot, _header, [u.snapshot() for u in self.users],
+                                   self.pickleProtocol)
+                elif _scope == 'groups':
+                    data = partial(dumpSnapshot, _header, [copy(g) for g in self.groups], self.pickleProtocol)
+                else:
+                    data = partial(dumpSnapshot, _header, data.snapshot(), self.pickleProtocol)
+                files.append((path, data))
+                scopes.append(_scope)
+
+            # Set persistance state to True, it's reverted if the snapshot cannot be written
+            for _scope in scopes:
+                self.persistenceState[_scope] = True
+            if 'users' in scopes:
                 for u in self.users:
-                    u.mt_credential.quotas_updated = False
-
-            if scope in ['all', 'moroutes']:
-                # Persist moroutes configuration
-                path = '%s/%s.router-moroutes' % (self.config.store_path, profile)
-                self.log.info('Persisting current MORoutingTable to [%s] profile in %s', profile, path)
-
-                fh = open(path, 'wb')
-                # Write configuration with datetime stamp
-                fh.write(
-                    ('Persisted on %s [Jasmin %s]\n' % (time.strftime("%c"), jasmin.get_release())).encode('ascii'))
-                fh.write(pickle.dumps(self.mo_routing_table, self.pickleProtocol))
-                fh.close()
-
-                # Set persistance state to True
-                self.persistenceState['moroutes'] = True
-
-            if scope in ['all', 'mtroutes']:
-                # Persist mtroutes configuration
-                path = '%s/%s.router-mtroutes' % (self.config.store_path, profile)
-                self.log.info('Persisting current MTRoutingTable to [%s] profile in %s', profile, path)
-
-                fh = open(path, 'wb')
-                # Write configuration with datetime stamp
-                fh.write(
-                    ('Persisted on %s [Jasmin %s]\n' % (time.strftime("%c"), jasmin.get_release())).encode('ascii'))
-                fh.write(pickle.dumps(self.mt_routing_table, self.pickleProtocol))
-                fh.close()
-
-                # Set persistance state to True
-                self.persistenceState['mtroutes'] = True
-
-            if scope in ['all', 'mointerceptors']:
-                # Persist mointerceptors configuration
-                path = '%s/%s.router-mointerceptors' % (self.config.store_path, profile)
-                self.log.info('Persisting current MOInterceptionTable to [%s] profile in %s',
-                              profile, path)
-
-                fh = open(path, 'wb')
-                # Write configuration with datetime stamp
-                fh.write(
-                    ('Persisted on %s [Jasmin %s]\n' % (time.strftime("%c"), jasmin.get_release())).encode('ascii'))
-                fh.write(pickle.dumps(self.mo_interception_table, self.pickleProtocol))
-                fh.close()
-
-                # Set persistance state to True
-                self.persistenceState['mointerceptors'] = True
-
-            if scope in ['all', 'mtinterceptors']:
-                # Persist mtinterceptors configuration
-                path = '%s/%s.router-mtinterceptors' % (self.config.store_path, profile)
-                self.log.info('Persisting current MTInterceptionTable to [%s] profile in %s',
-                              profile, path)
-
-                fh = open(path, 'wb')
-                # Write configuration with datetime stamp
-                fh.write(
-                    ('Persisted on %s [Jasmin %s]\n' % (time.strftime("%c"), jasmin.get_release())).encode('ascii'))
-                fh.write(pickle.dumps(self.mt_interception_table, self.pickleProtocol))
-                fh.close()
-
-                # Set persistance state to True
-                self.persistenceState['mtinterceptors'] = True
-
-        except IOError:
-            self.log.error('Cannot persist to %s', path)
-            return False
+                    if u.mt_credential.quotas_updated:
+                        updated_users.append(u)
+                        u.mt_credential.quotas_updated = False
         except Exception as e:
             self.log.error('Unknown error occurred while persisting configuration: %s', e)
+            return defer.succeed(False)
+
+        d = self.store_writer.write(files)
+        d.addCallback(self.persistedCallback, scopes, updated_users, journal_seq)
+        return d
+
+    def persistedCallback(self, written, scopes, updated_users, journal_seq):
+        """Called when a perspective_persist() snapshot is written (or not) to disk"""
+        if not written:
+            for _scope in scopes:
+                self.persistenceState[_scope] = False
+            for u in updated_users:
+                u.mt_credential.quotas_updated = True
             return False
 
+        if journal_seq is not None:
+            # Journal entries are dropped once the snapshot including them is durable
+            d = self.quotas_journal.compact(journal_seq)
+            d.addCallback(lambda _: True)
+            return d
+
         return True
 
     def perspective_load(self, profile='jcli-prod', scope='all'):
@@ -559,6 +729,7 @@ class RouterPB(pb.Avatar):
 
                 # Adding new groups
                 self.groups = cf.getMigratedData()
+                self.indexGroups()
                 self.log.info('Added new Groups (%d)', len(self.groups))
 
                 # Set persistance state to True
@@ -570,26 +741,58 @@ class RouterPB(pb.Avatar):
                 self.log.info('Loading/Activating [%s] profile Users configuration from %s',
                               profile, path)
 
-                # Load configuration from file
-                fh = open(path, 'rb')
-                lines = fh.readlines()
-                fh.close()
+                if RecordsStore.isRecordsStore(path):
+                    # Users are decoded and migrated one by one
+                    store = RecordsStore(path)
+                    header = store.header
+
+                    # Remove current configuration
+                    self.log.info('Removing current Users (%d)', len(self.users))
+                    self.perspective_user_remove_all()
+
+                    # Adding new users: a first batch right away, the others on access or in
+                    # background
+                    self.users_store = store
+                    self.users_migrator = ConfigurationMigrator(context='users', header=header)
+                    for uid in store.keys(self.config.users_load_batch_size):
+                        self.loadUserRecord(uid)
+                    self.log.info('Added new Users (%d), %d pending', len(self.users), len(store))
+
+                    if len(store) > 0:
+                        self.users_loader = task.cooperate(self.loadPendingUsers())
+                        self.users_loader.whenDone().addCallbacks(
+                            self.pendingUsersLoaded, lambda failure: failure.trap(task.TaskStopped))
+                    else:
+                        self.closeUsersStore()
+                else:
+                    # Load configuration from file
+                    fh = open(path, 'rb')
+                    lines = fh.readlines()
+                    fh.close()
+                    header = lines[0].decode('ascii')
 
-                # Init migrator
-                cf = ConfigurationMigrator(context='users', header=lines[0].decode('ascii'), data=b''.join(lines[1:]))
+                    # Init migrator
+                    cf = ConfigurationMigrator(context='users', header=header, data=b''.join(lines[1:]))
 
-                # Remove current configuration
-                self.log.info('Removing current Users (%d)', len(self.users))
-                self.perspective_user_remove_all()
+                    # Remove current configuration
+                    self.log.info('Removing current Users (%d)', len(self.users))
+                    self.perspective_user_remove_all()
+
+                    # Adding new users
+                    self.users = cf.getMigratedData()
+                    self.indexUsers()
+                    self.log.info('Added new Users (%d)', len(self.users))
 
-                # Adding new users
-                self.users = cf.getMigratedData()
-                self.log.info('Added new Users (%d)', len(self.users))
+                    for u in self.users:
+                        u.mt_credential.quotas_updated = False
 
                 # Set persistance state to True
                 self.persistenceState['users'] = True
-                for u in self.users:
-                    u.mt_credential.quotas_updated = False
+
+                # Apply quota updates journaled after users were persisted
+                if profile == JOURNAL_PROFILE and self.quotas_journal is not None:
+                    match = _REGEX_JOURNAL_SEQ.search(header)
+                    self.replayQuotasJournal(int(match.group('seq')) if match else 0)
 
             if scope in ['all', 'mointerceptors']:
                 # Load mointerceptors configuration
@@ -704,6 +907,10 @@ class RouterPB(pb.Avatar):
         self.log.debug('Adding a User: %s', user)
         self.log.info('Adding a User (id:%s)', user.uid)
 
+        # Users to be replaced are loaded from the users records store (if any)
+        self.getUser(user.uid)
+        self.getUsersByUsername(user.username)
+
         # Check if group exists
         foundGroup = False
         for _group in self.groups:
@@ -714,16 +921,19 @@ class RouterPB(pb.Avatar):
             return False
 
         # Replace existant users
-        for _user in self.users:
-            if user.uid == _user.uid or user.username == _user.username:
-                self.log.warning('User (id:%s) already existant, will be replaced !', user.uid)
-                self.users.remove(_user)
+        _user = self.users_by_uid.get(str(user.uid))
+        if _user is None and user.username in self.users_by_username:
+            _user = self.users_by_username[user.username][0]
+        if _user is not None:
+            self.log.warning('User (id:%s) already existant, will be replaced !', user.uid)
+            self.users.remove(_user)
+            self.unindexUser(_user)
 
-                # Save old CnxStatus in new user
-                user.setCnxStatus(_user.getCnxStatus())
-                break
+            # Save old CnxStatus in new user
+            user.setCnxStatus(_user.getCnxStatus())
 
         self.users.append(user)
+        self.indexUser(user)
 
         # Set persistance state to False (pending for persistance)
         self.persistenceState['users'] = False
@@ -740,13 +950,13 @@ class RouterPB(pb.Avatar):
         self.log.info('Enabling a User (id:%s)', uid)
 
         # Enable user
-        for _user in self.users:
-            if uid == _user.uid:
-                _user.enable()
+        _user = self.getUser(uid)
+        if _user is not None:
+            _user.enable()
 
-                # Set persistance state to False (pending for persistance)
-                self.persistenceState['users'] = False
-                return True
+            # Set persistance state to False (pending for persistance)
+            self.persistenceState['users'] = False
+            return True
 
         self.log.error("User with id:%s not found, not enabling it.", uid)
         return False
@@ -755,13 +965,13 @@ class RouterPB(pb.Avatar):
         self.log.info('Disabling a User (id:%s)', uid)
 
         # Disable user
-        for _user in self.users:
-            if uid == _user.uid:
-                _user.disable()
+        _user = self.getUser(uid)
+        if _user is not None:
+            _user.disable()
 
-                # Set persistance state to False (pending for persistance)
-                self.persistenceState['users'] = False
-                return True
+            # Set persistance state to False (pending for persistance)
+            self.persistenceState['users'] = False
+            return True
 
         self.log.error("User with id:%s not found, not disabling it.", uid)
         return False
@@ -770,13 +980,14 @@ class RouterPB(pb.Avatar):
         self.log.info('Removing a User (id:%s)', uid)
 
         # Remove user
-        for _user in self.users:
-            if uid == _user.uid:
-                self.users.remove(_user)
+        _user = self.getUser(uid)
+        if _user is not None:
+            self.users.remove(_user)
+            self.unindexUser(_user)
 
-                # Set persistance state to False (pending for persistance)
-                self.persistenceState['users'] = False
-                return True
+            # Set persistance state to False (pending for persistance)
+            self.persistenceState['users'] = False
+            return True
 
         self.log.error("User with id:%s not found, not removing it.", uid)
         return False
@@ -784,7 +995,9 @@ class RouterPB(pb.Avatar):
     def perspective_user_remove_all(self):
         self.log.info('Removing all users')
 
+        self.closeUsersStore()
         self.users = []
+        self.indexUsers()
 
         # Set persistance state to False (pending for persistance)
         self.persistenceState['users'] = False
@@ -793,6 +1006,7 @@ class RouterPB(pb.Avatar):
 
     def perspective_user_get_all(self, gid=None):
         self.log.info('Getting all users')
+        self.finishUsersLoading()
         self.log.debug('Getting all users: %s', self.users)
 
         if gid is None:
@@ -809,28 +1023,28 @@ class RouterPB(pb.Avatar):
         self.log.info('Setting a User (id:%s) quota: %s/%s %s', uid, cred, quota, value)
 
         # Find user
-        for _user in self.users:
-            if uid == _user.uid:
-                try:
-                    if not hasattr(_user, cred):
-                        raise Exception("Invalid cred: %s", cred)
-                    else:
-                        _cred = getattr(_user, cred)
+        _user = self.getUser(uid)
+        if _user is not None:
+            try:
+                if not hasattr(_user, cred):
+                    raise Exception("Invalid cred: %s", cred)
+                else:
+                    _cred = getattr(_user, cred)
 
-                    if quota not in _cred.quotas:
-                        raise Exception("Unknown quota: %s", quota)
+                if quota not in _cred.quotas:
+                    raise Exception("Unknown quota: %s", quota)
 
-                    # Update the quota
-                    _cred.setQuota(quota, value)
+                # Update the quota
+                _cred.setQuota(quota, value)
 
-                except Exception as e:
-                    self.log.error("Error updating user (id:%s): %s", uid, e)
-                    return False
-                else:
-                    # Successful update !
-                    # Set persistance state to False (pending for persistance)
-                    self.persistenceState['users'] = False
-                    return True
+            except Exception as e:
+                self.log.error("Error updating user (id:%s): %s", uid, e)
+                return False
+            else:
+                # Successful update !
+                # Set persistance state to False (pending for persistance)
+                self.persistenceState['users'] = False
+                return True
 
         self.log.error("User with id:%s not found, not updating it.", uid)
 
@@ -840,28 +1054,28 @@ class RouterPB(pb.Avatar):
         self.log.info('Updating a User (id:%s) quota: %s/%s %s', uid, cred, quota, value)
 
         # Find user
-        for _user in self.users:
-            if uid == _user.uid:
-                try:
-                    if not hasattr(_user, cred):
-                        raise Exception("Invalid cred: %s", cred)
-                    else:
-                        _cred = getattr(_user, cred)
+        _user = self.getUser(uid)
+        if _user is not None:
+            try:
+                if not hasattr(_user, cred):
+                    raise Exception("Invalid cred: %s", cred)
+                else:
+                    _cred = getattr(_user, cred)
 
-                    if quota not in _cred.quotas:
-                        raise Exception("Unknown quota: %s", quota)
+                if quota not in _cred.quotas:
+                    raise Exception("Unknown quota: %s", quota)
 
-                    # Update the quota
-                    _cred.updateQuota(quota, value)
+                # Update the quota
+                self.updateUserQuota(_user, quota, value, cred=cred)
 
-                except Exception as e:
-                    self.log.error("Error updating user (id:%s): %s", uid, e)
-                    return False
-                else:
-                    # Successful update !
-                    # Set persistance state to False (pending for persistance)
-                    self.persistenceState['users'] = False
-                    return True
+            except Exception as e:
+                self.log.error("Error updating user (id:%s): %s", uid, e)
+                return False
+            else:
+                # Successful update !
+                # Set persistance state to False (pending for persistance)
+                self.persistenceState['users'] = False
+                return True
 
         self.log.error("User with id:%s not found, not updating it.", uid)
 
@@ -878,6 +1092,7 @@ class RouterPB(pb.Avatar):
                 break
 
         self.groups.append(group)
+        self.groups_by_gid[str(group.gid)] = group
 
         # Set persistance state to False (pending for persistance)
         self.persistenceState['groups'] = False
@@ -916,6 +1131,7 @@ class RouterPB(pb.Avatar):
 
     def perspective_group_remove(self, gid):
         self.log.info('Removing a Group (id:%s)', gid)
+        self.finishUsersLoading()
 
         # Remove group
         for _group in self.groups:
@@ -926,9 +1142,11 @@ class RouterPB(pb.Avatar):
                     if _user.group.gid == _group.gid:
                         self.log.info('Removing a User (id:%s) from the Group (id:%s)', _user.uid, gid)
                         self.users.remove(_user)
+                        self.unindexUser(_user)
 
                 # Safely remove this group
                 self.groups.remove(_group)
+                self.groups_by_gid.pop(str(_group.gid), None)
                 return True
 
         self.log.error("Group with id:%s not found, not removing it.", gid)
@@ -940,6 +1158,7 @@ class RouterPB(pb.Avatar):
 
     def perspective_group_remove_all(self):
         self.log.info('Removing all groups')
+        self.finishUsersLoading()
 
         # Remove group
         for _group in self.groups:
@@ -955,6 +1174,8 @@ class RouterPB(pb.Avatar):
                     self.users.remove(_user)
 
         self.groups = []
+        self.indexUsers()
+        self.indexGroups()
 
         # Set persistance state to False (pending for persistance)
         self.persistenceState['groups'] = False
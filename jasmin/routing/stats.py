@@ -0,0 +1,34 @@
+from jasmin.tools.singleton import Singleton
+from jasmin.tools.stats import Stats
+
+
+class ThrowerStatistics(Stats):
+    """One thrower statistics holder"""
+
+    def __init__(self, thrower_id):
+        self.thrower_id = thrower_id
+
+        self.init()
+
+    def init(self):
+        self._stats = {
+            'http_connections_created': 0,
+            'http_connections_reused': 0,
+            'http_connections_idle': 0,
+            'http_requests_inflight': 0,
+        }
+
+    def getStats(self):
+        return self._stats
+
+
+class ThrowerStatsCollector(metaclass=Singleton):
+    """Throwers statistics collection holder"""
+    throwers = {}
+
+    def get(self, thrower_id):
+        """Return a thrower's stats object or instanciate a new one"""
+        if thrower_id not in self.throwers:
+            self.throwers[thrower_id] = ThrowerStatistics(thrower_id)
+
+        return self.throwers[thrower_id]
@@ -6,8 +6,9 @@ from logging.handlers import TimedRotatingFileHandler
 
 from twisted.application.service import Service
 from twisted.internet import defer
+from twisted.python.failure import Failure
 from twisted.internet import reactor
-from twisted.web.client import Agent
+from twisted.web.client import Agent, HTTPConnectionPool
 from txamqp.queue import Closed
 from treq.client import HTTPClient
 from treq import text_content
@@ -18,7 +19,8 @@ from jasmin.protocols.smpp.factory import SMPPServerFactory
 from jasmin.protocols.smpp.operations import SMPPOperationFactory
 from jasmin.protocols.smpp.proxies import SMPPServerPBProxy
 from jasmin.protocols.http.errors import HttpApiError
-
+from jasmin.queues import codec
+from jasmin.routing.stats import ThrowerStatsCollector
 
 
 class MessageAcknowledgementError(Exception):
@@ -46,6 +48,38 @@ class DeliveringFailed(Exception):
     """Raised when delivering a pdu errored"""
 
 
+class ThrowerHTTPConnectionPool(HTTPConnectionPool):
+    """A HTTPConnectionPool keeping track of its connections in the thrower statistics"""
+
+    def __init__(self, reactor, stats, persistent=True):
+        HTTPConnectionPool.__init__(self, reactor, persistent)
+        self.stats = stats
+
+    def _updateIdleConnections(self):
+        self.stats.set('http_connections_idle', sum(len(c) for c in self._connections.values()))
+
+    def _newConnection(self, key, endpoint):
+        self.stats.inc('http_connections_created')
+        return HTTPConnectionPool._newConnection(self, key, endpoint)
+
+    def getConnection(self, key, endpoint):
+        created_count = self.stats.get('http_connections_created')
+        d = HTTPConnectionPool.getConnection(self, key, endpoint)
+        if created_count == self.stats.get('http_connections_created'):
+            self.stats.inc('http_connections_reused')
+        self._updateIdleConnections()
+
+        return d
+
+    def _putConnection(self, key, connection):
+        HTTPConnectionPool._putConnection(self, key, connection)
+        self._updateIdleConnections()
+
+    def _removeConnection(self, key, connection):
+        HTTPConnectionPool._removeConnection(self, key, connection)
+        self._updateIdleConnections()
+
+
 class Thrower(Service):
     name = 'abstract thrower'
     log_category = 'abstract-thrower'
@@ -71,6 +105,17 @@ class Thrower(Service):
         self.smpps = None
         self.smpps_access = None
 
+        # Http connections are pooled and kept alive (if persistent) between throwings
+        self.stats = ThrowerStatsCollector().get(self.name)
+        self.http_pool = ThrowerHTTPConnectionPool(reactor, self.stats,
+                                                   persistent=self.config.http_persistent_connections)
+        self.http_pool.maxPersistentPerHost = self.config.http_max_persistent_per_host
+        self.http_pool.cachedConnectionTimeout = self.config.http_idle_timeout
+        self.http_client = HTTPClient(Agent(reactor, pool=self.http_pool))
+
+        # Per destination semaphores capping concurrent throws, see dispatch()
+        self.destinations = {}
+
         # Set up a dedicated logger
         self.log = logging.getLogger(self.log_category)
         if len(self.log.handlers) != 1:
@@ -117,7 +162,69 @@ class Thrower(Service):
         # Init retrial mechanism
         self.incThrowingRetrials(message)
 
-        self.thrower_q.get().addCallback(self.callback).addErrback(self.errback)
+    def getDestination(self, message):
+        """Return a (destination, callback keyword arguments) tuple: destination is a key identifying
+        the message's destination, used to cap concurrent throws to the same destination (None means
+        the message is not capped), keyword arguments are given to callback with the message (e.g.:
+        headers already decoded to get the destination)"""
+        return None, {}
+
+    @defer.inlineCallbacks
+    def consume(self):
+        """Consuming loop: get messages one at a time from the thrower queue and throw them,
+        config.concurrency loops are running in parallel"""
+        while True:
+            try:
+                message = yield self.thrower_q.get()
+            except Exception:
+                self.errback(Failure())
+                break
+
+            yield self.dispatch(message)
+
+    def dispatch(self, message):
+        """Throw message and return a deferred firing when the consuming loop can take the next one
+
+        When the message's destination already reached config.max_inflight_per_destination,
+        the message waits for a free slot without holding the consuming loop, this way a slow
+        destination will not starve the other ones; the consuming loop is held once
+        config.max_waiting_per_destination messages are waiting for the same destination.
+        """
+        destination, kwargs = self.getDestination(message)
+        if destination is None or self.config.max_inflight_per_destination <= 0:
+            return self.throw(message, **kwargs)
+
+        semaphore = self.destinations.get(destination)
+        if semaphore is None:
+            semaphore = defer.DeferredSemaphore(self.config.max_inflight_per_destination)
+            self.destinations[destination] = semaphore
+
+        saturated = semaphore.tokens == 0
+        held = saturated and len(semaphore.waiting) >= self.config.max_waiting_per_destination
+        d = semaphore.run(self.throw, message, **kwargs)
+        d.addBoth(self._releaseDestination, destination)
+
+        if held:
+            self.log.debug('Destination %s has %s waiting messages, holding consumption until message '
+                           '[msgid:%s] is thrown', destination, len(semaphore.waiting) - 1,
+                           message.content.properties['message-id'])
+        elif saturated:
+            self.log.debug('Destination %s is saturated, message [msgid:%s] is waiting for a free slot',
+                           destination, message.content.properties['message-id'])
+            return defer.succeed(None)
+        return d
+
+    def _releaseDestination(self, result, destination):
+        semaphore = self.destinations.get(destination)
+        if semaphore is not None and semaphore.tokens == semaphore.limit and len(semaphore.waiting) == 0:
+            del self.destinations[destination]
+
+        return result
+
+    def throw(self, message, **kwargs):
+        d = defer.maybeDeferred(self.callback, message, **kwargs)
+        d.addErrback(self.errback)
+        return d
 
     def throwing_errback(self, error):
         """It appears that when closing a queue with the close() method it errbacks with
@@ -155,6 +262,29 @@ class Thrower(Service):
 
         self.clearAllTimers()
 
+        return self.http_pool.closeCachedConnections()
+
+    @defer.inlineCallbacks
+    def http_request(self, method, url, params=None, data=None, headers=None):
+        """Send a http request through the shared connections pool and return a
+        (response, text content) tuple"""
+        self.stats.inc('http_requests_inflight')
+        try:
+            response = yield self.http_client.request(
+                method,
+                url,
+                params=params,
+                data=data,
+                timeout=self.config.timeout,
+                headers=headers)
+
+            # Body must be consumed before the connection is released back to the pool
+            content = yield text_content(response)
+        finally:
+            self.stats.dec('http_requests_inflight')
+
+        defer.returnValue((response, content))
+
     @defer.inlineCallbacks
     def addAmqpBroker(self, amqpBroker):
         self.amqpBroker = amqpBroker
@@ -165,19 +295,24 @@ class Thrower(Service):
             yield self.amqpBroker.channelReady
             self.log.info("AMQP Broker channel is ready now, let's go !")
 
-        # Declare exchange, queue and start consuming to self.callback
-        yield self.amqpBroker.chan.exchange_declare(exchange=self.exchangeName,
-                                                    type='topic')
+        # Declare exchange, queue and start consuming to self.callback, through a dedicated channel
+        # since its prefetch limit would apply to the consumers opened afterwards on a shared one
+        self.chan = yield self.amqpBroker.openChannel()
+        yield self.chan.exchange_declare(exchange=self.exchangeName, type='topic')
         yield self.amqpBroker.named_queue_declare(queue=self.queueName)
-        yield self.amqpBroker.chan.queue_bind(queue=self.queueName,
-                                              exchange=self.exchangeName,
-                                              routing_key=self.routingKey)
-        yield self.amqpBroker.chan.basic_consume(queue=self.queueName,
-                                                 no_ack=False,
-                                                 consumer_tag=self.consumerTag)
+        yield self.chan.queue_bind(queue=self.queueName,
+                                   exchange=self.exchangeName,
+                                   routing_key=self.routingKey)
+        # Limit unacknowledged messages delivered to this thrower (0 for no limit)
+        yield self.chan.basic_qos(prefetch_count=self.config.prefetch_count)
+        yield self.chan.basic_consume(queue=self.queueName,
+                                      no_ack=False,
+                                      consumer_tag=self.consumerTag)
         self.thrower_q = yield self.amqpBroker.client.queue(self.consumerTag)
-        self.thrower_q.get().addCallback(self.callback).addErrback(self.errback)
-        self.log.info('Consuming from routing key: %s', self.routingKey)
+        for _ in range(self.config.concurrency):
+            self.consume()
+        self.log.info('Consuming from routing key: %s with %s concurrent loops',
+                      self.routingKey, self.config.concurrency)
 
     @defer.inlineCallbacks
     def rejectAndRequeueMessage(self, message, delay=True):
@@ -208,14 +343,14 @@ class Thrower(Service):
             # Remove retrial tracker
             self.delThrowingRetrials(message)
 
-        yield self.amqpBroker.chan.basic_reject(delivery_tag=message.delivery_tag, requeue=requeue)
+        yield self.chan.basic_reject(delivery_tag=message.delivery_tag, requeue=requeue)
 
     @defer.inlineCallbacks
     def ackMessage(self, message):
         # Remove retrial tracker
         self.delThrowingRetrials(message)
 
-        yield self.amqpBroker.chan.basic_ack(message.delivery_tag)
+        yield self.chan.basic_ack(message.delivery_tag)
 
 
 class deliverSmThrower(Thrower):
@@ -232,11 +367,12 @@ class deliverSmThrower(Thrower):
         Thrower.__init__(self, config)
 
     @defer.inlineCallbacks
-    def http_deliver_sm_callback(self, message):
+    def http_deliver_sm_callback(self, message, dcs=None):
         msgid = message.content.properties['message-id']
         route_type = message.content.properties['headers']['route-type']
-        dcs = pickle.loads(message.content.properties['headers']['dst-connectors'])
-        RoutedDeliverSmContent = pickle.loads(message.content.body)
+        if dcs is None:
+            dcs = pickle.loads(message.content.properties['headers']['dst-connectors'])
+        RoutedDeliverSmContent = codec.loads(message.content.body)
         self.log.debug('Got one message (msgid:%s) to throw: %s', msgid, RoutedDeliverSmContent)
 
         # If any, clear requeuing timer
@@ -311,22 +447,17 @@ class deliverSmThrower(Thrower):
                     postdata = args
 
                 self.log.debug('Calling %s with args %s using %s method.', dc.baseurl, args, _method)
-                agent = Agent(reactor)
-                client = HTTPClient(agent)
-                response = yield client.request(
+                response, content = yield self.http_request(
                     _method,
                     baseurl,
                     params=params,
                     data=postdata,
-                    timeout=self.config.timeout,
                     headers={'Content-Type': 'application/x-www-form-urlencoded',
                              'Accept': 'text/plain',
                              'User-Agent': 'Jasmin gateway/1.0 deliverSmHttpThrower'})
                 self.log.info('Throwed message [msgid:%s] to connector (%s %s/%s)[cid:%s] using http to %s.',
                               msgid, route_type, counter, len(dcs), dc.cid, dc.baseurl)
-                
-                content = yield text_content(response)
-                
+
                 if response.code >= 400:
                     raise HttpApiError(response.code, content)
 
@@ -387,9 +518,8 @@ class deliverSmThrower(Thrower):
         msgid = message.content.properties['message-id']
         route_type = message.content.properties['headers']['route-type']
         dcs = pickle.loads(message.content.properties['headers']['dst-connectors'])
-        pdu = pickle.loads(message.content.body)
-        RoutedDeliverSmContent = pickle.loads(message.content.body)
-        self.log.debug('Got one message (msgid:%s) to throw: %s', msgid, RoutedDeliverSmContent)
+        pdu = codec.loads(message.content.body)
+        self.log.debug('Got one message (msgid:%s) to throw: %s', msgid, pdu)
 
         # If any, clear requeuing timer
         self.clearRequeueTimer(msgid)
@@ -488,12 +618,19 @@ class deliverSmThrower(Thrower):
                 elif route_type == 'failover' and not last_dc:
                     self.log.debug('Continue iteration for failover route.')
 
+    def getDestination(self, message):
+        if message.routing_key == 'deliver_sm_thrower.http':
+            dcs = pickle.loads(message.content.properties['headers']['dst-connectors'])
+            return dcs[0].baseurl, {'dcs': dcs}
+
+        return None, {}
+
     @defer.inlineCallbacks
-    def deliver_sm_throwing_callback(self, message):
+    def deliver_sm_throwing_callback(self, message, dcs=None):
         Thrower.throwing_callback(self, message)
 
         if message.routing_key == 'deliver_sm_thrower.http':
-            yield self.http_deliver_sm_callback(message)
+            yield self.http_deliver_sm_callback(message, dcs)
         elif message.routing_key == 'deliver_sm_thrower.smpps':
             yield self.smpp_deliver_sm_callback(message)
         else:
@@ -555,21 +692,16 @@ class DLRThrower(Thrower):
                 postdata = args
 
             self.log.debug('Calling %s with args %s using %s method.', baseurl, args, method)
-            agent = Agent(reactor)
-            client = HTTPClient(agent)
-            response = yield client.request(
+            response, content = yield self.http_request(
                 method,
                 baseurl,
                 params=params,
                 data=postdata,
-                timeout=self.config.timeout,
                 headers={'Content-Type': 'application/x-www-form-urlencoded',
                          'Accept': 'text/plain',
                          'User-Agent': 'Jasmin gateway/1.0 %s' % self.name})
             self.log.info('Throwed DLR [msgid:%s] to %s.', msgid, baseurl)
 
-            content = yield text_content(response)
-            
             if response.code >= 400:
                 raise HttpApiError(response.code, content)
 
@@ -689,6 +821,12 @@ class DLRThrower(Thrower):
             # Everything is okay ? then:
             yield self.ackMessage(message)
 
+    def getDestination(self, message):
+        if message.routing_key == 'dlr_thrower.http':
+            return message.content.properties['headers']['url'], {}
+
+        return None, {}
+
     @defer.inlineCallbacks
     def dlr_throwing_callback(self, message):
         Thrower.throwing_callback(self, message)
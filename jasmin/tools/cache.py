@@ -0,0 +1,98 @@
+"""
+In-memory caches
+"""
+
+import time
+from collections import OrderedDict
+
+_missing = object()
+
+
+class LRUCache:
+    """A bounded least-recently-used cache with optional time-to-live expiry
+
+    Setting maxsize to 0 will disable caching, ttl is given in seconds and None means entries
+    are only evicted when the cache is full.
+    """
+
+    def __init__(self, maxsize=1024, ttl=None, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _missing, count=False) is not _missing
+
+    def get(self, key, default=None, count=True):
+        """Return cached value for key or default if not found or expired"""
+        try:
+            value, expires_at = self._data[key]
+        except KeyError:
+            if count:
+                self.misses += 1
+            return default
+
+        if expires_at is not None and expires_at <= self.clock():
+            del self._data[key]
+            if count:
+                self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        if count:
+            self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Cache value for key, ttl (seconds) will override the cache default ttl"""
+        if self.maxsize <= 0:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (value, None if ttl is None else self.clock() + ttl)
+        self._data.move_to_end(key)
+
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """Remove key from cache and return its value"""
+        try:
+            value, expires_at = self._data.pop(key)
+        except KeyError:
+            return default
+
+        if expires_at is not None and expires_at <= self.clock():
+            return default
+        return value
+
+    def clear(self):
+        self._data.clear()
+
+    def purge(self):
+        """Remove expired entries, return the number of removed entries"""
+        now = self.clock()
+        expired = [k for k, (_, expires_at) in self._data.items()
+                   if expires_at is not None and expires_at <= now]
+        for k in expired:
+            del self._data[k]
+
+        return len(expired)
+
+    def getStats(self):
+        """Return a dict with cache statistics"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups > 0 else 0.0,
+        }
+
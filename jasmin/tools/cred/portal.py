@@ -27,10 +27,9 @@ class SmppsRealm:
     def requestAvatar(self, avatarId, mind, *interfaces):
         user = None
         # Lookout for user from router
-        for _user in self.router_factory.users:
-            if avatarId == _user.username:
-                user = _user
-                break
+        _users = self.router_factory.getUsersByUsername(avatarId)
+        if _users:
+            user = _users[0]
 
         if user is None:
             return ('SMPPs', None, lambda: None)
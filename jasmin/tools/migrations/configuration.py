@@ -54,11 +54,13 @@ def version_is_valid(version, condition):
 class ConfigurationMigrator:
     """Responsible of migrating old saved configuration to recent definition, if any"""
 
-    def __init__(self, context, header, data):
-        """Will contain inputs and parse header to get version and date of persisted data"""
+    def __init__(self, context, header, data=None):
+        """Will contain inputs and parse header to get version and date of persisted data, data
+        can be omitted when records are migrated one by one (see getMigratedRecord)"""
         self.log = logging.getLogger(LOGGING_HANDLER)
         self.context = context
-        self.data = pickle.loads(data)
+        self.data = pickle.loads(data) if data is not None else None
+        self.operations = None
         self.log.debug('Initializing CM with context:%s, header:%s', self.context, header)
 
         # Parse header and get version & date
@@ -69,8 +71,9 @@ class ConfigurationMigrator:
         self.version = match.groupdict()['release_version']
         self.log.debug('[%s] @%s/%s', self.context, self.date, self.version)
 
-    def getMigratedData(self):
-        """Return data after executing migration steps"""
+    def getOperations(self):
+        """Return migration operations matching context and version"""
+        operations = []
         for m in MAP:
             # Context verification
             if self.context not in m['contexts']:
@@ -88,8 +91,26 @@ class ConfigurationMigrator:
 
             # We have matching context and valid conditions
             if valid:
-                for operation in m['operations']:
-                    self.log.info('Migrating old data [%s] from v%s to v%s by calling %s(data)',
-                                  self.context, self.version, jasmin.get_release(), operation.__name__)
-                    self.data = operation(self.data, context=self.context)
+                operations.extend(m['operations'])
+        return operations
+
+    def getMigratedData(self):
+        """Return data after executing migration steps"""
+        for operation in self.getOperations():
+            self.log.info('Migrating old data [%s] from v%s to v%s by calling %s(data)',
+                          self.context, self.version, jasmin.get_release(), operation.__name__)
+            self.data = operation(self.data, context=self.context)
         return self.data
+
+    def getMigratedRecord(self, record):
+        """Return a single record (of a list context: users, groups ...) after executing migration
+        steps"""
+        if self.operations is None:
+            self.operations = self.getOperations()
+
+        data = [record]
+        for operation in self.operations:
+            self.log.debug('Migrating old record [%s] from v%s to v%s by calling %s(data)',
+                           self.context, self.version, jasmin.get_release(), operation.__name__)
+            data = operation(data, context=self.context)
+        return data[0]
@@ -1,5 +1,16 @@
+import logging
+import math
+import time
+from collections import deque
+
 from twisted.internet import defer, reactor
 
+# When no burst is given, a bucket can hold the tokens accrued during this number of seconds
+# (and at least one token)
+DEFAULT_BURST_SECONDS = 0.01
+
+LOG_CATEGORY = "jasmin-qos"
+
 
 @defer.inlineCallbacks
 def slow_down(seconds):
@@ -7,3 +18,234 @@ def slow_down(seconds):
     waitDeferred = defer.Deferred()
     reactor.callLater(seconds, waitDeferred.callback, None)
     yield waitDeferred
+
+
+class TokenBucket:
+    """A token bucket refilled at rate tokens per second and holding up to burst tokens
+
+    A rate lower or equal to zero means unlimited throughput.
+    """
+
+    def __init__(self, rate, burst=None, clock=time.monotonic):
+        self.clock = clock
+        self.rate = 0
+        self.burst = 1.0
+        self._fixed_burst = burst
+        self.setRate(rate)
+
+        # Bucket is initially full
+        self.tokens = self.burst
+        self.updated_at = self.clock()
+
+    def setRate(self, rate, burst=None):
+        """Update bucket rate (and burst), already accrued tokens are kept"""
+        if burst is not None:
+            self._fixed_burst = burst
+
+        self.rate = float(rate or 0)
+        if self._fixed_burst is not None:
+            self.burst = max(1.0, float(self._fixed_burst))
+        else:
+            self.burst = max(1.0, self.rate * DEFAULT_BURST_SECONDS)
+
+    def _refill(self):
+        now = self.clock()
+        if now > self.updated_at:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def consume(self, tokens=1):
+        """Take tokens from bucket, return False (and take nothing) if there's not enough of them"""
+        if self.rate <= 0:
+            return True
+
+        self._refill()
+        if self.tokens >= tokens:
+            self.tokens -= tokens
+            return True
+
+        return False
+
+    def reserve(self, tokens=1):
+        """Take tokens from bucket even if they are not yet available, return the number of
+        seconds to wait before using them"""
+        if self.rate <= 0:
+            return 0.0
+
+        self._refill()
+        self.tokens -= tokens
+        if self.tokens >= 0:
+            return 0.0
+
+        return -self.tokens / self.rate
+
+    def delay(self, tokens=1):
+        """Return the number of seconds to wait before tokens can be consumed"""
+        if self.rate <= 0:
+            return 0.0
+
+        self._refill()
+        if self.tokens >= tokens:
+            return 0.0
+
+        return (tokens - self.tokens) / self.rate
+
+
+class TokenBucketScheduler:
+    """Release callers at the pace of a TokenBucket
+
+    acquire() returns a deferred firing when a token is taken for the caller, waiting callers
+    are released in FIFO order by a single timer, many of them per reactor tick when the bucket
+    allows it.
+    """
+
+    def __init__(self, rate, burst=None, clock=None, _reactor=reactor):
+        self.reactor = _reactor
+        if clock is None:
+            clock = self.reactor.seconds
+        self.bucket = TokenBucket(rate, burst, clock)
+        self.waiting = deque()
+        self.timer = None
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def setRate(self, rate, burst=None):
+        if rate != self.bucket.rate or burst is not None:
+            self.bucket.setRate(rate, burst)
+            if self.waiting:
+                self._schedule()
+
+    def acquire(self):
+        """Return a deferred firing when caller is allowed to proceed"""
+        if not self.waiting and self.bucket.consume():
+            return defer.succeed(None)
+
+        d = defer.Deferred(self._cancelWaiting)
+        self.waiting.append(d)
+        if self.timer is None:
+            self._schedule()
+        return d
+
+    def _cancelWaiting(self, d):
+        try:
+            self.waiting.remove(d)
+        except ValueError:
+            pass
+
+    def _schedule(self):
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = self.reactor.callLater(self.bucket.delay(), self._release)
+
+    def _release(self):
+        self.timer = None
+        while self.waiting and self.bucket.consume():
+            self.waiting.popleft().callback(None)
+
+        if self.waiting:
+            self._schedule()
+
+    def cancel(self):
+        """Stop the scheduler timer and cancel all waiting callers"""
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+
+        while self.waiting:
+            self.waiting.popleft().cancel()
+
+
+# Reserve ARGV[1] tokens from every bucket in KEYS, ARGV[2*i] and ARGV[2*i+1] are the rate and burst
+# of KEYS[i]; tokens are taken even if they are not yet available (debt), the number of seconds to
+# wait for the most indebted bucket is returned (as a string, Lua numbers are truncated in replies)
+RESERVE_SCRIPT = """
+-- Writing after TIME (non deterministic) requires effects replication on Redis < 5, it's the
+-- default (and this call is a no-op) on later versions
+redis.replicate_commands()
+local t = redis.call('TIME')
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local requested = tonumber(ARGV[1])
+local wait = 0
+for i, key in ipairs(KEYS) do
+  local rate = tonumber(ARGV[i * 2])
+  local burst = tonumber(ARGV[i * 2 + 1])
+  local state = redis.call('HMGET', key, 'tokens', 'ts')
+  local tokens = tonumber(state[1]) or burst
+  local ts = tonumber(state[2]) or now
+  if now > ts then
+    tokens = math.min(burst, tokens + (now - ts) * rate)
+  end
+  tokens = tokens - requested
+  redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', tostring(now))
+  redis.call('PEXPIRE', key, math.ceil((burst - tokens) / rate * 1000) + 60000)
+  if tokens < 0 then
+    wait = math.max(wait, -tokens / rate)
+  end
+end
+return tostring(wait)
+"""
+
+
+class DistributedTokenBucket:
+    """Token buckets shared by many processes (Celery workers) through Redis
+
+    reserve() takes tokens from many named buckets at once (ex: a batch, its user and the whole
+    cluster), the caller must wait for the returned number of seconds before proceeding.
+    A rate lower or equal to zero means unlimited throughput; when Redis is not reachable
+    buckets are not enforced (errors are logged).
+    """
+
+    def __init__(self, redis_client, burst_seconds=1.0, prefix='qos', log=None):
+        self.script = redis_client.register_script(RESERVE_SCRIPT)
+        self.burst_seconds = burst_seconds
+        self.prefix = prefix
+        self.log = log if log is not None else logging.getLogger(LOG_CATEGORY)
+
+    def reserve(self, buckets, tokens=1):
+        """Take tokens from buckets, a list of (name, rate), and return the number of seconds
+        to wait before using them"""
+        keys = []
+        args = [tokens]
+        for name, rate in buckets:
+            if not rate or rate <= 0:
+                continue
+
+            keys.append('%s:%s' % (self.prefix, name))
+            args.extend([float(rate), max(1.0, float(rate) * self.burst_seconds)])
+
+        if len(keys) == 0:
+            return 0.0
+
+        try:
+            wait = self.script(keys=keys, args=args)
+        except Exception as e:
+            self.log.error('Cannot reserve tokens from %s (%s): %s', keys, type(e), e)
+            return 0.0
+
+        if isinstance(wait, bytes):
+            wait = wait.decode()
+        return float(wait)
+
+
+class LatencyWindow:
+    """Keep the last size latencies (seconds) to compute percentiles"""
+
+    def __init__(self, size=100):
+        self.latencies = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self.latencies)
+
+    def add(self, seconds):
+        self.latencies.append(seconds)
+
+    def percentile(self, p):
+        """Return the p-th percentile (nearest rank) or None when the window is empty"""
+        if len(self.latencies) == 0:
+            return None
+
+        ordered = sorted(self.latencies)
+        rank = max(1, int(math.ceil(p / 100.0 * len(ordered))))
+        return ordered[rank - 1]
@@ -1,3 +1,6 @@
+from jasmin.tools.singleton import Singleton
+
+
 class KeyNotFound(Exception):
     """
     Raised when setting or getting an unknown statistics key
@@ -40,3 +43,19 @@ class Stats:
             raise KeyNotIncrementable(key)
 
         self._stats[key] -= inc
+
+
+class ComponentsStatsCollector(metaclass=Singleton):
+    """Internal components statistics (store writers, caches, buffers ...), components are
+    registering their getStats() method by kind and id"""
+    components = {}
+
+    def register(self, kind, component_id, getStats):
+        self.components.setdefault(kind, {})[component_id] = getStats
+
+    def unregister(self, kind, component_id):
+        self.components.get(kind, {}).pop(component_id, None)
+
+    def get(self, kind):
+        """Return {component_id: stats} of the registered components of kind"""
+        return {component_id: getStats() for component_id, getStats in self.components.get(kind, {}).items()}
@@ -0,0 +1,198 @@
+"""
+Persistence of configuration profiles to the store
+
+Managers (RouterPB, SMPPClientManagerPB) are taking a consistent snapshot of their configuration
+on the reactor (copies of the objects being updated in place), snapshots are then pickled and
+written in a thread and files are atomically replaced.
+
+Large sets (users) can be persisted as records: each record is pickled on its own and indexed,
+a records store is memory-mapped when loaded and records are unpickled on access.
+"""
+
+import logging
+import mmap
+import os
+import pickle
+import struct
+import time
+from collections import OrderedDict
+from itertools import islice
+
+from twisted.internet import defer, threads
+
+LOG_CATEGORY = "jasmin-store"
+
+
+def atomicWrite(path, data):
+    """Write data to path through a temporary file, the file is synced to disk before replacing
+    path: path is holding either the previous or the new content, never a partial one"""
+    tmp_path = '%s.tmp' % path
+    with open(tmp_path, 'wb') as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp_path, path)
+
+    # Sync the directory entry as well
+    try:
+        dir_fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def dumpSnapshot(header, data, protocol=pickle.HIGHEST_PROTOCOL):
+    """Serialize a snapshot: header line followed by pickled data"""
+    return ('%s\n' % header).encode('ascii') + pickle.dumps(data, protocol)
+
+
+def dumpRecordsSnapshot(header, records, protocol=pickle.HIGHEST_PROTOCOL):
+    """Serialize a records snapshot: header line followed by packRecords() data"""
+    return ('%s\n' % header).encode('ascii') + packRecords(records, protocol)
+
+
+class StoreWriter:
+    """
+    Write snapshots to the store in a thread, one snapshot at a time and in order.
+
+    write() is returning a deferred fired with True when all the files are durable, False if one of
+    them cannot be written; file data is either bytes or a callable returning bytes, it's then
+    called in the thread (data must not be updated by the reactor meanwhile).
+    """
+
+    def __init__(self, log=None):
+        self.log = log if log is not None else logging.getLogger(LOG_CATEGORY)
+        self.lock = defer.DeferredLock()
+        self.stats = {'persisted': 0, 'failed': 0, 'last_duration': None, 'max_duration': 0.0}
+
+    def getStats(self):
+        return dict(self.stats)
+
+    def _writeFiles(self, files):
+        for path, data in files:
+            if callable(data):
+                data = data()
+            atomicWrite(path, data)
+
+    @defer.inlineCallbacks
+    def _write(self, files):
+        started_at = time.monotonic()
+        try:
+            yield threads.deferToThread(self._writeFiles, files)
+        except Exception as e:
+            self.log.error('Cannot persist to %s (%s): %s', [path for path, _ in files], type(e), e)
+            self.stats['failed'] += 1
+            defer.returnValue(False)
+
+        duration = time.monotonic() - started_at
+        self.stats['persisted'] += 1
+        self.stats['last_duration'] = duration
+        self.stats['max_duration'] = max(self.stats['max_duration'], duration)
+        self.log.debug('Persisted %s in %.3fs', [path for path, _ in files], duration)
+        defer.returnValue(True)
+
+    def write(self, files):
+        """Write a list of (path, data) files"""
+        return self.lock.run(self._write, files)
+
+    def stop(self):
+        """Wait for pending writes"""
+        return self.lock.run(lambda: None)
+
+
+RECORDS_MAGIC = b'JasminRecords:1\n'
+_INDEX_LENGTH = struct.Struct('>Q')
+
+
+def packRecords(records, protocol=pickle.HIGHEST_PROTOCOL):
+    """Serialize a list of (key, name, record) to the records store format:
+    magic, index length, index [(key, name, offset, length), ...] and the pickled records"""
+    index = []
+    blobs = []
+    offset = 0
+    for key, name, record in records:
+        blob = pickle.dumps(record, protocol)
+        index.append((key, name, offset, len(blob)))
+        blobs.append(blob)
+        offset += len(blob)
+
+    index = pickle.dumps(index, protocol)
+    return b''.join([RECORDS_MAGIC, _INDEX_LENGTH.pack(len(index)), index] + blobs)
+
+
+class RecordsStore:
+    """
+    Read-only, memory-mapped view of a persisted records store.
+
+    The file starts with a 'Persisted on ...' header line followed by packRecords() data, only
+    the index is decoded when opening the store; records are unpickled by get() and forgotten
+    by pop() once they're consumed.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fh = open(path, 'rb')
+        try:
+            self.header = self.fh.readline().decode('ascii')
+            self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self.fh.close()
+            raise
+
+        position = self.fh.tell()
+        if self.mm[position:position + len(RECORDS_MAGIC)] != RECORDS_MAGIC:
+            self.close()
+            raise ValueError('%s is not a records store' % path)
+        position += len(RECORDS_MAGIC)
+
+        index_length, = _INDEX_LENGTH.unpack_from(self.mm, position)
+        position += _INDEX_LENGTH.size
+        index = pickle.loads(self.mm[position:position + index_length])
+        records_offset = position + index_length
+
+        # key -> (offset, length) of pending (not yet consumed) records
+        self.records = OrderedDict()
+        self.keys_by_name = {}
+        for key, name, offset, length in index:
+            self.records[key] = (records_offset + offset, length)
+            self.keys_by_name.setdefault(name, []).append(key)
+
+    @staticmethod
+    def isRecordsStore(path):
+        with open(path, 'rb') as fh:
+            fh.readline()
+            return fh.read(len(RECORDS_MAGIC)) == RECORDS_MAGIC
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, key):
+        return key in self.records
+
+    def keys(self, limit=None):
+        """Return keys of pending records, up to limit keys if given"""
+        if limit is None:
+            return list(self.records)
+        return list(islice(self.records, limit))
+
+    def keysByName(self, name):
+        return [key for key in self.keys_by_name.get(name, []) if key in self.records]
+
+    def get(self, key):
+        offset, length = self.records[key]
+        return pickle.loads(self.mm[offset:offset + length])
+
+    def pop(self, key):
+        """Return the record and forget it"""
+        record = self.get(key)
+        del self.records[key]
+        return record
+
+    def close(self):
+        self.mm.close()
+        self.fh.close()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python
+"""This script will report the size of DLR maps in both storage formats and can migrate the
+DLR maps stored in Redis to the compact format.
+
+Usage:
+- Benchmark sample maps (no Redis required, payload bytes only):
+    + python dlr_map_tool.py bench
+- Benchmark sample maps in Redis (memory reported by MEMORY USAGE, sample keys are removed):
+    + python dlr_map_tool.py bench --redis [-c /etc/jasmin/jasmin.cfg]
+- Migrate hash DLR maps to the compact format (their ttl is kept):
+    + python dlr_map_tool.py migrate [-c /etc/jasmin/jasmin.cfg]
+
+Set dlr_map_format to compact in the [redis-client] section of jasmin.cfg before migrating, DLR
+lookups are reading both formats, migrating is not required to switch format.
+"""
+
+import argparse
+import datetime
+import random
+import uuid
+
+from twisted.internet import defer, task
+from smpp.pdu.pdu_types import AddrNpi, AddrTon, RegisteredDeliveryReceipt
+
+from jasmin.managers import dlrmap
+from jasmin.redis.client import ConnectionWithConfiguration
+from jasmin.redis.configs import RedisForJasminConfig
+
+# Replaces a hash dlr map by its compact form unless it was consumed in the meantime
+REPLACE_SCRIPT = """
+if redis.call('TYPE', KEYS[1])['ok'] ~= 'hash' then
+    return 0
+end
+
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+return 1
+"""
+
+
+def sample_maps(count):
+    """Return count httpapi and smppsapi dlr maps values (as written by SMPPClientManagerPB)"""
+    maps = []
+    for i in range(count):
+        if i % 2 == 0:
+            maps.append({'sc': 'httpapi',
+                         'url': 'http://127.0.0.1:8080/dlr/%s' % random.choice(['a', 'b', 'c']),
+                         'level': random.choice([1, 2, 3]),
+                         'method': random.choice(['GET', 'POST']),
+                         'connector': 'smppc-%s' % random.randint(1, 5),
+                         'expiry': 86400})
+        else:
+            maps.append({'sc': 'smppsapi',
+                         'system_id': 'user-%s' % random.randint(1, 5),
+                         'source_addr_ton': AddrTon.INTERNATIONAL,
+                         'source_addr_npi': AddrNpi.ISDN,
+                         'source_addr': b'JASMIN',
+                         'dest_addr_ton': AddrTon.INTERNATIONAL,
+                         'dest_addr_npi': AddrNpi.ISDN,
+                         'destination_addr': ('336%08d' % random.randint(0, 99999999)).encode(),
+                         'sub_date': datetime.datetime.now(),
+                         'rd_receipt': RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED,
+                         'expiry': 86400})
+
+    return maps
+
+
+def hash_payload_size(values):
+    """Bytes of fields and values of a hash map"""
+    return sum(len(dlrmap._to_bytes(k)) + len(dlrmap._to_bytes(v)) for k, v in values.items())
+
+
+class DLRMapTool:
+    def __init__(self, redisClient=None, dictionary_size=10000):
+        self.redisClient = redisClient
+        self.dictionary = dlrmap.DLRMapDictionary(redisClient, max_size=dictionary_size)
+
+    @defer.inlineCallbacks
+    def memoryUsage(self, key):
+        usage = yield self.redisClient.execute_command('MEMORY', 'USAGE', key)
+        defer.returnValue(usage or 0)
+
+    @defer.inlineCallbacks
+    def bench(self, count):
+        maps = sample_maps(count)
+
+        if self.redisClient is None:
+            # Interned strings are given dummy ids
+            for values in maps:
+                for string in dlrmap.internedStrings(values):
+                    if self.dictionary.getId(string) is None:
+                        self.dictionary.ids.set(string, len(self.dictionary.ids) + 1)
+            before = sum(hash_payload_size(values) for values in maps)
+            after = sum(len(dlrmap.dumps(values, self.dictionary)) for values in maps)
+            unit = 'payload bytes'
+        else:
+            before = after = 0
+            for values in maps:
+                yield self.dictionary.internAll(dlrmap.internedStrings(values))
+
+                key = 'dlr-bench:%s' % uuid.uuid4()
+                yield self.redisClient.hmset(key, values)
+                before += yield self.memoryUsage(key)
+                yield self.redisClient.set(key, dlrmap.dumps(values, self.dictionary))
+                after += yield self.memoryUsage(key)
+                yield self.redisClient.delete(key)
+            unit = 'bytes (MEMORY USAGE)'
+
+        print('%s sample maps, %s per map:' % (count, unit))
+        print('  hash:    %.1f' % (before / count))
+        print('  compact: %.1f (%.1f%%)' % (after / count, 100.0 * after / before))
+
+    @defer.inlineCallbacks
+    def migrate(self, batch):
+        cursor, migrated, skipped, before, after = 0, 0, 0, 0, 0
+        while True:
+            cursor, keys = yield self.redisClient.scan(cursor, 'dlr:*', batch)
+            for key in keys:
+                key_type = yield self.redisClient.type(key)
+                ttl = yield self.redisClient.ttl(key)
+                if key_type != 'hash' or ttl is None or ttl <= 0:
+                    continue
+
+                values = yield self.redisClient.hgetall(key)
+                try:
+                    yield self.dictionary.internAll(dlrmap.internedStrings(values))
+                    data = dlrmap.dumps(values, self.dictionary)
+                except (KeyError, dlrmap.DLRMapFormatError) as e:
+                    print('Skipping %s: %s' % (key, e))
+                    skipped += 1
+                    continue
+
+                usage = yield self.memoryUsage(key)
+                replaced = yield self.redisClient.eval(REPLACE_SCRIPT, [key], [data, ttl])
+                if replaced:
+                    migrated += 1
+                    before += usage
+                    after += yield self.memoryUsage(key)
+
+            if int(cursor) == 0:
+                break
+
+        print('Migrated %s dlr maps (%s skipped)' % (migrated, skipped))
+        if migrated > 0:
+            print('  bytes per map before: %.1f' % (before / migrated))
+            print('  bytes per map after:  %.1f' % (after / migrated))
+
+
+@defer.inlineCallbacks
+def main(reactor, args):
+    redisClient = None
+    config = RedisForJasminConfig(args.config)
+    if args.command == 'migrate' or args.redis:
+        redisClient = yield ConnectionWithConfiguration(config)
+        if config.password is not None:
+            yield redisClient.auth(config.password)
+            yield redisClient.select(config.dbid)
+
+    tool = DLRMapTool(redisClient, config.dlr_map_dictionary_size)
+    try:
+        if args.command == 'bench':
+            yield tool.bench(args.count)
+        else:
+            yield tool.migrate(args.batch)
+    finally:
+        if redisClient is not None:
+            yield redisClient.disconnect()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Jasmin DLR maps benchmark and migration tool')
+    parser.add_argument('command', choices=['bench', 'migrate'])
+    parser.add_argument('-c', '--config', default='/etc/jasmin/jasmin.cfg', help='Jasmin configuration file')
+    parser.add_argument('--redis', action='store_true', help='Benchmark against Redis memory usage')
+    parser.add_argument('--count', type=int, default=1000, help='Number of sample maps to benchmark')
+    parser.add_argument('--batch', type=int, default=1000, help='Number of keys scanned at once when migrating')
+
+    task.react(main, (parser.parse_args(),))
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""This script will benchmark delivery receipts parsing (SMPPOperationFactory.isDeliveryReceipt)
+over receipt samples from different SMSCs and MO messages (parsed as well).
+
+Usage:
+    + python dlr_receipt_bench.py [--number 20000] [--format standard]
+
+Each sample is parsed with the legacy parser (one re.search per receipt field) and with the
+connector's compiled receipt format, results are checked to be the same before timing them.
+"""
+
+import argparse
+import re
+import timeit
+
+from smpp.pdu.operations import DeliverSM
+
+from jasmin.protocols.smpp.configs import SMPPClientConfig
+from jasmin.protocols.smpp.operations import SMPPOperationFactory
+from jasmin.protocols.smpp.receipts import RECEIPT_FORMATS
+
+SAMPLES = {
+    'standard': b'id:1891273321 sub:001 dlvrd:001 submit date:1305050826 done date:1305050826 '
+                b'stat:DELIVRD err:000 text:DLVRD TO MOBILE',
+    'uuid-no-sub': b'id:c87c2273-7edb-4bc7-8d3a-7f57f21b625e submit date:201506201641 '
+                   b'done date:201506201641 stat:DELIVRD err:000',
+    'short-counters': b'id:4fb7d5ef sub:1 dlvrd:1 submit date:2011151021 done date:2011151021 '
+                      b'stat:UNDELIV err:34 Text:Hello world',
+    'long-text': b'id:0000A5F1 sub:001 dlvrd:000 submit date:1801011200 done date:1801011201 '
+                 b'stat:EXPIRED err:254 text:' + b'x' * 120,
+    'mo-message': b'Hello, could you please call me back when you get this message ?',
+}
+
+LEGACY_PATTERNS = [
+    r"id:(?P<id>[\dA-Za-z-_]+)",
+    r"sub:(?P<sub>\d{1,3})",
+    r"dlvrd:(?P<dlvrd>\d{1,3})",
+    r"submit date:(?P<sdate>\d+)",
+    r"done date:(?P<ddate>\d+)",
+    r"stat:(?P<stat>\w{7})",
+    r"err:(?P<err>\w{1,3})",
+    r"[tT]ext:(?P<text>.*)",
+]
+
+
+def legacy_parse(short_message):
+    """Receipt parsing as done before compiled receipt formats"""
+    ret = {}
+    for pattern in LEGACY_PATTERNS:
+        m = re.search(pattern, short_message.decode('utf-8', 'ignore'))
+        if m:
+            ret.update(m.groupdict())
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Delivery receipts parsing benchmark')
+    parser.add_argument('--number', type=int, default=20000, help='Parsings per sample')
+    parser.add_argument('--format', default='standard', choices=sorted(RECEIPT_FORMATS.keys()))
+    args = parser.parse_args()
+
+    receipt_parser = RECEIPT_FORMATS[args.format]
+    opFactory = SMPPOperationFactory(SMPPClientConfig(id='bench', dlr_receipt_format=args.format))
+
+    print('%-16s %14s %14s %14s %8s' % ('sample', 'legacy (us)', 'parser (us)', 'isDLR (us)', 'speedup'))
+    for name, short_message in SAMPLES.items():
+        if args.format == 'standard':
+            assert legacy_parse(short_message) == receipt_parser.parse(short_message), name
+
+        pdu = DeliverSM(source_addr=b'1234', destination_addr=b'4567', short_message=short_message)
+        legacy = timeit.timeit(lambda: legacy_parse(short_message), number=args.number)
+        compiled = timeit.timeit(lambda: receipt_parser.parse(short_message), number=args.number)
+        full = timeit.timeit(lambda: opFactory.isDeliveryReceipt(pdu), number=args.number)
+
+        print('%-16s %14.2f %14.2f %14.2f %7.1fx' % (
+            name, 1e6 * legacy / args.number, 1e6 * compiled / args.number, 1e6 * full / args.number,
+            legacy / compiled))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""This script will benchmark http api requests parsing (json body loading, default values and
+arguments validation) of /send, /rate and /balance.
+
+Usage:
+    + python http_request_bench.py [--number 20000]
+
+Each sample is parsed with the legacy parsing (fields built with re.compile on every request and
+every field validated again for each argument) and with the endpoint's HttpRequestParser, parsed
+arguments are checked to be the same before timing them; results are given in requests/second
+on a single core.
+"""
+
+import argparse
+import io
+import json
+import re
+import timeit
+
+from jasmin.protocols.http.errors import UrlArgsValidationError
+from jasmin.protocols.http.endpoints.balance import BALANCE_PARSER
+from jasmin.protocols.http.endpoints.rate import RATE_PARSER
+from jasmin.protocols.http.endpoints.send import SEND_PARSER
+
+
+class BenchRequest:
+    """The parts of twisted.web.server.Request used by parsers"""
+
+    def __init__(self, args, body=None):
+        self.args = args
+        self.content = io.BytesIO(body or b'')
+        self.headers = {b'content-type': b'application/json'} if body is not None else {}
+
+    def getHeader(self, key):
+        return self.headers.get(key)
+
+
+SEND_ARGS = {b'username': [b'fourat'], b'password': [b'correct'], b'to': [b'+21698700177'],
+             b'from': [b'JASMIN'], b'content': [b'Hello world !'], b'dlr-url': [b'http://127.0.0.1/dlr'],
+             b'dlr-level': [b'3'], b'priority': [b'1'], b'tags': [b'100,200']}
+SAMPLES = {
+    '/send form': (SEND_PARSER, SEND_ARGS, None),
+    '/send json': (SEND_PARSER, {}, json.dumps({k.decode(): v[0].decode() for k, v in SEND_ARGS.items()}).encode()),
+    '/rate': (RATE_PARSER, {b'username': [b'fourat'], b'password': [b'correct'], b'to': [b'+21698700177'],
+                            b'content': [b'Hello world !']}, None),
+    '/balance': (BALANCE_PARSER, {b'username': [b'fourat'], b'password': [b'correct']}, None),
+}
+
+
+def legacy_fields(parser):
+    """Fields as they were built on every request"""
+    return {field: dict(fieldData, pattern=re.compile(fieldData['pattern'].pattern, fieldData['pattern'].flags))
+            if 'pattern' in fieldData else dict(fieldData)
+            for field, fieldData in parser.fields.items()}
+
+
+def legacy_validate(args, fields):
+    """UrlArgsValidator.validate() as done before single pass validation"""
+    if len(args) == 0:
+        raise UrlArgsValidationError('Mandatory arguments not found, please refer to the HTTPAPI specifications.')
+
+    for arg in args:
+        if arg not in fields:
+            raise UrlArgsValidationError(b"Argument [%s] is unknown." % arg)
+
+        for field in fields:
+            fieldData = fields[field]
+
+            if field in args:
+                if isinstance(args[field][0], dict) or isinstance(args[field][0], list):
+                    continue
+                elif isinstance(args[field][0], int) or isinstance(args[field][0], float):
+                    value = str(args[field][0]).encode()
+                elif isinstance(args[field][0], str):
+                    value = args[field][0].encode()
+                else:
+                    value = args[field][0]
+
+                if 'pattern' in fields[field] and fields[field]['pattern'].match(value) is None:
+                    raise UrlArgsValidationError(b"Argument [%s] has an invalid value: [%s]." % (field, value))
+            elif not fieldData['optional']:
+                raise UrlArgsValidationError(b"Mandatory argument [%s] is not found." % field)
+
+    return True
+
+
+def legacy_parse(parser, request):
+    """Request parsing as done by endpoints before HttpRequestParser"""
+    fields = legacy_fields(parser)
+
+    if request.getHeader(b'content-type') == b'application/json':
+        for key, value in json.loads(request.content.read()).items():
+            if isinstance(value, str):
+                value = value.encode()
+            if isinstance(key, str):
+                key = key.encode()
+            request.args[key] = [value]
+
+    if parser.set_defaults is not None:
+        parser.set_defaults(request.args)
+    legacy_validate(request.args, fields)
+    if parser.check is not None:
+        parser.check(request.args)
+
+    return request.args
+
+
+def new_request(args, body):
+    return BenchRequest({k: list(v) for k, v in args.items()}, body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Http api requests parsing benchmark')
+    parser.add_argument('--number', type=int, default=20000, help='Parsings per sample')
+    args = parser.parse_args()
+
+    print('%-12s %16s %16s %8s' % ('sample', 'legacy (req/s)', 'parser (req/s)', 'speedup'))
+    for name, (request_parser, request_args, body) in SAMPLES.items():
+        assert (legacy_parse(request_parser, new_request(request_args, body)) ==
+                request_parser.parse(new_request(request_args, body))), name
+
+        legacy = timeit.timeit(lambda: legacy_parse(request_parser, new_request(request_args, body)),
+                               number=args.number)
+        parsed = timeit.timeit(lambda: request_parser.parse(new_request(request_args, body)),
+                               number=args.number)
+
+        print('%-12s %16.0f %16.0f %7.1fx' % (
+            name, args.number / legacy, args.number / parsed, legacy / parsed))
+
+
+if __name__ == '__main__':
+    main()
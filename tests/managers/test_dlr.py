@@ -0,0 +1,256 @@
+"""
+Test cases for DLRLookup and DLRMapWriter Redis interactions
+"""
+
+from unittest.mock import Mock
+
+from twisted.internet import defer, reactor
+from twisted.internet.task import deferLater
+from twisted.trial.unittest import TestCase
+from twisted.python.failure import Failure
+from txredisapi import ScriptDoesNotExist
+from smpp.pdu.pdu_types import CommandId, CommandStatus, RegisteredDeliveryReceipt
+
+from jasmin.managers import dlrmap
+from jasmin.managers.configs import DLRLookupConfig
+from jasmin.managers.content import DLR
+from jasmin.managers.dlr import DLRLookup, DLRMapWriter
+from jasmin.tools.stats import ComponentsStatsCollector
+
+
+class DLRLookupScriptsTestCase(TestCase):
+    def setUp(self):
+        self.redisClient = Mock()
+        self.redisClient.evalsha = Mock(return_value=defer.succeed([]))
+        self.redisClient.eval = Mock(return_value=defer.succeed([]))
+        self.amqpBroker = Mock()
+        self.amqpBroker.publish = Mock(return_value=defer.succeed(None))
+        self.amqpBroker.chan.basic_ack = Mock(return_value=defer.succeed(None))
+        self.amqpBroker.chan.basic_reject = Mock(return_value=defer.succeed(None))
+
+        dlr_config = DLRLookupConfig()
+        dlr_config.log_file = 'stdout'
+        self.dlr = DLRLookup(dlr_config, self.amqpBroker, self.redisClient)
+
+    def message(self, content):
+        message = Mock()
+        message.content = content
+        message.delivery_tag = 1
+        return message
+
+    @defer.inlineCallbacks
+    def test_submit_sm_resp_single_call(self):
+        self.redisClient.evalsha.return_value = defer.succeed(
+            ['sc', 'httpapi', 'url', 'http://127.0.0.1/dlr', 'level', 3, 'method', 'POST', 'expiry', 86400])
+
+        message = self.message(DLR(pdu_type=CommandId.submit_sm_resp, msgid='MSGID', status=CommandStatus.ESME_ROK,
+                                   smpp_msgid=b'0abc'))
+        yield self.dlr.submit_sm_resp_dlr_callback(message)
+
+        # One round-trip and no script loading
+        self.assertEqual(self.redisClient.evalsha.call_count, 1)
+        self.assertEqual(self.redisClient.eval.call_count, 0)
+        sha, keys, args = self.redisClient.evalsha.call_args[0]
+        self.assertEqual(sha, self.dlr.scripts['submit_sm_resp']['sha'])
+        self.assertEqual(keys, ['dlr:MSGID', 'queue-msgid:ABC'])
+        self.assertEqual(args[:2], ['MSGID', 1])
+        self.assertIn(RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED.name, args[2:])
+
+        # Receipt is published and message acked
+        self.assertEqual(self.amqpBroker.publish.call_count, 1)
+        self.assertEqual(self.amqpBroker.publish.call_args[1]['routing_key'], 'dlr_thrower.http')
+        self.assertEqual(self.amqpBroker.chan.basic_ack.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_script_loaded_on_noscript(self):
+        self.redisClient.evalsha.return_value = defer.fail(ScriptDoesNotExist('No script matching hash'))
+
+        message = self.message(DLR(pdu_type=CommandId.submit_sm_resp, msgid='MSGID',
+                                   status=CommandStatus.ESME_RINVDSTADR))
+        yield self.dlr.submit_sm_resp_dlr_callback(message)
+
+        self.assertEqual(self.redisClient.eval.call_count, 1)
+        script, keys, args = self.redisClient.eval.call_args[0]
+        self.assertEqual(script, self.dlr.scripts['submit_sm_resp']['source'])
+        self.assertEqual(args[:2], ['MSGID', 0])
+
+        # Empty reply: no dlr map
+        self.assertEqual(self.amqpBroker.publish.call_count, 0)
+        self.assertEqual(self.amqpBroker.chan.basic_reject.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_deliver_sm_single_call(self):
+        self.redisClient.evalsha.return_value = defer.succeed(
+            ['MSGID', 'httpapi',
+             'sc', 'httpapi', 'url', 'http://127.0.0.1/dlr', 'level', 2, 'method', 'GET', 'expiry', 86400])
+
+        message = self.message(DLR(pdu_type=CommandId.deliver_sm, msgid='ABC', status='DELIVRD', cid='abc',
+                                   dlr_details={'id': 'ABC', 'sub': 'ND', 'dlvrd': 'ND', 'sdate': 'ND',
+                                                'ddate': 'ND', 'err': 'ND', 'text': ''}))
+        yield self.dlr.deliver_sm_dlr_callback(message)
+
+        self.assertEqual(self.redisClient.evalsha.call_count, 1)
+        sha, keys, args = self.redisClient.evalsha.call_args[0]
+        self.assertEqual(sha, self.dlr.scripts['deliver_sm']['sha'])
+        self.assertEqual(keys, ['queue-msgid:ABC'])
+        # Final receipt
+        self.assertEqual(args[0], 1)
+        # Only REQUESTED receipts are consumed by success states
+        self.assertNotIn(RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED_FOR_FAILURE.name, args[1:])
+
+        self.assertEqual(self.amqpBroker.publish.call_count, 1)
+        content = self.amqpBroker.publish.call_args[1]['content']
+        self.assertEqual(content.properties['message-id'], 'MSGID')
+        self.assertEqual(self.amqpBroker.chan.basic_ack.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_compact_dlr_map(self):
+        data = dlrmap.dumps({'sc': 'httpapi', 'url': 'http://127.0.0.1/dlr', 'level': 2, 'method': 'GET',
+                             'connector': 'smppc', 'expiry': 86400})
+        self.redisClient.evalsha.return_value = defer.succeed(['MSGID', 'httpapi', '__compact__', data])
+
+        message = self.message(DLR(pdu_type=CommandId.deliver_sm, msgid='ABC', status='DELIVRD', cid='abc',
+                                   dlr_details={'id': 'ABC', 'sub': 'ND', 'dlvrd': 'ND', 'sdate': 'ND',
+                                                'ddate': 'ND', 'err': 'ND', 'text': ''}))
+        yield self.dlr.deliver_sm_dlr_callback(message)
+
+        # Compact maps' receipts are matched by their value
+        self.assertIn(str(RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED.value),
+                      self.redisClient.evalsha.call_args[0][2][1:])
+        self.assertEqual(self.amqpBroker.publish.call_count, 1)
+        content = self.amqpBroker.publish.call_args[1]['content']
+        self.assertEqual(content.properties['message-id'], 'MSGID')
+        self.assertEqual(content.properties['headers']['url'], 'http://127.0.0.1/dlr')
+        self.assertEqual(self.amqpBroker.chan.basic_ack.call_count, 1)
+
+    @defer.inlineCallbacks
+    def test_cached_smpp_msgid(self):
+        self.redisClient.evalsha.return_value = defer.succeed(
+            ['sc', 'httpapi', 'url', 'http://127.0.0.1/dlr', 'level', 2, 'method', 'POST', 'expiry', 86400])
+        self.redisClient.delete = Mock(return_value=defer.succeed(1))
+
+        yield self.dlr.submit_sm_resp_dlr_callback(
+            self.message(DLR(pdu_type=CommandId.submit_sm_resp, msgid='MSGID', status=CommandStatus.ESME_ROK,
+                             smpp_msgid=b'abc')))
+        self.assertEqual(self.redisClient.evalsha.call_count, 1)
+
+        # Intermediate then final receipts are served from the cache
+        for status in ['ACCEPTD', 'DELIVRD']:
+            yield self.dlr.deliver_sm_dlr_callback(
+                self.message(DLR(pdu_type=CommandId.deliver_sm, msgid='ABC', status=status, cid='abc',
+                                 dlr_details={'id': 'ABC', 'sub': 'ND', 'dlvrd': 'ND', 'sdate': 'ND',
+                                              'ddate': 'ND', 'err': 'ND', 'text': ''})))
+        self.assertEqual(self.redisClient.evalsha.call_count, 1)
+        self.assertEqual(self.amqpBroker.publish.call_count, 2)
+        self.assertEqual(self.amqpBroker.publish.call_args[1]['content'].properties['message-id'], 'MSGID')
+        self.assertEqual(self.amqpBroker.chan.basic_ack.call_count, 3)
+
+        # Final receipt consumed the dlr map
+        self.redisClient.delete.assert_called_once_with('dlr:MSGID')
+        self.assertNotIn('ABC', self.dlr.msgid_cache)
+        self.assertEqual(self.dlr.getStats()['hits'], 2)
+        # and exported by /metrics
+        self.assertEqual(ComponentsStatsCollector().get('dlr_lookup')[self.dlr.pid]['hits'], 2)
+
+    @defer.inlineCallbacks
+    def test_deliver_sm_unknown_msgid(self):
+        message = self.message(DLR(pdu_type=CommandId.deliver_sm, msgid='ABC', status='DELIVRD', cid='abc',
+                                   dlr_details={'id': 'ABC', 'sub': 'ND', 'dlvrd': 'ND', 'sdate': 'ND',
+                                                'ddate': 'ND', 'err': 'ND', 'text': ''}))
+        yield self.dlr.deliver_sm_dlr_callback(message)
+
+        self.assertEqual(self.amqpBroker.publish.call_count, 0)
+        self.assertEqual(self.amqpBroker.chan.basic_reject.call_count, 1)
+
+
+class DLRMapWriterTestCase(TestCase):
+    def setUp(self):
+        self.pipeline = Mock()
+        self.pipeline.execute_pipeline = Mock(side_effect=lambda: defer.succeed([]))
+        self.redisClient = Mock()
+        self.redisClient.script_load = Mock(return_value=defer.succeed('sha'))
+        self.redisClient.pipeline = Mock(side_effect=lambda: defer.succeed(self.pipeline))
+
+    @defer.inlineCallbacks
+    def test_batch_size(self):
+        writer = DLRMapWriter(self.redisClient, flush_interval=60, batch_size=3)
+
+        writer.set('dlr:1', {'sc': 'httpapi', 'level': 1}, 300)
+        writer.set('dlr:2', {'sc': 'httpapi', 'level': 2}, 300)
+        self.assertEqual(writer.getQueueDepth(), 2)
+        self.assertEqual(self.pipeline.evalsha.call_count, 0)
+
+        # Batch is full: maps are written in one pipeline, one script call per map
+        writer.set('dlr:3', {'sc': 'httpapi', 'level': 3}, 300)
+        yield writer.stop()
+        self.assertEqual(writer.getQueueDepth(), 0)
+        self.assertEqual(self.redisClient.script_load.call_count, 1)
+        self.assertEqual(self.pipeline.execute_pipeline.call_count, 1)
+        self.assertEqual(self.pipeline.evalsha.call_count, 3)
+        sha, keys, args = self.pipeline.evalsha.call_args[0]
+        self.assertEqual(sha, writer.script['sha'])
+        self.assertEqual(keys, ['dlr:3'])
+        self.assertEqual(args, [300, 'sc', 'httpapi', 'level', 3])
+
+        stats = writer.getStats()
+        self.assertEqual(stats['written'], 3)
+        self.assertEqual(stats['batches'], 1)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['in_flight'], 0)
+
+    @defer.inlineCallbacks
+    def test_flush_interval(self):
+        writer = DLRMapWriter(self.redisClient, flush_interval=0.01, batch_size=100)
+        writer.set('dlr:1', {'sc': 'httpapi'}, 300)
+        writer.set('dlr:2', {'sc': 'httpapi'}, 300)
+
+        yield deferLater(reactor, 0.05, lambda: None)
+        self.assertEqual(writer.getQueueDepth(), 0)
+        self.assertEqual(self.pipeline.execute_pipeline.call_count, 1)
+        self.assertEqual(self.pipeline.evalsha.call_count, 2)
+
+    @defer.inlineCallbacks
+    def test_stop_waits_for_pending_maps(self):
+        written = defer.Deferred()
+        self.pipeline.execute_pipeline = Mock(return_value=written)
+        writer = DLRMapWriter(self.redisClient, flush_interval=60, batch_size=100)
+        writer.set('dlr:1', {'sc': 'httpapi'}, 300)
+
+        stopped = writer.stop()
+        self.assertFalse(stopped.called)
+        self.assertEqual(writer.getStats()['in_flight'], 1)
+
+        written.callback([1])
+        yield stopped
+        self.assertEqual(writer.getStats()['written'], 1)
+
+    @defer.inlineCallbacks
+    def test_set_waits_for_write(self):
+        written = defer.Deferred()
+        self.pipeline.execute_pipeline = Mock(return_value=written)
+        writer = DLRMapWriter(self.redisClient, flush_interval=60, batch_size=2)
+
+        d1 = writer.set('dlr:1', {'sc': 'httpapi'}, 300)
+        d2 = writer.set('dlr:2', {'sc': 'httpapi'}, 300)
+        self.assertFalse(d1.called)
+
+        # Fired once their batch is written
+        written.callback([1, 1])
+        yield defer.gatherResults([d1, d2])
+        self.assertEqual(writer.getStats()['written'], 2)
+
+    @defer.inlineCallbacks
+    def test_script_reloaded(self):
+        replies = [defer.fail(defer.FirstError(Failure(ScriptDoesNotExist('NOSCRIPT')), 0)),
+                   defer.succeed([1])]
+        self.pipeline.execute_pipeline = Mock(side_effect=lambda: replies.pop(0))
+        writer = DLRMapWriter(self.redisClient, flush_interval=60, batch_size=1)
+        writer.script_loaded = True
+
+        writer.set('dlr:1', {'sc': 'httpapi'}, 300)
+        yield writer.stop()
+
+        self.assertEqual(self.redisClient.script_load.call_count, 1)
+        self.assertEqual(self.pipeline.execute_pipeline.call_count, 2)
+        self.assertEqual(writer.getStats()['written'], 1)
+        self.assertEqual(writer.getStats()['errors'], 0)
@@ -0,0 +1,145 @@
+"""
+Test cases for DLR maps compact format
+"""
+
+import datetime
+import struct
+from unittest.mock import Mock
+
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from smpp.pdu.pdu_types import AddrNpi, AddrTon, RegisteredDeliveryReceipt
+
+from jasmin.managers import dlrmap
+from jasmin.managers.dlr import DLRMapWriter
+
+
+class DLRMapFormatTestCase(TestCase):
+    def setUp(self):
+        # Valid utf-8 epoch bytes, test_httpapi decodes maps the way txredisapi does
+        self.epoch = 0x01020304
+        self.interned = {}
+        self.redisClient = Mock()
+        self.redisClient.eval = Mock(side_effect=self.intern)
+        self.redisClient.hmget = Mock(side_effect=self.hmget)
+        self.dictionary = dlrmap.DLRMapDictionary(self.redisClient)
+
+    def intern(self, script, keys, args):
+        string = args[0]
+        if string not in self.interned:
+            self.interned[string] = len(self.interned) + 1
+        return defer.succeed([self.epoch, self.interned[string]])
+
+    def hmget(self, key, fields):
+        strings = {'i:%s' % v: k for k, v in self.interned.items()}
+        return defer.succeed([str(self.epoch), strings.get(fields[1])])
+
+    @defer.inlineCallbacks
+    def test_httpapi(self):
+        values = {'sc': 'httpapi', 'url': 'http://127.0.0.1/dlr', 'level': 3, 'method': 'POST',
+                  'connector': 'smppc', 'expiry': 3600}
+        yield self.dictionary.internAll(dlrmap.internedStrings(values))
+        data = dlrmap.dumps(values, self.dictionary)
+
+        # Prefix is read by DLRLookup scripts
+        self.assertEqual(data[1], dlrmap.SC_HTTPAPI)
+        self.assertEqual(data[2], 3)
+        self.assertEqual(struct.unpack('!I', data[4:8])[0], 3600)
+        self.assertEqual(struct.unpack('!I', data[8:12])[0], self.epoch)
+        self.assertEqual(len(self.interned), 3)
+
+        # Decoded by another process, from a reply decoded by txredisapi
+        decoded = yield dlrmap.loads(data.decode(), dlrmap.DLRMapDictionary(self.redisClient))
+        self.assertEqual(decoded, values)
+
+    @defer.inlineCallbacks
+    def test_smppsapi(self):
+        sub_date = datetime.datetime.now()
+        values = {'sc': 'smppsapi', 'system_id': 'username',
+                  'source_addr_ton': AddrTon.INTERNATIONAL, 'source_addr_npi': AddrNpi.ISDN,
+                  'source_addr': b'JASMIN', 'dest_addr_ton': AddrTon.NATIONAL, 'dest_addr_npi': AddrNpi.ISDN,
+                  'destination_addr': b'06155423', 'sub_date': sub_date,
+                  'rd_receipt': RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED_FOR_FAILURE,
+                  'expiry': 3600}
+        yield self.dictionary.internAll(dlrmap.internedStrings(values))
+        data = dlrmap.dumps(values, self.dictionary)
+        self.assertEqual(data[2], RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED_FOR_FAILURE.value)
+
+        decoded = yield dlrmap.loads(data, self.dictionary)
+        # Same values as a fetched hash map
+        self.assertEqual(decoded, {
+            'sc': 'smppsapi', 'system_id': 'username',
+            'source_addr_ton': str(AddrTon.INTERNATIONAL), 'source_addr_npi': str(AddrNpi.ISDN),
+            'source_addr': 'JASMIN', 'dest_addr_ton': str(AddrTon.NATIONAL), 'dest_addr_npi': str(AddrNpi.ISDN),
+            'destination_addr': '06155423', 'sub_date': str(sub_date),
+            'rd_receipt': str(RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED_FOR_FAILURE),
+            'expiry': 3600})
+
+        # Fetched hash map values are packed the same way (migration)
+        self.assertEqual(dlrmap.dumps(decoded, self.dictionary), data)
+
+    @defer.inlineCallbacks
+    def test_not_interned(self):
+        values = {'sc': 'httpapi', 'url': 'http://127.0.0.1/dlr', 'level': 1, 'method': 'GET',
+                  'connector': None, 'expiry': 60}
+        data = dlrmap.dumps(values)
+
+        decoded = yield dlrmap.loads(data)
+        self.assertEqual(decoded['url'], 'http://127.0.0.1/dlr')
+        self.assertEqual(decoded['connector'], 'None')
+        self.assertEqual(self.redisClient.eval.call_count, 0)
+
+    @defer.inlineCallbacks
+    def test_lost_dictionary(self):
+        values = {'sc': 'httpapi', 'url': 'http://127.0.0.1/dlr', 'level': 3, 'method': 'POST',
+                  'connector': 'smppc', 'expiry': 3600}
+        yield self.dictionary.internAll(dlrmap.internedStrings(values))
+        data = dlrmap.dumps(values, self.dictionary)
+
+        # Dictionary is flushed and started again with another epoch, interned ids are reused
+        self.epoch, self.interned = 5678, {}
+        other_values = {'sc': 'httpapi', 'url': 'http://other/dlr', 'level': 3, 'method': 'GET',
+                        'connector': 'other', 'expiry': 3600}
+        writer_dictionary = dlrmap.DLRMapDictionary(self.redisClient)
+        yield writer_dictionary.internAll(dlrmap.internedStrings(other_values))
+        other_data = dlrmap.dumps(other_values, writer_dictionary)
+
+        # Maps of the lost dictionary cannot be decoded with the new one's strings
+        reader_dictionary = dlrmap.DLRMapDictionary(self.redisClient)
+        yield self.assertFailure(dlrmap.loads(data, reader_dictionary), dlrmap.DLRMapFormatError)
+        self.assertEqual((yield dlrmap.loads(other_data, reader_dictionary)), other_values)
+
+        # Ids cached with the lost epoch are dropped once the new epoch is known
+        yield self.dictionary.intern(b'new string')
+        self.assertEqual(self.dictionary.epoch, 5678)
+        self.assertIsNone(self.dictionary.getId(b'http://127.0.0.1/dlr'))
+
+    def test_invalid(self):
+        self.assertRaises(dlrmap.DLRMapFormatError, dlrmap.dumps, {'sc': 'unknown'})
+        self.assertRaises(dlrmap.DLRMapFormatError, dlrmap.dumps, {'sc': 'httpapi', 'level': 1})
+
+        data = dlrmap.dumps({'sc': 'httpapi', 'url': 'u', 'level': 1, 'method': 'GET', 'connector': 'c',
+                             'expiry': 60})
+        return self.assertFailure(dlrmap.loads(b'\x02' + data[1:]), dlrmap.DLRMapFormatError)
+
+    @defer.inlineCallbacks
+    def test_writer(self):
+        pipeline = Mock()
+        pipeline.execute_pipeline = Mock(return_value=defer.succeed([]))
+        self.redisClient.script_load = Mock(return_value=defer.succeed('sha'))
+        self.redisClient.pipeline = Mock(return_value=defer.succeed(pipeline))
+        writer = DLRMapWriter(self.redisClient, batch_size=2, dlr_map_format='compact', dictionary=self.dictionary)
+
+        values = {'sc': 'httpapi', 'url': 'http://127.0.0.1/dlr', 'level': 2, 'method': 'POST',
+                  'connector': 'smppc', 'expiry': 300}
+        writer.set('dlr:1', values, 300)
+        # Cannot be packed (unknown sc), written as a hash
+        writer.set('dlr:2', {'sc': 'other'}, 300)
+        yield writer.stop()
+
+        self.assertEqual(pipeline.set.call_count, 1)
+        key, data = pipeline.set.call_args[0]
+        self.assertEqual(key, 'dlr:1')
+        self.assertEqual(pipeline.set.call_args[1], {'expire': 300})
+        self.assertEqual(data, dlrmap.dumps(values, self.dictionary))
+        self.assertEqual(pipeline.evalsha.call_count, 1)
@@ -19,9 +19,11 @@ from smpp.twisted.protocol import SMPPSessionStates
 
 import jasmin
 from jasmin.managers.clients import SMPPClientManagerPB
-from jasmin.managers.configs import SMPPClientPBConfig
+from jasmin.managers.configs import SMPPClientPBConfig, SMPPClientSMListenerConfig
+from jasmin.managers.listeners import SMPPClientSMListener
 from jasmin.managers.proxies import SMPPClientManagerPBProxy
 from jasmin.protocols.smpp.configs import SMPPClientConfig
+from jasmin.protocols.smpp.factory import SMPPClientFactory
 from jasmin.protocols.smpp.operations import SMPPOperationFactory
 from tests.protocols.smpp.smsc_simulator import HappySMSC, HappySMSCRecorder, DeliverSMSMSC
 from jasmin.queues.configs import AmqpConfig
@@ -1180,3 +1182,127 @@ class ClientConnectorStatusTestCases(SMSCSimulator):
 
         # Give a grace time for stopping
         yield waitFor(0.2)
+
+
+class SubmitWindowTestCases(TestCase):
+    def setUp(self):
+        self.config = SMPPClientConfig(id='window', max_outstanding_submits=2)
+        self.factory = SMPPClientFactory(self.config)
+        self.listener = SMPPClientSMListener(SMPPClientSMListenerConfig(), self.factory, None, None)
+
+    def test_window(self):
+        acquired = [self.listener.submit_window.acquire() for _ in range(3)]
+        self.listener.updateSubmitWindowStats()
+
+        self.assertEqual([d.called for d in acquired], [True, True, False])
+        self.assertEqual(self.factory.stats.get('submit_sm_window'), 2)
+        self.assertEqual(self.factory.stats.get('submit_sm_outstanding'), 2)
+
+        self.listener.releaseSubmitWindow()
+        self.assertTrue(acquired[2].called)
+        self.assertEqual(self.factory.stats.get('submit_sm_outstanding'), 2)
+
+    def test_resize(self):
+        acquired = [self.listener.submit_window.acquire() for _ in range(4)]
+
+        # Growing the window will release waiting submits
+        self.config.max_outstanding_submits = 3
+        self.listener.resizeSubmitWindow()
+        self.assertEqual([d.called for d in acquired], [True, True, True, False])
+
+        # Shrinking it will not release waiting submits until outstanding ones are back under the limit
+        self.config.max_outstanding_submits = 1
+        self.listener.resizeSubmitWindow()
+        self.listener.releaseSubmitWindow()
+        self.listener.releaseSubmitWindow()
+        self.assertFalse(acquired[3].called)
+        self.assertEqual(self.factory.stats.get('submit_sm_outstanding'), 1)
+
+        self.listener.releaseSubmitWindow()
+        self.assertTrue(acquired[3].called)
+
+    def test_clear_submit_window(self):
+        acquired = [self.listener.submit_window.acquire() for _ in range(3)]
+
+        self.listener.clearAllTimers()
+        self.assertFailure(acquired[2], defer.CancelledError)
+        self.assertEqual(len(self.listener.submit_window.waiting), 0)
+        return acquired[2]
+
+
+class ConnectorsCacheTestCases(TestCase):
+    def setUp(self):
+        self.pb = SMPPClientManagerPB(SMPPClientPBConfig())
+
+        self.connector = {'id': 'cache', 'config': SMPPClientConfig(id='cache', binds=2), 'binds': []}
+        self.pb.setConnectorBinds(self.connector)
+        self.pb.connectors.append(self.connector)
+        self.pb.invalidateConnectorsCache()
+
+    def test_live_config(self):
+        self.assertIs(self.pb.getConnector('cache'), self.connector)
+        self.assertIs(self.pb.getConnectorConfig('cache'), self.connector['config'])
+        self.assertIsNone(self.pb.getConnectorConfig('unknown'))
+
+    def test_session_state(self):
+        self.assertEqual(self.pb.getConnectorSessionState('cache'), SMPPSessionStates.NONE)
+        self.assertIsNone(self.pb.getConnectorSessionState('unknown'))
+
+        # A multi-bind connector is bound when any of its binds is
+        self.connector['binds'][1]['service'].SMPPClientFactory.smpp = Mock(
+            sessionState=SMPPSessionStates.BOUND_TRX)
+        self.assertEqual(self.pb.getConnectorSessionState('cache'), SMPPSessionStates.BOUND_TRX)
+
+    def test_invalidation(self):
+        version = self.pb.connectors_version
+        self.pb.getConnector('cache')
+
+        self.assertTrue(self.pb.delConnector('cache'))
+        self.assertGreater(self.pb.connectors_version, version)
+        self.assertIsNone(self.pb.getConnector('cache'))
+
+        # Cache is only rebuilt when its version is outdated
+        self.pb.connectors.append(self.connector)
+        self.assertIsNone(self.pb.getConnector('cache'))
+        self.pb.invalidateConnectorsCache()
+        self.assertIs(self.pb.getConnector('cache'), self.connector)
+
+
+class MultiBindTestCases(TestCase):
+    def setUp(self):
+        self.config = SMPPClientConfig(id='multibind', max_outstanding_submits=2, binds=3)
+        self.listeners = []
+        for _ in range(self.config.binds):
+            factory = SMPPClientFactory(self.config)
+            factory.smpp = Mock(isBound=Mock(return_value=True))
+            self.listeners.append(
+                SMPPClientSMListener(SMPPClientSMListenerConfig(), factory, None, None))
+        for listener in self.listeners:
+            listener.siblings = self.listeners
+
+    def test_pick_least_loaded(self):
+        self.assertIs(self.listeners[1].pickBind(), self.listeners[1])
+
+        self.listeners[0].submit_window.acquire()
+        self.listeners[1].submit_window.acquire()
+        self.assertIs(self.listeners[0].pickBind(), self.listeners[2])
+
+    def test_pick_bound_only(self):
+        self.listeners[0].submit_window.acquire()
+        self.listeners[1].SMPPClientFactory.smpp.isBound.return_value = False
+        self.listeners[2].SMPPClientFactory.smpp = None
+        self.assertIs(self.listeners[0].pickBind(), self.listeners[0])
+
+        # No bound session at all
+        self.listeners[0].SMPPClientFactory.smpp = None
+        self.assertIs(self.listeners[1].pickBind(), self.listeners[1])
+
+    def test_aggregated_stats(self):
+        self.listeners[0].submit_window.acquire()
+        self.listeners[2].submit_window.acquire()
+        self.listeners[2].updateSubmitWindowStats()
+
+        # Binds are sharing the connector's stats
+        stats = self.listeners[0].SMPPClientFactory.stats
+        self.assertEqual(stats.get('submit_sm_window'), 6)
+        self.assertEqual(stats.get('submit_sm_outstanding'), 2)
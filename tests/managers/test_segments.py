@@ -0,0 +1,193 @@
+"""
+Test cases for long SMS-MO reassembly
+"""
+
+import pickle
+from unittest.mock import Mock, patch
+
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from smpp.pdu.operations import DeliverSM
+from smpp.pdu.pdu_types import EsmClass, EsmClassMode, EsmClassType, EsmClassGsmFeatures
+
+from jasmin.managers.configs import SMPPClientSMListenerConfig
+from jasmin.managers.listeners import SMPPClientSMListener
+from jasmin.managers.segments import SegmentsBuffer, concatenate
+from jasmin.protocols.smpp.configs import SMPPClientConfig, UnknownValue
+from jasmin.protocols.smpp.factory import SMPPClientFactory
+
+
+def sar_segments(contents, msg_ref_num=12):
+    pdus = {}
+    for i, content in enumerate(contents):
+        pdus[i + 1] = DeliverSM(source_addr=b'1234', destination_addr=b'4567', short_message=content,
+                                sar_total_segments=len(contents), sar_segment_seqnum=i + 1,
+                                sar_msg_ref_num=msg_ref_num)
+    return pdus
+
+
+class ConcatenateTestCase(TestCase):
+    def test_sar(self):
+        pdus = sar_segments([b'hello ', b'world'])
+        pdu = concatenate(pdus, 2, 'sar')
+
+        self.assertEqual(pdu.params['short_message'], b'hello world')
+        self.assertNotIn('sar_msg_ref_num', pdu.params)
+        # Segments are kept as received
+        self.assertEqual(pdus[1].params['short_message'], b'hello ')
+        self.assertEqual(pdus[1].params['sar_msg_ref_num'], 12)
+
+    def test_udh(self):
+        esm_class = EsmClass(EsmClassMode.DEFAULT, EsmClassType.DEFAULT, [EsmClassGsmFeatures.UDHI_INDICATOR_SET])
+        pdus = {
+            1: DeliverSM(source_addr=b'1234', esm_class=esm_class, short_message=b'\x05\x00\x03\x0c\x02\x01hello '),
+            2: DeliverSM(source_addr=b'1234', esm_class=esm_class, short_message=b'\x05\x00\x03\x0c\x02\x02world'),
+        }
+        pdu = concatenate(pdus, 2, 'udh')
+
+        self.assertEqual(pdu.params['short_message'], b'hello world')
+        self.assertIsNone(pdu.params['esm_class'])
+
+    def test_message_payload(self):
+        pdus = sar_segments([b'', b''])
+        for i, content in [(1, b'hello '), (2, b'world')]:
+            del pdus[i].params['short_message']
+            pdus[i].params['message_payload'] = content
+
+        self.assertEqual(concatenate(pdus, 2, 'sar').params['message_payload'], b'hello world')
+
+
+class SegmentsBufferTestCase(TestCase):
+    def setUp(self):
+        self.buffer = SegmentsBuffer(ttl=300, max_messages=2, max_bytes=100, log=Mock())
+
+    def test_unordered(self):
+        pdus = sar_segments([b'a', b'b', b'c'])
+
+        self.assertIsNone(self.buffer.add('key', 3, 3, pdus[3]))
+        self.assertIsNone(self.buffer.add('key', 3, 1, pdus[1]))
+        self.assertEqual(self.buffer.add('key', 3, 2, pdus[2]), pdus)
+
+        stats = self.buffer.getStats()
+        self.assertEqual(stats['assembled'], 1)
+        self.assertEqual(stats['pending_messages'], 0)
+        self.assertEqual(stats['pending_bytes'], 0)
+
+    def test_duplicate(self):
+        pdus = sar_segments([b'a', b'b'])
+
+        self.assertIsNone(self.buffer.add('key', 2, 1, pdus[1]))
+        self.assertIsNone(self.buffer.add('key', 2, 1, pdus[1]))
+        self.assertEqual(self.buffer.getStats()['duplicates'], 1)
+        self.assertEqual(self.buffer.add('key', 2, 2, pdus[2]), pdus)
+
+    def test_expiry(self):
+        pdus = sar_segments([b'a', b'b'])
+
+        with patch('jasmin.managers.segments.time.monotonic', return_value=1000):
+            self.buffer.add('key', 2, 1, pdus[1])
+        with patch('jasmin.managers.segments.time.monotonic', return_value=1301):
+            # First segment expired, second one is buffered as a new message
+            self.assertIsNone(self.buffer.add('key', 2, 2, pdus[2]))
+
+        stats = self.buffer.getStats()
+        self.assertEqual(stats['expired'], 1)
+        self.assertEqual(stats['pending_messages'], 1)
+
+    def test_max_messages(self):
+        for key in ['key1', 'key2', 'key3']:
+            self.buffer.add(key, 2, 1, sar_segments([b'a', b'b'])[1])
+
+        self.assertEqual(list(self.buffer.messages.keys()), ['key2', 'key3'])
+        self.assertEqual(self.buffer.getStats()['evicted'], 1)
+
+    def test_max_bytes(self):
+        self.buffer.add('key1', 2, 1, sar_segments([b'a' * 60, b'b'])[1])
+        self.buffer.add('key2', 2, 1, sar_segments([b'a' * 60, b'b'])[1])
+
+        self.assertEqual(list(self.buffer.messages.keys()), ['key2'])
+        self.assertEqual(self.buffer.getStats()['pending_bytes'], 60)
+
+
+class LongContentBufferConfigTestCase(TestCase):
+    def config(self, value):
+        path = self.mktemp()
+        with open(path, 'w') as f:
+            f.write('[sm-listener]\nlong_content_buffer = %s\n' % value)
+        return SMPPClientSMListenerConfig(path)
+
+    def test_valid(self):
+        self.assertEqual(SMPPClientSMListenerConfig().long_content_buffer, 'redis')
+        self.assertEqual(self.config('memory').long_content_buffer, 'memory')
+        self.assertEqual(self.config('redis').long_content_buffer, 'redis')
+
+    def test_invalid(self):
+        self.assertRaises(UnknownValue, self.config, 'Redis')
+        self.assertRaises(UnknownValue, self.config, 'disk')
+
+
+class RedisHashes:
+    """The redis hash commands used for long content reassembly"""
+
+    def __init__(self):
+        self.hashes = {}
+
+    def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+        return defer.succeed(1)
+
+    def expire(self, key, seconds):
+        return defer.succeed(1)
+
+    def hlen(self, key):
+        return defer.succeed(len(self.hashes.get(key, {})))
+
+    def hvals(self, key):
+        return defer.succeed(list(self.hashes.get(key, {}).values()))
+
+    def delete(self, key):
+        return defer.succeed(1 if self.hashes.pop(key, None) is not None else 0)
+
+
+class RedisConcatenationTestCase(TestCase):
+    def setUp(self):
+        self.redis = RedisHashes()
+        self.listener = SMPPClientSMListener(SMPPClientSMListenerConfig(),
+                                             SMPPClientFactory(SMPPClientConfig(id='long')), None, self.redis)
+        self.listener.deliverConcatenatedSm = Mock(return_value=defer.succeed(None))
+
+    @defer.inlineCallbacks
+    def receive(self, pdus, segment_seqnum, hashKey='longDeliverSm:long:12:4567'):
+        hset = yield self.redis.hset(hashKey, segment_seqnum, pickle.dumps(
+            {'pdu': pdus[segment_seqnum], 'total_segments': len(pdus), 'msg_ref_num': 12,
+             'segment_seqnum': segment_seqnum}))
+        yield self.listener.concatDeliverSMs(hset, hashKey, 'sar', len(pdus), 12, segment_seqnum)
+
+    @defer.inlineCallbacks
+    def test_unordered(self):
+        pdus = sar_segments([b'a', b'b', b'c'])
+
+        # Last part first
+        yield self.receive(pdus, 3)
+        yield self.receive(pdus, 1)
+        self.assertFalse(self.listener.deliverConcatenatedSm.called)
+
+        yield self.receive(pdus, 2)
+        self.assertEqual(self.listener.deliverConcatenatedSm.call_count, 1)
+        delivered, total_segments, splitMethod = self.listener.deliverConcatenatedSm.call_args[0]
+        self.assertEqual(sorted(delivered), [1, 2, 3])
+        self.assertEqual(delivered[2].params['short_message'], b'b')
+        self.assertEqual(total_segments, 3)
+        self.assertEqual(self.redis.hashes, {})
+
+    @defer.inlineCallbacks
+    def test_already_delivered(self):
+        pdus = sar_segments([b'a', b'b'])
+        yield self.receive(pdus, 1)
+        yield self.receive(pdus, 2)
+
+        # Another instance completing the same message after it got deleted will not deliver it again
+        self.redis.delete = Mock(return_value=defer.succeed(0))
+        yield self.receive(pdus, 1)
+        yield self.receive(pdus, 2)
+        self.assertEqual(self.listener.deliverConcatenatedSm.call_count, 1)
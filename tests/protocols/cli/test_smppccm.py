@@ -177,6 +177,9 @@ class BasicTestCases(HappySMSCTestCase):
             r'dst_npi 1',
             r'trx_to 300',
             r'ssl no',
+            r'submit_window 1',
+            r'binds 1',
+            r'dlr_format standard',
         ]
         commands = [{'command': 'smppccm -s %s' % cid, 'expect': expectedList}]
         yield self._test(r'jcli : ', commands)
@@ -262,6 +265,9 @@ class BasicTestCases(HappySMSCTestCase):
             r'dst_npi 1',
             r'trx_to 300',
             r'ssl no',
+            r'submit_window 1',
+            r'binds 1',
+            r'dlr_format standard',
         ]
         commands = [{'command': 'smppccm -s %s' % cid, 'expect': expectedList}]
         yield self._test(r'jcli : ', commands)
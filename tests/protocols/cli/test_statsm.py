@@ -166,6 +166,8 @@ class SmppcStatsTestCases(SmppccmTestCases):
                         '#other_submit_error_count  0',
                         '#interceptor_error_count   0',
                         '#interceptor_count         0',
+                        '#submit_sm_window          1',
+                        '#submit_sm_outstanding     0',
                         ]
         commands = [{'command': 'stats --smppc=test_smppc', 'expect': expectedList}]
         yield self._test(r'jcli : ', commands)
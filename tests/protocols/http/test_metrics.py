@@ -1,5 +1,11 @@
+from unittest.mock import Mock
+
 from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from twisted.web.test.requesthelper import DummyRequest
 
+from jasmin.protocols.http.endpoints.metrics import Metrics
+from jasmin.tools.stats import ComponentsStatsCollector
 from .test_server import HTTPApiTestCases
 
 
@@ -64,3 +70,22 @@ class HttpapiTestCases(MetricsTestCases):
                          int(_after['httpapi_request_count'].encode()))
         self.assertEqual(int(_before['httpapi_server_error_count'].encode()) + 1,
                          int(_after['httpapi_server_error_count'].encode()))
+
+
+class ComponentsTestCases(TestCase):
+    def setUp(self):
+        ComponentsStatsCollector().register('store', 'test', lambda: {
+            'persisted': 2, 'failed': 0, 'last_duration': None, 'max_duration': 0.5})
+        self.addCleanup(ComponentsStatsCollector().unregister, 'store', 'test')
+
+        SMPPClientManagerPB = Mock()
+        SMPPClientManagerPB.perspective_connector_list.return_value = []
+        self.metrics = Metrics(SMPPClientManagerPB, Mock())
+
+    def test_store(self):
+        response = self.metrics.render_GET(DummyRequest([b'metrics'])).decode().split('\n')
+
+        self.assertIn('store_persisted{id="test"} 2', response)
+        self.assertIn('store_max_duration{id="test"} 0.5', response)
+        # Unset values are not exported
+        self.assertNotIn('store_last_duration{id="test"} None', response)
@@ -0,0 +1,169 @@
+import json
+from unittest.mock import Mock
+
+from twisted.internet import defer, reactor, task
+from twisted.trial.unittest import TestCase
+
+from jasmin.managers.clients import SMPPClientManagerPB
+from jasmin.managers.configs import SMPPClientPBConfig
+from jasmin.protocols.http.configs import HTTPApiConfig
+from jasmin.protocols.http.server import HTTPApi
+from jasmin.routing.Filters import DestinationAddrFilter, EvalPyFilter
+from jasmin.routing.Routes import DefaultRoute, StaticMTRoute
+from jasmin.routing.router import RouterPB
+from jasmin.routing.configs import RouterPBConfig
+from jasmin.routing.jasminApi import User, Group, SmppClientConnector
+from .twisted_web_test_utils import DummySite
+
+
+class SendBatchTestCases(TestCase):
+    def setUp(self):
+        self.RouterPB_f = RouterPB(RouterPBConfig())
+
+        # Provision Router with Users and Route
+        self.g1 = Group(1)
+        self.u1 = User(1, self.g1, 'nathalie', 'correct')
+        self.u2 = User(2, self.g1, 'sabrina', 'correct')
+        self.RouterPB_f.groups.append(self.g1)
+        self.RouterPB_f.users.append(self.u1)
+        self.RouterPB_f.users.append(self.u2)
+        self.RouterPB_f.indexGroups()
+        self.RouterPB_f.indexUsers()
+        self.RouterPB_f.mt_routing_table.add(DefaultRoute(SmppClientConnector('abc')), 0)
+
+        # Batches are published through a mocked SMPPClientManagerPB
+        SMPPClientPBConfigInstance = SMPPClientPBConfig()
+        SMPPClientPBConfigInstance.authentication = False
+        self.clientManager_f = SMPPClientManagerPB(SMPPClientPBConfigInstance)
+        self.clientManager_f.submitSmBatch = Mock(
+            side_effect=lambda uid, cid, submit_sms: defer.succeed(
+                ['%s-%s' % (cid, i) for i in range(len(submit_sms))]))
+
+        self.config = HTTPApiConfig()
+        self.web = DummySite(HTTPApi(self.RouterPB_f, self.clientManager_f, self.config))
+
+    def tearDown(self):
+        self.RouterPB_f.cancelPersistenceTimer()
+
+    def post_batch(self, messages, username='nathalie', password='correct', _globals=None):
+        return self.web.post(b'sendbatch', json_data={
+            'username': username,
+            'password': password,
+            'globals': _globals or {},
+            'messages': messages})
+
+    @defer.inlineCallbacks
+    def wait_batch(self, batch_id, username='nathalie'):
+        """Poll /batchstatus until batch is done"""
+        for _ in range(100):
+            response = yield self.web.get(b'batchstatus', {b'username': username,
+                                                          b'password': b'correct',
+                                                          b'batch_id': batch_id})
+            self.assertEqual(response.responseCode, 200)
+            status = json.loads(response.value())
+            if status['status'] == 'done':
+                defer.returnValue(status)
+
+            yield task.deferLater(reactor, 0.01, lambda: None)
+
+        self.fail('Batch %s is not done' % batch_id)
+
+    @defer.inlineCallbacks
+    def test_send_batch(self):
+        response = yield self.post_batch(
+            [{'to': ['06155423', '06155424'], 'content': 'hello'},
+             {'to': '06155425', 'content': 'world', 'dlr_level': 2}],
+            _globals={'dlr_url': 'http://127.0.0.1/dlr'})
+        self.assertEqual(response.responseCode, 200)
+        result = json.loads(response.value())
+        self.assertEqual(result['messageCount'], 3)
+
+        status = yield self.wait_batch(result['batchId'])
+        self.assertEqual(status['total'], 3)
+        self.assertEqual(status['submitted'], 3)
+        self.assertEqual(status['failed'], 0)
+
+        # One batched submission for the connector
+        self.assertEqual(self.clientManager_f.submitSmBatch.call_count, 1)
+        uid, cid, submit_sms = self.clientManager_f.submitSmBatch.call_args[0]
+        self.assertEqual((uid, cid), (1, 'abc'))
+        self.assertEqual([sm['SubmitSmPDU'].params['destination_addr'] for sm in submit_sms],
+                         [b'06155423', b'06155424', b'06155425'])
+        self.assertEqual([sm['dlr_level'] for sm in submit_sms], [1, 1, 2])
+        self.assertEqual(submit_sms[0]['dlr_url'], b'http://127.0.0.1/dlr')
+
+    @defer.inlineCallbacks
+    def test_invalid_messages(self):
+        response = yield self.post_batch(
+            [{'to': '06155423', 'content': 'hello'},
+             {'to': 'abc', 'content': 'hello'},
+             {'to': '06155424'}])
+        result = json.loads(response.value())
+
+        status = yield self.wait_batch(result['batchId'])
+        self.assertEqual(status['submitted'], 1)
+        self.assertEqual(status['failed'], 2)
+
+    @defer.inlineCallbacks
+    def test_chunks(self):
+        self.config.batch_chunk_size = 2
+
+        response = yield self.post_batch([{'to': '0615542%s' % i, 'content': 'hello'} for i in range(5)])
+        result = json.loads(response.value())
+
+        status = yield self.wait_batch(result['batchId'])
+        self.assertEqual(status['submitted'], 5)
+        self.assertEqual([len(c[0][2]) for c in self.clientManager_f.submitSmBatch.call_args_list], [2, 2, 1])
+
+    @defer.inlineCallbacks
+    def test_routes_cache(self):
+        self.RouterPB_f.mt_routing_table.add(
+            StaticMTRoute([DestinationAddrFilter(r'^0616')], SmppClientConnector('def'), 0.0), 10)
+        self.RouterPB_f.mt_routing_table.getRouteFor = Mock(wraps=self.RouterPB_f.mt_routing_table.getRouteFor)
+
+        response = yield self.post_batch([{'to': ['06155423', '06165423', '06155423', '06165423'],
+                                           'content': 'hello'}])
+        result = json.loads(response.value())
+
+        status = yield self.wait_batch(result['batchId'])
+        self.assertEqual(status['submitted'], 4)
+        # Route is resolved once per destination
+        self.assertEqual(self.RouterPB_f.mt_routing_table.getRouteFor.call_count, 2)
+        self.assertEqual(sorted((c[0][1], len(c[0][2])) for c in self.clientManager_f.submitSmBatch.call_args_list),
+                         [('abc', 2), ('def', 2)])
+
+    @defer.inlineCallbacks
+    def test_routes_cache_disabled(self):
+        self.RouterPB_f.mt_routing_table.add(
+            StaticMTRoute([EvalPyFilter('result = False')], SmppClientConnector('def'), 0.0), 10)
+        self.RouterPB_f.mt_routing_table.getRouteFor = Mock(wraps=self.RouterPB_f.mt_routing_table.getRouteFor)
+
+        response = yield self.post_batch([{'to': ['06155423', '06155423'], 'content': 'hello'}])
+        result = json.loads(response.value())
+
+        yield self.wait_batch(result['batchId'])
+        self.assertEqual(self.RouterPB_f.mt_routing_table.getRouteFor.call_count, 2)
+
+    @defer.inlineCallbacks
+    def test_authentication_failure(self):
+        response = yield self.post_batch([{'to': '06155423', 'content': 'hello'}], password='incorrec')
+        self.assertEqual(response.responseCode, 403)
+        self.assertEqual(self.clientManager_f.submitSmBatch.call_count, 0)
+
+    @defer.inlineCallbacks
+    def test_max_messages(self):
+        self.config.batch_max_messages = 2
+
+        response = yield self.post_batch([{'to': ['06155423', '06155424', '06155425'], 'content': 'hello'}])
+        self.assertEqual(response.responseCode, 400)
+
+    @defer.inlineCallbacks
+    def test_status_owner(self):
+        response = yield self.post_batch([{'to': '06155423', 'content': 'hello'}])
+        result = json.loads(response.value())
+        yield self.wait_batch(result['batchId'])
+
+        response = yield self.web.get(b'batchstatus', {b'username': 'sabrina',
+                                                      b'password': b'correct',
+                                                      b'batch_id': result['batchId']})
+        self.assertEqual(response.responseCode, 404)
@@ -28,6 +28,8 @@ class HTTPApiTestCases(TestCase):
         self.u1 = User(1, self.g1, 'nathalie', 'correct')
         self.RouterPB_f.groups.append(self.g1)
         self.RouterPB_f.users.append(self.u1)
+        self.RouterPB_f.indexGroups()
+        self.RouterPB_f.indexUsers()
         self.RouterPB_f.mt_routing_table.add(DefaultRoute(SmppClientConnector('abc')), 0)
 
         # Instanciate a SMPPClientManagerPB (a requirement for HTTPApi)
@@ -423,6 +425,7 @@ class RateTestCases(HTTPApiTestCases):
         u3.mt_credential.setQuota('balance', 10)
         self.RouterPB_f.users.append(u2)
         self.RouterPB_f.users.append(u3)
+        self.RouterPB_f.indexUsers()
         filters = [GroupFilter(Group(2))]
         route = StaticMTRoute(filters, SmppClientConnector('abc'), 1.5)
         self.RouterPB_f.mt_routing_table.add(route, 2)
@@ -522,6 +525,7 @@ class BalanceTestCases(HTTPApiTestCases):
         u3.mt_credential.setQuota('balance', 10)
         self.RouterPB_f.users.append(u2)
         self.RouterPB_f.users.append(u3)
+        self.RouterPB_f.indexUsers()
 
     @defer.inlineCallbacks
     def test_balance_with_correct_args(self):
@@ -0,0 +1,66 @@
+import io
+import json
+
+from twisted.trial.unittest import TestCase
+from twisted.web.test.requesthelper import DummyRequest
+
+from jasmin.protocols.http.errors import UrlArgsValidationError
+from jasmin.protocols.http.endpoints.balance import BALANCE_PARSER
+from jasmin.protocols.http.endpoints.rate import RATE_PARSER
+from jasmin.protocols.http.endpoints.send import SEND_PARSER
+
+
+class HttpRequestParserTestCases(TestCase):
+    def request(self, args=None, json_data=None):
+        request = DummyRequest([b'send'])
+        request.args = args or {}
+        if json_data is not None:
+            request.requestHeaders.setRawHeaders(b'content-type', [b'application/json'])
+            request.content = io.BytesIO(json.dumps(json_data).encode())
+        return request
+
+    def assertParseError(self, parser, request, message):
+        e = self.assertRaises(UrlArgsValidationError, parser.parse, request)
+        self.assertEqual(e.message, message)
+
+    def test_send_defaults(self):
+        args = SEND_PARSER.parse(self.request({b'username': [b'fourat'], b'password': [b'correct'],
+                                               b'to': [b'06155423'], b'content': [b'hello'],
+                                               b'dlr-url': [b'http://127.0.0.1/dlr']}))
+        self.assertEqual(args[b'coding'], [b'0'])
+        self.assertEqual(args[b'dlr'], [b'yes'])
+        self.assertEqual(args[b'dlr-level'], [1])
+        self.assertEqual(args[b'dlr-method'], [b'POST'])
+
+    def test_send_json(self):
+        args = SEND_PARSER.parse(self.request(json_data={'username': 'fourat', 'password': 'correct',
+                                                         'to': '06155423', 'content': 'hello', 'coding': 8}))
+        self.assertEqual(args[b'username'], [b'fourat'])
+        self.assertEqual(args[b'coding'], [8])
+        self.assertEqual(args[b'dlr'], [b'no'])
+
+    def test_send_content(self):
+        self.assertParseError(SEND_PARSER, self.request({b'username': [b'fourat'], b'password': [b'correct'],
+                                                         b'to': [b'06155423']}),
+                              'content or hex-content not present.')
+
+    def test_rate_defaults(self):
+        args = RATE_PARSER.parse(self.request({b'username': [b'fourat'], b'password': [b'correct'],
+                                               b'to': [b'06155423']}))
+        self.assertEqual(args[b'content'], [b''])
+        self.assertEqual(args[b'coding'], [b'0'])
+
+    def test_errors_order(self):
+        # Unknown first argument, then invalid values and mandatory fields in fields order,
+        # then other unknown arguments
+        self.assertParseError(BALANCE_PARSER, self.request({b'any': [b'1'], b'username': [b'x' * 17]}),
+                              b'Argument [any] is unknown.')
+        self.assertParseError(BALANCE_PARSER, self.request({b'username': [b'x' * 17], b'any': [b'1']}),
+                              b'Argument [username] has an invalid value: [%s].' % (b'x' * 17))
+        self.assertParseError(BALANCE_PARSER, self.request({b'username': [b'fourat'], b'any': [b'1']}),
+                              b'Mandatory argument [password] is not found.')
+        self.assertParseError(BALANCE_PARSER, self.request({b'username': [b'fourat'], b'password': [b'correct'],
+                                                            b'any': [b'1']}),
+                              b'Argument [any] is unknown.')
+        self.assertParseError(BALANCE_PARSER, self.request(),
+                              'Mandatory arguments not found, please refer to the HTTPAPI specifications.')
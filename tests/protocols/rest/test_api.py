@@ -0,0 +1,81 @@
+"""
+Test cases for jasmin-restapi authentication through Jasmin's http api
+"""
+
+import importlib
+from unittest.mock import Mock, patch
+
+from twisted.trial.unittest import TestCase
+
+# jasmin.protocols.rest.api is shadowed by the falcon application in jasmin.protocols.rest
+api = importlib.import_module('jasmin.protocols.rest.api')
+
+
+class AuthenticateTestCase(TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        self.session = Mock()
+        self.session.get.return_value = Mock(status_code=200, content=b'{"balance": 10, "sms_count": "ND"}')
+
+        patcher = patch.object(api, 'get_http_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.setAuthCache(10)
+
+        self.proxy = api.JasminHttpApiProxy()
+
+    def setAuthCache(self, seconds):
+        auth_cache = api.AuthCache(seconds, 500)
+        auth_cache.cache.clock = lambda: self.now
+
+        patcher = patch.object(api, 'auth_cache', auth_cache)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_cache_hit(self):
+        self.assertTrue(self.proxy.authenticate('nathalie', 'correct'))
+        self.assertTrue(self.proxy.authenticate('nathalie', 'correct'))
+
+        # Credentials were checked once through /balance
+        self.session.get.assert_called_once_with('%s/balance' % api.old_api_uri,
+                                                 params={'username': 'nathalie', 'password': 'correct'},
+                                                 timeout=api.old_api_timeout)
+
+        # and are not cached in clear
+        self.assertNotIn(('nathalie', 'correct'), api.auth_cache.cache)
+
+    def test_cache_other_password(self):
+        self.assertTrue(self.proxy.authenticate('nathalie', 'correct'))
+
+        self.session.get.return_value = Mock(status_code=403, content=b'"Authentication failure for username:nathalie"')
+        self.assertFalse(self.proxy.authenticate('nathalie', 'incorrect'))
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_ttl_expiry(self):
+        self.assertTrue(self.proxy.authenticate('nathalie', 'correct'))
+
+        self.now += 9
+        self.assertTrue(self.proxy.authenticate('nathalie', 'correct'))
+        self.assertEqual(self.session.get.call_count, 1)
+
+        # Checked again once expired
+        self.now += 1
+        self.assertTrue(self.proxy.authenticate('nathalie', 'correct'))
+        self.assertEqual(self.session.get.call_count, 2)
+
+    def test_cache_disabled(self):
+        self.setAuthCache(0)
+
+        self.assertTrue(self.proxy.authenticate('nathalie', 'correct'))
+        self.assertTrue(self.proxy.authenticate('nathalie', 'correct'))
+        self.assertEqual(self.session.get.call_count, 2)
+        self.assertEqual(len(api.auth_cache.cache), 0)
+
+    def test_failure_not_cached(self):
+        self.session.get.return_value = Mock(status_code=403, content=b'"Authentication failure for username:nathalie"')
+        self.assertFalse(self.proxy.authenticate('nathalie', 'correct'))
+
+        # Credentials are fixed (or user enabled) in Jasmin
+        self.session.get.return_value = Mock(status_code=200, content=b'{"balance": 10, "sms_count": "ND"}')
+        self.assertTrue(self.proxy.authenticate('nathalie', 'correct'))
+        self.assertEqual(self.session.get.call_count, 2)
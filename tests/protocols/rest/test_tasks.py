@@ -0,0 +1,140 @@
+"""
+Test cases for jasmin-celery tasks: http api calls and batch callbacks
+"""
+
+from datetime import timedelta
+from unittest.mock import Mock, call, patch
+
+from twisted.trial.unittest import TestCase
+
+from jasmin.protocols.rest import tasks
+
+RESULTS = [('06155423', 1, 'Success "1"'), ('06155424', 0, 'HTTPAPI error: Unknown user'),
+           ('06155425', 1, 'Success "2"')]
+BATCH_CONFIG = {'callback_url': 'http://127.0.0.1/callback', 'errback_url': 'http://127.0.0.1/errback'}
+
+
+class EnqueueCallbacksTestCase(TestCase):
+    def setUp(self):
+        self.delays = {}
+        for name in ['batch_callback', 'batch_callbacks', 'batch_summary_callback']:
+            patcher = patch.object(getattr(tasks, name), 'delay')
+            self.delays[name] = patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def enqueue(self, mode, batch_config=BATCH_CONFIG, results=RESULTS):
+        with patch.object(tasks, 'batch_callback_mode', mode):
+            tasks.enqueue_callbacks('BATCH', batch_config, results)
+
+    def test_message(self):
+        self.enqueue('message')
+
+        self.assertEqual(self.delays['batch_callback'].call_args_list, [
+            call('http://127.0.0.1/callback', 'BATCH', '06155423', 1, 'Success "1"'),
+            call('http://127.0.0.1/callback', 'BATCH', '06155425', 1, 'Success "2"'),
+            call('http://127.0.0.1/errback', 'BATCH', '06155424', 0, 'HTTPAPI error: Unknown user')])
+        self.assertFalse(self.delays['batch_callbacks'].called)
+        self.assertFalse(self.delays['batch_summary_callback'].called)
+
+    def test_batched(self):
+        self.enqueue('batched')
+
+        self.assertEqual(self.delays['batch_callbacks'].call_args_list, [
+            call('http://127.0.0.1/callback', 'BATCH', 1, [('06155423', 'Success "1"'), ('06155425', 'Success "2"')]),
+            call('http://127.0.0.1/errback', 'BATCH', 0, [('06155424', 'HTTPAPI error: Unknown user')])])
+        self.assertFalse(self.delays['batch_callback'].called)
+
+    def test_summary(self):
+        self.enqueue('summary')
+
+        self.assertEqual(self.delays['batch_summary_callback'].call_args_list, [
+            call('http://127.0.0.1/callback', 'BATCH', 1, 2),
+            call('http://127.0.0.1/errback', 'BATCH', 0, 1)])
+        self.assertFalse(self.delays['batch_callback'].called)
+
+    def test_no_urls(self):
+        # Urls are optional and not called without results of their status
+        self.enqueue('batched', {'errback_url': 'http://127.0.0.1/errback'}, RESULTS[:1])
+        self.enqueue('batched', {})
+
+        for delay in self.delays.values():
+            self.assertFalse(delay.called)
+
+
+class CallbacksTestCase(TestCase):
+    def setUp(self):
+        self.session = Mock()
+        patcher = patch.object(tasks, 'get_http_session', return_value=self.session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_batch_callbacks(self):
+        tasks.batch_callbacks('http://127.0.0.1/callback', 'BATCH', 1,
+                              [('06155423', 'Success "1"'), ('06155425', 'Success "2"')])
+
+        self.session.post.assert_called_once_with('http://127.0.0.1/callback', json={
+            'batchId': 'BATCH', 'status': 1,
+            'messages': [{'to': '06155423', 'statusText': 'Success "1"'},
+                         {'to': '06155425', 'statusText': 'Success "2"'}]}, timeout=tasks.callback_timeout)
+
+    def test_batch_callbacks_error(self):
+        # Callback errors are logged, not raised
+        self.session.post.side_effect = Exception('Connection refused')
+        with patch.object(tasks.logger, 'error') as error:
+            tasks.batch_callbacks('http://127.0.0.1/errback', 'BATCH', 0, [('06155424', 'error')])
+
+        self.assertEqual(error.call_count, 1)
+        self.assertIn('Connection refused', error.call_args[0][0])
+
+    def test_batch_summary_callback(self):
+        tasks.batch_summary_callback('http://127.0.0.1/callback', 'BATCH', 1, 2)
+
+        self.session.get.assert_called_once_with('http://127.0.0.1/callback',
+                                                 params={'batchId': 'BATCH', 'status': 1, 'count': 2},
+                                                 timeout=tasks.callback_timeout)
+
+
+class HttpSessionTestCase(TestCase):
+    def setUp(self):
+        patcher = patch.multiple(tasks, _http_session=None, _http_session_pid=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_per_process(self):
+        session = tasks.get_http_session()
+        self.assertIs(tasks.get_http_session(), session)
+
+        # A forked worker is getting its own session
+        with patch.object(tasks.os, 'getpid', return_value=-1):
+            forked_session = tasks.get_http_session()
+            self.assertIsNot(forked_session, session)
+            self.assertIs(tasks.get_http_session(), forked_session)
+
+
+class HttpApiSendBatchTestCase(TestCase):
+    def setUp(self):
+        self.session = Mock()
+        self.session.get.side_effect = [
+            Mock(status_code=200, text='Success "1"', elapsed=timedelta(milliseconds=10)),
+            Mock(status_code=403, text='"Unknown user"', elapsed=timedelta(milliseconds=10))]
+        for patcher in [patch.object(tasks, 'get_http_session', return_value=self.session),
+                        patch.object(tasks, 'get_rate_limiter', return_value=None),
+                        patch.object(tasks, 'batch_callback_mode', 'message')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_send_batch(self):
+        messages_params = [{'username': 'nathalie', 'to': '06155423', 'content': 'hello'},
+                           {'username': 'nathalie', 'to': '06155424', 'content': 'hello'}]
+        with patch.object(tasks.batch_callback, 'delay') as delay:
+            tasks.httpapi_send_batch('BATCH', BATCH_CONFIG, messages_params, {'throughput': 0, 'smart_qos': False})
+
+        # Messages are sent in order through the process session
+        self.assertEqual(self.session.get.call_args_list, [
+            call('%s/send' % tasks.old_api_uri, params=params, timeout=tasks.old_api_timeout)
+            for params in messages_params])
+
+        # Then callbacks are enqueued for all of them
+        self.assertEqual(delay.call_args_list, [
+            call('http://127.0.0.1/callback', 'BATCH', '06155423', 1, 'Success "1"'),
+            call('http://127.0.0.1/errback', 'BATCH', '06155424', 0, 'HTTPAPI error: Unknown user')])
@@ -4,7 +4,7 @@ Test cases for jasmin.protocols.smpp.configs module.
 
 from twisted.trial.unittest import TestCase
 
-from jasmin.protocols.smpp.configs import ConfigUndefinedIdError, ConfigInvalidIdError
+from jasmin.protocols.smpp.configs import ConfigUndefinedIdError, ConfigInvalidIdError, TypeMismatch, UnknownValue
 from jasmin.protocols.smpp.configs import SMPPClientConfig
 
 
@@ -16,3 +16,15 @@ class SMPPClientConfigCases(TestCase):
         invalidValues = ['zzz s', '', 'a,', 'r#r', '9a', '&"()=+~#{[|\`\^@]}', 'a123456789012345678901234-', 'aa']
         for invalidValue in invalidValues:
             self.assertRaises(ConfigInvalidIdError, SMPPClientConfig, id=invalidValue)
+
+    def test_max_outstanding_submits(self):
+        self.assertEqual(SMPPClientConfig(id='test').max_outstanding_submits, 1)
+        self.assertEqual(SMPPClientConfig(id='test', max_outstanding_submits=50).max_outstanding_submits, 50)
+        self.assertRaises(UnknownValue, SMPPClientConfig, id='test', max_outstanding_submits=0)
+        self.assertRaises(TypeMismatch, SMPPClientConfig, id='test', max_outstanding_submits='10')
+
+    def test_binds(self):
+        self.assertEqual(SMPPClientConfig(id='test').binds, 1)
+        self.assertEqual(SMPPClientConfig(id='test', binds=4).binds, 4)
+        self.assertRaises(UnknownValue, SMPPClientConfig, id='test', binds=0)
+        self.assertRaises(TypeMismatch, SMPPClientConfig, id='test', binds='2')
@@ -0,0 +1,74 @@
+"""
+Test cases for delivery receipts parsing
+"""
+
+import re
+
+from twisted.trial.unittest import TestCase
+from smpp.pdu.operations import DeliverSM
+
+from jasmin.protocols.smpp.configs import SMPPClientConfig
+from jasmin.protocols.smpp.operations import SMPPOperationFactory
+from jasmin.protocols.smpp.receipts import RECEIPT_FORMATS, STANDARD_FIELDS, getReceiptParser
+
+SAMPLES = [
+    b'id:1891273321 sub:001 dlvrd:001 submit date:1305050826 done date:1305050826 stat:DELIVRD err:000 text:DLVRD TO MOBILE',
+    b'id:c87c2273-7edb-4bc7-8d3a-7f57f21b625e submit date:201506201641 done date:201506201641 stat:DELIVRD err:000',
+    b'id:4fb7d5ef sub:1 dlvrd:1 submit date:2011151021 done date:2011151021 stat:UNDELIV err:34 Text:Hello world',
+    b'id:bcc34cb0-c6e5-4b3d-9c01-4c1f3c0d2c50 sub:001 dlvrd:000 submit date:1801011200 done date:1801011201 '
+    b'stat:EXPIRED err:254 text:id:fake stat:REJECTD',
+    b'text:first stat:ACCEPTD id:after-text',
+    b'sub:001 dlvrd:001 stat:DELIVRD',
+    b'Hello, this is not a receipt',
+    b'id:\xc3\xa9t\xe9 stat:DELIVRD err:0',
+]
+
+
+def legacy_parse(content):
+    """Fields found by searching every standard field separately"""
+    content = content.decode('utf-8', 'ignore')
+    found = {}
+    for key, label, value in STANDARD_FIELDS:
+        m = re.search('%s(?P<%s>%s)' % (label, key, value), content)
+        if m:
+            found[key] = m.group(key)
+    return found
+
+
+class ReceiptParserTestCase(TestCase):
+    def test_standard_same_as_separate_searches(self):
+        parser = RECEIPT_FORMATS['standard']
+        for sample in SAMPLES:
+            self.assertEqual(parser.parse(sample), legacy_parse(sample), sample)
+
+    def test_text_runs_until_end_of_line(self):
+        parsed = RECEIPT_FORMATS['standard'].parse('id:abc stat:DELIVRD err:0 text:line one\nline two')
+        self.assertEqual(parsed['text'], 'line one')
+
+    def test_lenient(self):
+        parser = RECEIPT_FORMATS['lenient']
+        parsed = parser.parse(b'ID: 17.25-a SUB:1 DLVRD:1 SUBMIT_DATE:2011151021 DONE_DATE:2011151022 '
+                              b'STAT:DELIVERED ERR:0 TEXT:Hi')
+        self.assertEqual(parsed, {'id': '17.25-a', 'sub': '1', 'dlvrd': '1', 'sdate': '2011151021',
+                                  'ddate': '2011151022', 'stat': 'DELIVRD', 'err': '0', 'text': 'Hi'})
+
+        # Standard receipts are parsed the same
+        self.assertEqual(parser.parse(SAMPLES[0]), legacy_parse(SAMPLES[0]))
+
+    def test_unknown_format(self):
+        self.assertIs(getReceiptParser('unknown'), RECEIPT_FORMATS['standard'])
+
+
+class ConnectorReceiptFormatTestCase(TestCase):
+    def test_lenient_connector(self):
+        pdu = DeliverSM(source_addr=b'1234', destination_addr=b'4567',
+                        short_message=b'ID:1891273321 SUBMIT_DATE:1305050826 STAT:UNDELIVERABLE ERR:34')
+
+        self.assertIsNone(SMPPOperationFactory(SMPPClientConfig(id='standard')).isDeliveryReceipt(pdu))
+
+        opFactory = SMPPOperationFactory(SMPPClientConfig(id='lenient', dlr_receipt_format='lenient'))
+        dlr = opFactory.isDeliveryReceipt(pdu)
+        self.assertEqual(dlr['id'], '1891273321')
+        self.assertEqual(dlr['stat'], 'UNDELIV')
+        self.assertEqual(dlr['sdate'], '1305050826')
+        self.assertEqual(dlr['err'], '034')
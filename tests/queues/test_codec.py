@@ -0,0 +1,128 @@
+"""
+Test cases for AMQP messages codec
+"""
+
+import pickle
+
+from twisted.trial.unittest import TestCase
+from smpp.pdu.operations import DeliverSM, SubmitSMResp
+from smpp.pdu.pdu_types import RegisteredDelivery, RegisteredDeliveryReceipt
+
+from jasmin.protocols.smpp.configs import SMPPClientConfig
+from jasmin.protocols.smpp.operations import SMPPOperationFactory
+from jasmin.queues import codec
+from jasmin.routing.Bills import SubmitSmBill
+from jasmin.routing.jasminApi import User, Group
+
+
+class CodecTestCase(TestCase):
+    def setUp(self):
+        self.opFactory = SMPPOperationFactory(SMPPClientConfig(id='test-codec'))
+
+    def assertSamePDUs(self, pdu, other):
+        """Compare two PDU chains (PDU.__eq__ is printing params)"""
+        while pdu is not None:
+            self.assertEqual(pdu.__class__, other.__class__)
+            self.assertEqual(pdu.seqNum, other.seqNum)
+            self.assertEqual(pdu.status, other.status)
+            self.assertEqual(pdu.params, other.params)
+
+            pdu = getattr(pdu, 'nextPdu', None)
+            other = getattr(other, 'nextPdu', None)
+        self.assertIsNone(other)
+
+    def test_submit_sm(self):
+        pdu = self.opFactory.SubmitSM(
+            source_addr=None,
+            destination_addr=b'06155423',
+            short_message=b'Hello world',
+            registered_delivery=RegisteredDelivery(RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED))
+        self.assertIsNone(pdu.seqNum)
+        self.assertIsInstance(pdu.params['data_coding'], int)
+
+        encoded = codec.dumps(pdu, 'compact')
+        self.assertTrue(encoded.startswith(codec.MAGIC))
+        self.assertLess(len(encoded), len(pickle.dumps(pdu, pickle.HIGHEST_PROTOCOL)) / 4)
+        self.assertSamePDUs(pdu, codec.loads(encoded))
+
+        # Encoding did not alter pdu
+        self.assertIsNone(pdu.seqNum)
+        self.assertIsNone(pdu.params['source_addr'])
+
+    def test_long_submit_sm(self):
+        for split in ['sar', 'udh']:
+            opFactory = SMPPOperationFactory(SMPPClientConfig(id='test-codec', long_content_split=split))
+            pdu = opFactory.SubmitSM(
+                source_addr=b'JASMIN',
+                destination_addr=b'06155423',
+                short_message=b'0123456789' * 50,
+                data_coding=8)
+            self.assertTrue(hasattr(pdu, 'nextPdu'))
+
+            decoded = codec.loads(codec.dumps(pdu, 'compact'))
+            self.assertSamePDUs(pdu, decoded)
+            self.assertFalse(hasattr(decoded.nextPdu.nextPdu.nextPdu, 'nextPdu'))
+
+    def test_deliver_sm_and_submit_sm_resp(self):
+        for pdu in [DeliverSM(source_addr=b'4567', destination_addr=b'1234', short_message=b'any content',
+                              seqNum=1),
+                    SubmitSMResp(message_id=b'4f2e6a8c', seqNum=10)]:
+            self.assertSamePDUs(pdu, codec.loads(codec.dumps(pdu, 'compact')))
+
+    def test_custom_tlvs(self):
+        custom_tlvs = [(0x3000, None, 'Int1', 1), (0x3001, None, 'COctetString', 'custom value')]
+        for short_message in [b'Hello world', b'0123456789' * 50]:
+            pdu = self.opFactory.SubmitSM(
+                source_addr=b'JASMIN',
+                destination_addr=b'06155423',
+                short_message=short_message,
+                custom_tlvs=custom_tlvs)
+
+            # Custom TLVs (on every PDU of the chain) are kept through pickling
+            encoded = codec.dumps(pdu, 'compact')
+            self.assertEqual(encoded, pickle.dumps(pdu, pickle.HIGHEST_PROTOCOL))
+
+            decoded = codec.loads(encoded)
+            self.assertSamePDUs(pdu, decoded)
+            while decoded is not None:
+                self.assertEqual(decoded.custom_tlvs, custom_tlvs)
+                decoded = getattr(decoded, 'nextPdu', None)
+
+    def test_fallback_to_pickle(self):
+        # Concatenated deliver_sm content cannot fit in a short_message
+        pdu = DeliverSM(source_addr=b'4567', destination_addr=b'1234', short_message=b'x' * 300, seqNum=1)
+        encoded = codec.dumps(pdu, 'compact')
+        self.assertEqual(encoded, pickle.dumps(pdu, pickle.HIGHEST_PROTOCOL))
+        self.assertSamePDUs(pdu, codec.loads(encoded))
+
+        # Not a PDU nor a bill
+        self.assertEqual(codec.loads(codec.dumps({'any': 'object'}, 'compact')), {'any': 'object'})
+
+    def test_pickle_codec(self):
+        pdu = SubmitSMResp(message_id=b'4f2e6a8c', seqNum=10)
+        encoded = codec.dumps(pdu)
+        self.assertEqual(encoded, pickle.dumps(pdu, pickle.HIGHEST_PROTOCOL))
+        self.assertSamePDUs(pdu, codec.loads(encoded))
+
+    def test_bill(self):
+        user = User(1, Group(1), 'username', 'password')
+        bill = SubmitSmBill(user)
+        bill.setAmount('submit_sm', 1.5)
+        bill.setAmount('submit_sm_resp', 0.25)
+        bill.setAction('decrement_submit_sm_count', 1)
+
+        encoded = codec.dumps(bill, 'compact')
+        self.assertLess(len(encoded), len(pickle.dumps(bill, pickle.HIGHEST_PROTOCOL)))
+
+        decoded = codec.loads(encoded)
+        self.assertEqual(decoded.bid, bill.bid)
+        self.assertEqual(decoded.user.uid, user.uid)
+        self.assertEqual(decoded.amounts, bill.amounts)
+        self.assertEqual(decoded.actions, bill.actions)
+        self.assertEqual(decoded.getSubmitSmRespBill().getTotalAmounts(), 0.25)
+
+    def test_unsupported_version(self):
+        encoded = codec.dumps(SubmitSMResp(message_id=b'4f2e6a8c', seqNum=10), 'compact')
+        encoded = codec.HEADER.pack(codec.MAGIC, codec.VERSION + 1, codec.KIND_PDU) + encoded[codec.HEADER.size:]
+
+        self.assertRaises(codec.CodecError, codec.loads, encoded)
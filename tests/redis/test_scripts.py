@@ -0,0 +1,187 @@
+"""
+Test cases for Redis server-side (Lua) scripts, they are run against a real Redis server
+"""
+
+from datetime import datetime
+from unittest.mock import Mock
+
+import redis as redispy
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+from smpp.pdu.pdu_types import AddrNpi, AddrTon, CommandId, CommandStatus, RegisteredDeliveryReceipt
+
+from jasmin.managers.configs import DLRLookupConfig
+from jasmin.managers.content import DLR
+from jasmin.managers.dlr import DLRLookup, DLRMapWriter
+from jasmin.redis.client import ConnectionWithConfiguration
+from jasmin.redis.configs import RedisForJasminConfig
+from jasmin.tools.qos import DistributedTokenBucket
+
+DLR_DETAILS = {'id': 'ABC', 'sub': 'ND', 'dlvrd': 'ND', 'sdate': 'ND', 'ddate': 'ND', 'err': 'ND', 'text': ''}
+
+
+class DLRScriptsTestCase(TestCase):
+    dlr_map_format = 'hash'
+
+    @defer.inlineCallbacks
+    def setUp(self):
+        RedisForJasminConfigInstance = RedisForJasminConfig()
+        RedisForJasminConfigInstance.password = None
+        self.redisClient = yield ConnectionWithConfiguration(RedisForJasminConfigInstance)
+        yield self.redisClient._connected
+        yield self.redisClient.delete('dlr:MSGID', 'queue-msgid:ABC')
+
+        self.amqpBroker = Mock()
+        self.amqpBroker.publish = Mock(return_value=defer.succeed(None))
+        self.amqpBroker.chan.basic_ack = Mock(return_value=defer.succeed(None))
+        self.amqpBroker.chan.basic_reject = Mock(return_value=defer.succeed(None))
+
+        # Receipts are always looked up in Redis
+        dlr_config = DLRLookupConfig()
+        dlr_config.log_file = 'stdout'
+        dlr_config.smpp_msgid_cache_size = 0
+        self.dlr = DLRLookup(dlr_config, self.amqpBroker, self.redisClient)
+        self.writer = DLRMapWriter(self.redisClient, dlr_map_format=self.dlr_map_format)
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.writer.stop()
+        yield self.redisClient.delete('dlr:MSGID', 'queue-msgid:ABC')
+        yield self.redisClient.disconnect()
+
+    def message(self, content):
+        message = Mock()
+        message.content = content
+        message.delivery_tag = 1
+        return message
+
+    def submit_sm_resp(self, status=CommandStatus.ESME_ROK):
+        return self.dlr.submit_sm_resp_dlr_callback(
+            self.message(DLR(pdu_type=CommandId.submit_sm_resp, msgid='MSGID', status=status, smpp_msgid=b'0abc')))
+
+    def deliver_sm(self, status):
+        return self.dlr.deliver_sm_dlr_callback(
+            self.message(DLR(pdu_type=CommandId.deliver_sm, msgid='ABC', status=status, cid='abc',
+                             dlr_details=DLR_DETAILS)))
+
+    def set_httpapi_map(self, level):
+        self.writer.set('dlr:MSGID', {'sc': 'httpapi', 'url': 'http://127.0.0.1/dlr', 'level': level,
+                                      'method': 'POST', 'connector': 'abc', 'expiry': 86400}, 86400)
+        return self.writer.flush()
+
+    @defer.inlineCallbacks
+    def test_set_dlr_map(self):
+        yield self.set_httpapi_map(3)
+
+        ttl = yield self.redisClient.ttl('dlr:MSGID')
+        self.assertGreater(ttl, 86300)
+        self.assertEqual(self.writer.getStats()['errors'], 0)
+
+    @defer.inlineCallbacks
+    def test_httpapi_level_1(self):
+        yield self.set_httpapi_map(1)
+        yield self.submit_sm_resp()
+
+        # Dlr map is consumed by the submit_sm_resp and receipts are not mapped
+        self.assertEqual(self.amqpBroker.publish.call_count, 1)
+        self.assertEqual(self.amqpBroker.publish.call_args[1]['routing_key'], 'dlr_thrower.http')
+        self.assertFalse((yield self.redisClient.exists('dlr:MSGID')))
+        self.assertFalse((yield self.redisClient.exists('queue-msgid:ABC')))
+
+    @defer.inlineCallbacks
+    def test_httpapi_level_3(self):
+        yield self.set_httpapi_map(3)
+        yield self.submit_sm_resp()
+
+        # Receipts are mapped to the message for the dlr expiry
+        self.assertEqual(self.amqpBroker.publish.call_count, 1)
+        self.assertEqual((yield self.redisClient.hgetall('queue-msgid:ABC')),
+                         {'msgid': 'MSGID', 'connector_type': 'httpapi'})
+        self.assertGreater((yield self.redisClient.ttl('queue-msgid:ABC')), 86300)
+
+        # Intermediate receipt keeps the dlr map, the final one is consuming it
+        yield self.deliver_sm('ACCEPTD')
+        self.assertEqual(self.amqpBroker.publish.call_count, 2)
+        self.assertEqual(self.amqpBroker.publish.call_args[1]['content'].properties['message-id'], 'MSGID')
+        self.assertTrue((yield self.redisClient.exists('dlr:MSGID')))
+
+        yield self.deliver_sm('DELIVRD')
+        self.assertEqual(self.amqpBroker.publish.call_count, 3)
+        self.assertFalse((yield self.redisClient.exists('dlr:MSGID')))
+        self.assertEqual(self.amqpBroker.chan.basic_ack.call_count, 3)
+
+    @defer.inlineCallbacks
+    def test_httpapi_level_3_failure(self):
+        yield self.set_httpapi_map(3)
+        yield self.submit_sm_resp(CommandStatus.ESME_RINVDSTADR)
+
+        # No receipt is expected for a rejected message
+        self.assertEqual(self.amqpBroker.publish.call_count, 1)
+        self.assertFalse((yield self.redisClient.exists('dlr:MSGID')))
+        self.assertFalse((yield self.redisClient.exists('queue-msgid:ABC')))
+
+    @defer.inlineCallbacks
+    def test_smppsapi(self):
+        self.writer.set('dlr:MSGID', {'sc': 'smppsapi', 'system_id': 'user1', 'source_addr': b'1234',
+                                      'destination_addr': b'4567', 'sub_date': datetime.now(),
+                                      'source_addr_ton': AddrTon.NATIONAL, 'source_addr_npi': AddrNpi.ISDN,
+                                      'dest_addr_ton': AddrTon.NATIONAL, 'dest_addr_npi': AddrNpi.ISDN,
+                                      'rd_receipt': RegisteredDeliveryReceipt.SMSC_DELIVERY_RECEIPT_REQUESTED,
+                                      'expiry': 86400}, 86400)
+        yield self.writer.flush()
+
+        yield self.submit_sm_resp()
+        self.assertEqual((yield self.redisClient.hgetall('queue-msgid:ABC')),
+                         {'msgid': 'MSGID', 'connector_type': 'smppsapi'})
+
+        yield self.deliver_sm('DELIVRD')
+        self.assertEqual(self.amqpBroker.publish.call_args[1]['routing_key'], 'dlr_thrower.smpps')
+        self.assertFalse((yield self.redisClient.exists('dlr:MSGID')))
+
+    @defer.inlineCallbacks
+    def test_unknown_dlr_map(self):
+        yield self.submit_sm_resp()
+        yield self.deliver_sm('DELIVRD')
+
+        self.assertEqual(self.amqpBroker.publish.call_count, 0)
+        self.assertEqual(self.amqpBroker.chan.basic_reject.call_count, 2)
+
+
+class CompactDLRScriptsTestCase(DLRScriptsTestCase):
+    dlr_map_format = 'compact'
+
+
+class ReserveScriptTestCase(TestCase):
+    def setUp(self):
+        RedisForJasminConfigInstance = RedisForJasminConfig()
+        self.redisClient = redispy.Redis(host=RedisForJasminConfigInstance.host,
+                                         port=RedisForJasminConfigInstance.port,
+                                         db=RedisForJasminConfigInstance.dbid)
+        self.redisClient.delete('qos-test:batch', 'qos-test:user')
+        self.addCleanup(self.redisClient.delete, 'qos-test:batch', 'qos-test:user')
+        self.buckets = DistributedTokenBucket(self.redisClient, prefix='qos-test')
+
+    def assertWait(self, wait, expected):
+        # Buckets are refilled while reserving
+        self.assertLessEqual(wait, expected)
+        self.assertGreater(wait, expected - 0.05)
+
+    def test_burst(self):
+        # Burst of rate tokens, then one token every 1/rate seconds
+        self.assertEqual(self.buckets.reserve([('batch', 2)]), 0.0)
+        self.assertEqual(self.buckets.reserve([('batch', 2)]), 0.0)
+        self.assertWait(self.buckets.reserve([('batch', 2)]), 0.5)
+        self.assertWait(self.buckets.reserve([('batch', 2)]), 1.0)
+
+        # Bucket state expires once refilled
+        ttl = self.redisClient.pttl('qos-test:batch')
+        self.assertGreater(ttl, 60000)
+        self.assertLessEqual(ttl, 62000)
+
+    def test_many_buckets(self):
+        # Tokens are taken from all buckets, waiting for the slowest one
+        self.buckets.reserve([('batch', 10), ('user', 1)])
+        self.assertWait(self.buckets.reserve([('batch', 10), ('user', 1)]), 1.0)
+        tokens = float(self.redisClient.hget('qos-test:batch', 'tokens'))
+        self.assertGreaterEqual(tokens, 8.0)
+        self.assertLess(tokens, 8.05)
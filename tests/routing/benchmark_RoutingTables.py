@@ -0,0 +1,79 @@
+"""
+Routing table lookup benchmark, compares the indexed RoutingTable.getRouteFor() with a linear scan
+for a growing number of MT routes.
+
+Run with: python -m tests.routing.benchmark_RoutingTables
+"""
+
+import random
+import timeit
+
+from smpp.pdu.operations import SubmitSM
+
+from jasmin.routing.Filters import DestinationAddrFilter, GroupFilter, TransparentFilter, UserFilter
+from jasmin.routing.Routables import RoutableSubmitSm
+from jasmin.routing.Routes import DefaultRoute, StaticMTRoute
+from jasmin.routing.RoutingTables import MTRoutingTable
+from jasmin.routing.jasminApi import Group, SmppClientConnector, User
+
+ROUTE_COUNTS = [10, 100, 500, 1000, 2000, 5000]
+LOOKUPS = 2000
+
+
+def build_table(route_count, users, groups, connector):
+    """Build a table made of destination prefix routes mixed with user and group routes"""
+    routing_t = MTRoutingTable()
+    routing_t.add(DefaultRoute(connector), 0)
+    for order in range(1, route_count + 1):
+        kind = order % 10
+        if kind == 0:
+            filters = [UserFilter(users[order % len(users)])]
+        elif kind == 1:
+            filters = [GroupFilter(groups[order % len(groups)]), DestinationAddrFilter(r'^%s\d+' % (20000 + order))]
+        elif kind == 2 and order % 100 == 2:
+            filters = [TransparentFilter(), UserFilter(users[(order * 7) % len(users)])]
+        else:
+            filters = [DestinationAddrFilter(r'^%s\d+' % (99800000 + order))]
+        routing_t.add(StaticMTRoute(filters, connector, 0.0), order)
+
+    return routing_t
+
+
+def linear_route_for(routing_t, routable):
+    for r in routing_t.getAll():
+        route = list(r.values())[0]
+        if route.matchFilters(routable):
+            return route
+
+    return None
+
+
+def main():
+    random.seed(0)
+    connector = SmppClientConnector('smppc')
+    groups = [Group(gid) for gid in range(10)]
+    users = [User(uid, groups[uid % 10], 'user%s' % uid, 'password') for uid in range(100)]
+
+    print('%8s %14s %14s %9s' % ('routes', 'linear (us)', 'indexed (us)', 'speedup'))
+    for route_count in ROUTE_COUNTS:
+        routing_t = build_table(route_count, users, groups, connector)
+        routables = []
+        for _ in range(LOOKUPS):
+            destination_addr = '%s%s' % (99800000 + random.randint(1, route_count * 2), random.randint(100, 999))
+            routables.append(RoutableSubmitSm(SubmitSM(
+                source_addr=b'JASMIN',
+                destination_addr=destination_addr.encode(),
+                short_message=b'hello world',
+            ), random.choice(users)))
+
+        for routable in routables:
+            assert routing_t.getRouteFor(routable) is linear_route_for(routing_t, routable)
+
+        linear = timeit.timeit(lambda: [linear_route_for(routing_t, r) for r in routables], number=1)
+        indexed = timeit.timeit(lambda: [routing_t.getRouteFor(r) for r in routables], number=1)
+        print('%8d %14.2f %14.2f %8.1fx' % (
+            route_count, linear * 1e6 / LOOKUPS, indexed * 1e6 / LOOKUPS, linear / indexed))
+
+
+if __name__ == '__main__':
+    main()
@@ -107,6 +107,25 @@ class DestinationAddrFilterTestCase(FilterTestCase):
         self.assertRaises(InvalidFilterParameterError, self.f.match, object)
         self.assertRaises(TypeError, self._filter, object)
 
+    def test_prefix_matcher(self):
+        """Literal prefix patterns are matched without regex and must give the same results"""
+        patterns = [r'^20\d+', r'^20', r'20\d*', r'^\+20.*', r'^20$', r'^20\d+$', r'^20\d*$', r'^\d+']
+        values = ['20', '20\n', '2020', '2020\n', '20a', '2', '+20', '+201', '21', '20\u0663', '', '2020\n\n']
+        for pattern in patterns:
+            f = self._filter(pattern)
+            self.assertNotEqual(f.prefix_matcher, None, pattern)
+            for value in values:
+                self.assertEqual(f.prefix_matcher.match(value),
+                                 re.match(pattern, value) is not None, '%r / %r' % (pattern, value))
+
+        for pattern in [r'^(20)', r'^20|^30', r'^2[0-9]', r'^20\d{2}', r'(?i)^ab']:
+            self.assertEqual(self._filter(pattern).prefix_matcher, None, pattern)
+
+    def test_is_picklable(self):
+        f = pickle.loads(pickle.dumps(self.f))
+        self.assertNotEqual(f.prefix_matcher, None)
+        self.assertTrue(f.match(self.routable))
+
 
 class ShortMessageFilterTestCase(FilterTestCase):
     _filter = ShortMessageFilter
@@ -150,3 +150,86 @@ class MORoutingTableTestCase(RoutingTableTests, TestCase):
         self.routable_matching_route1 = RoutableDeliverSm(self.PDU_dst_1, self.connector1)
         self.routable_matching_route2 = RoutableDeliverSm(self.PDU_dst_2, self.connector1)
         self.routable_notmatching_any = RoutableDeliverSm(self.PDU_dst_3, self.connector1)
+
+
+class RoutingTableIndexTestCase(TestCase):
+    """Ensure indexed lookups are matching the first-match-by-order linear scan"""
+
+    def setUp(self):
+        self.connectors = [SmppClientConnector('smppc%s' % i) for i in range(5)]
+        self.groups = [Group(i) for i in range(3)]
+        self.users = [User(i, self.groups[i % 3], 'user%s' % i, 'password') for i in range(6)]
+
+        self.routing_t = MTRoutingTable()
+        self.routing_t.add(DefaultRoute(self.connectors[0]), 0)
+        self.routing_t.add(StaticMTRoute([DestinationAddrFilter(r'^336\d+')], self.connectors[1], 0.0), 10)
+        self.routing_t.add(StaticMTRoute([DestinationAddrFilter(r'^3361\d+'), UserFilter(self.users[1])],
+                                         self.connectors[2], 0.0), 20)
+        self.routing_t.add(StaticMTRoute([GroupFilter(self.groups[2])], self.connectors[3], 0.0), 15)
+        self.routing_t.add(StaticMTRoute([TagFilter(42)], self.connectors[4], 0.0), 30)
+        self.routing_t.add(StaticMTRoute([DestinationAddrFilter(r'^21?6\d+')], self.connectors[4], 0.0), 5)
+        self.routing_t.add(StaticMTRoute([SourceAddrFilter(r'^JASMIN$')], self.connectors[3], 0.0), 25)
+        self.routing_t.add(StaticMTRoute([SourceAddrFilter(r'^JAS')], self.connectors[2], 0.0), 3)
+        self.routing_t.add(StaticMTRoute([EvalPyFilter('result = False'), UserFilter(self.users[4])],
+                                         self.connectors[1], 0.0), 40)
+
+    def linearRouteFor(self, routable):
+        for r in self.routing_t.getAll():
+            route = list(r.values())[0]
+            if route.matchFilters(routable):
+                return route
+
+        return None
+
+    def test_literal_prefix(self):
+        from jasmin.routing.Indexes import literal_prefix
+
+        self.assertEqual(literal_prefix(re.compile(r'^99890\d+')), '99890')
+        self.assertEqual(literal_prefix(re.compile(r'99890')), '99890')
+        self.assertEqual(literal_prefix(re.compile(r'^\+336')), '+336')
+        self.assertEqual(literal_prefix(re.compile(r'^21?6')), '2')
+        self.assertEqual(literal_prefix(re.compile(r'^33{2}')), '3')
+        self.assertEqual(literal_prefix(re.compile(r'^336|^337')), '')
+        self.assertEqual(literal_prefix(re.compile(r'^(336)')), '')
+        self.assertEqual(literal_prefix(re.compile(r'^abc', re.IGNORECASE)), '')
+        self.assertEqual(literal_prefix(re.compile(r'.*')), '')
+
+    def test_matches_linear_scan(self):
+        for user in self.users:
+            for destination_addr in [b'3361234', b'336', b'3365555', b'2161', b'2611', b'99890', b'']:
+                for source_addr in [b'JASMIN', b'JASMINE', b'x']:
+                    for tag in [None, 42, 43]:
+                        routable = RoutableSubmitSm(SubmitSM(
+                            source_addr=source_addr,
+                            destination_addr=destination_addr,
+                            short_message=b'hello world',
+                        ), user)
+                        if tag is not None:
+                            routable.addTag(tag)
+
+                        self.assertEqual(self.routing_t.getRouteFor(routable), self.linearRouteFor(routable))
+
+    def test_index_is_rebuilt_on_update(self):
+        routable = RoutableSubmitSm(SubmitSM(source_addr=b'x', destination_addr=b'3369',
+                                             short_message=b'hello world'), self.users[0])
+        self.assertEqual(self.routing_t.getRouteFor(routable).getConnector(), self.connectors[1])
+
+        self.routing_t.remove(10)
+        self.assertEqual(self.routing_t.getRouteFor(routable).getConnector(), self.connectors[0])
+
+        self.routing_t.add(StaticMTRoute([UserFilter(self.users[0])], self.connectors[2], 0.0), 10)
+        self.assertEqual(self.routing_t.getRouteFor(routable).getConnector(), self.connectors[2])
+
+        self.routing_t.flush()
+        self.assertEqual(self.routing_t.getRouteFor(routable), None)
+
+    def test_pickling(self):
+        import pickle
+
+        routable = RoutableSubmitSm(SubmitSM(source_addr=b'x', destination_addr=b'3369',
+                                             short_message=b'hello world'), self.users[0])
+        self.routing_t.getRouteFor(routable)
+
+        routing_t = pickle.loads(pickle.dumps(self.routing_t))
+        self.assertEqual(routing_t._index, None)
+        self.assertEqual(routing_t.getRouteFor(routable).getConnector().cid, self.connectors[1].cid)
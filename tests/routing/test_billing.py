@@ -0,0 +1,96 @@
+"""
+Test cases for the billing ledger
+"""
+
+from unittest.mock import Mock
+
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+
+from jasmin.routing.billing import BillingLedger
+from jasmin.routing.jasminApi import Group, MtMessagingCredential, User
+
+
+class BillingLedgerTestCase(TestCase):
+    def setUp(self):
+        self.users = {}
+        for uid, balance in [('1', 10.0), ('2', 1.0), ('3', None)]:
+            mt_c = MtMessagingCredential()
+            mt_c.setQuota('balance', balance)
+            self.users[uid] = User(uid, Group(1), 'user%s' % uid, 'password', mt_c)
+
+        self.updates = []
+        self.settle = Mock(return_value=defer.succeed(None))
+        self.journal = Mock()
+        self.journal.flush = Mock(return_value=defer.succeed(True))
+        self.ledger = BillingLedger(self.users.get, self.updateQuota, self.settle, self.journal,
+                                    batch_size=100, log=Mock())
+
+    def updateQuota(self, _user, quota, difference, bids=None):
+        _user.mt_credential.updateQuota(quota, difference)
+        self.updates.append((_user.uid, quota, difference, bids))
+
+    def tearDown(self):
+        return self.ledger.stop()
+
+    @defer.inlineCallbacks
+    def test_batch(self):
+        self.ledger.charge(1, 2.0, 'bid1', 'm1')
+        self.ledger.charge(2, 0.5, 'bid2', 'm2')
+        self.ledger.charge(1, 3.0, 'bid3', 'm3')
+        # Not enough balance left
+        self.ledger.charge(2, 0.6, 'bid4', 'm4')
+        # Unlimited balance
+        self.ledger.charge(3, 1.0, 'bid5', 'm5')
+        # Unknown user
+        self.ledger.charge(4, 1.0, 'bid6', 'm6')
+        yield self.ledger.flush()
+
+        self.assertEqual(self.settle.call_count, 1)
+        accepted, rejected = self.settle.call_args[0]
+        self.assertEqual(sorted(accepted), ['m1', 'm2', 'm3', 'm5'])
+        self.assertEqual(sorted(rejected), ['m4', 'm6'])
+
+        # One balance update per user and batch
+        self.assertEqual(self.updates, [('1', 'balance', -5.0, ['bid1', 'bid3']),
+                                        ('2', 'balance', -0.5, ['bid2'])])
+        self.assertEqual(self.users['1'].mt_credential.getQuota('balance'), 5.0)
+        self.assertIsNone(self.users['3'].mt_credential.getQuota('balance'))
+        # Settled once journaled
+        self.assertEqual(self.journal.flush.call_count, 1)
+
+    def test_batch_size(self):
+        self.ledger.batch_size = 2
+        self.ledger.charge(1, 1.0, 'bid1', 'm1')
+        self.assertEqual(self.settle.call_count, 0)
+        self.ledger.charge(1, 1.0, 'bid2', 'm2')
+        self.assertEqual(self.settle.call_count, 1)
+        self.assertEqual(self.ledger.getStats()['queue_depth'], 0)
+
+    @defer.inlineCallbacks
+    def test_charged_bids(self):
+        # Charged before a restart
+        self.ledger.addChargedBids(['bid1'])
+
+        self.ledger.charge(1, 1.0, 'bid1', 'm1')
+        self.ledger.charge(1, 1.0, 'bid2', 'm2')
+        yield self.ledger.flush()
+        # Redelivered
+        self.ledger.charge(1, 1.0, 'bid2', 'm2')
+        yield self.ledger.flush()
+
+        self.assertEqual(self.users['1'].mt_credential.getQuota('balance'), 9.0)
+        self.assertEqual(self.settle.call_args[0], (['m2'], []))
+
+    @defer.inlineCallbacks
+    def test_update_error(self):
+        mt_c = MtMessagingCredential()
+        mt_c.setQuota('balance', 10)
+        self.users['4'] = User('4', Group(1), 'user4', 'password', mt_c)
+
+        # Cannot update an int balance with a float amount
+        self.ledger.charge(4, 1.5, 'bid1', 'm1')
+        self.ledger.charge(1, 1.0, 'bid2', 'm2')
+        yield self.ledger.flush()
+
+        self.assertEqual(self.settle.call_args[0], (['m2'], ['m1']))
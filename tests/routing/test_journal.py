@@ -0,0 +1,176 @@
+"""
+Test cases for the quotas journal
+"""
+
+import os
+import pickle
+from unittest.mock import Mock
+
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+
+from jasmin.routing.configs import RouterPBConfig
+from jasmin.routing.jasminApi import Group, MtMessagingCredential, User
+from jasmin.routing.journal import QuotasJournal
+from jasmin.routing.router import RouterPB
+
+
+class QuotasJournalTestCase(TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+
+    @defer.inlineCallbacks
+    def test_flush_and_read(self):
+        journal = QuotasJournal(self.path)
+        self.assertEqual(journal.append({'uid': '1', 'delta': -1}), 1)
+        self.assertEqual(journal.append({'uid': '2', 'delta': -2}), 2)
+        # Buffered until flushed
+        self.assertEqual(journal.read(), [])
+
+        written = yield journal.flush()
+        self.assertTrue(written)
+        self.assertEqual([e['uid'] for e in journal.read()], ['1', '2'])
+        self.assertEqual([e['uid'] for e in journal.read(after_seq=1)], ['2'])
+
+        # Sequence numbers are kept across restarts
+        self.assertEqual(QuotasJournal(self.path).seq, 2)
+
+    @defer.inlineCallbacks
+    def test_compact(self):
+        journal = QuotasJournal(self.path, max_size=100)
+        for i in range(5):
+            journal.append({'uid': str(i), 'delta': -1})
+        yield journal.flush()
+        self.assertTrue(journal.needsCompaction())
+
+        journal.append({'uid': '5', 'delta': -1})
+        yield journal.compact(5)
+        yield journal.flush()
+
+        self.assertEqual([e['seq'] for e in journal.read()], [6])
+        self.assertFalse(journal.needsCompaction())
+
+    @defer.inlineCallbacks
+    def test_resume(self):
+        journal = QuotasJournal(self.path)
+        for i in range(5):
+            journal.append({'uid': str(i), 'delta': -1})
+        yield journal.flush()
+        yield journal.compact(5)
+
+        # Restart with an empty journal
+        journal = QuotasJournal(self.path)
+        self.assertEqual(journal.seq, 0)
+        journal.resume(5)
+        self.assertEqual(journal.append({'uid': '5', 'delta': -1}), 6)
+        journal.resume(3)
+        self.assertEqual(journal.seq, 6)
+
+    def test_partial_line(self):
+        with open(self.path, 'w') as fh:
+            fh.write('{"seq": 1, "uid": "1", "delta": -1}\n{"seq": 2, "uid"')
+
+        journal = QuotasJournal(self.path, log=Mock())
+        self.assertEqual(len(journal.read()), 1)
+        self.assertEqual(journal.seq, 1)
+
+
+class RouterPBQuotasJournalTestCase(TestCase):
+    @defer.inlineCallbacks
+    def setUp(self):
+        self.config = RouterPBConfig()
+        self.config.store_path = self.mktemp()
+        os.makedirs(self.config.store_path)
+        self.router = self.newRouter()
+
+        mt_c = MtMessagingCredential()
+        mt_c.setQuota('balance', 10.0)
+        mt_c.setQuota('submit_sm_count', 100)
+        self.router.perspective_group_add(pickle.dumps(Group(1)))
+        self.router.perspective_user_add(pickle.dumps(User('u1', Group(1), 'username', 'password', mt_c)))
+        yield self.router.perspective_persist(scope='groups')
+        yield self.router.perspective_persist(scope='users')
+
+    def newRouter(self):
+        return RouterPB(self.config, persistenceTimer=False)
+
+    def tearDown(self):
+        return self.router.quotas_journal.stop()
+
+    def getQuota(self, router, quota):
+        return router.getUser('u1').mt_credential.getQuota(quota)
+
+    @defer.inlineCallbacks
+    def test_replay(self):
+        _user = self.router.getUser('u1')
+        self.router.updateUserQuota(_user, 'balance', -1.5)
+        self.router.updateUserQuota(_user, 'submit_sm_count', -2)
+        # Journaled updates do not require users persistence
+        self.assertFalse(_user.mt_credential.quotas_updated)
+        yield self.router.quotas_journal.flush()
+
+        # Restart
+        router = self.newRouter()
+        router.perspective_load(scope='groups')
+        router.perspective_load(scope='users')
+        self.assertEqual(self.getQuota(router, 'balance'), 8.5)
+        self.assertEqual(self.getQuota(router, 'submit_sm_count'), 98)
+
+    @defer.inlineCallbacks
+    def test_snapshot(self):
+        _user = self.router.getUser('u1')
+        self.router.updateUserQuota(_user, 'balance', -1.0)
+        yield self.router.quotas_journal.flush()
+
+        # Snapshot is including the journaled update, the journal is compacted
+        yield self.router.perspective_persist(scope='users')
+        self.router.updateUserQuota(_user, 'balance', -2.0)
+        yield self.router.quotas_journal.flush()
+        self.assertEqual([e['delta'] for e in self.router.quotas_journal.read()], [-2.0])
+
+        router = self.newRouter()
+        router.perspective_load(scope='groups')
+        router.perspective_load(scope='users')
+        self.assertEqual(self.getQuota(router, 'balance'), 7.0)
+
+    @defer.inlineCallbacks
+    def test_replay_after_compaction(self):
+        _user = self.router.getUser('u1')
+        for _ in range(5):
+            self.router.updateUserQuota(_user, 'balance', -1.0)
+        yield self.router.quotas_journal.flush()
+
+        # Snapshot at seq 5, the journal is emptied by compaction
+        yield self.router.perspective_persist(scope='users')
+        self.assertEqual(self.router.quotas_journal.read(), [])
+        yield self.router.quotas_journal.stop()
+
+        # Restart then charge before the next snapshot
+        self.router = self.newRouter()
+        self.router.perspective_load(scope='groups')
+        self.router.perspective_load(scope='users')
+        self.router.updateUserQuota(self.router.getUser('u1'), 'balance', -2.0)
+        yield self.router.quotas_journal.flush()
+        self.assertEqual([e['seq'] for e in self.router.quotas_journal.read(after_seq=5)], [6])
+
+        # Crash and restart
+        router = self.newRouter()
+        router.perspective_load(scope='groups')
+        router.perspective_load(scope='users')
+        self.assertEqual(self.getQuota(router, 'balance'), 3.0)
+
+    @defer.inlineCallbacks
+    def test_snapshot_before_compaction(self):
+        _user = self.router.getUser('u1')
+        self.router.updateUserQuota(_user, 'balance', -1.0)
+        yield self.router.quotas_journal.flush()
+
+        # Crash after writing the snapshot, before compacting the journal
+        self.router.quotas_journal.compact = lambda seq: defer.succeed(None)
+        yield self.router.perspective_persist(scope='users')
+        self.assertEqual(len(self.router.quotas_journal.read()), 1)
+
+        router = self.newRouter()
+        router.perspective_load(scope='groups')
+        router.perspective_load(scope='users')
+        self.assertEqual(self.getQuota(router, 'balance'), 9.0)
@@ -4,6 +4,7 @@ import os
 import string
 import urllib.request, urllib.parse, urllib.error
 import random
+from hashlib import md5
 
 from unittest.mock import Mock, call
 from twisted.cred import portal
@@ -105,6 +106,7 @@ class RouterPBTestCase(TestCase):
 
         yield self.PBServer.stopListening()
         yield self.pbRoot_f.cancelPersistenceTimer()
+        yield self.pbRoot_f.billing_ledger.stop()
 
 
 class HttpServerTestCase(RouterPBTestCase):
@@ -197,6 +199,7 @@ class SMPPClientManagerPBTestCase(HttpServerTestCase):
         if self.SMPPClientManagerPBProxy.isConnected:
             yield self.SMPPClientManagerPBProxy.disconnect()
         yield self.CManagerServer.stopListening()
+        yield self.clientManager_f.dlrMapWriter.stop()
         for q in self.amqpBroker.queues:
             yield self.amqpBroker.chan.queue_delete(queue=q)
         yield self.amqpClient.disconnect()
@@ -518,6 +521,73 @@ class UserAndGroupTestCases(RouterPBProxy, RouterPBTestCase):
         r = yield self.user_authenticate('incorrect', 'incorrect')
         self.assertEqual(r, None)
 
+    @defer.inlineCallbacks
+    def test_authenticate_cache(self):
+        yield self.connect('127.0.0.1', self.pbPort)
+
+        g1 = Group(1)
+        yield self.group_add(g1)
+
+        u1 = User(1, g1, 'username', 'password')
+        yield self.user_add(u1)
+
+        r = yield self.user_authenticate('username', 'password')
+        self.assertNotEqual(r, None)
+        self.assertEqual(1, len(self.pbRoot_f.auth_cache))
+        # Credentials are cached with the hashed password
+        self.assertEqual(md5(b'password').digest(), self.pbRoot_f.auth_cache.get('username', count=False)[0])
+
+        # Adding and removing other users will keep cached credentials
+        u2 = User(2, g1, 'other', 'password')
+        yield self.user_add(u2)
+        r = yield self.user_authenticate('other', 'password')
+        self.assertNotEqual(r, None)
+        yield self.user_remove(2)
+        self.assertEqual(1, len(self.pbRoot_f.auth_cache))
+        self.assertIn('username', self.pbRoot_f.auth_cache)
+
+        # Replacing the user will evict its cached credentials
+        u1 = User(1, g1, 'username', 'newpassword')
+        yield self.user_add(u1)
+        self.assertEqual(0, len(self.pbRoot_f.auth_cache))
+        r = yield self.user_authenticate('username', 'password')
+        self.assertEqual(r, None)
+        r = yield self.user_authenticate('username', 'newpassword')
+        self.assertNotEqual(r, None)
+
+        # Disabled users and groups are not authenticated even if cached
+        yield self.user_disable(1)
+        r = yield self.user_authenticate('username', 'newpassword')
+        self.assertEqual(r, None)
+        yield self.user_enable(1)
+        yield self.group_disable(1)
+        r = yield self.user_authenticate('username', 'newpassword')
+        self.assertEqual(r, None)
+        yield self.group_enable(1)
+
+        yield self.user_remove(1)
+        r = yield self.user_authenticate('username', 'newpassword')
+        self.assertEqual(r, None)
+
+    @defer.inlineCallbacks
+    def test_get_user_and_group(self):
+        yield self.connect('127.0.0.1', self.pbPort)
+
+        g1 = Group(1)
+        yield self.group_add(g1)
+        u1 = User(1, g1, 'username', 'password')
+        yield self.user_add(u1)
+
+        self.assertEqual(self.pbRoot_f.getUser(1).uid, 1)
+        self.assertEqual(self.pbRoot_f.getUser('1').uid, 1)
+        self.assertEqual(self.pbRoot_f.getUser(2), None)
+        self.assertEqual(self.pbRoot_f.getGroup('1').gid, 1)
+        self.assertEqual(self.pbRoot_f.getGroup(2), None)
+
+        yield self.group_remove(1)
+        self.assertEqual(self.pbRoot_f.getUser(1), None)
+        self.assertEqual(self.pbRoot_f.getGroup(1), None)
+
     @defer.inlineCallbacks
     def test_enable_disable_group(self):
         yield self.connect('127.0.0.1', self.pbPort)
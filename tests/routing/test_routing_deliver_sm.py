@@ -381,8 +381,43 @@ class DeliverSmHttpThrowingTestCases(RouterPBProxy, DeliverSmSMSCTestCase):
     @defer.inlineCallbacks
     def test_last_first_long_content_delivery_HttpConnector(self):
         "Ensure that receiving the last data_sm part at first is handled"
+        yield self.connect('127.0.0.1', self.pbPort)
+        # Connect to SMSC
+        source_connector = Connector(id_generator())
+        yield self.prepareRoutingsAndStartConnector(source_connector)
 
-    test_last_first_long_content_delivery_HttpConnector.skip = "TODO: handle this specific case, it was omitted for more performance"
+        # Send a deliver_sm from the SMSC
+        basePdu = DeliverSM(
+            source_addr='1234',
+            destination_addr='4567',
+            short_message='',
+            sar_total_segments=3,
+            sar_msg_ref_num=int(id_generator(size=2, chars=string.digits)),
+        )
+        pdu_part1 = copy.deepcopy(basePdu)
+        pdu_part2 = copy.deepcopy(basePdu)
+        pdu_part3 = copy.deepcopy(basePdu)
+        pdu_part1.params[
+            'short_message'] = b'__1st_part_with_153_char________________________________________________________________________________________________________________________________.'
+        pdu_part1.params['sar_segment_seqnum'] = 1
+        pdu_part2.params[
+            'short_message'] = b'__2nd_part_with_153_char________________________________________________________________________________________________________________________________.'
+        pdu_part2.params['sar_segment_seqnum'] = 2
+        pdu_part3.params['short_message'] = b'__3rd_part_end.'
+        pdu_part3.params['sar_segment_seqnum'] = 3
+        yield self.triggerDeliverSmFromSMSC([pdu_part3, pdu_part1, pdu_part2])
+
+        # Run tests
+        # Destination connector must receive the message one time (no retries)
+        self.assertEqual(self.AckServerResource.render_POST.call_count, 1)
+        # Assert received args
+        receivedHttpReq = self.AckServerResource.last_request.args
+        self.assertEqual(receivedHttpReq[b'content'], [
+            pdu_part1.params['short_message'] + pdu_part2.params['short_message'] + pdu_part3.params['short_message']])
+        self.assertEqual(receivedHttpReq[b'origin-connector'], [source_connector.cid.encode()])
+
+        # Disconnector from SMSC
+        yield self.stopConnector(source_connector)
 
 
 class DeliverSmSmppThrowingTestCases(RouterPBProxy, SMPPClientTestCases, SubmitSmTestCaseTools):
@@ -1,8 +1,9 @@
 import binascii
 import copy
+import pickle
 from datetime import datetime, timedelta
 
-from unittest.mock import Mock
+from unittest.mock import Mock, patch
 from twisted.internet import reactor, defer
 from twisted.trial.unittest import TestCase
 from twisted.web import server
@@ -77,6 +78,29 @@ class deliverSmThrowerTestCase(TestCase):
         yield self.amqpBroker.disconnect()
 
 
+class deliverSmThrowerDestinationTestCase(TestCase):
+    def setUp(self):
+        self.deliverSmThrower = deliverSmThrower(deliverSmThrowerConfig())
+        self.deliverSmThrower.callback = Mock(return_value=defer.succeed(None))
+
+    def tearDown(self):
+        return self.deliverSmThrower.stopService()
+
+    def test_dst_connectors_decoded_once(self):
+        message = Mock()
+        message.routing_key = 'deliver_sm_thrower.http'
+        message.content.properties = {'message-id': 'm1', 'headers': {'dst-connectors': pickle.dumps(
+            [HttpConnector('dst', 'http://127.0.0.1/deliver')], pickle.HIGHEST_PROTOCOL)}}
+
+        with patch('jasmin.routing.throwers.pickle.loads', wraps=pickle.loads) as loads:
+            self.deliverSmThrower.dispatch(message)
+        self.assertEqual(loads.call_count, 1)
+
+        # Destination connectors are given to the callback
+        dcs = self.deliverSmThrower.callback.call_args[1]['dcs']
+        self.assertEqual(dcs[0].baseurl, 'http://127.0.0.1/deliver')
+
+
 class HTTPDeliverSmThrowingTestCases(deliverSmThrowerTestCase):
     routingKey = 'deliver_sm_thrower.http'
 
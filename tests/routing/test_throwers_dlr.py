@@ -13,7 +13,12 @@ from jasmin.routing.proxies import RouterPBProxy
 from tests.routing.http_server import TimeoutLeafServer, AckServer, NoAckServer, Error404Server
 from tests.routing.test_router import SubmitSmTestCaseTools
 from tests.routing.test_router_smpps import SMPPClientTestCases
-from jasmin.routing.throwers import DLRThrower
+from jasmin.routing.stats import ThrowerStatistics
+from jasmin.routing.throwers import DLRThrower, ThrowerHTTPConnectionPool
+from treq import text_content
+from treq.client import HTTPClient
+from twisted.web.client import Agent
+from txamqp.queue import TimeoutDeferredQueue
 from smpp.pdu.pdu_types import MessageState, CommandId
 
 
@@ -61,6 +66,159 @@ class DLRThrowerTestCases(TestCase):
         yield self.DLRThrower.stopService()
 
 
+class ThrowerHTTPConnectionPoolTestCase(TestCase):
+    def setUp(self):
+        self.AckServerResource = AckServer()
+        self.AckServer = reactor.listenTCP(0, server.Site(self.AckServerResource))
+
+        self.stats = ThrowerStatistics('test')
+        self.pool = ThrowerHTTPConnectionPool(reactor, self.stats)
+        self.client = HTTPClient(Agent(reactor, pool=self.pool))
+
+    @defer.inlineCallbacks
+    def tearDown(self):
+        yield self.pool.closeCachedConnections()
+        yield self.AckServer.stopListening()
+
+    @defer.inlineCallbacks
+    def test_connection_reused(self):
+        url = 'http://127.0.0.1:%s/send' % self.AckServer.getHost().port
+
+        for _ in range(3):
+            response = yield self.client.get(url)
+            content = yield text_content(response)
+            self.assertEqual(content, 'ACK/Jasmin')
+
+        self.assertEqual(self.stats.get('http_connections_created'), 1)
+        self.assertEqual(self.stats.get('http_connections_reused'), 2)
+        self.assertEqual(self.stats.get('http_connections_idle'), 1)
+
+    @defer.inlineCallbacks
+    def test_not_persistent(self):
+        self.pool.persistent = False
+        url = 'http://127.0.0.1:%s/send' % self.AckServer.getHost().port
+
+        for _ in range(2):
+            response = yield self.client.get(url)
+            yield text_content(response)
+
+        self.assertEqual(self.stats.get('http_connections_created'), 2)
+        self.assertEqual(self.stats.get('http_connections_reused'), 0)
+        self.assertEqual(self.stats.get('http_connections_idle'), 0)
+
+
+class ThrowerConcurrencyTestCase(TestCase):
+    def setUp(self):
+        DLRThrowerConfigInstance = DLRThrowerConfig()
+        DLRThrowerConfigInstance.concurrency = 2
+        DLRThrowerConfigInstance.max_inflight_per_destination = 1
+
+        self.DLRThrower = DLRThrower(DLRThrowerConfigInstance)
+        self.DLRThrower.thrower_q = TimeoutDeferredQueue()
+
+        # Record thrown messages and keep them in-flight until their deferred is fired
+        self.inflight = {}
+        self.DLRThrower.callback = self.callback
+
+    def tearDown(self):
+        self.DLRThrower.thrower_q.close()
+        return self.DLRThrower.stopService()
+
+    def callback(self, message):
+        d = defer.Deferred()
+        self.inflight[message.content.properties['message-id']] = d
+        return d
+
+    def prepareMessage(self, msgid, url):
+        message = Mock()
+        message.routing_key = 'dlr_thrower.http'
+        message.content.properties = {'message-id': msgid, 'headers': {'url': url}}
+        self.DLRThrower.thrower_q.put(message)
+
+    def test_per_destination_cap(self):
+        for _ in range(self.DLRThrower.config.concurrency):
+            self.DLRThrower.consume()
+
+        self.prepareMessage('a1', 'http://slow/')
+        self.prepareMessage('a2', 'http://slow/')
+        self.prepareMessage('b1', 'http://fast/')
+        self.prepareMessage('b2', 'http://fast/')
+
+        # a2 is waiting for http://slow/ without holding a consuming loop
+        self.assertEqual(sorted(self.inflight), ['a1', 'b1'])
+
+        self.inflight.pop('b1').callback(None)
+        self.assertEqual(sorted(self.inflight), ['a1', 'b2'])
+
+        self.inflight.pop('a1').callback(None)
+        self.assertEqual(sorted(self.inflight), ['a2', 'b2'])
+
+        self.inflight.pop('a2').callback(None)
+        self.inflight.pop('b2').callback(None)
+        self.assertEqual(self.DLRThrower.destinations, {})
+
+    def test_max_waiting_per_destination(self):
+        self.DLRThrower.config.max_waiting_per_destination = 1
+        for _ in range(self.DLRThrower.config.concurrency):
+            self.DLRThrower.consume()
+
+        for msgid in ['a1', 'a2', 'a3']:
+            self.prepareMessage(msgid, 'http://slow/')
+        self.prepareMessage('b1', 'http://fast/')
+
+        # a2 is waiting, a3 is holding the second consuming loop: b1 is not consumed
+        self.assertEqual(sorted(self.inflight), ['a1'])
+        self.assertEqual(len(self.DLRThrower.destinations['http://slow/'].waiting), 2)
+
+        self.inflight.pop('a1').callback(None)
+        self.assertEqual(sorted(self.inflight), ['a2', 'b1'])
+
+        self.inflight.pop('a2').callback(None)
+        self.inflight.pop('b1').callback(None)
+        self.inflight.pop('a3').callback(None)
+        self.assertEqual(self.DLRThrower.destinations, {})
+
+    def test_concurrency(self):
+        self.DLRThrower.config.max_inflight_per_destination = 0
+        for _ in range(self.DLRThrower.config.concurrency):
+            self.DLRThrower.consume()
+
+        for i in range(4):
+            self.prepareMessage('m%s' % i, 'http://slow/')
+
+        self.assertEqual(sorted(self.inflight), ['m0', 'm1'])
+
+        self.inflight.pop('m0').callback(None)
+        self.assertEqual(sorted(self.inflight), ['m1', 'm2'])
+
+    def test_defaults(self):
+        config = DLRThrowerConfig()
+        self.assertEqual(config.prefetch_count, 10 * config.concurrency)
+        self.assertEqual(config.max_inflight_per_destination, config.concurrency // 2)
+        self.assertLess(config.max_waiting_per_destination, config.prefetch_count)
+
+    @defer.inlineCallbacks
+    def test_dedicated_channel(self):
+        chan = Mock()
+        amqpBroker = Mock()
+        amqpBroker.connected = True
+        amqpBroker.openChannel = Mock(return_value=defer.succeed(chan))
+        amqpBroker.client.queue = Mock(return_value=defer.succeed(self.DLRThrower.thrower_q))
+        yield self.DLRThrower.addAmqpBroker(amqpBroker)
+
+        # Prefetch limit is not applied to the broker's shared channel
+        chan.basic_qos.assert_called_once_with(prefetch_count=self.DLRThrower.config.prefetch_count)
+        self.assertEqual(chan.basic_consume.call_count, 1)
+        self.assertEqual(amqpBroker.chan.basic_qos.call_count, 0)
+
+        # Delivery tags are acknowledged on the consuming channel
+        message = Mock()
+        message.content.properties = {'message-id': 'm1'}
+        yield self.DLRThrower.ackMessage(message)
+        chan.basic_ack.assert_called_once_with(message.delivery_tag)
+        self.assertEqual(amqpBroker.chan.basic_ack.call_count, 0)
+
+
 class HTTPDLRThrowerTestCase(DLRThrowerTestCases):
     @defer.inlineCallbacks
     def setUp(self):
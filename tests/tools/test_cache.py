@@ -0,0 +1,103 @@
+"""
+Test cases for in-memory caches
+"""
+
+from twisted.trial.unittest import TestCase
+
+from jasmin.tools.cache import LRUCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTestCase(TestCase):
+    def setUp(self):
+        self.clock = Clock()
+
+    def test_ttl(self):
+        cache = LRUCache(maxsize=10, ttl=5, clock=self.clock)
+        cache.set('a', 1)
+        cache.set('b', 2, ttl=20)
+
+        self.clock.now = 4
+        self.assertEqual(cache.get('a'), 1)
+
+        # Entries expire after their ttl, whether they were read or not
+        self.clock.now = 5
+        self.assertEqual(cache.get('a'), None)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.get('b'), 2)
+
+        self.clock.now = 20
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(cache.purge(), 1)
+        self.assertEqual(len(cache), 0)
+
+    def test_no_ttl(self):
+        cache = LRUCache(maxsize=10, clock=self.clock)
+        cache.set('a', 1)
+
+        self.clock.now = 10 ** 9
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual(cache.purge(), 0)
+
+    def test_disabled(self):
+        cache = LRUCache(maxsize=0, clock=self.clock)
+        cache.set('a', 1)
+
+        self.assertEqual(len(cache), 0)
+        self.assertEqual(cache.get('a', 'default'), 'default')
+
+    def test_eviction_order(self):
+        cache = LRUCache(maxsize=3, clock=self.clock)
+        for k in 'abc':
+            cache.set(k, k)
+
+        # Reading 'a' makes 'b' the least recently used
+        cache.get('a')
+        cache.set('d', 'd')
+        self.assertEqual(len(cache), 3)
+        self.assertNotIn('b', cache)
+
+        # Setting an existing key makes it the most recently used
+        cache.set('c', 'C')
+        cache.set('e', 'e')
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.get('c'), 'C')
+        self.assertIn('d', cache)
+        self.assertIn('e', cache)
+
+    def test_pop(self):
+        cache = LRUCache(maxsize=10, ttl=5, clock=self.clock)
+        cache.set('a', 1)
+        cache.set('b', 2)
+
+        self.assertEqual(cache.pop('a'), 1)
+        self.assertNotIn('a', cache)
+        self.assertEqual(cache.pop('a', 'default'), 'default')
+
+        # Expired entries are removed but not returned
+        self.clock.now = 5
+        self.assertEqual(cache.pop('b', 'default'), 'default')
+        self.assertEqual(len(cache), 0)
+
+    def test_stats(self):
+        cache = LRUCache(maxsize=10, ttl=5, clock=self.clock)
+        self.assertEqual(cache.getStats()['hit_ratio'], 0.0)
+
+        cache.set('a', 1)
+        cache.get('a')
+        cache.get('a')
+        cache.get('b')
+        self.clock.now = 5
+        cache.get('a')
+        # Membership tests are not counted
+        self.assertNotIn('a', cache)
+
+        self.assertEqual(cache.getStats(), {
+            'size': 0, 'maxsize': 10, 'hits': 2, 'misses': 2, 'hit_ratio': 0.5})
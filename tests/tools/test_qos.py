@@ -0,0 +1,152 @@
+from unittest.mock import Mock
+
+from twisted.internet import defer, task
+from twisted.trial.unittest import TestCase
+
+from jasmin.tools.qos import TokenBucket, TokenBucketScheduler, DistributedTokenBucket, LatencyWindow
+
+
+class TokenBucketTestCase(TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def test_consume(self):
+        bucket = TokenBucket(10, clock=self.clock.seconds)
+
+        self.assertTrue(bucket.consume())
+        self.assertFalse(bucket.consume())
+        self.assertAlmostEqual(bucket.delay(), 0.1)
+
+        self.clock.advance(0.1)
+        self.assertTrue(bucket.consume())
+
+    def test_burst(self):
+        bucket = TokenBucket(10, burst=3, clock=self.clock.seconds)
+
+        self.assertEqual([bucket.consume() for _ in range(4)], [True, True, True, False])
+
+        # Bucket never holds more than burst tokens
+        self.clock.advance(60)
+        self.assertEqual([bucket.consume() for _ in range(4)], [True, True, True, False])
+
+    def test_sub_millisecond_rate(self):
+        bucket = TokenBucket(5000, burst=1, clock=self.clock.seconds)
+
+        self.assertTrue(bucket.consume())
+        self.assertAlmostEqual(bucket.delay(), 0.0002)
+        self.clock.advance(0.0002)
+        self.assertTrue(bucket.consume())
+
+    def test_slow_rate(self):
+        bucket = TokenBucket(0.5, clock=self.clock.seconds)
+
+        self.assertTrue(bucket.consume())
+        self.assertAlmostEqual(bucket.delay(), 2)
+
+    def test_unlimited(self):
+        bucket = TokenBucket(0, clock=self.clock.seconds)
+
+        self.assertTrue(all(bucket.consume() for _ in range(1000)))
+        self.assertEqual(bucket.reserve(), 0)
+
+    def test_reserve(self):
+        bucket = TokenBucket(10, clock=self.clock.seconds)
+
+        self.assertEqual(bucket.reserve(), 0)
+        self.assertAlmostEqual(bucket.reserve(), 0.1)
+        self.assertAlmostEqual(bucket.reserve(), 0.2)
+
+
+class TokenBucketSchedulerTestCase(TestCase):
+    def setUp(self):
+        self.clock = task.Clock()
+
+    def test_fifo_release(self):
+        scheduler = TokenBucketScheduler(10, _reactor=self.clock)
+        released = []
+        for i in range(3):
+            scheduler.acquire().addCallback(lambda _, i=i: released.append(i))
+
+        self.assertEqual(released, [0])
+        self.clock.advance(0.1)
+        self.assertEqual(released, [0, 1])
+        self.clock.advance(0.1)
+        self.assertEqual(released, [0, 1, 2])
+        self.assertEqual(len(scheduler.waiting), 0)
+
+    def test_many_per_tick(self):
+        scheduler = TokenBucketScheduler(1000, burst=10, _reactor=self.clock)
+        released = []
+        for i in range(21):
+            scheduler.acquire().addCallback(lambda _, i=i: released.append(i))
+
+        self.assertEqual(len(released), 10)
+
+        # One timer call is releasing all the accrued tokens
+        self.clock.advance(0.01)
+        self.assertEqual(len(released), 20)
+
+    def test_set_rate(self):
+        scheduler = TokenBucketScheduler(1, _reactor=self.clock)
+        released = []
+        for i in range(3):
+            scheduler.acquire().addCallback(lambda _, i=i: released.append(i))
+        self.assertEqual(released, [0])
+
+        scheduler.setRate(0)
+        self.clock.advance(0)
+        self.assertEqual(released, [0, 1, 2])
+
+    def test_cancel(self):
+        scheduler = TokenBucketScheduler(1, _reactor=self.clock)
+        scheduler.acquire()
+        d = scheduler.acquire()
+
+        scheduler.cancel()
+        self.assertFailure(d, defer.CancelledError)
+        self.assertEqual(self.clock.getDelayedCalls(), [])
+        return d
+
+
+class DistributedTokenBucketTestCase(TestCase):
+    def setUp(self):
+        self.script = Mock(return_value=b'0.25')
+        self.redis_client = Mock()
+        self.redis_client.register_script.return_value = self.script
+        self.bucket = DistributedTokenBucket(self.redis_client, burst_seconds=0.5, log=Mock())
+
+    def test_reserve(self):
+        self.assertEqual(self.bucket.reserve([('batch:1', 10), ('user:foo', 1), ('httpapi', 0)]), 0.25)
+
+        # Unlimited buckets are not sent to Redis, burst is at least one token
+        self.script.assert_called_once_with(keys=['qos:batch:1', 'qos:user:foo'], args=[1, 10.0, 5.0, 1.0, 1.0])
+
+    def test_unlimited(self):
+        self.assertEqual(self.bucket.reserve([('batch:1', 0), ('httpapi', None)]), 0)
+        self.assertFalse(self.script.called)
+
+    def test_redis_error(self):
+        self.script.side_effect = ConnectionError('Redis is down')
+
+        self.assertEqual(self.bucket.reserve([('batch:1', 10)]), 0)
+
+
+class LatencyWindowTestCase(TestCase):
+    def test_percentile(self):
+        window = LatencyWindow(size=100)
+        self.assertIsNone(window.percentile(95))
+
+        for i in range(1, 101):
+            window.add(i / 100.0)
+        self.assertEqual(window.percentile(95), 0.95)
+        self.assertEqual(window.percentile(50), 0.5)
+
+    def test_window(self):
+        window = LatencyWindow(size=10)
+        for _ in range(10):
+            window.add(5.0)
+        for _ in range(10):
+            window.add(0.1)
+
+        self.assertEqual(len(window), 10)
+        self.assertEqual(window.percentile(95), 0.1)
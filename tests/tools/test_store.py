@@ -0,0 +1,250 @@
+"""
+Test cases for the configuration store writer
+"""
+
+import os
+import pickle
+from unittest.mock import Mock
+
+from twisted.internet import defer
+from twisted.trial.unittest import TestCase
+
+from jasmin.routing.configs import RouterPBConfig
+from jasmin.routing.Filters import GroupFilter
+from jasmin.routing.Routes import DefaultRoute, StaticMTRoute
+from jasmin.routing.jasminApi import Group, MtMessagingCredential, SmppClientConnector, User
+from jasmin.routing.router import RouterPB
+from jasmin.tools.store import RecordsStore, StoreWriter, atomicWrite, packRecords
+
+
+class StoreWriterTestCase(TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        os.makedirs(self.path)
+
+    def test_atomic_write(self):
+        path = os.path.join(self.path, 'profile')
+        atomicWrite(path, b'first')
+        atomicWrite(path, b'second')
+
+        with open(path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'second')
+        self.assertEqual(os.listdir(self.path), ['profile'])
+
+    @defer.inlineCallbacks
+    def test_write(self):
+        writer = StoreWriter(log=Mock())
+        files = [(os.path.join(self.path, 'a'), b'a'), (os.path.join(self.path, 'b'), b'b')]
+
+        written = yield writer.write(files)
+        self.assertTrue(written)
+        self.assertEqual(sorted(os.listdir(self.path)), ['a', 'b'])
+
+        stats = writer.getStats()
+        self.assertEqual(stats['persisted'], 1)
+        self.assertEqual(stats['failed'], 0)
+        self.assertGreaterEqual(stats['max_duration'], stats['last_duration'])
+
+    @defer.inlineCallbacks
+    def test_write_callable(self):
+        writer = StoreWriter(log=Mock())
+        path = os.path.join(self.path, 'a')
+
+        written = yield writer.write([(path, lambda: b'serialized')])
+        self.assertTrue(written)
+        with open(path, 'rb') as fh:
+            self.assertEqual(fh.read(), b'serialized')
+
+    @defer.inlineCallbacks
+    def test_write_error(self):
+        writer = StoreWriter(log=Mock())
+
+        written = yield writer.write([(os.path.join(self.path, 'missing', 'a'), b'a')])
+        self.assertFalse(written)
+        self.assertEqual(writer.getStats()['failed'], 1)
+
+
+class RecordsStoreTestCase(TestCase):
+    def setUp(self):
+        self.path = self.mktemp()
+        with open(self.path, 'wb') as fh:
+            fh.write(b'Persisted on Thu Jan  1 00:00:00 2026 [Jasmin 0.10.12]\n')
+            fh.write(packRecords([('1', 'a', {'v': 1}), ('2', 'b', {'v': 2}), ('3', 'a', {'v': 3})]))
+
+    def test_records(self):
+        self.assertTrue(RecordsStore.isRecordsStore(self.path))
+        store = RecordsStore(self.path)
+        self.addCleanup(store.close)
+
+        self.assertTrue(store.header.startswith('Persisted on'))
+        self.assertEqual(store.keys(), ['1', '2', '3'])
+        self.assertEqual(store.keys(2), ['1', '2'])
+        self.assertEqual(store.keysByName('a'), ['1', '3'])
+        self.assertEqual(store.get('2'), {'v': 2})
+
+        self.assertEqual(store.pop('1'), {'v': 1})
+        self.assertNotIn('1', store)
+        self.assertEqual(store.keysByName('a'), ['3'])
+        self.assertEqual(len(store), 2)
+
+    def test_legacy_format(self):
+        path = self.mktemp()
+        with open(path, 'wb') as fh:
+            fh.write(b'Persisted on Thu Jan  1 00:00:00 2026 [Jasmin 0.10.12]\n')
+            fh.write(pickle.dumps([]))
+
+        self.assertFalse(RecordsStore.isRecordsStore(path))
+        self.assertRaises(ValueError, RecordsStore, path)
+
+
+class RouterPBPersistTestCase(TestCase):
+    def setUp(self):
+        self.config = RouterPBConfig()
+        self.config.store_path = self.mktemp()
+        self.config.quotas_journal = False
+        os.makedirs(self.config.store_path)
+        self.router = RouterPB(self.config, persistenceTimer=False)
+        self.router.perspective_group_add(pickle.dumps(Group(1)))
+
+    @defer.inlineCallbacks
+    def test_snapshot(self):
+        d = self.router.perspective_persist(scope='groups')
+        # Copied when called: later updates are not part of the snapshot
+        self.router.perspective_group_add(pickle.dumps(Group(2)))
+        self.router.perspective_group_disable(1)
+        self.assertTrue((yield d))
+
+        router = RouterPB(self.config, persistenceTimer=False)
+        router.perspective_load(scope='groups')
+        self.assertEqual([str(g.gid) for g in router.groups], ['1'])
+        self.assertTrue(router.groups[0].enabled)
+
+    def test_pickled_in_writer_thread(self):
+        self.router.store_writer.write = Mock(return_value=defer.succeed(True))
+        self.router.perspective_persist()
+
+        # Every scope is pickled by the writer
+        files = self.router.store_writer.write.call_args[0][0]
+        self.assertEqual(len(files), 6)
+        for _, data in files:
+            self.assertTrue(callable(data))
+
+    @defer.inlineCallbacks
+    def test_routes_snapshot(self):
+        self.router.perspective_mtroute_add(pickle.dumps(DefaultRoute(SmppClientConnector('abc'))), 0)
+        self.router.perspective_mtroute_add(pickle.dumps(
+            StaticMTRoute([GroupFilter(Group(1))], SmppClientConnector('def'), 0.0)), 10)
+
+        d = self.router.perspective_persist(scope='mtroutes')
+        # Routing table is pickled in a thread, routes removed meanwhile are part of the snapshot
+        self.router.perspective_mtroute_remove(10)
+        self.assertTrue((yield d))
+
+        router = RouterPB(self.config, persistenceTimer=False)
+        router.perspective_load(scope='mtroutes')
+        self.assertEqual([list(r.keys())[0] for r in router.mt_routing_table.getAll()], [10, 0])
+
+    @defer.inlineCallbacks
+    def test_users_snapshot(self):
+        mt_c = MtMessagingCredential()
+        mt_c.setQuota('balance', 10.0)
+        self.router.perspective_user_add(pickle.dumps(User('u1', Group(1), 'username', 'password', mt_c)))
+
+        d = self.router.perspective_persist(scope='users')
+        # Users are pickled in a thread, quota updates made meanwhile are not part of the snapshot
+        self.router.getUser('u1').mt_credential.updateQuota('balance', -1.0)
+        self.assertTrue((yield d))
+
+        router = RouterPB(self.config, persistenceTimer=False)
+        self.addCleanup(router.closeUsersStore)
+        router.perspective_load(scope='groups')
+        router.perspective_load(scope='users')
+        self.assertEqual(router.getUser('u1').mt_credential.getQuota('balance'), 10.0)
+
+    @defer.inlineCallbacks
+    def test_write_error(self):
+        self.config.store_path = os.path.join(self.config.store_path, 'missing')
+        self.assertFalse(self.router.perspective_is_persisted())
+
+        persisted = yield self.router.perspective_persist(scope='groups')
+        self.assertFalse(persisted)
+        self.assertFalse(self.router.perspective_is_persisted())
+
+
+class RouterPBUsersLoadingTestCase(TestCase):
+    def setUp(self):
+        self.config = RouterPBConfig()
+        self.config.store_path = self.mktemp()
+        self.config.quotas_journal = False
+        self.config.users_records_store = True
+        self.config.users_load_batch_size = 10
+        os.makedirs(self.config.store_path)
+
+    @defer.inlineCallbacks
+    def persistUsers(self, count):
+        router = RouterPB(self.config, persistenceTimer=False)
+        router.perspective_group_add(pickle.dumps(Group(1)))
+        for i in range(count):
+            mt_c = MtMessagingCredential()
+            mt_c.setQuota('balance', 10.0)
+            router.perspective_user_add(pickle.dumps(User(i, Group(1), 'user%s' % i, 'password', mt_c)))
+
+        yield router.perspective_persist()
+
+    def newRouter(self):
+        router = RouterPB(self.config, persistenceTimer=False)
+        self.addCleanup(router.closeUsersStore)
+        self.assertTrue(router.perspective_load())
+        return router
+
+    @defer.inlineCallbacks
+    def test_lazy_load(self):
+        yield self.persistUsers(25)
+        router = self.newRouter()
+
+        # First batch is loaded, the other users are decoded on access
+        self.assertEqual(len(router.users), 10)
+        self.assertEqual(router.getUser(20).username, 'user20')
+        self.assertIsNotNone(router.authenticateUser('user15', 'password'))
+        self.assertEqual(len(router.users), 12)
+        self.assertFalse(router.users[-1].mt_credential.quotas_updated)
+
+        # Others are loaded in background
+        yield router.users_loader.whenDone()
+        self.assertEqual(sorted(int(u.uid) for u in router.users), list(range(25)))
+        self.assertIsNone(router.users_store)
+        self.assertTrue(router.perspective_is_persisted())
+
+    @defer.inlineCallbacks
+    def test_update_while_loading(self):
+        yield self.persistUsers(25)
+        router = self.newRouter()
+
+        # Only updated users are loaded
+        self.assertTrue(router.perspective_user_remove(24))
+        self.assertTrue(router.perspective_user_disable(23))
+        self.assertTrue(router.perspective_user_update_quota(22, 'mt_credential', 'balance', 5.0))
+        mt_c = MtMessagingCredential()
+        mt_c.setQuota('balance', 1.0)
+        self.assertTrue(router.perspective_user_add(pickle.dumps(User(99, Group(1), 'user21', 'password', mt_c))))
+        self.assertEqual(len(router.users_store), 11)
+        self.assertEqual(sorted(int(u.uid) for u in router.users), list(range(10)) + [22, 23, 99])
+        self.assertFalse(router.getUser(23).enabled)
+        self.assertIsNone(router.getUser(21))
+
+        # Pending users are loaded when persisting all users
+        yield router.perspective_persist()
+        self.assertIsNone(router.users_store)
+        self.assertEqual(len(router.users), 24)
+        router = self.newRouter()
+        yield router.users_loader.whenDone()
+        self.assertEqual(len(router.users), 24)
+
+    @defer.inlineCallbacks
+    def test_legacy_format(self):
+        self.config.users_records_store = False
+        yield self.persistUsers(25)
+        router = self.newRouter()
+
+        self.assertEqual(len(router.users), 25)
+        self.assertIsNone(router.users_store)